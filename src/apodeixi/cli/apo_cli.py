@@ -7,6 +7,7 @@ import warnings
 
 import apodeixi
 from apodeixi.cli.kb_session                        import KB_Session
+from apodeixi.cli.apo_daemon                        import ApoDaemon
 from apodeixi.cli.error_reporting                   import CLI_ErrorReporting
 from apodeixi.cli.cli_utils                         import CLI_Utils
 from apodeixi.util.a6i_error                        import FunctionalTrace, ApodeixiError
@@ -15,7 +16,10 @@ from apodeixi.util.path_utils                       import PathUtils
 from apodeixi.util.performance_utils                import ApodeixiTimer
 from apodeixi.util.warning_utils                    import WarningUtils
 from apodeixi.util.formatting_utils                 import StringUtils
-from apodeixi.knowledge_base.manifest_utils         import ManifestUtils
+
+# GOTCHA: Modules that are slow to import (such as ManifestUtils, which brings in pandas) are imported lazily by the
+#       commands that need them, so that each command only pays for what it uses. For the same reason the
+#       KB_Session only imports the KnowledgeBase when it is constructed, i.e., when a command needs it.
 
 
 pass_kb_session                             = click.make_pass_decorator(KB_Session, ensure=True)
@@ -488,6 +492,8 @@ def diff(kb_session, manifest_api, kind, namespace, name):
     
     Example: 'delivery-planning.journeys.a6i.io', (as opposed to 'delivery-planning.journeys.a6i.io/v1a'). 
     '''
+    from apodeixi.knowledge_base.manifest_utils     import ManifestUtils
+
     timer                               = ApodeixiTimer()
     func_trace                          = FunctionalTrace(  parent_trace    = None, 
                                                             path_mask       = None) 
@@ -552,4 +558,173 @@ def diff(kb_session, manifest_api, kind, namespace, name):
         #       Use print, not click.echo or click exception because they don't correctly display styling
         #       (colors, underlines, etc.). So use vanilla Python print and then exit
         print(error_msg)
-        _sys.exit()
\ No newline at end of file
+        _sys.exit()
+
+@apo_cli.command()
+@click.option('--environment', type=click.STRING,help="If provided, the index will be rebuilt for the given environment instead of the base environment")
+@pass_kb_session
+def rebuild_index(kb_session, environment):
+    '''
+    Rebuilds the index used to look up manifests in the KnowledgeBase.
+
+    Only needed for KnowledgeBases created by earlier versions of Apodeixi, or if manifest files were
+    changed outside of Apodeixi. Until the index is rebuilt, lookups of manifests fall back to scanning
+    the KnowledgeBase's files, which is slower.
+    '''
+    timer                               = ApodeixiTimer()
+    func_trace                          = FunctionalTrace(  parent_trace    = None, 
+                                                            path_mask       = None) 
+    root_trace                          = func_trace.doing("CLI call to rebuild manifest index",
+                                                            origination     = {'signaled_from': __file__})
+    try:
+        if environment != None:
+            kb_session.store.activate(parent_trace = root_trace, environment_name = environment)
+            click.echo(CLI_Utils().sandox_announcement(environment))
+
+        my_trace                        = root_trace.doing("Invoking KnowledgeBaseStore's rebuildManifestCatalog service")
+        nb_manifests                    = kb_session.store.rebuildManifestCatalog(my_trace)
+
+        click.echo("Indexed " + str(nb_manifests) + " manifests")
+        output                          = "Success"
+        click.echo(output)
+        click.echo(timer.elapsed_time_message())
+    except ApodeixiError as ex:
+        error_msg                       = CLI_ErrorReporting(kb_session).report_a6i_error( 
+                                                                        parent_trace                = root_trace, 
+                                                                        a6i_error                   = ex)
+        # GOTCHA
+        #       Use print, not click.echo or click exception because they don't correctly display styling
+        #       (colors, underlines, etc.). So use vanilla Python print and then exit
+        print(error_msg)
+        _sys.exit()
+    except Exception as ex:
+        try:
+            error_msg                   = CLI_ErrorReporting(kb_session).report_generic_error( 
+                                                                        parent_trace                = root_trace, 
+                                                                        generic_error               = ex)
+        except Exception as ex2:
+            error_msg                   = "CLI run into trouble: found error:\n\n\t" + str(ex) + "\n\n" \
+                                                + "To make things worse, when trying to produce an error log file with a "\
+                                                + "stack trace, run into an additional error:\n\n\t" + str(ex2)
+        # GOTCHA
+        #       Use print, not click.echo or click exception because they don't correctly display styling
+        #       (colors, underlines, etc.). So use vanilla Python print and then exit
+        print(error_msg)
+        _sys.exit()
+
+@apo_cli.command()
+@click.option('--environment', type=click.STRING,help="If provided, sidecars will be written for the given environment instead of the base environment")
+@pass_kb_session
+def backfill_sidecars(kb_session, environment):
+    '''
+    Writes binary sidecars for all manifests in the KnowledgeBase that don't have a valid one.
+
+    Sidecars are binary copies of manifests that are faster to load than YAML. New manifests get sidecars
+    if 'manifest-sidecars' is set to true in the 'knowledge-base' section of the Apodeixi configuration.
+    This command adds sidecars to manifests that were written before that.
+    '''
+    timer                               = ApodeixiTimer()
+    func_trace                          = FunctionalTrace(  parent_trace    = None, 
+                                                            path_mask       = None) 
+    root_trace                          = func_trace.doing("CLI call to backfill manifest sidecars",
+                                                            origination     = {'signaled_from': __file__})
+    try:
+        if environment != None:
+            kb_session.store.activate(parent_trace = root_trace, environment_name = environment)
+            click.echo(CLI_Utils().sandox_announcement(environment))
+
+        my_trace                        = root_trace.doing("Invoking KnowledgeBaseStore's backfillManifestSidecars service")
+        nb_sidecars                     = kb_session.store.backfillManifestSidecars(my_trace)
+
+        click.echo("Wrote " + str(nb_sidecars) + " sidecars")
+        output                          = "Success"
+        click.echo(output)
+        click.echo(timer.elapsed_time_message())
+    except ApodeixiError as ex:
+        error_msg                       = CLI_ErrorReporting(kb_session).report_a6i_error( 
+                                                                        parent_trace                = root_trace, 
+                                                                        a6i_error                   = ex)
+        # GOTCHA
+        #       Use print, not click.echo or click exception because they don't correctly display styling
+        #       (colors, underlines, etc.). So use vanilla Python print and then exit
+        print(error_msg)
+        _sys.exit()
+    except Exception as ex:
+        try:
+            error_msg                   = CLI_ErrorReporting(kb_session).report_generic_error( 
+                                                                        parent_trace                = root_trace, 
+                                                                        generic_error               = ex)
+        except Exception as ex2:
+            error_msg                   = "CLI run into trouble: found error:\n\n\t" + str(ex) + "\n\n" \
+                                                + "To make things worse, when trying to produce an error log file with a "\
+                                                + "stack trace, run into an additional error:\n\n\t" + str(ex2)
+        # GOTCHA
+        #       Use print, not click.echo or click exception because they don't correctly display styling
+        #       (colors, underlines, etc.). So use vanilla Python print and then exit
+        print(error_msg)
+        _sys.exit()
+
+@apo_cli.group()
+def daemon():
+    '''
+    Manages the Apodeixi daemon, a background process that keeps the KnowledgeBase loaded so that other commands
+    run faster. While the daemon is running all other commands are forwarded to it.
+    '''
+
+def _daemon_command(action_description, action):
+    '''
+    Helper method for the daemon commands, which share the same error handling.
+
+    @param action A function that takes a FunctionalTrace and an ApoDaemon as parameters, and returns a string
+                    to display to the user
+    '''
+    timer                               = ApodeixiTimer()
+    func_trace                          = FunctionalTrace(  parent_trace    = None, 
+                                                            path_mask       = None) 
+    root_trace                          = func_trace.doing("CLI call to " + action_description,
+                                                            origination     = {'signaled_from': __file__})
+    try:
+        click.echo(action(root_trace, ApoDaemon()))
+        output                          = "Success"
+        click.echo(output)
+        click.echo(timer.elapsed_time_message())
+    except ApodeixiError as ex:
+        error_msg                       = CLI_ErrorReporting(None).report_a6i_error( 
+                                                                        parent_trace                = root_trace, 
+                                                                        a6i_error                   = ex)
+        # GOTCHA
+        #       Use print, not click.echo or click exception because they don't correctly display styling
+        #       (colors, underlines, etc.). So use vanilla Python print and then exit
+        print(error_msg)
+        _sys.exit()
+    except Exception as ex:
+        click.echo("Unrecoverable error: " + str(ex))
+        _sys.exit()
+
+def _describe_daemon(status_dict):
+    if status_dict == None:
+        return "Apodeixi daemon is not running"
+    return "Apodeixi daemon is running:\n" + "\n".join(["\t" + key + ": " + str(status_dict[key]) 
+                                                                for key in status_dict.keys()])
+
+@daemon.command()
+def start():
+    '''
+    Starts the Apodeixi daemon in the background
+    '''
+    _daemon_command("start daemon", lambda trace, daemon: _describe_daemon(daemon.start(trace)))
+
+@daemon.command()
+def stop():
+    '''
+    Stops the Apodeixi daemon
+    '''
+    _daemon_command("stop daemon", lambda trace, daemon: "Apodeixi daemon stopped" if daemon.stop(trace) 
+                                                                else "Apodeixi daemon was not running")
+
+@daemon.command()
+def status():
+    '''
+    Displays whether the Apodeixi daemon is running
+    '''
+    _daemon_command("get daemon status", lambda trace, daemon: _describe_daemon(daemon.status(trace)))
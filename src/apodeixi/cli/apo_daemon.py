@@ -0,0 +1,349 @@
+import sys                                          as _sys
+import os                                           as _os
+import io                                           as _io
+import json                                         as _json
+import time                                         as _time
+import socket                                       as _socket
+import stat                                         as _stat
+import struct                                       as _struct
+import hashlib                                      as _hashlib
+import datetime                                     as _datetime
+import tempfile                                     as _tempfile
+import subprocess                                   as _subprocess
+from contextlib                                     import redirect_stdout, redirect_stderr
+
+from apodeixi.util.a6i_error                        import ApodeixiError, FunctionalTrace
+
+# GOTCHA: This module is imported by the `apo` entry point before it knows whether commands will be forwarded
+#       to a running daemon, so it must only import lightweight modules at the top. Modules that are expensive to
+#       import (pandas, openpyxl, the KnowledgeBase, the CLI itself, ...) are only imported when needed.
+
+class ApoDaemon():
+    '''
+    Long-lived local server that holds a "warm" KB_Session, i.e., one for which all modules have already been
+    imported, the ApodeixiConfig loaded, the KnowledgeBase and its store constructed, and the store's caches
+    populated. When the daemon is running, `apo` commands are forwarded to it instead of paying all those
+    costs each time.
+
+    The daemon listens on a Unix domain socket whose path is determined by the $APODEIXI_CONFIG_DIRECTORY, so that
+    different Apodeixi configurations get different daemons. On platforms without Unix domain sockets the daemon is
+    not supported, and `apo` commands are always run in-process.
+
+    Since commands run with the privileges of whoever started the daemon, only that user may talk to it:
+
+    * The socket and the daemon's log are in a directory that only the user can access: a subfolder of 
+      $XDG_RUNTIME_DIR if it is set, and of the system's temporary folder otherwise. If that directory is not
+      private, commands are run in-process and the daemon refuses to start
+    * The socket itself is only readable and writable by the user
+    * Where the platform supports it, both the client and the daemon check that the other end of the connection
+      runs as the same user
+
+    The protocol is simple: the client connects, sends a JSON dictionary and shuts down its side of the
+    connection. The daemon replies with a JSON dictionary and closes the connection.
+    Requests are served one at a time, since the KB_Session is not thread safe. After each request the KB_Session
+    is reset (refer to KB_Session.reset), so that state (such as the active environment) does not leak from one
+    command to the next.
+
+    Since the ApodeixiConfig is loaded only once, the daemon must be restarted for configuration changes to take effect.
+    '''
+    def __init__(self):
+        config_dir                          = _os.environ.get('APODEIXI_CONFIG_DIRECTORY', "")
+        digest                              = _hashlib.sha1(_os.path.abspath(config_dir).encode("utf8")).hexdigest()[:12]
+        runtime_dir                         = _os.environ.get('XDG_RUNTIME_DIR', "")
+        if len(runtime_dir) == 0:
+            runtime_dir                     = _tempfile.gettempdir()
+        uid                                 = str(_os.getuid()) if hasattr(_os, "getuid") else ""
+        daemon_dir                          = runtime_dir + "/apodeixi-" + uid
+        self.socket_path                    = daemon_dir + "/apo_daemon." + digest + ".sock"
+        self.log_path                       = daemon_dir + "/apo_daemon." + digest + ".log"
+
+    RUN                                     = "run"
+    STATUS                                  = "status"
+    STOP                                    = "stop"
+
+    # How long `start` waits for the daemon to be ready to serve requests
+    START_TIMEOUT_SECS                      = 120
+
+    def is_supported(self):
+        '''
+        Returns a boolean, stating whether the daemon can run on this platform.
+        '''
+        return hasattr(_socket, "AF_UNIX") and hasattr(_os, "getuid")
+
+    def _daemon_dir(self):
+        return _os.path.dirname(self.socket_path)
+
+    def _is_private_dir(self, path):
+        '''
+        Returns a boolean, stating whether `path` is a directory (not a symbolic link) that is owned by the current
+        user and that no other user can access
+        '''
+        try:
+            path_stat                       = _os.lstat(path)
+        except FileNotFoundError:
+            return False
+        return _stat.S_ISDIR(path_stat.st_mode) and path_stat.st_uid == _os.getuid() \
+                                                and path_stat.st_mode & 0o077 == 0
+
+    def _make_private_dir(self, parent_trace):
+        '''
+        Creates the directory for the daemon's socket and log, if it does not exist, and checks that it is private 
+        to the current user
+        '''
+        daemon_dir                          = self._daemon_dir()
+        try:
+            _os.mkdir(daemon_dir, 0o700)
+        except FileExistsError:
+            pass
+        if not self._is_private_dir(daemon_dir):
+            raise ApodeixiError(parent_trace, "Can't use the Apodeixi daemon because its directory is not private to "
+                                                + "the current user. Remove it, or restrict its permissions to the user",
+                                            data = {"directory": daemon_dir})
+
+    def _is_same_user(self, conn):
+        '''
+        Returns a boolean, stating whether the process at the other end of the Unix domain socket `conn` runs as the 
+        current user. Where the platform can't tell, it returns True, and we rely on the socket's permissions.
+        '''
+        if not hasattr(_socket, "SO_PEERCRED"):
+            return True
+        credentials                         = conn.getsockopt(_socket.SOL_SOCKET, _socket.SO_PEERCRED, 
+                                                                _struct.calcsize("3i"))
+        pid, uid, gid                       = _struct.unpack("3i", credentials)
+        return uid == _os.getuid()
+
+    def _send(self, request_dict):
+        '''
+        Sends the `request_dict` to the daemon and returns the daemon's response, as a dict.
+
+        Returns None if no daemon of the current user is listening. If a daemon was reached but the conversation 
+        with it broke, it raises an OSError or a ValueError, since in that case it is not known whether the request 
+        was processed.
+        '''
+        if not self.is_supported() or not self._is_private_dir(self._daemon_dir()) \
+                                    or not _os.path.exists(self.socket_path):
+            return None
+        conn                                = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+        try:
+            try:
+                conn.connect(self.socket_path)
+            except (ConnectionRefusedError, FileNotFoundError, PermissionError):
+                return None # A stale socket file from a daemon that is no longer running, or not ours
+            if not self._is_same_user(conn):
+                return None
+            conn.sendall(_json.dumps(request_dict).encode("utf8"))
+            conn.shutdown(_socket.SHUT_WR)
+            return _json.loads(self._receive_all(conn).decode("utf8"))
+        finally:
+            conn.close()
+
+    def _receive_all(self, conn):
+        chunks                              = []
+        while True:
+            chunk                           = conn.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def forward(self, argv):
+        '''
+        Attempts to run the `apo` command given by `argv` (a list of strings, without the program name) in the
+        daemon. Whatever the command outputs is printed to this process' stdout.
+
+        Returns the command's exit code, or None if no daemon is running, in which case the caller should run
+        the command in-process.
+        '''
+        request_dict                        = { "command":  ApoDaemon.RUN,
+                                                "argv":     argv,
+                                                "cwd":      _os.getcwd(),
+                                                "color":    _sys.stdout.isatty()}
+        try:
+            response_dict                   = self._send(request_dict)
+        except (OSError, ValueError) as ex:
+            print("Lost connection with the Apodeixi daemon, so can't tell if the command completed: " + str(ex))
+            return 1
+        if response_dict == None:
+            return None
+        _sys.stdout.write(response_dict["output"])
+        _sys.stdout.flush()
+        return response_dict["exit_code"]
+
+    def status(self, parent_trace):
+        '''
+        Returns a dict describing the running daemon, or None if no daemon is running.
+        '''
+        try:
+            return self._send({"command": ApoDaemon.STATUS})
+        except (OSError, ValueError) as ex:
+            raise ApodeixiError(parent_trace, "Unable to get the status of the Apodeixi daemon",
+                                            data = {"socket": self.socket_path, "error": str(ex)})
+
+    def start(self, parent_trace):
+        '''
+        Starts the daemon in a background process and waits until it is ready to serve requests.
+
+        Returns a dict describing the daemon, as in self.status.
+        '''
+        if not self.is_supported():
+            raise ApodeixiError(parent_trace, "The Apodeixi daemon is not supported on this platform, since it lacks "
+                                                + "Unix domain sockets")
+        if self.status(parent_trace) != None:
+            raise ApodeixiError(parent_trace, "The Apodeixi daemon is already running",
+                                            data = {"socket": self.socket_path})
+
+        self._make_private_dir(parent_trace)
+        # Don't follow symbolic links, in case the log's path was planted before the directory was private
+        log_fd                              = _os.open(self.log_path, 
+                                                        _os.O_WRONLY | _os.O_CREAT | _os.O_APPEND | _os.O_NOFOLLOW, 0o600)
+        with _os.fdopen(log_fd, 'a') as log_file:
+            process                         = _subprocess.Popen([_sys.executable, "-m", "apodeixi.cli.apo_daemon"],
+                                                                stdin               = _subprocess.DEVNULL,
+                                                                stdout              = log_file,
+                                                                stderr              = log_file,
+                                                                start_new_session   = True)
+        deadline                            = _time.time() + ApoDaemon.START_TIMEOUT_SECS
+        while _time.time() < deadline:
+            if process.poll() != None:
+                raise ApodeixiError(parent_trace, "The Apodeixi daemon exited while starting up. Check its log",
+                                            data = {"log": self.log_path, "exit code": str(process.returncode)})
+            status_dict                     = self.status(parent_trace)
+            if status_dict != None:
+                return status_dict
+            _time.sleep(0.2)
+
+        raise ApodeixiError(parent_trace, "Timed out waiting for the Apodeixi daemon to start. Check its log",
+                                            data = {"log": self.log_path})
+
+    def stop(self, parent_trace):
+        '''
+        Stops the daemon. Returns a boolean, stating whether a daemon was running.
+        '''
+        try:
+            return self._send({"command": ApoDaemon.STOP}) != None
+        except (OSError, ValueError) as ex:
+            raise ApodeixiError(parent_trace, "Unable to stop the Apodeixi daemon",
+                                            data = {"socket": self.socket_path, "error": str(ex)})
+
+    def serve(self, kb_session=None):
+        '''
+        Runs the daemon's server loop in the current process, until a request to stop is received.
+
+        @param kb_session Optional KB_Session to serve requests with. If None, a new KB_Session is created.
+        '''
+        if kb_session == None:
+            from apodeixi.cli.kb_session            import KB_Session
+            kb_session                      = KB_Session()
+        func_trace                          = FunctionalTrace(  parent_trace    = None,
+                                                                path_mask       = None)
+        root_trace                          = func_trace.doing("Running Apodeixi daemon",
+                                                                origination     = {'signaled_from': __file__})
+        started                             = _datetime.datetime.now()
+        nb_requests                         = 0
+
+        self._make_private_dir(root_trace)
+        if _os.path.exists(self.socket_path):
+            _os.remove(self.socket_path) # Stale, or self.start would not have launched us
+        server                              = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+        # Create the socket with no permissions for other users, rather than restricting them after it exists
+        original_umask                      = _os.umask(0o177)
+        try:
+            server.bind(self.socket_path)
+        finally:
+            _os.umask(original_umask)
+        _os.chmod(self.socket_path, 0o600)
+        server.listen()
+        print("Apodeixi daemon " + str(_os.getpid()) + " listening on " + self.socket_path, flush=True)
+        try:
+            while True:
+                conn, address               = server.accept()
+                if not self._is_same_user(conn):
+                    print("Refused a connection from another user", flush=True)
+                    conn.close()
+                    continue
+                try:
+                    request_dict            = _json.loads(self._receive_all(conn).decode("utf8"))
+                    command                 = request_dict["command"]
+                    if command == ApoDaemon.RUN:
+                        response_dict       = self._run(root_trace, kb_session, request_dict)
+                        nb_requests         += 1
+                    else:
+                        response_dict       = { "pid":              _os.getpid(),
+                                                "socket":           self.socket_path,
+                                                "started":          started.strftime("%y%m%d.%H%M%S"),
+                                                "requests served":  nb_requests}
+                    conn.sendall(_json.dumps(response_dict).encode("utf8"))
+                except Exception as ex:
+                    print("Error serving request: " + str(ex), flush=True)
+                    command                 = None
+                finally:
+                    conn.close()
+                if command == ApoDaemon.STOP:
+                    break
+        finally:
+            server.close()
+            if _os.path.exists(self.socket_path):
+                _os.remove(self.socket_path)
+        print("Apodeixi daemon " + str(_os.getpid()) + " stopped after serving " + str(nb_requests) + " requests",
+                                                                                                        flush=True)
+
+    def _run(self, parent_trace, kb_session, request_dict):
+        '''
+        Runs an `apo` command in-process with the warm `kb_session`, capturing its output.
+
+        Returns a dict with the output and the exit code of the command.
+        '''
+        import click
+        from apodeixi.cli.apo_cli                   import apo_cli
+
+        output                              = _io.StringIO()
+        original_cwd                        = _os.getcwd()
+        exit_code                           = 0
+        try:
+            _os.chdir(request_dict["cwd"])
+            with redirect_stdout(output), redirect_stderr(output):
+                try:
+                    result                  = apo_cli.main( args                = request_dict["argv"],
+                                                            prog_name           = "apo",
+                                                            standalone_mode     = False,
+                                                            obj                 = kb_session,
+                                                            color               = request_dict["color"])
+                    if type(result) == int:
+                        exit_code           = result
+                except click.exceptions.ClickException as ex:
+                    ex.show()
+                    exit_code               = ex.exit_code
+                except click.exceptions.Abort:
+                    exit_code               = 1
+                except SystemExit as ex:
+                    exit_code               = ex.code if type(ex.code) == int else 0
+                except Exception as ex:
+                    print("Unrecoverable error: " + str(ex))
+                    exit_code               = 1
+        finally:
+            _os.chdir(original_cwd)
+            my_trace                        = parent_trace.doing("Resetting KB_Session after serving a request")
+            try:
+                kb_session.reset(my_trace)
+            except ApodeixiError as ex:
+                output.write("\nProblem resetting the Apodeixi daemon's session. Consider restarting the daemon:\n"
+                                + ex.trace_message())
+
+        return {"output": output.getvalue(), "exit_code": exit_code}
+
+def main():
+    '''
+    Entry point for the `apo` command. If an Apodeixi daemon is running, the command is forwarded to it. Otherwise
+    it is run in this process.
+    '''
+    argv                                    = _sys.argv[1:]
+    if len(argv) == 0 or argv[0] != "daemon":
+        exit_code                           = ApoDaemon().forward(argv)
+        if exit_code != None:
+            _sys.exit(exit_code)
+
+    from apodeixi.cli.apo_cli                       import apo_cli
+    apo_cli()
+
+if __name__ == "__main__":
+    ApoDaemon().serve()
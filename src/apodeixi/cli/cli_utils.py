@@ -3,21 +3,18 @@ import os                                                           as _os
 import re                                                           as _re
 
 from tabulate                                                       import tabulate
-import pandas                                                       as _pd
-import xlsxwriter
 
 from apodeixi.cli.error_reporting                                   import CLI_ErrorReporting
-from apodeixi.controllers.admin.static_data.static_data_validator   import StaticDataValidator
 
-from apodeixi.knowledge_base.manifest_utils                         import ManifestUtils
 from apodeixi.knowledge_base.kb_environment                         import File_KBEnv_Impl
-from apodeixi.text_layout.excel_layout                              import Palette
 from apodeixi.util.a6i_error                                        import ApodeixiError
 from apodeixi.util.formatting_utils                                 import StringUtils
 from apodeixi.util.path_utils                                       import PathUtils
 from apodeixi.util.performance_utils                                import ApodeixiTimer
 from apodeixi.util.dictionary_utils                                 import DictionaryUtils
-from apodeixi.util.reporting_utils                                  import ReportWriterUtils
+
+# GOTCHA: Modules that are slow to import (pandas, xlsxwriter, controllers, ...) are imported lazily in the methods
+#       that need them, so that CLI commands only pay for what they use.
 
 class CLI_Utils():
     '''
@@ -163,6 +160,8 @@ class CLI_Utils():
 
         The table has a row per manifest that was involved, with a description of what changed, if anything.
         '''
+        from apodeixi.knowledge_base.manifest_utils                 import ManifestUtils
+
         description_table                   = []
         description_headers                 = ["Manifest", "Event", "Entities added", "Entities removed",
                                                     "Entities changed", "Entities unchanged", "Namespace", "Name"]
@@ -334,6 +333,10 @@ class CLI_Utils():
             directory and filename)
         @param description A string, used to give a description of the report. Example: "big-rock_v1-v2_diff".
         '''
+        import pandas                                               as _pd
+        import xlsxwriter
+        from apodeixi.util.reporting_utils                          import ReportWriterUtils
+
         workbook                        = xlsxwriter.Workbook(path)
         my_trace                        = parent_trace.doing("Populating the report's content") 
         report_content_df               = _pd.DataFrame(data=data, columns=columns)
@@ -376,6 +379,8 @@ class CLI_Utils():
             Its purposes is to filte out which KnowledgeBase store's environments to include when searching
             for products. If it is None, then all environments are included
         '''
+        from apodeixi.controllers.admin.static_data.static_data_validator   import StaticDataValidator
+
         expected_organization           = kb_session.a6i_config.getOrganization(parent_trace)
         allowed_kb_areas                = kb_session.a6i_config.getKnowledgeBaseAreas(parent_trace)
 
@@ -429,6 +434,8 @@ class CLI_Utils():
         SCORING_CYCLE_COL               = 'Scoring Cycle'
         SCENARIO_COL                    = 'Scenario'
 
+        from apodeixi.controllers.admin.static_data.static_data_validator   import StaticDataValidator
+
         expected_organization           = kb_session.a6i_config.getOrganization(parent_trace)
         allowed_kb_areas                = kb_session.a6i_config.getKnowledgeBaseAreas(parent_trace)
 
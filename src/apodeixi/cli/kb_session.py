@@ -2,10 +2,8 @@ import sys                                          as _sys
 import datetime                                     as _datetime
 from importlib                                      import import_module
 
-from apodeixi.knowledge_base.knowledge_base         import KnowledgeBase
-from apodeixi.knowledge_base.knowledge_base_store   import KnowledgeBaseStore
-from apodeixi.knowledge_base.kb_environment         import KB_Environment_Config
-from apodeixi.knowledge_base.shutil_kb_store        import Shutil_KBStore_Impl
+# GOTCHA: The KnowledgeBase classes are imported lazily, in the methods that need them, since they are slow to import
+#       and the `apo` CLI imports this module even for commands that don't need a KnowledgeBase (e.g., `apo --version`)
 
 from apodeixi.util.apodeixi_config                  import ApodeixiConfig
 from apodeixi.util.a6i_error                        import FunctionalTrace, ApodeixiError
@@ -45,6 +43,11 @@ class KB_Session_Initializer():
 
         @param kb_session A KB_Session instance that needs to be initialized
         '''
+        from apodeixi.knowledge_base.knowledge_base         import KnowledgeBase
+        from apodeixi.knowledge_base.knowledge_base_store   import KnowledgeBaseStore
+        from apodeixi.knowledge_base.shutil_kb_store        import Shutil_KBStore_Impl
+        from apodeixi.xli.xlimporter                        import ExcelRangeCache
+
         my_trace                            = parent_trace.doing("Loading Apodeixi configuration",
                                                                     origination     = {'signaled_from': __file__})
         kb_session.a6i_config               = ApodeixiConfig(my_trace)
@@ -54,9 +57,20 @@ class KB_Session_Initializer():
         kb_session.kb_rootdir               = kb_session.a6i_config.get_KB_RootFolder(my_trace)
         kb_session.clientURL                = kb_session.a6i_config.get_ExternalCollaborationFolder(my_trace) 
 
-        store_impl                          = Shutil_KBStore_Impl(  parent_trace    = my_trace,
-                                                                    kb_rootdir      = kb_session.kb_rootdir, 
-                                                                    clientURL       = kb_session.clientURL)
+        posting_cache_folder                = kb_session.a6i_config.get_PostingCacheFolder(my_trace)
+        if posting_cache_folder != None:
+            posting_cache                   = ExcelRangeCache(  parent_trace        = my_trace,
+                                                                cache_folder        = posting_cache_folder,
+                                                                max_bytes           = kb_session.a6i_config.get_PostingCacheMaxMB(my_trace) 
+                                                                                        * 1024 * 1024)
+        else:
+            posting_cache                   = None
+
+        store_impl                          = Shutil_KBStore_Impl(  parent_trace        = my_trace,
+                                                                    kb_rootdir          = kb_session.kb_rootdir, 
+                                                                    clientURL           = kb_session.clientURL,
+                                                                    manifest_sidecars   = kb_session.a6i_config.get_ManifestSidecars(my_trace),
+                                                                    posting_cache       = posting_cache)
         kb_session.store                    = KnowledgeBaseStore(my_trace, store_impl)
         my_trace                            = parent_trace.doing("Starting KnowledgeBase")
         kb_session.kb                       = KnowledgeBase(my_trace, kb_session.store, a6i_config=kb_session.a6i_config)
@@ -70,9 +84,9 @@ class KB_Session():
     In practice that means a single CLI command, since each CLI command typically leads to the spawning of a
     dedicated Python process to handle such command.
 
-    In future versions, that behavior might change if an "Apodeixi daemon" is introduced, to which a CLI command
-    might latch if a daemon is running, or create the daemon if it is not running. In such a future state then
-    the duration of a KB_Session would be the lifetime of such daemon.
+    The exception is when an "Apodeixi daemon" is running (refer to ApoDaemon), to which CLI commands are
+    forwarded. In that case the duration of a KB_Session is the lifetime of the daemon, and the KB_Session is
+    reset after each CLI command.
     '''
     def __init__(self):
         try:
@@ -124,6 +138,17 @@ class KB_Session():
             _sys.exit()
 
 
+    def reset(self, parent_trace):
+        '''
+        Used when a KB_Session outlives a single CLI command, as is the case for the Apodeixi daemon. It forgets
+        state that a CLI command may have left behind (such as the active environment), so that the next command
+        runs as if the KB_Session had just been created, while keeping the store's caches warm.
+        '''
+        self.store.clearSessionState(parent_trace)
+
+        dt                                  = _datetime.datetime.today()
+        self.timestamp                      = dt.strftime("%y%m%d.%H%M%S")
+
     def provisionSandbox(self, parent_trace):
         '''
         Provisions a sandbox for running KnowledgeBase requests. Typical use case is for dry-runs, where the user
@@ -151,7 +176,12 @@ class KB_Session():
         outside the sandbox) if the data is not already in the sandbox. 
         This turns the sandbox into a "virtual copy" of the parent environment: it feels like it has all the
         same data as the parent, but any writes are not made to the parent.
+
+        If so configured (refer to ApodeixiConfig.get_OverlaySandboxes), the sandbox is an overlay of the parent
+        environment, so that data read from the parent is not copied into the sandbox.
         '''
+        from apodeixi.knowledge_base.kb_environment         import KB_Environment_Config
+
         # This will look like '210703.102746_sandbox' for a sandbox requested on the 3rd of July of 2021 at 10:27 am 
         # (and 46 sec). 
         # Intention is for this folder name to be unique across all sandboxes
@@ -162,7 +192,8 @@ class KB_Session():
                                             parent_trace        = my_trace, 
                                             read_misses_policy  = KB_Environment_Config.FAILOVER_ALL_READS_TO_PARENT,
                                             use_timestamps      = True,
-                                            path_mask           = None)
+                                            path_mask           = None,
+                                            overlay             = self.a6i_config.get_OverlaySandboxes(my_trace))
 
         self.store.current_environment(my_trace).addSubEnvironment( parent_trace        = my_trace, 
                                                                     name                = sandbox_name, 
@@ -0,0 +1,162 @@
+import sys                                              as _sys
+import os                                               as _os
+import io                                               as _io
+import socket                                           as _socket
+import stat                                             as _stat
+import tempfile                                         as _tempfile
+import threading                                        as _threading
+import time                                             as _time
+import unittest                                         as _unittest
+from contextlib                                         import redirect_stdout
+
+from apodeixi.testing_framework.a6i_unit_test           import ApodeixiUnitTest
+from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
+
+from apodeixi.cli.apo_daemon                            import ApoDaemon
+
+class Recording_KB_Session():
+    '''
+    Stands in for a KB_Session in the daemon, so that the daemon can be tested without a KnowledgeBase.
+    It records how many times it is reset, and can be told to fail when it is reset.
+    '''
+    def __init__(self):
+        self.nb_resets                  = 0
+        self.fail_resets                = False
+
+    def reset(self, parent_trace):
+        self.nb_resets                  += 1
+        if self.fail_resets:
+            raise ApodeixiError(parent_trace, "Simulated failure to reset the session")
+
+class Test_ApoDaemon(ApodeixiUnitTest):
+
+    def setUp(self):
+        super().setUp()
+
+    @_unittest.skipIf(not ApoDaemon().is_supported(), "Unix domain sockets are not supported on this platform")
+    def test_daemon_round_trip(self):
+
+        TEST_NAME                       = 'daemon_round_trip'
+
+        try:
+            root_trace                  = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing Apodeixi daemon",
+                                                                        origination = {
+                                                                                'signaled_from' : __file__,
+                                                                                'concrete class': str(self.__class__.__name__)})
+            # Socket paths can't be long, so the daemon's directory is not created in self.output_data
+            original_runtime_dir        = _os.environ.get('XDG_RUNTIME_DIR')
+            with _tempfile.TemporaryDirectory() as tmp_dir:
+                _os.environ['XDG_RUNTIME_DIR'] = tmp_dir
+                try:
+                    daemon              = ApoDaemon()
+                finally:
+                    if original_runtime_dir == None:
+                        _os.environ.pop('XDG_RUNTIME_DIR')
+                    else:
+                        _os.environ['XDG_RUNTIME_DIR'] = original_runtime_dir
+                daemon_dir              = _os.path.dirname(daemon.socket_path)
+                kb_session              = Recording_KB_Session()
+
+                output_txt              = "=========== Before the daemon starts"
+                # A directory that other users can write to, where one of them might have planted a socket
+                _os.mkdir(daemon_dir, 0o777)
+                _os.chmod(daemon_dir, 0o777)
+                with open(daemon.socket_path, 'w') as planted_file:
+                    planted_file.write("")
+                output_txt              += "\nStatus with a directory that is not private: " + str(daemon.status(root_trace))
+                try:
+                    daemon.serve(kb_session = kb_session)
+                    output_txt          += "\nServed with a directory that is not private"
+                except ApodeixiError as ex:
+                    output_txt          += "\nRefused to serve with a directory that is not private"
+
+                # A socket file left behind by a daemon that is no longer running
+                _os.chmod(daemon_dir, 0o700)
+                output_txt              += "\nStatus with a stale socket file: " + str(daemon.status(root_trace))
+
+                server_thread           = _threading.Thread(target = daemon.serve, kwargs = {"kb_session": kb_session})
+                server_thread.start()
+                status_dict             = None
+                deadline                = _time.time() + 30
+                while status_dict == None and _time.time() < deadline:
+                    _time.sleep(0.05)
+                    status_dict         = daemon.status(root_trace)
+
+                output_txt              += "\n\n=========== After the daemon starts"
+                output_txt              += "\nStatus fields: " + str(sorted(status_dict.keys()))
+                output_txt              += "\nRequests served: " + str(status_dict["requests served"])
+                output_txt              += "\nDirectory permissions: " \
+                                            + oct(_stat.S_IMODE(_os.stat(daemon_dir).st_mode))
+                output_txt              += "\nSocket permissions: " \
+                                            + oct(_stat.S_IMODE(_os.stat(daemon.socket_path).st_mode))
+
+                output_txt              += "\n\n=========== Forwarding a command"
+                forwarded_output        = _io.StringIO()
+                with redirect_stdout(forwarded_output):
+                    exit_code           = daemon.forward(["--help"])
+                output_txt              += "\nExit code: " + str(exit_code)
+                output_txt              += "\nPrinted the usage: " + str(forwarded_output.getvalue().startswith("Usage: apo"))
+                output_txt              += "\nSession resets: " + str(kb_session.nb_resets)
+
+                output_txt              += "\n\n=========== Running a command that fails"
+                response_dict           = self._run_command(daemon, ["no-such-command"])
+                output_txt              += "\nExit code: " + str(response_dict["exit_code"])
+                output_txt              += "\nOutput explains the error: " + str("No such command" in response_dict["output"])
+                output_txt              += "\nSession resets: " + str(kb_session.nb_resets)
+
+                output_txt              += "\n\n=========== Failing to reset the session"
+                kb_session.fail_resets  = True
+                response_dict           = self._run_command(daemon, ["--help"])
+                kb_session.fail_resets  = False
+                output_txt              += "\nExit code: " + str(response_dict["exit_code"])
+                output_txt              += "\nOutput reports the problem: " \
+                                            + str("Problem resetting the Apodeixi daemon's session" in response_dict["output"])
+                output_txt              += "\nSession resets: " + str(kb_session.nb_resets)
+
+                output_txt              += "\n\n=========== Sending a request that is not JSON"
+                conn                    = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+                try:
+                    conn.connect(daemon.socket_path)
+                    output_txt          += "\nDaemon runs as the same user: " + str(daemon._is_same_user(conn))
+                    conn.sendall("This is not JSON".encode("utf8"))
+                    conn.shutdown(_socket.SHUT_WR)
+                    output_txt          += "\nResponse: " + str(daemon._receive_all(conn))
+                finally:
+                    conn.close()
+                status_dict             = daemon.status(root_trace)
+                output_txt              += "\nDaemon still serves requests: " + str(status_dict != None)
+                output_txt              += "\nRequests served: " + str(status_dict["requests served"])
+
+                output_txt              += "\n\n=========== Stopping the daemon"
+                output_txt              += "\nStopped a running daemon: " + str(daemon.stop(root_trace))
+                server_thread.join(timeout = 30)
+                output_txt              += "\nServer loop exited: " + str(not server_thread.is_alive())
+                output_txt              += "\nSocket file removed: " + str(not _os.path.exists(daemon.socket_path))
+                output_txt              += "\nStatus: " + str(daemon.status(root_trace))
+                output_txt              += "\nStopped a running daemon: " + str(daemon.stop(root_trace))
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
+    def _run_command(self, daemon, argv):
+        '''
+        Sends the daemon a request to run the `apo` command given by `argv`, and returns the daemon's response
+        '''
+        return daemon._send({   "command":  ApoDaemon.RUN,
+                                "argv":     argv,
+                                "cwd":      _os.getcwd(),
+                                "color":    False})
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        T = Test_ApoDaemon()
+        T.setUp()
+        what_to_do = args[1]
+        if what_to_do=='daemon_round_trip':
+            T.test_daemon_round_trip()
+
+    main(_sys.argv)
@@ -0,0 +1,46 @@
+import sys                                              as _sys
+
+from apodeixi.testing_framework.a6i_unit_test           import ApodeixiUnitTest
+from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
+
+from apodeixi.testing_framework.benchmarks.import_time_benchmark    import ImportTime_Benchmark
+
+class Test_CLI_Startup(ApodeixiUnitTest):
+
+    def setUp(self):
+        super().setUp()
+
+    def test_lazy_imports(self):
+
+        TEST_NAME                       = 'lazy_imports'
+
+        try:
+            root_trace                  = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing CLI startup imports",
+                                                                        origination = {
+                                                                                'signaled_from' : __file__,
+                                                                                'concrete class': str(self.__class__.__name__)})
+
+            # Timings vary from run to run, so they are left to the benchmark. Here we only check which modules
+            # the entry points import
+            benchmark                   = ImportTime_Benchmark()
+            output_txt                  = ""
+            for module in ImportTime_Benchmark.BUDGETS.keys():
+                loaded                  = benchmark.loaded_modules(root_trace, module)
+                output_txt              += "\n" + module + " imports heavy modules: " + str(benchmark.heavy_modules(loaded))
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        T = Test_CLI_Startup()
+        T.setUp()
+        what_to_do = args[1]
+        if what_to_do=='lazy_imports':
+            T.test_lazy_imports()
+
+    main(_sys.argv)
@@ -0,0 +1,130 @@
+import threading                                        as _threading
+
+from apodeixi.util.formatting_utils                     import StringUtils
+
+class StaticDataCache():
+    '''
+    In-memory cache, owned by a KnowledgeBaseStore, of objects derived from the latest version of static data manifests.
+    Entries are keyed by the (namespace, kind) of the static data manifest, and each entry remembers the version of
+    the manifest it was derived from.
+
+    Used by the StaticDataValidator so that validating posting labels does not require finding and loading the latest
+    static data manifest again and again for the same namespace.
+
+    Entries are only valid for some environments of the store: those in which the entries were loaded, and the
+    isolation environments of transactions started from them (since transactions fail over reads to their parent
+    environment). The store is responsible for calling the methods of this class when something happens that
+    might make the entries stale:
+
+    * When a manifest is persisted, entries for its namespace and kind are evicted
+    * When an entry is looked up, the store passes the latest version of the manifest according to its manifest
+      catalog, and the entry is evicted if it was derived from a different version. That way new versions persisted
+      by other processes (e.g., another KnowledgeBase sharing the same store) are noticed
+    * When a transaction starts, its environment shares the entries of its parent environment
+    * When a transaction is aborted, or the store's session state is cleared, all entries are evicted
+    * When an environment is removed, it is forgotten, so that if later an environment with the same name is
+      created the entries are not used for it
+    '''
+    # Name of the static data manifests, which are identified by their namespace and kind
+    MANIFEST_NAME                       = "static-data"
+
+    def __init__(self):
+        self._entries                   = {} # Keys are (namespace, kind), values are pairs (version, static data)
+        self._environments              = set() # Names of the environments for which entries are valid
+        self._lock                      = _threading.Lock()
+        self.hits                       = 0
+        self.misses                     = 0
+
+    def __getstate__(self):
+        '''
+        Locks can't be pickled, so leave out the lock when this cache is sent to worker processes
+        '''
+        state                           = self.__dict__.copy()
+        state.pop('_lock')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock                      = _threading.Lock()
+
+    def _key(self, namespace, kind):
+        FMT                             = StringUtils().format_as_yaml_fieldname
+        return (FMT(namespace), FMT(kind))
+
+    def get(self, parent_trace, environment_name, namespace, kind, latest_version):
+        '''
+        Returns the static data object cached for the `namespace` and `kind`, or None if there is none, if
+        entries are not valid in the environment called `environment_name`, or if the entry was derived from
+        a version other than `latest_version`
+
+        @param latest_version An int, for the latest version of the static data manifest for the `namespace` and 
+                    `kind`, or None if it is not known. In the latter case nothing is returned, since the entry
+                    might be stale.
+        '''
+        with self._lock:
+            if not environment_name in self._environments:
+                # We switched to an environment unrelated to the one in which entries were loaded
+                self._entries           = {}
+                self._environments      = set([environment_name])
+            key                         = self._key(namespace, kind)
+            entry                       = self._entries.get(key)
+            if entry != None and (latest_version == None or entry[0] != latest_version):
+                # Someone else persisted another version of the manifest since the entry was cached
+                self._entries.pop(key)
+                entry                   = None
+            if entry == None:
+                self.misses             += 1
+                return None
+            self.hits                   += 1
+            return entry[1]
+
+    def put(self, parent_trace, environment_name, namespace, kind, version, static_data):
+        '''
+        Caches `static_data`, which was derived from version `version` of the static data manifest for the
+        `namespace` and `kind`, as loaded in the environment called `environment_name`
+        '''
+        with self._lock:
+            if not environment_name in self._environments:
+                self._entries           = {}
+                self._environments      = set([environment_name])
+            self._entries[self._key(namespace, kind)] = (version, static_data)
+
+    def version(self, parent_trace, namespace, kind):
+        '''
+        Returns the version of the manifest from which the entry for `namespace` and `kind` was derived, or None
+        if there is no such entry
+        '''
+        with self._lock:
+            entry                       = self._entries.get(self._key(namespace, kind))
+            return None if entry == None else entry[0]
+
+    def evict(self, parent_trace, namespace, kind):
+        '''
+        Evicts the entry for `namespace` and `kind`, if any. Called when a new version of a manifest is persisted.
+        '''
+        with self._lock:
+            self._entries.pop(self._key(namespace, kind), None)
+
+    def shareEnvironment(self, parent_trace, environment_name, child_environment_name):
+        '''
+        Makes entries valid for the environment called `child_environment_name` if they are valid for the
+        environment called `environment_name`. Called when starting a transaction.
+        '''
+        with self._lock:
+            if environment_name in self._environments:
+                self._environments.add(child_environment_name)
+
+    def forgetEnvironment(self, parent_trace, environment_name):
+        '''
+        Makes entries no longer valid for the environment called `environment_name`. Called when it is removed.
+        '''
+        with self._lock:
+            self._environments.discard(environment_name)
+
+    def clear(self, parent_trace):
+        '''
+        Evicts all entries
+        '''
+        with self._lock:
+            self._entries               = {}
+            self._environments          = set()
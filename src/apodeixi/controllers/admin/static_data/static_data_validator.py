@@ -1,12 +1,86 @@
 import os                                               as _os
 
 from apodeixi.controllers.admin.static_data.products    import ProductsController
+from apodeixi.controllers.admin.static_data.static_data_cache   import StaticDataCache
 from apodeixi.representers.as_dataframe                 import AsDataframe_Representer
 
 from apodeixi.util.a6i_error                            import ApodeixiError
 from apodeixi.util.dictionary_utils                     import DictionaryUtils
 from apodeixi.util.formatting_utils                     import StringUtils
 
+class StaticData():
+    '''
+    Data structure class with the content of the latest version of a static data manifest as a DataFrame, along
+    with indexes to look up rows in it. Indexes are built the first time they are needed.
+
+    Instances are cached in the KnowledgeBaseStore, and shared by all StaticDataValidators using the store. So
+    they must not be modified after the indexes are built, and callers must not modify `contents_df`.
+    '''
+    def __init__(self, contents_df):
+        self.contents_df                = contents_df
+        self._product_rows              = None # Dict from product codes or aliases to list of row numbers
+        self._product_codes             = None
+        self._scoring_cycles            = None # Set of (journey, scoring cycle, scenario) tuples formatted as YAML
+        self._cycles_and_scenarios      = None # Set of (scoring cycle, scenario) tuples formatted as YAML
+
+    def product_rows(self, parent_trace, alleged_product):
+        '''
+        Returns a list of ints, for the positions of the rows of `contents_df` for the `alleged_product`, i.e., 
+        rows for which the `alleged_product` is the product code or one of its aliases
+        '''
+        if self._product_rows == None:
+            product_rows                = {}
+            prod_codes                  = self.contents_df[ProductsController.PRODUCT_COL]
+            aliases                     = self.contents_df[ProductsController.ALIAS_COL]
+            for row_nb in range(len(self.contents_df.index)):
+                prod_code               = prod_codes.iloc[row_nb].strip()
+                alias_list              = [alias.strip() for alias in aliases.iloc[row_nb].split(",")]
+                for key in [prod_code] + alias_list:
+                    rows                = product_rows.setdefault(key, [])
+                    if len(rows) == 0 or rows[-1] != row_nb: # A product's code might also be one of its aliases
+                        rows.append(row_nb)
+            self._product_rows          = product_rows
+        return self._product_rows.get(alleged_product, [])
+
+    def product_codes(self, parent_trace):
+        '''
+        Returns a list of all official product codes, without duplicates
+        '''
+        if self._product_codes == None:
+            self._product_codes         = list(self.contents_df[ProductsController.PRODUCT_COL].unique())
+        return list(self._product_codes)
+
+    def has_scoring_cycle(self, parent_trace, journey, scoring_cycle, scenario):
+        '''
+        Returns True if `contents_df` has a row for the `journey`, `scoring_cycle` and `scenario`, compared
+        as YAML fields. The journey may also be ProductsController.MULTIPLE_JOURNEYS, which matches any journey.
+        '''
+        JOURNEY_COL                     = 'journey'
+        SCORING_CYCLE_COL               = 'Scoring Cycle'
+        SCENARIO_COL                    = 'Scenario'
+        FMT                             = StringUtils().format_as_yaml_fieldname
+        if self._scoring_cycles == None:
+            scoring_cycles              = set()
+            cycles_and_scenarios        = set()
+            for row in self.contents_df[[JOURNEY_COL, SCORING_CYCLE_COL, SCENARIO_COL]].itertuples(index=False):
+                # Only strings can be equal as YAML fields
+                if type(row[1]) == str and type(row[2]) == str:
+                    cycles_and_scenarios.add((FMT(row[1]), FMT(row[2])))
+                    if type(row[0]) == str:
+                        scoring_cycles.add((FMT(row[0]), FMT(row[1]), FMT(row[2])))
+            self._cycles_and_scenarios  = cycles_and_scenarios
+            self._scoring_cycles        = scoring_cycles
+
+        if type(journey) != str or type(scoring_cycle) != str or type(scenario) != str:
+            return False
+        if (FMT(journey), FMT(scoring_cycle), FMT(scenario)) in self._scoring_cycles:
+            return True
+        # Sometimes (e.g., for products with subproducts) there might be different journeys for different subproducts, 
+        # say, and Apodeixi semantics are that the user should enter "Multiple" as the journey. So this is
+        # also considered valid
+        return FMT(journey) == FMT(ProductsController.MULTIPLE_JOURNEYS) \
+                        and (FMT(scoring_cycle), FMT(scenario)) in self._cycles_and_scenarios
+
 class StaticDataValidator():
     '''
     Utility class that provides services to validate static data. 
@@ -66,34 +140,22 @@ class StaticDataValidator():
 
                 submitted                   = [alleged_journey, alleged_scoring_cycle, alleged_scenario]
 
-                contents_df                 = self._loadStaticData( my_trace, 
+                static_data                 = self._loadStaticData( my_trace, 
                                                                     namespace, 
                                                                     kind            = 'scoring-cycle', 
                                                                     entity          = 'journey')
 
+                if static_data.has_scoring_cycle(my_trace, alleged_journey, alleged_scoring_cycle, alleged_scenario):
+                    # Good, we have a match so that Posting Label is referencing things that exist.
+                    # So just return, validation is a success
+                    return
 
+                # Remember valid options to provide this feedback to the user
                 valid_options               = []
-
-                for row in contents_df.iterrows():
+                for row in static_data.contents_df.iterrows():
                     journey                 = row[1][JOURNEY_COL]
                     scoring_cycle           = row[1][SCORING_CYCLE_COL]
                     scenario                = row[1][SCENARIO_COL]
-
-                    EQ                      = StringUtils().equal_as_yaml
-
-                    if EQ(alleged_journey, journey) and EQ(alleged_scoring_cycle, scoring_cycle) \
-                                                    and EQ(alleged_scenario, scenario):
-                        # Good, we have a match so that Posting Label is referencing things that exist.
-                        # So just return, validation is a success
-                        return
-                    elif EQ(alleged_journey, ProductsController.MULTIPLE_JOURNEYS) and EQ(alleged_scoring_cycle, scoring_cycle) \
-                                                    and EQ(alleged_scenario, scenario):
-                        # This is also a "match", in the sense that sometimes (e.g., for products with subproducts)
-                        # there might be different journeys for different subproducts, say, and Apodeixi
-                        # semantics are that the user should enter "Multiple" as the journey. So this is
-                        # also considered vaid
-                        return
-                    # Remember this in case we need to error out and provide this feedback to the user
                     valid_options.append([journey, scoring_cycle, scenario])
                     valid_options.append([ProductsController.MULTIPLE_JOURNEYS, scoring_cycle, scenario])
 
@@ -155,11 +217,12 @@ class StaticDataValidator():
         Gets a list of all scoring cycles in the namespace, as a DataFrames
         '''
         my_trace                    = parent_trace.doing("Checking scoring cycle referential integrity")
-        contents_df                 = self._loadStaticData( my_trace, 
+        static_data                 = self._loadStaticData( my_trace, 
                                                             namespace, 
                                                             kind            = 'scoring-cycle', 
                                                             entity          = 'journey')
-        return contents_df
+        # Return a copy, since the DataFrame is cached
+        return static_data.contents_df.copy()
   
     
     def getProductCode(self, parent_trace, namespace, alleged_product):
@@ -178,15 +241,13 @@ class StaticDataValidator():
                             valid product.
         '''
         my_trace                    = parent_trace.doing("Retrieving product static data")
-        contents_df                 = self._loadStaticData(my_trace, namespace, kind='product', entity='product') 
+        static_data                 = self._loadStaticData(my_trace, namespace, kind='product', entity='product') 
 
         my_trace                    = parent_trace.doing("Checking if '" + str(alleged_product) 
                                                             + "' appears in product static data")
-        for row in contents_df.iterrows():
-            prod_code               = row[1][ProductsController.PRODUCT_COL].strip()
-            alias_list              = [alias.strip() for alias in row[1][ProductsController.ALIAS_COL].split(",")]
-            if alleged_product == prod_code or alleged_product in alias_list:
-                return prod_code
+        product_rows                = static_data.product_rows(my_trace, alleged_product)
+        if len(product_rows) > 0:
+            return static_data.contents_df[ProductsController.PRODUCT_COL].iloc[product_rows[0]].strip()
 
         # If we get this far, then we didn't find it, so return None
         return None
@@ -204,29 +265,19 @@ class StaticDataValidator():
         @param alleged_product A string that is claimed represents the name of a product or an known alias for a
                             valid product.
         '''
-        PRODUCT_COL                 = 'product'
         SUB_PRODUCT_COL             = 'Sub Product'
 
-        ALIAS_COL                   = 'Alias names'
-
         my_trace                    = parent_trace.doing("Retrieving product static data")
-        contents_df                 = self._loadStaticData(my_trace, namespace, kind='product', entity='product') 
+        static_data                 = self._loadStaticData(my_trace, namespace, kind='product', entity='product') 
 
         my_trace                    = parent_trace.doing("Checking if '" + str(alleged_product) 
                                                             + "' appears in product static data")
-        def _is_a_match(row):
-            prod_code               = row[PRODUCT_COL].strip()
-            alias_list              = [alias.strip() for alias in row[ALIAS_COL].split(",")]
-            if alleged_product == prod_code or alleged_product in alias_list:
-                return True
-            else:
-                return False
+        product_rows                = static_data.product_rows(my_trace, alleged_product)
 
-        alleged_product_df          = contents_df[contents_df.apply(_is_a_match, axis=1) == True]
-
-        if len(alleged_product_df.index) == 0:
+        if len(product_rows) == 0:
             raise ApodeixiError(my_trace, "'" + str(alleged_product) + "' is not a valid product or alias of a valid product")
 
+        alleged_product_df          = static_data.contents_df.iloc[product_rows]
 
         if SUB_PRODUCT_COL in alleged_product_df.columns:
             # Because of the way how content_df is built (with sparse=False in self._loadStaticData), 
@@ -248,31 +299,37 @@ class StaticDataValidator():
         @param namespace A string. Corresponds to a namespace in the manifest's section of the KnowledgeBase store.
                             For example, "my-corp.production"
         '''
-        PRODUCT_COL                 = 'product'
-
         my_trace                    = parent_trace.doing("Retrieving product static data")
-        contents_df                 = self._loadStaticData(my_trace, namespace, kind='product', entity='product')
+        static_data                 = self._loadStaticData(my_trace, namespace, kind='product', entity='product')
         
-        # GOTCHA: due to subproducts, some products may appear in multiple rows in contents_df, so make sure to
-        # remove duplicates
-        all_product_codes           = list(contents_df[PRODUCT_COL].unique())
+        # GOTCHA: due to subproducts, some products may appear in multiple rows in contents_df, so 
+        # StaticData.product_codes removes duplicates
+        all_product_codes           = static_data.product_codes(my_trace)
         return all_product_codes
 
     def _loadStaticData(self, parent_trace, namespace, kind, entity):
         '''
-        Helper method. Returns a DataFrame of the latest version of the static data manifest for the `kind`
+        Helper method. Returns a StaticData object for the latest version of the static data manifest for the `kind`.
+
+        StaticData objects are cached in the store, which only returns them if they were derived from the latest
+        version of the static data manifest, even if a newer version was persisted by another process. So only on a
+        cache miss is the manifest loaded and converted to a DataFrame.
 
         @param kind A string, representing the `kind` of static data to load
         @param entity A string, representing the field in the manifest under 'assertions' that is the root
                         of the content for the manifest.
         '''
+        static_data         = self.store.getCachedStaticData(parent_trace, namespace, kind)
+        if static_data != None:
+            return static_data
+
         STATIC_DATA_API     = self.a6i_config.get_static_data_api(parent_trace)
 
         manifest_dict, manifest_path  = self.store.findLatestVersionManifest(
                                                                         parent_trace        = parent_trace, 
                                                                         manifest_api_name   = STATIC_DATA_API, 
                                                                         namespace           = namespace, 
-                                                                        name                = 'static-data', 
+                                                                        name                = StaticDataCache.MANIFEST_NAME, 
                                                                         kind                = kind)
 
         if manifest_dict == None:
@@ -297,4 +354,8 @@ class StaticDataValidator():
         contents_df, uid_info_list      = rep.dict_2_df(parent_trace, content_dict, contents_path, 
                                                                 sparse=False, abbreviate_uids=True)
 
-        return contents_df
\ No newline at end of file
+        static_data                     = StaticData(contents_df)
+        # Some stores (e.g., mock stores in unit tests) have manifests without a version, so don't insist on one
+        version                         = manifest_dict.get('metadata', {}).get('version')
+        self.store.cacheStaticData(parent_trace, namespace, kind, version, static_data)
+        return static_data
\ No newline at end of file
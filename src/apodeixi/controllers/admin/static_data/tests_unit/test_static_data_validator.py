@@ -0,0 +1,105 @@
+import sys                                              as _sys
+import copy                                             as _copy
+
+from apodeixi.testing_framework.a6i_unit_test           import ApodeixiUnitTest
+from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
+from apodeixi.util.path_utils                           import PathUtils
+
+from apodeixi.controllers.admin.static_data.static_data_validator   import StaticDataValidator
+from apodeixi.knowledge_base.knowledge_base_store       import KnowledgeBaseStore
+from apodeixi.knowledge_base.shutil_kb_store            import Shutil_KBStore_Impl
+
+class Test_StaticDataValidator(ApodeixiUnitTest):
+
+    def setUp(self):
+        super().setUp()
+
+    def test_static_data_cache(self):
+        '''
+        Checks that the StaticDataValidator only loads a static data manifest from the store the first time it is
+        needed, and that it sees the new content after a new version of the static data manifest is persisted,
+        whether by the same store or by another one (as if by another process)
+        '''
+        TEST_NAME                       = 'static_data_cache'
+        NAMESPACE                       = 'my-corp.production'
+        MANIFEST_DICT                   = {'apiVersion': self.a6i_config.get_static_data_api(None) + '/v1a', 
+                                            'kind': 'product',
+                                            'metadata': {'name': 'static-data', 'namespace': NAMESPACE, 'version': 1},
+                                            'assertion': {'product': {
+                'P1':   {'UID': 'P1',   'name': 'LIQ',       'Alias names': 'Liquidity, Liq', 'Sub Product': {
+                    'SP1':  {'UID': 'P1.SP1',   'name': 'Treasury'},
+                    'SP2':  {'UID': 'P1.SP2',   'name': 'Cash'}}},
+                'P2':   {'UID': 'P2',   'name': 'FX',       'Alias names': 'Foreign Exchange'}},
+                                                            'entity_type': 'product'}}
+        try:
+            root_trace                  = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing static data cache")
+            test_dir                    = self.output_data + "/" + TEST_NAME
+            PathUtils().remove_folder_if_exists(root_trace, test_dir)
+            PathUtils().create_path_if_needed(root_trace, test_dir + "/kb")
+            PathUtils().create_path_if_needed(root_trace, test_dir + "/collab")
+
+            store                       = KnowledgeBaseStore(root_trace, Shutil_KBStore_Impl(   parent_trace    = root_trace,
+                                                                                                kb_rootdir      = test_dir + "/kb",
+                                                                                                clientURL       = test_dir + "/collab"))
+            store.beginTransaction(root_trace)
+            store.persistManifest(root_trace, _copy.deepcopy(MANIFEST_DICT))
+            store.commitTransaction(root_trace)
+
+            def _lookups(loop_trace):
+                validator               = StaticDataValidator(loop_trace, store, self.a6i_config)
+                stats                   = store.staticDataCacheStats(loop_trace)
+                return "\n\tLIQ:\t\t\t" + str(validator.getProductCode(loop_trace, NAMESPACE, 'LIQ')) \
+                        + "\n\tLiquidity:\t\t" + str(validator.getProductCode(loop_trace, NAMESPACE, 'Liquidity')) \
+                        + "\n\tFX sub products:\t" + str(validator.getSubProducts(loop_trace, NAMESPACE, 'FX')) \
+                        + "\n\tLiq sub products:\t" + str(validator.getSubProducts(loop_trace, NAMESPACE, 'Liq')) \
+                        + "\n\tRates:\t\t\t" + str(validator.getProductCode(loop_trace, NAMESPACE, 'Rates')) \
+                        + "\n\tAll products:\t\t" + str(validator.allProductCodes(loop_trace, NAMESPACE)) \
+                        + "\n\tCache hits=" + str(store.staticDataCacheStats(loop_trace)["hits"] - stats["hits"]) \
+                        + "\tmisses=" + str(store.staticDataCacheStats(loop_trace)["misses"] - stats["misses"])
+
+            output_txt                  = ""
+            output_txt                  += "\nFirst validator:" + _lookups(root_trace)
+            output_txt                  += "\nSecond validator:" + _lookups(root_trace)
+
+            my_trace                    = root_trace.doing("Persisting a new version of the static data")
+            new_dict                    = _copy.deepcopy(MANIFEST_DICT)
+            new_dict['metadata']['version'] = 2
+            new_dict['assertion']['product']['P3'] = {'UID': 'P3', 'name': 'RATES', 'Alias names': 'Rates'}
+            store.beginTransaction(my_trace)
+            store.persistManifest(my_trace, new_dict)
+            store.commitTransaction(my_trace)
+            output_txt                  += "\nAfter new version:" + _lookups(my_trace)
+
+            my_trace                    = root_trace.doing("Persisting a new version of the static data from another store")
+            other_store                 = KnowledgeBaseStore(my_trace, Shutil_KBStore_Impl(     parent_trace    = my_trace,
+                                                                                                kb_rootdir      = test_dir + "/kb",
+                                                                                                clientURL       = test_dir + "/collab"))
+            new_dict                    = _copy.deepcopy(new_dict)
+            new_dict['metadata']['version'] = 3
+            new_dict['assertion']['product']['P4'] = {'UID': 'P4', 'name': 'EQUITIES', 'Alias names': 'Stocks'}
+            other_store.beginTransaction(my_trace)
+            other_store.persistManifest(my_trace, new_dict)
+            other_store.commitTransaction(my_trace)
+            output_txt                  += "\nAfter new version from another store:" + _lookups(my_trace)
+
+            my_trace                    = root_trace.doing("Aborting a transaction")
+            store.beginTransaction(my_trace)
+            store.abortTransaction(my_trace)
+            output_txt                  += "\nAfter aborted transaction:" + _lookups(my_trace)
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        T = Test_StaticDataValidator()
+        T.setUp()
+        what_to_do = args[1]
+        if what_to_do=='static_data_cache':
+            T.test_static_data_cache()
+
+    main(_sys.argv)
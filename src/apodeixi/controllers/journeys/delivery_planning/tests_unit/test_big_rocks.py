@@ -1,8 +1,14 @@
 import sys                                              as _sys
+import copy                                             as _copy
+import pandas                                           as _pd
 
 from apodeixi.testing_framework.a6i_unit_test           import ApodeixiUnitTest
 from apodeixi.testing_framework.mock_kb_store           import UnitTest_KnowledgeBaseStore
 from apodeixi.knowledge_base.knowledge_base_store       import KnowledgeBaseStore
+from apodeixi.knowledge_base.knowledge_base_util        import FormRequest
+from apodeixi.knowledge_base.filing_coordinates         import JourneysFilingCoordinates
+from apodeixi.knowledge_base.shutil_kb_store            import Shutil_KBStore_Impl
+from apodeixi.util.path_utils                           import PathUtils
 from apodeixi.util.formatting_utils                     import DictionaryFormatter
 from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
 
@@ -18,6 +24,91 @@ class Test_BigRocksEstimate(ApodeixiUnitTest):
         Tests the "internal logic" of a controller: the _buildAllManifests method, using a simple mock KnowledgeBaseStore
         suitable for unit tests.
         '''
+        self._impl_simple_burnout(manifest_build_threads = 1)
+
+    def test_parallel_build(self):
+        '''
+        Same as test_simple_burnout, but building independent manifests in parallel. The 'big-rock-estimate' manifest
+        can only be built after the 'big-rock' manifest, since it references its UIDs. The results must be the same.
+        '''
+        self._impl_simple_burnout(manifest_build_threads = 3)
+
+    def test_parallel_form(self):
+        '''
+        Generates a form for the 'simple_burnout' manifests with 1 and with 3 threads, inside a transaction of a
+        Shutil store, as KnowledgeBase.requestForm does. Reads in a transaction fail over to the parent environment,
+        so this checks that the generated forms are the same and the store is left in the transaction's environment.
+        '''
+        EXCEL_FILE              = 'simple_burnout_INPUT.xlsx' 
+        SHEET                   = 'simple burnout'
+        TEST_NAME               = 'parallel_form'
+
+        try:
+            root_trace          = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Generating forms in parallel")
+
+            STORE_IMPL          = UnitTest_KnowledgeBaseStore(  test_case_name          = 'simple_burnout',
+                                                                input_manifests_dir     = self.input_data, 
+                                                                input_postings_dir      = self.input_data, 
+                                                                output_manifests_dir    = self.output_data, 
+                                                                output_postings_dir     = self.output_data)
+            MOCK_STORE          = KnowledgeBaseStore(root_trace, STORE_IMPL)
+            posting_handle      = MOCK_STORE.buildPostingHandle(root_trace, EXCEL_FILE, sheet=SHEET, excel_range="B2:C100")
+            controller          = big_rocks.BigRocksEstimate_Controller(root_trace, MOCK_STORE, a6i_config = self.a6i_config)
+            all_manifests_dict, label,   = controller._buildAllManifests(root_trace, posting_handle)
+
+            test_dir            = self.output_data + "/" + TEST_NAME
+            PathUtils().remove_folder_if_exists(root_trace, test_dir)
+            PathUtils().create_path_if_needed(root_trace, test_dir + "/kb")
+            PathUtils().create_path_if_needed(root_trace, test_dir + "/collab")
+            STORE               = KnowledgeBaseStore(root_trace, Shutil_KBStore_Impl(   parent_trace    = root_trace,
+                                                                                        kb_rootdir      = test_dir + "/kb",
+                                                                                        clientURL       = test_dir + "/collab"))
+            STORE.beginTransaction(root_trace)
+            manifest_handles    = [STORE.persistManifest(root_trace, all_manifests_dict[manifest_nb]) 
+                                        for manifest_nb in all_manifests_dict.keys()]
+            STORE.commitTransaction(root_trace)
+
+            form_request        = FormRequest(  parent_trace    = root_trace, 
+                                                posting_api     = posting_handle.posting_api, 
+                                                filing_coords   = JourneysFilingCoordinates().infer_from_label(root_trace, label),
+                                                scope           = FormRequest.ExplicitScope(manifest_handles))
+
+            output_txt          = ""
+            forms_dict          = {}
+            for form_generation_threads in [1, 3]:
+                loop_trace      = root_trace.doing("Generating form", data = {"threads": form_generation_threads})
+                a6i_config      = _copy.copy(self.a6i_config)
+                a6i_config.config_dict  = _copy.deepcopy(self.a6i_config.config_dict)
+                a6i_config.config_dict.setdefault('knowledge-base', {})['form-generation-threads'] = form_generation_threads
+
+                STORE.beginTransaction(loop_trace)
+                transaction_env = STORE.current_environment(loop_trace)
+                controller      = big_rocks.BigRocksEstimate_Controller(loop_trace, STORE, a6i_config = a6i_config)
+                response        = controller.generateForm(loop_trace, form_request)
+                form_path       = STORE.getClientURL(loop_trace) + "/" + form_request.getRelativePath(loop_trace)
+                forms_dict[form_generation_threads] = _pd.read_excel(form_path, sheet_name = None, header = None)
+
+                output_txt      += "\n\n======== " + str(form_generation_threads) + " thread(s) ========"
+                output_txt      += "\nManifests in form:\t\t" + str(response.manifest_identifiers(loop_trace))
+                output_txt      += "\nWorksheets:\t\t\t" + str(list(forms_dict[form_generation_threads].keys()))
+                output_txt      += "\nStill in transaction:\t\t" + str(STORE.current_environment(loop_trace) == transaction_env)
+                STORE.abortTransaction(loop_trace)
+
+            same_forms          = forms_dict[1].keys() == forms_dict[3].keys() \
+                                    and all([forms_dict[1][sheet].equals(forms_dict[3][sheet]) for sheet in forms_dict[1].keys()])
+            output_txt          += "\n\nForms are the same:\t\t" + str(same_forms)
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
+    def _impl_simple_burnout(self, manifest_build_threads):
+        '''
+        Helper to the test cases, which builds the manifests for the 'simple_burnout' posting with the given number
+        of threads and checks they are as expected
+        '''
 
         EXCEL_FILE              = 'simple_burnout_INPUT.xlsx' 
         SHEET                   = 'simple burnout'
@@ -46,9 +137,17 @@ class Test_BigRocksEstimate(ApodeixiUnitTest):
         try:
             root_trace          = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Generating Big Rocks (simple burnout)")
 
-            controller          = big_rocks.BigRocksEstimate_Controller(root_trace, STORE, a6i_config = self.a6i_config)
+            # Inject a copy of the configuration, so that the thread setting doesn't leak into other tests
+            a6i_config          = _copy.copy(self.a6i_config)
+            a6i_config.config_dict  = _copy.deepcopy(self.a6i_config.config_dict)
+            a6i_config.config_dict.setdefault('knowledge-base', {})['manifest-build-threads'] = manifest_build_threads
+            controller          = big_rocks.BigRocksEstimate_Controller(root_trace, STORE, a6i_config = a6i_config)
             all_manifests_dict, label,   = controller._buildAllManifests(root_trace, posting_handle)
 
+            data_handles        = controller.getDataHandles(root_trace, posting_handle)
+            waves               = controller.manifestBuildWaves(root_trace, data_handles)
+            build_order         = [[data_handle.kind for data_handle in wave] for wave in waves]
+
             NB_MANIFESTS_EXPECTED   = 3
             if len(all_manifests_dict.keys()) != NB_MANIFESTS_EXPECTED:
                 raise ApodeixiError(root_trace, 'Expected ' + str(NB_MANIFESTS_EXPECTED) + ' manifests, but found ' 
@@ -74,6 +173,10 @@ class Test_BigRocksEstimate(ApodeixiUnitTest):
             self.assertTrue(1==2)                                                                                        
 
         self.assertTrue(len(all_manifests_dict) == NB_MANIFESTS_EXPECTED)
+        self.assertEqual(build_order, [['big-rock', 'investment'], ['big-rock-estimate']])
+        # The Excel file should have been opened once, and read once for the Posting Label and once per manifest
+        self.assertEqual(controller.workbook_stats["opens"], 1)
+        self.assertEqual(controller.workbook_stats["reads"], 1 + NB_MANIFESTS_EXPECTED)
         for manifest_nb in all_manifests_dict.keys():
             manifest_dict   = all_manifests_dict[manifest_nb]
             kind            = manifest_dict['kind']
@@ -90,6 +193,10 @@ if __name__ == "__main__":
         what_to_do = args[1]
         if what_to_do=='simple_burnout':
             T.test_simple_burnout()
+        elif what_to_do=='parallel_build':
+            T.test_parallel_build()
+        elif what_to_do=='parallel_form':
+            T.test_parallel_form()
         T.tearDown()
 
     main(_sys.argv)
\ No newline at end of file
@@ -1,12 +1,13 @@
 import datetime                                         as _datetime
 import pandas                                           as _pd
+from concurrent.futures                                 import ThreadPoolExecutor as _ThreadPoolExecutor
 
 from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
 
 from apodeixi.xli.posting_controller_utils              import PostingController, PostingLabel
 from apodeixi.xli.update_policy                         import InferReferenceUIDsPolicy
 from apodeixi.xli.uid_store                             import UID_Store
-from apodeixi.xli.xlimporter                            import ExcelTableReader, SchemaUtils
+from apodeixi.xli.xlimporter                            import ExcelTableReader, SchemaUtils, ExcelWorkbookSession
 from apodeixi.xli.interval                              import Interval
 from apodeixi.xli.uid_acronym_schema                    import UID_Acronym_Schema
 
@@ -40,6 +41,10 @@ class SkeletonController(PostingController):
         self.log_txt                = None
         self.representer            = None
 
+        # Metrics of the ExcelWorkbookSession used by the last call to self._buildAllManifests, as a dictionary
+        # (refer to ExcelWorkbookSession.stats)
+        self.workbook_stats         = None
+
     GENERATED_FORM_WORKSHEET            = "Assertions"
     POSTING_LABEL_SHEET                 = "Posting Label"
     POSTING_LABEL_RANGE                 = "B2:C100"
@@ -66,13 +71,39 @@ class SkeletonController(PostingController):
         Returns a PostResponse.
 
         '''
-        excel_filename              = posting_label_handle.excel_filename
+        all_manifests_dicts, label  = self.buildPosting(parent_trace, posting_label_handle)
+
+        return self.persistPosting(parent_trace, posting_label_handle, all_manifests_dicts, label)
+
+    def buildPosting(self, parent_trace, posting_label_handle):
+        '''
+        First half of `apply`: retrieves an Excel and parses its content to create the manifests, but without
+        persisting anything. 
+        
+        Since it only reads from the store, it is safe to run it in a different process than `persistPosting`, 
+        as is done by the KnowledgeBase when posting in parallel.
 
+        Returns the same 2 things as `_buildAllManifests`, i.e., a dictionary of manifest dictionaries and
+        the PostingLabel that was parsed.
+        '''
         my_trace                    = parent_trace.doing("Applying Excel posting", 
                                                             origination = {'signaled_from' : __file__})
-        manifest_file               = StringUtils().rreplace(excel_filename, 'xlsx', 'yaml')
         all_manifests_dicts, label  = self._buildAllManifests(my_trace, posting_label_handle)
 
+        return all_manifests_dicts, label
+
+    def persistPosting(self, parent_trace, posting_label_handle, all_manifests_dicts, label):
+        '''
+        Second half of `apply`: persists the manifests previously built by `buildPosting`, registers
+        foreign key constraints and archives the posting.
+
+        Returns a PostResponse.
+        '''
+        excel_filename              = posting_label_handle.excel_filename
+
+        my_trace                    = parent_trace.doing("Applying Excel posting", 
+                                                            origination = {'signaled_from' : __file__})
+
         response                    = PostResponse()
         for manifest_nb in all_manifests_dicts.keys():
             loop_trace              = my_trace.doing("Persisting manifest in store",
@@ -126,24 +157,41 @@ class SkeletonController(PostingController):
         as a posting
 
         Returns a FormRequestResponse object, as well as a string corresponding the log made during the processing.
+
+        If the Apodeixi configuration asks for more than 1 thread to generate forms, the manifests in scope are
+        converted to DataFrames and laid out in parallel. Manifests are still retrieved from the store by the calling
+        thread, which may be inside a transaction, and the Excel spreadsheet is still written by a single thread, 
+        so it is the same as if only 1 thread was used.
+        '''
+        nb_threads                  = self.a6i_config.get_FormGenerationThreads(parent_trace)
+        if nb_threads > 1:
+            with _ThreadPoolExecutor(max_workers = nb_threads) as executor:
+                return self._generateForm(parent_trace, form_request, executor)
+        else:
+            return self._generateForm(parent_trace, form_request, executor = None)
+
+    def _generateForm(self, parent_trace, form_request, executor):
+        '''
+        Helper to self.generateForm, which does all the work.
+
+        @param executor A concurrent.futures.Executor to which to submit work that can be done in parallel. If it is
+                    None, all work is done in the calling thread.
         '''
-        ME                      = SkeletonController
         my_trace                = parent_trace.doing("Loading manifests requested in the form")
         if True:
             manifests_in_scope_dict             = self._manifests_in_scope(parent_trace, form_request)
             manifestInfo_dict                   = {}
             contents_df_dict                    = {} # needed for ManifestRepresenter
             manifest_identifiers                = [] # needed for FormRequestResponse
+            # Converting manifests to DataFrames is independent for each manifest, so start all of them first
+            manifest_infos                      = {}
             for key in manifests_in_scope_dict.keys():
                 loop_trace                      = my_trace.doing("Extracting content for manifest",
                                                                     data = {"manifest identifier": str(key)})
-                manifest_dict                   = manifests_in_scope_dict[key]
-                if manifest_dict == None:
-                    raise ApodeixiError(loop_trace, "Sorry, blind form requests are not yet supported") # TODO - Implement it!
-                manifest_info                   = ME._ManifestInfo( parent_trace            = loop_trace,
-                                                                    key                     = key,
-                                                                    manifest_dict           = manifest_dict,
-                                                                    controller              = self)
+                manifest_infos[key]             = self._submit(executor, self._loadManifestInfo, 
+                                                                    loop_trace, key, manifests_in_scope_dict[key])
+            for key in manifests_in_scope_dict.keys():
+                manifest_info                   = manifest_infos[key].result()
                 manifestInfo_dict[key]          = manifest_info
                 # This other dictionary of dataframes is needed for ManifestRepresenter
                 data_df                         = manifest_info.getManifestContents(my_trace)
@@ -166,6 +214,8 @@ class SkeletonController(PostingController):
                                                         xlw_config_table    = xlw_config_table,
                                                         label_ctx           = label.ctx,
                                                         manifestInfo_dict   = manifestInfo_dict,)
+            if executor != None:
+                rep.prepareContents(my_trace, executor)
             filename            = self.store.uploadForm(my_trace, 
                                                         form_request        = form_request, 
                                                         representer         = rep)
@@ -278,6 +328,44 @@ class SkeletonController(PostingController):
                                                             y_offset            = 1)
 
         return label, label_xlw_config
+
+    def _loadManifestInfo(self, parent_trace, key, manifest_dict):
+        '''
+        Helper to self.generateForm. Returns a _ManifestInfo for the manifest identified by `key`, whose content
+        is `manifest_dict`.
+        '''
+        if manifest_dict == None:
+            raise ApodeixiError(parent_trace, "Sorry, blind form requests are not yet supported") # TODO - Implement it!
+        return SkeletonController._ManifestInfo(    parent_trace            = parent_trace,
+                                                    key                     = key,
+                                                    manifest_dict           = manifest_dict,
+                                                    controller              = self)
+
+    def _submit(self, executor, fn, *args):
+        '''
+        Helper used when generating forms. Returns an object whose `result()` method returns `fn(*args)`, or raises
+        the error it raised, like a concurrent.futures.Future.
+
+        If `executor` is not None, `fn` is submitted to it right away. Otherwise, `fn` is only called when `result()`
+        is called, in the calling thread. Either way, callers that call `result()` in the same order as a serial 
+        computation would have called `fn` get the same results and, if there are errors, the same first error.
+        '''
+        if executor != None:
+            return executor.submit(fn, *args)
+        else:
+            return SkeletonController._DeferredCall(fn, args)
+
+    class _DeferredCall():
+        '''
+        Helper class used by SkeletonController._submit when there is no executor: a call that is only made when
+        its result is asked for.
+        '''
+        def __init__(self, fn, args):
+            self._fn                        = fn
+            self._args                      = args
+
+        def result(self):
+            return self._fn(*self._args)
     
     class _ManifestInfo():
         '''
@@ -536,6 +624,21 @@ class SkeletonController(PostingController):
         
         * the PostingLabel that was parsed in the process
 
+        The Excel file is opened only once for the Posting Label and all the manifests, through an ExcelWorkbookSession
+        that is attached to the `posting_label_handle` while the manifests are built.
+        '''
+        workbook_session                    = ExcelWorkbookSession()
+        posting_label_handle.workbook_session = workbook_session
+        try:
+            return self._buildAllManifestsInSession(parent_trace, posting_label_handle)
+        finally:
+            posting_label_handle.workbook_session = None
+            workbook_session.close(parent_trace)
+            self.workbook_stats             = workbook_session.stats()
+
+    def _buildAllManifestsInSession(self, parent_trace, posting_label_handle):
+        '''
+        Helper to self._buildAllManifests, which it implements once the `posting_label_handle` has an ExcelWorkbookSession
         '''
         my_trace                            = parent_trace.doing("Parsing posting label", 
                                                                 origination = {'signaled_from': __file__})
@@ -560,8 +663,14 @@ class SkeletonController(PostingController):
 
         # Keys will be the manifest unique integer identifiers assigned by _MyPostingLabel._initialize_show_your_work
         all_manifests_dict                 = {} 
-        
-        for data_handle in self.getDataHandles(parent_trace, posting_label_handle):
+
+        data_handles                        = self.getDataHandles(parent_trace, posting_label_handle)
+        nb_threads                          = self.a6i_config.get_ManifestBuildThreads(parent_trace)
+        if nb_threads > 1 and len(data_handles) > 1:
+            all_manifests_dict              = self._buildManifestsInParallel(parent_trace, data_handles, label, nb_threads)
+            return all_manifests_dict, label
+
+        for data_handle in data_handles:
             kind                            = data_handle.kind
             manifest_nb                     = data_handle.manifest_nb
 
@@ -591,6 +700,111 @@ class SkeletonController(PostingController):
 
         return all_manifests_dict, label
 
+    def _buildManifestsInParallel(self, parent_trace, data_handles, label, nb_threads):
+        '''
+        Helper to self._buildAllManifestsInSession, used when the Apodeixi configuration asks for more than 1 thread
+        to build manifests. Returns the same dictionary of manifest dictionaries as the serial build would.
+
+        Manifests are built in "waves", as determined by self.manifestBuildWaves, so that a manifest is only built
+        once all manifests it depends on have been built. Manifests in the same wave are built in parallel, with
+        up to `nb_threads` threads.
+
+        Builds only write to self.link_table under the key of the manifest's kind, and manifests of the same kind
+        are never in the same wave, so concurrent builds write to different entries of self.link_table. Once
+        all are built, self.link_table's entries are re-ordered to be in the order in which a serial build would 
+        have added them (i.e., the order of `data_handles`), so that the result is the same irrespective of which
+        thread finished first. If several manifests fail, the error raised is that of the first of them in 
+        `data_handles`.
+        '''
+        all_manifests_dict                  = {}
+        prior_identifiers                   = list(self.link_table.links_dict.keys())
+        waves                               = self.manifestBuildWaves(parent_trace, data_handles)
+        with _ThreadPoolExecutor(max_workers = nb_threads) as executor:
+            for wave in waves:
+                futures                     = []
+                for data_handle in wave:
+                    my_trace                = parent_trace.doing("Parsing data for 1 manifest", 
+                                                                    data = {'kind':         data_handle.kind, 
+                                                                            'excel_range':  data_handle.excel_range},
+                                                                    origination = {'signaled_from': __file__})
+                    futures.append(executor.submit(self._buildOneManifest,  parent_trace        = my_trace,
+                                                                            posting_data_handle = data_handle,
+                                                                            label               = label))
+                for data_handle, future in zip(wave, futures):
+                    all_manifests_dict[data_handle.manifest_nb] = future.result()
+
+        links_dict                          = self.link_table.links_dict
+        identifiers                         = prior_identifiers + [data_handle.kind for data_handle in data_handles] \
+                                                + list(links_dict.keys())
+        ordered_links_dict                  = {}
+        for identifier in identifiers:
+            if identifier in links_dict.keys() and not identifier in ordered_links_dict.keys():
+                ordered_links_dict[identifier] = links_dict[identifier]
+        self.link_table.links_dict          = ordered_links_dict
+
+        # Return manifests in the same order as the serial build would
+        return {data_handle.manifest_nb: all_manifests_dict[data_handle.manifest_nb] for data_handle in data_handles}
+
+    def manifestDependencies(self, parent_trace, data_handles):
+        '''
+        Returns a dictionary whose keys are the kinds of the manifests in `data_handles`, a list of PostingDataHandle
+        objects. The value for a kind is a list of the other kinds that must be built before manifests of that kind,
+        because building it reads the row-to-UID links they add to self.link_table.
+
+        By default they are derived from the PostingConfig for each kind:
+
+        * For mappings, the kinds in the PostingConfig's kind_mapped_from_list (refer to self.linkMappedManifest)
+        * For kinds with an InferReferenceUIDsPolicy, the policy's referenced_kind (refer to 
+          self.restoreReferenceManifestUIDs)
+
+        Concrete controller classes whose manifests depend on each other in other ways while they are built must
+        extend this method.
+        '''
+        result                              = {}
+        for data_handle in data_handles:
+            kind                            = data_handle.kind
+            my_trace                        = parent_trace.doing("Determining which manifests '" + str(kind)
+                                                                    + "' depends on")
+            xlr_config                      = self.getPostingConfig(    parent_trace        = my_trace,
+                                                                        kind                = kind,
+                                                                        manifest_nb         = data_handle.manifest_nb)
+            dependencies                    = result.get(kind, [])
+            if xlr_config.is_a_mapping and xlr_config.kind_mapped_from_list != None:
+                dependencies                += [a_kind for a_kind in xlr_config.kind_mapped_from_list]
+            if type(xlr_config.update_policy) == InferReferenceUIDsPolicy:
+                dependencies                += [xlr_config.update_policy.referenced_kind]
+            result[kind]                    = [a_kind for a_kind in dependencies if a_kind != kind]
+        return result
+
+    def manifestBuildWaves(self, parent_trace, data_handles):
+        '''
+        Returns a list of lists of PostingDataHandle objects, partitioning `data_handles` into "waves" of manifests
+        that can be built in parallel, once all manifests in prior waves have been built. That is, each manifest 
+        is in a later wave than all the manifests it depends on, as per self.manifestDependencies.
+
+        Waves preserve the order of `data_handles`, and two manifests of the same kind are never in the same wave since
+        they would add row-to-UID links to the same entry of self.link_table. If dependencies are circular, the 
+        first pending manifest is built on its own.
+        '''
+        dependencies                        = self.manifestDependencies(parent_trace, data_handles)
+        waves                               = []
+        pending                             = list(data_handles)
+        while len(pending) > 0:
+            pending_kinds                   = [data_handle.kind for data_handle in pending]
+            wave                            = []
+            for idx in range(len(pending)):
+                data_handle                 = pending[idx]
+                if data_handle.kind in pending_kinds[:idx]:
+                    continue # An earlier manifest of the same kind has not been built yet
+                if len([a_kind for a_kind in dependencies[data_handle.kind] if a_kind in pending_kinds]) > 0:
+                    continue
+                wave.append(data_handle)
+            if len(wave) == 0:
+                wave                        = [pending[0]]
+            waves.append(wave)
+            pending                         = [data_handle for data_handle in pending if not data_handle in wave]
+        return waves
+
     def getDataHandles(self, parent_trace, posting_label_handle):
         '''
         Returns a list of PostingDataHandle objects, one for each manifest whose posting needs to be processed
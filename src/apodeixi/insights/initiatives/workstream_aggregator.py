@@ -13,7 +13,7 @@ class WorkstreamAggregator():
         self.kb                     = knowledge_base
 
 
-    def aggregateMetrics(self, parent_trace, filing_coordinates_filter=None):
+    def aggregateMetrics(self, parent_trace, filing_coordinates_filter=None, workers=None):
         '''
         Returns a DataFrame that aggregates all metrics across all workstreams for self.initiative that exist in self.kb_store.
         If no such metrics exist, it returns None.
@@ -21,6 +21,8 @@ class WorkstreamAggregator():
         @param filing_coordinates_filter A function that takes a FilingCoordinates instance as a parameter and returns a boolean. 
                             Any FilingCoordinates instance for which this filter returns False will be excluded from the output.
                             If set to None then no filtering is done.
+        @param workers An int for the number of worker processes to use to parse the workstream postings, or None,
+                            in which case it is taken from the Apodeixi configuration. See KnowledgeBase.postInBatch
         
         '''
         POSTING_API                             = 'workstream.initiatives.a6i'
@@ -40,7 +42,7 @@ class WorkstreamAggregator():
 
 
         my_trace                                = parent_trace.doing("Posting " + str(len(handle_list)) + " handles in batch")
-        successes, errors                       = self.kb.postInBatch(my_trace, handle_list)
+        successes, errors                       = self.kb.postInBatch(my_trace, handle_list, workers=workers)
 
         my_trace                                = parent_trace.doing("Loading manifests")
         df_list                                 = []
@@ -60,10 +62,12 @@ class WorkstreamAggregator():
 
                 rep                             = AsDataframe_Representer()
                 contents_path                   = 'assertion.metric'
-                df, uid_info_list               = rep.dict_2_df(parent_trace, content_dict, contents_path, 
-                                                                    sparse=False, abbreviate_uids=True)
-                df['WUID']                      = manifest_dict['metadata']['labels']['workstreamUID']
-                df_list.append(df)
+                # We only concatenate the DataFrames, so there is no need to build the whole DataFrame for
+                # each manifest: get its rows in batches instead
+                for df in rep.dict_2_df_batches(parent_trace, content_dict, contents_path, 
+                                                                    sparse=False, abbreviate_uids=True):
+                    df['WUID']                  = manifest_dict['metadata']['labels']['workstreamUID']
+                    df_list.append(df)
         
         if len(df_list) == 0:
             return None, errors
@@ -19,8 +19,39 @@ class for convenience.
 '''
 class File_KBStore_Impl():
     def __init__(self):
+        # Optional ExcelRangeCache for the data read from postings. Derived classes may set it
+        self._posting_cache         = None
         return
 
+    def postingCache(self, parent_trace):
+        '''
+        Returns the ExcelRangeCache in which data read from postings is cached, or None if there is no such cache
+        '''
+        return self._posting_cache
+
+    def getCachedStaticData(self, parent_trace, namespace, kind):
+        '''
+        Returns the object cached for the latest version of the static data manifest for the `namespace` and `kind`,
+        or None if there is none.
+
+        This class caches no static data, since it can't tell when it becomes stale. Derived classes that can tell,
+        such as Isolation_KBStore_Impl, override this method.
+        '''
+        return None
+
+    def cacheStaticData(self, parent_trace, namespace, kind, version, static_data):
+        '''
+        Caches `static_data`, an object derived from version `version` of the static data manifest for the
+        `namespace` and `kind`. No-op for this class, since it caches no static data.
+        '''
+        return
+
+    def staticDataCacheStats(self, parent_trace):
+        '''
+        Returns a dictionary with cumulative statistics on how often cached static data was found
+        '''
+        return {"hits": 0, "misses": 0}
+
     def buildPostingHandle(self, parent_trace, excel_posting_path, sheet, excel_range):
         '''
         Returns an PostingLabelHandle for the posting label embedded within the Excel spreadsheet that resides in 
@@ -131,7 +162,9 @@ class File_KBStore_Impl():
                                                     excel_fullpath      = path, 
                                                     excel_sheet         = sheet,
                                                     excel_range         = excel_range, 
-                                                    xlr_config          = label_xlr_config)
+                                                    xlr_config          = label_xlr_config,
+                                                    workbook_session    = posting_label_handle.workbook_session,
+                                                    range_cache         = self.postingCache(parent_trace))
         my_trace                = parent_trace.doing("Loading Posting Label data from Excel into a DataFrame",
                                                 data = {"relative_path": relative_path, "excel range": excel_range})
         label_df                = reader.read(my_trace)
@@ -151,7 +184,9 @@ class File_KBStore_Impl():
                                                     excel_fullpath      = path, 
                                                     excel_sheet         = sheet,
                                                     excel_range         = excel_range, 
-                                                    xlr_config          = config)
+                                                    xlr_config          = config,
+                                                    workbook_session    = data_handle.workbook_session,
+                                                    range_cache         = self.postingCache(parent_trace))
         my_trace                = parent_trace.doing("Loading Excel posting data into a DataFrame",
                                                         data = {"relative_path": relative_path, "excel range": excel_range})
         df                      = r.read(my_trace)
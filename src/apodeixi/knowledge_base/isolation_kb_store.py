@@ -1,5 +1,7 @@
 import os                                               as _os
 import shutil                                           as _shutil
+import threading                                        as _threading
+from contextlib                                         import contextmanager as _contextmanager
 from apodeixi.util.formatting_utils import StringUtils
 
 from apodeixi.knowledge_base.file_kb_store              import File_KBStore_Impl
@@ -8,9 +10,12 @@ from apodeixi.knowledge_base.filing_coordinates         import JourneysFilingCoo
                                                                 InitiativesFilingCoordinates, \
                                                                 ArchiveFilingCoordinates, LogFilingCoordinates   
 from apodeixi.controllers.admin.static_data.static_data_coords  import StaticDataFilingCoordinates
+from apodeixi.controllers.admin.static_data.static_data_cache   import StaticDataCache
 from apodeixi.knowledge_base.knowledge_base_util        import PostingLabelHandle
 from apodeixi.knowledge_base.manifest_utils             import ManifestUtils
+from apodeixi.knowledge_base.manifest_catalog           import ManifestCatalog
 from apodeixi.representers.as_excel                     import ManifestRepresenter
+from apodeixi.xli.uid_acronym_schema                    import UID_Acronym_Schema
 
 from apodeixi.tree_relationships.foreign_key_constraints    import ForeignKeyConstraintsRegistry
 
@@ -107,8 +112,13 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
                             generated forms or reports requested by end-users. This is a "root folder" in that
                             the structure below will be assumed to follow the filing structure of the
                             KnowledgeBase for postings.
+    @param manifest_sidecars A boolean. If True, each persisted manifest also gets a binary sidecar file
+                            next to its YAML file, which speeds up subsequent retrievals. The YAML file remains
+                            the canonical representation of the manifest.
+    @param posting_cache Optional ExcelRangeCache. If given, data read from postings' Excel files is cached in it,
+                            so that postings that are parsed again without having changed are not read from Excel again.
     '''
-    def __init__(self, parent_trace, kb_rootdir, clientURL):
+    def __init__(self, parent_trace, kb_rootdir, clientURL, manifest_sidecars=False, posting_cache=None):
 
         my_trace                        = parent_trace.doing("Validating root folders are valid")
         if True:
@@ -124,6 +134,10 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
 
             self._kb_rootdir                       = kb_rootdir
             self._clientURL     = clientURL
+            self._manifest_sidecars                = manifest_sidecars
+            if manifest_sidecars:
+                UID_Acronym_Schema().register_sidecar_annotator(parent_trace)
+            self._posting_cache                    = posting_cache
 
             postings_rootdir                        =  kb_rootdir + "/excel-postings" 
             manifests_roodir                        =  kb_rootdir + "/manifests"      
@@ -162,6 +176,10 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
                                                         impl                    = base_env_impl)  
         self._current_env           = self._base_env
 
+        # Environment that reads fail over to, if any, for the calling thread only. It lets concurrent readers
+        # search ancestor environments without switching the store's `_current_env` from under each other.
+        self._failover_state        = _threading.local()
+
         self.filing_rules           = { #List of associations of posting API => FilingCoordinate class to use for such posting API
             'big-rocks.journeys.a6i':                               JourneysFilingCoordinates,
             'milestone.journeys.a6i':                               JourneysFilingCoordinates,
@@ -184,6 +202,12 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         self.containing_store                       = None
         self.foreign_key_constraints                = None
 
+        # Objects derived from static data manifests, such as those used to validate posting labels
+        self._static_data_cache                     = StaticDataCache()
+
+        # Set by self.makeReadOnly, for stores that must not write to the environment they share with another store
+        self._read_only                             = False
+
     _TRANSACTION                    = "store-transaction"
 
     def transaction_env(self, parent_trace):
@@ -219,6 +243,21 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         self._transaction_nb        += 1
         return name
 
+    def makeReadOnly(self, parent_trace):
+        '''
+        Turns this store into a read-only view of its current environment. 
+        
+        Used by worker processes that build postings in parallel: they read from the environment of the transaction 
+        that the parent process has open, so they must neither start transactions of their own nor write to that 
+        environment, not even to bring in data found in a parent environment after a read miss.
+        '''
+        self._read_only             = True
+
+    def _abort_if_read_only(self, parent_trace):
+        if self._read_only:
+            raise ApodeixiError(parent_trace, "Can't modify a read-only store",
+                                    data = {"environment": self.current_environment(parent_trace).name(parent_trace)})
+
     def beginTransaction(self, parent_trace):
         '''       
         Starts an isolation state in which all subsequent I/O is done in an isolation area
@@ -228,6 +267,7 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         If an error is raised in this method, then the transaction is not begun (hence an
         abortTransaction should not be attempted if this method raises an error)
         '''
+        self._abort_if_read_only(parent_trace)
         env                         = self.transaction_env(parent_trace) 
         if env == None:
             env                     = self.current_environment(parent_trace)
@@ -248,11 +288,14 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         subenv_config               = KB_Environment_Config(    parent_trace        = parent_trace,
                                                                 read_misses_policy  = KB_Environment_Config.FAILOVER_ALL_READS_TO_PARENT,
                                                                 use_timestamps      = my_env_config.use_timestamps,
-                                                                path_mask           = my_env_config.path_mask)
+                                                                path_mask           = my_env_config.path_mask,
+                                                                overlay             = my_env_config.overlay)
 
         isolation_env               = env.addSubEnvironment(parent_trace, name, subenv_config)
 
         self.activate(parent_trace, name)
+        # Reads in the transaction fail over to the parent environment, so cached static data remains valid
+        self._static_data_cache.shareEnvironment(parent_trace, env.name(parent_trace), name)
 
         # **GOTCHA** 
         #
@@ -315,6 +358,9 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         self.removeEnvironment(parent_trace, env.name(parent_trace)) 
         self.activate(parent_trace, parent_env.name(parent_trace))
 
+        # Static data might have been cached after the transaction persisted static data manifests that are now gone
+        self._static_data_cache.clear(parent_trace)
+
     def _failover_manifest_reads_to_parent(self, parent_trace):
         '''
         Returns a boolean to determine if parent environment should be used to retrieve manifests that are not
@@ -324,10 +370,10 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         current environment lacks the data in question, the I/O read service will search in the parent 
         environment and, if it finds it, will copy it to the current environment. 
         '''
-        if self._current_env.parent(parent_trace) == None: # Can't failover to a non-existent parent
+        if self.current_environment(parent_trace).parent(parent_trace) == None: # Can't failover to a non-existent parent
             return False
         KBEC                    = KB_Environment_Config
-        policy                  = self._current_env.config(parent_trace).read_misses_policy
+        policy                  = self.current_environment(parent_trace).config(parent_trace).read_misses_policy
         if  policy in [KBEC.FAILOVER_ALL_READS_TO_PARENT, KBEC.FAILOVER_MANIFEST_READS_TO_PARENT]:
             return True
         else:
@@ -342,10 +388,10 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         current environment lacks the data in question, the I/O read service will search in the parent 
         environment and, if it finds it, will copy it to the current environment. 
         '''
-        if self._current_env.parent(parent_trace) == None: # Can't failover to a non-existent parent
+        if self.current_environment(parent_trace).parent(parent_trace) == None: # Can't failover to a non-existent parent
             return False
         KBEC                    = KB_Environment_Config
-        policy                  = self._current_env.config(parent_trace).read_misses_policy
+        policy                  = self.current_environment(parent_trace).config(parent_trace).read_misses_policy
         if  policy in [KBEC.FAILOVER_ALL_READS_TO_PARENT, KBEC.FAILOVER_POSTING_READS_TO_PARENT]:
             return True
         else:
@@ -375,7 +421,7 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         '''
         Returns a string that can be used to locate the postings area in the Knowledge Base store's current environment
         '''   
-        current_env_postings_url              = self._current_env.postingsURL(parent_trace)
+        current_env_postings_url              = self.current_environment(parent_trace).postingsURL(parent_trace)
         return current_env_postings_url
 
     def getClientURL(self, parent_trace):
@@ -383,7 +429,7 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         Returns a string that can be used to locate the user-specific area (such as a SharePoint folder)
         into which generated forms and reports should be store.
         '''   
-        current_env_client_url              = self._current_env.clientURL(parent_trace)
+        current_env_client_url              = self.current_environment(parent_trace).clientURL(parent_trace)
         return current_env_client_url
         
     def resetClientArea(self, parent_trace, coords):
@@ -422,10 +468,39 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
                                                     "error":                str(ex)})       
 
     def current_environment(self, parent_trace):
+        failover_env                = getattr(self._failover_state, "environment", None)
+        if failover_env != None:
+            return failover_env
         return self._current_env
 
     def parent_environment(self, parent_trace):
-        return self._current_env.parent(parent_trace)
+        return self.current_environment(parent_trace).parent(parent_trace)
+
+    @_contextmanager
+    def _reading_from_environment(self, parent_trace, environment):
+        '''
+        Context manager used when a read "misses" and fails over to an ancestor `environment`. Within the block,
+        the calling thread sees `environment` as the current environment, while other threads (and the store's
+        activated environment) are left untouched. The previous view is restored on exit even if the read raises.
+        '''
+        previous_env                = getattr(self._failover_state, "environment", None)
+        self._failover_state.environment = environment
+        try:
+            yield environment
+        finally:
+            self._failover_state.environment = previous_env
+
+    def __getstate__(self):
+        '''
+        Thread-local state can't be pickled, and a failover in progress is meaningless in another process
+        '''
+        state                       = self.__dict__.copy()
+        del state['_failover_state']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._failover_state        = _threading.local()
 
     def base_environment(self, parent_trace):
         return self._base_env
@@ -439,6 +514,9 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         '''
         ME                          = File_KBEnv_Impl
 
+        # If an environment with this name is created later, it might have different static data
+        self._static_data_cache.forgetEnvironment(parent_trace, name)
+
         env_to_remove               = self.base_environment(parent_trace).findSubEnvironment(parent_trace, name)
 
         # Don't error out if env_to_remove is None, as it might have been created by an earlier Python process, 
@@ -464,6 +542,8 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         try:
             if _os.path.isdir(dir_to_remove):
 
+                # Close cached connections to the environment's manifest catalog, else in Windows it can't be removed
+                ManifestCatalog.release_connections(dir_to_remove)
                 PathUtils().remove_folder_if_exists(my_trace, dir_to_remove)
     
                 # Also remove it as a child in the parent, lest later on when the parent is removed
@@ -523,6 +603,27 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         Switches the store's current environment to be the base environment.
         '''
         self._current_env               = self._base_env
+
+    def clearSessionState(self, parent_trace):
+        '''
+        Forgets in-memory state that accumulates as the store is used, so that subsequent requests see the store as 
+        if it had just been created. Any transaction left open by a previous request is aborted.
+        '''
+        while len(self._transactions_stack) > 0:
+            self.abortTransaction(parent_trace)
+        self.deactivate(parent_trace)
+
+        # Environments' metadata is persisted, so they will be re-loaded from it as needed
+        base_env                        = self.base_environment(parent_trace)
+        for child_name in list(base_env.children_names(parent_trace)):
+            base_env.removeChild(parent_trace, child_name)
+        # Commands may have changed this, so restore the value set in our constructor
+        base_env.config(parent_trace).use_timestamps = True
+
+        # Will be re-loaded on the next call to self.getForeignKeyConstraints
+        self.containing_store           = None
+        self.foreign_key_constraints    = None
+        self._static_data_cache.clear(parent_trace)
                                                                             
     def searchPostings(self, parent_trace, posting_api, filing_coordinates_filter=None):
         '''
@@ -568,6 +669,7 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         '''
         Persists manifest_dict as a yaml object and returns a ManifestHandle that uniquely identifies it.
         '''
+        self._abort_if_read_only(parent_trace)
         kind                = manifest_dict['kind']
         name                = manifest_dict['metadata']['name']
         namespace           = manifest_dict['metadata']['namespace']
@@ -576,7 +678,7 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         version             = ManifestUtils().get_manifest_version(parent_trace, manifest_dict)
         if version != None and len(str(version).strip()) > 0:
             suffix = '.' + str(version)
-        manifest_dir        = self._current_env.manifestsURL(parent_trace) + "/" + namespace  + "/" + name
+        manifest_dir        = self.current_environment(parent_trace).manifestsURL(parent_trace) + "/" + namespace  + "/" + name
         PathUtils().create_path_if_needed(parent_trace=parent_trace, path=manifest_dir)
         manifest_file       = kind + suffix + ".yaml"
         relative_path       = namespace  + "/" + name + "/" + manifest_file
@@ -592,12 +694,108 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
             self.foreign_key_constraints.check_foreign_key_constraints(my_trace, manifest_dict)
 
         if True:
-            YAML_Utils().save(my_trace, data_dict = manifest_dict, path = manifest_dir + "/" + manifest_file)
+            YAML_Utils().save(my_trace, data_dict = manifest_dict, path = manifest_dir + "/" + manifest_file,
+                                        write_sidecar = self._manifest_sidecars)
+            self.manifestCatalog(my_trace).record(my_trace, relative_path, manifest_dict)
             self._remember_manifest_write(my_trace, relative_path)
+            self._static_data_cache.evict(my_trace, namespace, kind)
             
             handle          = ManifestUtils().inferHandle(my_trace, manifest_dict)
             return handle
 
+    def manifestCatalog(self, parent_trace, environment=None):
+        '''
+        Returns the ManifestCatalog that indexes the manifests area of the given `environment`.
+
+        @param environment A KB_Environment object. If None, the current environment is used.
+        '''
+        if environment == None:
+            environment                     = self.current_environment(parent_trace)
+        return ManifestCatalog(environment.manifestsURL(parent_trace))
+
+    def getCachedStaticData(self, parent_trace, namespace, kind):
+        '''
+        Returns the object that was cached with self.cacheStaticData for the latest version of the static data
+        manifest for the `namespace` and `kind`, or None if there is none (for example, because a newer version
+        of the manifest was persisted since it was cached, possibly by another process).
+        '''
+        latest_version                      = self._latestCataloguedVersion(parent_trace, namespace, 
+                                                                            StaticDataCache.MANIFEST_NAME, kind)
+        return self._static_data_cache.get(parent_trace, self.current_environment(parent_trace).name(parent_trace), namespace, kind,
+                                                latest_version)
+
+    def _latestCataloguedVersion(self, parent_trace, namespace, name, kind):
+        '''
+        Returns an int, for the latest version of the manifest identified by `namespace`, `name` and `kind` according
+        to the manifest catalog, failing over to the parent environment if the manifest is not in the current
+        one and the current environment is configured to fail over manifest reads.
+
+        Returns None if there is no such manifest, or if the catalog can't be trusted to answer.
+        '''
+        FMT                                 = StringUtils().format_as_yaml_fieldname
+        catalogued_paths                    = self.manifestCatalog(parent_trace).findLatest(parent_trace, FMT(namespace), 
+                                                                                                FMT(name), FMT(kind))
+        if catalogued_paths == None:
+            return None
+        if len(catalogued_paths) > 0:
+            # Paths are like "my-corp.production/static-data/product.2.yaml"
+            return int(catalogued_paths[0].split("/")[-1].split(".")[1])
+        if not self._failover_manifest_reads_to_parent(parent_trace):
+            return None
+        with self._reading_from_environment(parent_trace, self.parent_environment(parent_trace)):
+            return self._latestCataloguedVersion(parent_trace, namespace, name, kind)
+
+    def cacheStaticData(self, parent_trace, namespace, kind, version, static_data):
+        '''
+        Caches `static_data`, an object derived from version `version` of the static data manifest for the
+        `namespace` and `kind`, which must be the latest version of that manifest.
+        '''
+        self._static_data_cache.put(parent_trace, self.current_environment(parent_trace).name(parent_trace), namespace, kind, version,
+                                        static_data)
+
+    def staticDataCacheStats(self, parent_trace):
+        '''
+        Returns a dictionary with cumulative statistics on how often cached static data was found
+        '''
+        cache                               = self._static_data_cache
+        return {"hits": cache.hits, "misses": cache.misses}
+
+    def rebuildManifestCatalog(self, parent_trace):
+        '''
+        Re-creates the ManifestCatalog for the current environment by scanning its manifests area.
+        Catalogs are otherwise built on first use, so this is only needed to pay that cost ahead of time (e.g., for
+        KnowledgeBases that were created before catalogs were introduced) or to recover from a corrupted catalog.
+
+        Returns an int, corresponding to the number of manifests catalogued.
+        '''
+        my_trace                            = parent_trace.doing("Rebuilding manifest catalog",
+                                                    data = {"environment": self.current_environment(parent_trace).name(parent_trace)})
+        return self.manifestCatalog(my_trace).rebuild(my_trace)
+
+    def backfillManifestSidecars(self, parent_trace):
+        '''
+        Writes a binary sidecar for every manifest in the current environment that lacks a valid one. 
+        Intended for KnowledgeBases whose manifests were persisted without sidecars.
+
+        Returns an int, corresponding to the number of sidecars written.
+        '''
+        UID_Acronym_Schema().register_sidecar_annotator(parent_trace)
+        nb_written                          = 0
+        for currentdir, dirs, files in _os.walk(self.current_environment(parent_trace).manifestsURL(parent_trace)):
+            for a_file in files:
+                tokens                      = a_file.split(".")
+                # We are only interested in files like "big-rock.2.yaml" with tokens ["big-rock", "2", "yaml"]
+                if len(tokens) != 3 or tokens[2]!= "yaml" or not tokens[1].isdigit():
+                    continue
+                path                        = currentdir + "/" + a_file
+                loop_trace                  = parent_trace.doing("Backfilling sidecar", data = {"path": str(path)})
+                if YAML_Utils()._load_sidecar(loop_trace, path) != None:
+                    continue # Already has a valid sidecar
+                manifest_dict               = YAML_Utils().load(loop_trace, path = path, use_cache = False)
+                YAML_Utils().save_sidecar(loop_trace, manifest_dict, path)
+                nb_written                  += 1
+        return nb_written
+
     def getForeignKeyConstraints(self, parent_trace, containing_store):
         '''
         Returns a ForeignKeyConstraintsRegistry object containing all the foreign key constraints that have been registered
@@ -622,73 +820,131 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         '''
         self.foreign_key_constraints.check_foreign_key_constraints(parent_trace, manifest_dict)
 
+    # Foreign key constraints are persisted in the system area of an environment's manifests as two files: a snapshot
+    # of the whole ForeignKeyConstraintsRegistry, and a log of the entries registered after the snapshot was written.
+    # Either may be missing.
+    #
+    # An environment that fails over to its parent (such as a transaction's environment) may have a log and no 
+    # snapshot, in which case its constraints are those of the parent plus those in the log.
+    #
+    # GOTCHA: Don't use the YAML Cache for foreign key constraints. The snapshot's version number never increases, 
+    #       so the YAML Cache can't tell the snapshot committed from a transaction apart from the parent environment's
+    #       prior snapshot, since the key in the YAML Cache is the same (as version is always 1).
+    #
+    FOREIGN_KEY_FILE                = "foreign_key_contraints.1.yaml"
+    FOREIGN_KEY_LOG                 = "foreign_key_contraints.1.log.yaml"
+
+    # The log is compacted into the snapshot once it is larger than both the snapshot and this many bytes, so that
+    # the cost of re-writing the snapshot is amortized across many appends to the log
+    FOREIGN_KEY_LOG_COMPACTION_BYTES = 1024 * 1024
+
+    def _foreignKeyConstraintsPaths(self, parent_trace, environment=None):
+        '''
+        Returns two strings: the paths for the foreign key constraints' snapshot and log in the `environment`, which
+        by default is the current environment
+        '''
+        ME                                  = Isolation_KBStore_Impl
+        if environment == None:
+            environment                     = self.current_environment(parent_trace)
+        system_dir                          = environment.manifestsURL(parent_trace) + "/system"
+        return system_dir + "/" + ME.FOREIGN_KEY_FILE, system_dir + "/" + ME.FOREIGN_KEY_LOG
+
     def persistForeignKeyConstraints(self, parent_trace):
         '''
-        Persists this store's ForeignKeyConstraintsRegistry to the system area of the store
+        Persists this store's ForeignKeyConstraintsRegistry to the system area of the store.
+
+        Only the entries registered since the registry was loaded or last persisted are written, by appending them to
+        the current environment's log. The log is compacted into the snapshot when it grows too big.
         '''
-        foreign_key_constraints_dict        = self.foreign_key_constraints.to_persistent_dict(parent_trace)
+        self._abort_if_read_only(parent_trace)
+        pending_dict                        = self.foreign_key_constraints.pending_to_persistent_dict(parent_trace)
+        if pending_dict == None:
+            return # Nothing new to persist
 
-        manifest_dir                        = self._current_env.manifestsURL(parent_trace) + "/system"
-        PathUtils().create_path_if_needed(parent_trace=parent_trace, path=manifest_dir)
-        version                             = 1
-        FOREIGN_KEY_FILE                    = "foreign_key_contraints." + str(version) + ".yaml"
-
-        # GOTCHA: Don't use the YAML Cache for foreign key constraints, because the current quirky implementation never
-        #       increases the version number, which causes "data loss" during transaction commits: while commits will
-        #       correctly "copy" the foreign key constraints from a sub-environment to the parent-environment, the
-        #       YAML Cache doesn't know that. This wouldn't be a problem except that it seems that the parent environment's
-        #       foreign key constraints where previously set in the cache to an empty dictionary. Since foreign key constraints
-        #       don't increase version number, the YAML Cache incorrectly believes that the parent environment's integrity
-        #       constraints are an empty dictionary, since the key in the YAML Cache is the same (as version is always 1)
-        #       for foreign key constraints).
-        #
-        #   Bottom line: don't use the YAML Cache for integrity constraints until integrity constraints subsystem is
-        #   properly re-designed.
-        # 
-        YAML_Utils().save(  parent_trace, 
-                            data_dict       = foreign_key_constraints_dict, 
-                            path            = manifest_dir + "/" + FOREIGN_KEY_FILE,
+        snapshot_path, log_path             = self._foreignKeyConstraintsPaths(parent_trace)
+        PathUtils().create_path_if_needed(parent_trace=parent_trace, path=_os.path.dirname(log_path))
+        YAML_Utils().append(parent_trace, data_dict = pending_dict, path = log_path)
+        self.foreign_key_constraints.clear_pending(parent_trace)
+
+        self._compactForeignKeyConstraints(parent_trace, self.current_environment(parent_trace))
+
+    def _compactForeignKeyConstraints(self, parent_trace, environment):
+        '''
+        If the foreign key constraints' log in the `environment` has grown bigger than its snapshot (and bigger than
+        Isolation_KBStore_Impl.FOREIGN_KEY_LOG_COMPACTION_BYTES), re-writes the snapshot so that it includes the
+        entries in the log, and removes the log.
+
+        Environments whose constraints depend on their parent's (i.e., with a log but no snapshot, that fail over to
+        their parent) are not compacted.
+        '''
+        ME                                  = Isolation_KBStore_Impl
+        snapshot_path, log_path             = self._foreignKeyConstraintsPaths(parent_trace, environment)
+        if not _os.path.isfile(log_path):
+            return
+        log_bytes                           = _os.path.getsize(log_path)
+        if _os.path.isfile(snapshot_path):
+            snapshot_bytes                  = _os.path.getsize(snapshot_path)
+        elif self._environmentFailsOverToParent(parent_trace, environment):
+            return
+        else:
+            snapshot_bytes                  = 0
+        if log_bytes <= max(snapshot_bytes, ME.FOREIGN_KEY_LOG_COMPACTION_BYTES):
+            return
+
+        my_trace                            = parent_trace.doing("Compacting foreign key constraints",
+                                                                    data = {"log": log_path})
+        registry                            = self._readForeignKeyConstraints(my_trace, environment)
+        YAML_Utils().save(  my_trace,
+                            data_dict       = registry.to_persistent_dict(my_trace),
+                            path            = snapshot_path,
                             use_cache       = False)
+        PathUtils().remove_file_if_exists(my_trace, log_path)
+
+    def _environmentFailsOverToParent(self, parent_trace, environment):
+        '''
+        Returns a boolean stating whether reads of manifests in the `environment` fail over to its parent
+        '''
+        if environment.parent(parent_trace) == None:
+            return False
+        KBEC                                = KB_Environment_Config
+        policy                              = environment.config(parent_trace).read_misses_policy
+        return policy in [KBEC.FAILOVER_ALL_READS_TO_PARENT, KBEC.FAILOVER_MANIFEST_READS_TO_PARENT]
+
+    def _readForeignKeyConstraints(self, parent_trace, environment, registry=None):
+        '''
+        Reads the foreign key constraints' snapshot and log in the `environment` (whichever of them exist) into `registry`,
+        which is created if it is None, and returns the registry.
+        '''
+        snapshot_path, log_path             = self._foreignKeyConstraintsPaths(parent_trace, environment)
+        if registry == None:
+            registry                        = ForeignKeyConstraintsRegistry(store = self.containing_store)
+        if _os.path.isfile(snapshot_path):
+            loaded_dict                     = YAML_Utils().load(parent_trace, path = snapshot_path, use_cache=False)
+            registry.replay_persisted_dict(parent_trace, loaded_dict)
+        if _os.path.isfile(log_path):
+            for delta_dict in YAML_Utils().load_all(parent_trace, path = log_path):
+                registry.replay_persisted_dict(parent_trace, delta_dict)
+        return registry
 
     def loadForeignKeyConstraints(self, parent_trace):
         '''
         Loads this store's ForeignKeyConstraintsRegistry from the system area of the store
         Returns two things:
 
-        * A ForeignKeyConstraintsRegistry object. If null, this signifies that there was none found in storage
+        * A ForeignKeyConstraintsRegistry object. If null, this signifies that there was none found in storage, or
+          that what was found only makes sense on top of the parent environment's foreign key constraints
         * A string, for the path in the file system where the ForeignKeyConstraintsRegistry was retrieved from
         '''
-        manifest_dir                        = self._current_env.manifestsURL(parent_trace) + "/system"
-        PathUtils().create_path_if_needed(parent_trace=parent_trace, path=manifest_dir)
-        version                             = 1
-        FOREIGN_KEY_FILE                    = "foreign_key_contraints." + str(version) + ".yaml"
-        full_path                           = manifest_dir + "/" + FOREIGN_KEY_FILE
-        try:
-            PathUtils().checkPathExists(parent_trace, full_path) # Will error out if path does not exist
-        except ApodeixiError:
-            # There is are no pre-existing constraints to load, so just create an empty registry and return
-            return None, full_path
-
-        # GOTCHA: Don't use the YAML Cache for foreign key constraints, because the current quirky implementation never
-        #       increases the version number, which causes "data loss" during transaction commits: while commits will
-        #       correctly "copy" the foreign key constraints from a sub-environment to the parent-environment, the
-        #       YAML Cache doesn't know that. This wouldn't be a problem except that it seems that the parent environment's
-        #       foreign key constraints where previously set in the cache to an empty dictionary. Since foreign key constraints
-        #       don't increase version number, the YAML Cache incorrectly believes that the parent environment's integrity
-        #       constraints are an empty dictionary, since the key in the YAML Cache is the same (as version is always 1)
-        #       for foreign key constraints).
-        #
-        #   Bottom line: don't use the YAML Cache for integrity constraints until integrity constraints subsystem is
-        #   properly re-designed.
-        # 
-        loaded_dict                         = YAML_Utils().load(parent_trace, path = full_path, use_cache=False)
+        snapshot_path, log_path             = self._foreignKeyConstraintsPaths(parent_trace)
+        if _os.path.isfile(snapshot_path):
+            pass
+        elif not _os.path.isfile(log_path) or self._environmentFailsOverToParent(parent_trace, self.current_environment(parent_trace)):
+            # There are no pre-existing constraints to load (at least not without the parent environment's), so return None
+            return None, snapshot_path
 
-        foreign_key_constraints             = ForeignKeyConstraintsRegistry.from_persisted_dict(
-                                                                            parent_trace, 
-                                                                            persisted_dict      = loaded_dict, 
-                                                                            store               = self.containing_store)
+        foreign_key_constraints             = self._readForeignKeyConstraints(parent_trace, self.current_environment(parent_trace))
 
-        return foreign_key_constraints, full_path
+        return foreign_key_constraints, snapshot_path
 
     def findLatestVersionManifest(self, parent_trace, manifest_api_name, namespace, name, kind):
         '''
@@ -740,20 +996,27 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
                                                                                     'kind':             kind})
 
 
-        folder                                      = self._current_env.manifestsURL(parent_trace) + '/' \
+        folder                                      = self.current_environment(parent_trace).manifestsURL(parent_trace) + '/' \
                                                                     + namespace + '/' + name
         result_dict                                 = None
         result_path                                 = None
         
-        candidates                                  = self._getFilenames(parent_trace, folder)
-        candidates                                  = [file for file in candidates if len(file.split("."))==3] # of form <kind>.<version nb>.yaml
-        candidates                                  = [file for file in candidates if file.split(".")[0]==kind]
-        pairs                                       = [(file, int(file.split(".")[1])) for file in candidates] # List be version number
-        if len(pairs) == 0:
-            return None, None
-
-        latest_version                              = max([pair[1] for pair in pairs])
-        candidates                                  = [pair[0] for pair in pairs if pair[1]==latest_version]
+        catalogued_paths                            = self.manifestCatalog(my_trace).findLatest(my_trace, namespace, name, kind)
+        if catalogued_paths != None:
+            candidates                              = [path.split("/")[-1] for path in catalogued_paths]
+            if len(candidates) == 0:
+                return None, None
+            latest_version                          = int(candidates[0].split(".")[1])
+        else: # Catalog can't be trusted, so scan the folder
+            candidates                              = self._getFilenames(parent_trace, folder)
+            candidates                              = [file for file in candidates if len(file.split("."))==3] # of form <kind>.<version nb>.yaml
+            candidates                              = [file for file in candidates if file.split(".")[0]==kind]
+            pairs                                   = [(file, int(file.split(".")[1])) for file in candidates] # List be version number
+            if len(pairs) == 0:
+                return None, None
+
+            latest_version                          = max([pair[1] for pair in pairs])
+            candidates                              = [pair[0] for pair in pairs if pair[1]==latest_version]
 
         if len(candidates) > 1:
             raise ApodeixiError(parent_trace, "There is more than 1 possible candidate as the latest manifest. KnowledgeBase sees corrupted",
@@ -952,7 +1215,7 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         matching_manifests      = [] # List of dictionaries, one per manifest
         matching_filenames      = [] # List of filename strings. Will be 1-1 lined up with matching_manifests
 
-        folder                  = self._current_env.manifestsURL(parent_trace) + '/' \
+        folder                  = self.current_environment(parent_trace).manifestsURL(parent_trace) + '/' \
                                         + manifest_handle.namespace + '/' + manifest_handle.name
 
         manifests, filenames    = self._getMatchingManifests(   parent_trace    = parent_trace, 
@@ -992,8 +1255,19 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         matching_manifests = [] # List of dictionaries, one per manifest
         matching_filenames = [] # List of filename strings. Will be 1-1 lined up with matching_manifests
 
+        catalogued_paths    = self.manifestCatalog(parent_trace).find(  parent_trace,
+                                                                        manifest_api    = manifest_handle.manifest_api,
+                                                                        namespace       = manifest_handle.namespace,
+                                                                        name            = manifest_handle.name,
+                                                                        kind            = manifest_handle.kind,
+                                                                        version         = manifest_handle.version)
+        if catalogued_paths != None:
+            filenames       = [path.split("/")[-1] for path in catalogued_paths]
+        else: # Catalog can't be trusted, so scan the folder
+            filenames       = self._getFilenames(parent_trace, folder)
+
         # Two areas where to search for manifests: input area, and output area. First the input area
-        for filename in self._getFilenames(parent_trace, folder):
+        for filename in filenames:
             loop_trace            = parent_trace.doing("Loading manifest from file",
                                                         data = {'filename':         filename,
                                                                 'folder':           folder},
@@ -1050,23 +1324,30 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         @param manifest_filter A function that takes two parameters: a FunctionalTrace and a dict object, and returns
                 a boolean. 
         '''
-        result                      = []
-        for currentdir, dirs, files in _os.walk(self.current_environment(parent_trace).manifestsURL(parent_trace)):
-            loop_trace              = parent_trace.doing("Scanning directory", data = {'currentdir': currentdir})
-            for a_file in files:
-                tokens = a_file.split(".")
-                # We are only interested in files like "big-rock.2.yaml" with tokens ["big-rock", "2", "yaml"]
-                if len(tokens) != 3 or tokens[2]!= "yaml" or not tokens[0] in kinds_of_interest or not tokens[1].isdigit():
-                    continue
+        manifests_url               = self.current_environment(parent_trace).manifestsURL(parent_trace)
+        catalogued_paths            = self.manifestCatalog(parent_trace).findByKinds(parent_trace, kinds_of_interest)
+        if catalogued_paths != None:
+            candidate_paths         = [manifests_url + "/" + path for path in catalogued_paths]
+        else: # Catalog can't be trusted, so scan the manifests area
+            candidate_paths         = []
+            for currentdir, dirs, files in _os.walk(manifests_url):
+                for a_file in files:
+                    tokens = a_file.split(".")
+                    # We are only interested in files like "big-rock.2.yaml" with tokens ["big-rock", "2", "yaml"]
+                    if len(tokens) != 3 or tokens[2]!= "yaml" or not tokens[0] in kinds_of_interest or not tokens[1].isdigit():
+                        continue
+                    candidate_paths.append(currentdir + '/' + a_file)
 
-                inner_trace         = loop_trace.doing("Loading manifest", data = {'currentdir': currentdir, 'file': a_file})
-                manifest_dict       = YAML_Utils().load(inner_trace, path=currentdir + '/' + a_file)
-                if filter == None:
-                    result.append(manifest_dict)
-                elif filter(inner_trace, manifest_dict):
-                    result.append(manifest_dict)
-                else:
-                    continue # Not a match
+        result                      = []
+        for path in candidate_paths:
+            loop_trace              = parent_trace.doing("Loading manifest", data = {'path': path})
+            manifest_dict           = YAML_Utils().load(loop_trace, path=path)
+            if manifest_filter == None:
+                result.append(manifest_dict)
+            elif manifest_filter(loop_trace, manifest_dict):
+                result.append(manifest_dict)
+            else:
+                continue # Not a match
                 
         return result
 
@@ -1076,6 +1357,7 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         to this posting event and returns a PostingLabelHandle to identify the Excel file in this newly
         created archival folder.       
         '''
+        self._abort_if_read_only(parent_trace)
         submitted_posting_path              = self._getPostingFullPath(parent_trace, posting_label_handle)
         submitted_posting_coords            = posting_label_handle.filing_coords
         filename                            = posting_label_handle.excel_filename
@@ -1191,6 +1473,7 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         '''
         Used to record in the store information about a posting event that has been completed.
         '''
+        self._abort_if_read_only(parent_trace)
         archival_list                       = controller_response.archivedPostings()
         if len(archival_list) != 1:
             raise ApodeixiError(parent_trace, "Can't log post event because it lacks a unique archival record",
@@ -1263,6 +1546,7 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
         '''
         Used to record in the store information about a request form event that has been completed.
         '''
+        self._abort_if_read_only(parent_trace)
         log_folder, log_coords              = self._get_log_folder(parent_trace, form_request)
 
         env_config                          = self.current_environment(parent_trace).config(parent_trace)
@@ -1302,6 +1586,7 @@ class Isolation_KBStore_Impl(File_KBStore_Impl):
 
         @return The filename (a string) under which the form was uploaded
         '''
+        self._abort_if_read_only(parent_trace)
         full_path                   = self.getClientURL(parent_trace) \
                                             + "/" + form_request.getRelativePath(parent_trace)
         output_folder, filename     = _os.path.split(full_path)
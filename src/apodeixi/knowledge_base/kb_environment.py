@@ -1,6 +1,8 @@
 import os                                               as _os
 import shutil                                           as _shutil
 
+from apodeixi.knowledge_base.manifest_catalog           import ManifestCatalog
+
 from apodeixi.util.a6i_error                            import ApodeixiError
 from apodeixi.util.path_utils                           import PathUtils, FolderHierarchy
 from apodeixi.util.yaml_utils                           import YAML_Utils
@@ -34,9 +36,14 @@ class KB_Environment_Config():
                 is displayed. In the above example, that might become:
 
                 '<KNOWLEDGE_BASE>/envs/big_rocks_posting_ENV/excel-postings'
-
+    @param overlay A boolean. If False (the default), then whenever a read fails over to the parent environment the
+                data found in the parent is copied (or hard-linked) into the current environment, so that next time
+                there is no need to failover again. If True, the environment is an "overlay" of its parent: reads
+                that fail over are served from the parent environment (via its manifest catalog or its postings
+                area) without bringing anything into the current environment, so the current environment only holds
+                what was written to it. Visibility of data is the same in both modes.
     '''
-    def __init__(self, parent_trace, read_misses_policy, use_timestamps=True, path_mask=None):
+    def __init__(self, parent_trace, read_misses_policy, use_timestamps=True, path_mask=None, overlay=False):
         ME                                  = KB_Environment_Config
         if not read_misses_policy in ME.READ_MISSES_POLICIES:
             raise ApodeixiError(parent_trace, "The read misses policy that was provided is not supported",
@@ -46,6 +53,7 @@ class KB_Environment_Config():
         self.read_misses_policy             = read_misses_policy
         self.use_timestamps                 = use_timestamps
         self.path_mask                      = path_mask
+        self.overlay                        = overlay
 
     FAILOVER_ALL_READS_TO_PARENT            = 'FAILOVER_ALL_READS_TO_PARENT'
     FAILOVER_MANIFEST_READS_TO_PARENT       = 'FAILOVER_MANIFEST_READS_TO_PARENT'
@@ -422,6 +430,9 @@ class File_KBEnv_Impl():
 
         self._children[sub_env_name] = sub_env
         sub_env_impl.save_environment_metadata(my_trace)
+
+        # The new environment has no manifests yet, so its catalog is trivially complete
+        ManifestCatalog(subenv_manifests_rootdir).initialize(my_trace)
         return sub_env
 
     def save_environment_metadata(self, parent_trace):
@@ -449,6 +460,7 @@ class File_KBEnv_Impl():
         config_dict                         = {}
         config_dict['read_misses_policy']   = config.read_misses_policy
         config_dict['use_timestamps']       = config.use_timestamps
+        config_dict['overlay']              = config.overlay
 
         metadata_dict['config']             = config_dict
 
@@ -520,6 +532,7 @@ class File_KBEnv_Impl():
                                                                 read_misses_policy      = config_dict["read_misses_policy"],
                                                                 use_timestamps          = config_dict["use_timestamps"],
                                                                 path_mask               = None, # This was not persisted
+                                                                overlay                 = config_dict.get("overlay", False),
                                                             )
 
         # GOTCHA: When constructing the child_env_impl, we must give a parent_environment that is
@@ -604,12 +617,15 @@ class File_KBEnv_Impl():
                 avoid1          = _os.path.normpath(root_dir + "/" + ME.ENVS_FOLDER)
                 avoid2          = _os.path.normpath(root_dir + "/" + ME.LOGS_FOLDER) 
                 path            = _os.path.normpath(subdir)
-                return (not path.startswith(avoid1)) and (not path.startswith(avoid2))
+                return (not path.startswith(avoid1)) and (not path.startswith(avoid2)) \
+                                and (not ManifestCatalog.is_catalog_file(path)) and (not YAML_Utils.is_sidecar(path))
             filter              = avoid_envs_and_logs_folders
         else:        
             my_dir              = root_dir + "/" + ME.ENVS_FOLDER + "/" + self._name
-            # In this case, include everything under my_dir
-            filter              = None
+            # In this case, include everything under my_dir except the manifest catalog and sidecars, which are derived data
+            def avoid_derived_data(path):
+                return (not ManifestCatalog.is_catalog_file(path)) and (not YAML_Utils.is_sidecar(path))
+            filter              = avoid_derived_data
 
 
         hierarchy                   = FolderHierarchy.build(    parent_trace        = parent_trace, 
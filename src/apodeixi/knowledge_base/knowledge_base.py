@@ -1,12 +1,12 @@
+import concurrent.futures                                                    as _futures
+import pickle                                                               as _pickle
+import logging                                                              as _logging
+from importlib                                                              import import_module
+
 from apodeixi.knowledge_base.isolation_kb_store import Isolation_KBStore_Impl
+from apodeixi.knowledge_base.posting_workers                                import build_posting_in_worker
 from apodeixi.util.a6i_error                                                import ApodeixiError, FunctionalTrace
 
-from apodeixi.controllers.admin.static_data.products                        import ProductsController
-from apodeixi.controllers.admin.static_data.scoring_cycles                  import ScoringCyclesController
-from apodeixi.controllers.kernel.bdd.capability_hierarchy                   import CapabilityHierarchy_Controller
-from apodeixi.controllers.journeys.delivery_planning.big_rocks              import BigRocksEstimate_Controller
-from apodeixi.controllers.journeys.delivery_planning.milestones_controller  import MilestonesController
-from apodeixi.controllers.initiatives.workstream                            import Workstream_Controller
 from apodeixi.util.dictionary_utils                                         import DictionaryUtils
 from apodeixi.util.formatting_utils                                         import DictionaryFormatter
 
@@ -23,17 +23,19 @@ class KnowledgeBase():
         self.introspection      = KB_Introspection(self)
 
         self.controllers        = { 
-            #List of associations of posting API => dict of kind=> PostingController class to use 
-            # for such posting API
-            'big-rocks.journeys.a6i':                   BigRocksEstimate_Controller,
-            'milestone.journeys.a6i':                   MilestonesController,
+            #List of associations of posting API => PostingController class to use for such posting API.
+            # The class may be given by its fully qualified name, in which case its module is only imported the
+            # first time that the controller is needed (refer to self.findController). That way, processes
+            # that don't need a controller don't pay the cost of importing it.
+            'big-rocks.journeys.a6i':                   'apodeixi.controllers.journeys.delivery_planning.big_rocks.BigRocksEstimate_Controller',
+            'milestone.journeys.a6i':                   'apodeixi.controllers.journeys.delivery_planning.milestones_controller.MilestonesController',
 
-            'products.static-data.admin.a6i':           ProductsController,
-            'scoring-cycles.static-data.admin.a6i':     ScoringCyclesController,
+            'products.static-data.admin.a6i':           'apodeixi.controllers.admin.static_data.products.ProductsController',
+            'scoring-cycles.static-data.admin.a6i':     'apodeixi.controllers.admin.static_data.scoring_cycles.ScoringCyclesController',
 
-            'capability-hierarchy.bdd.kernel.a6i':      CapabilityHierarchy_Controller,
+            'capability-hierarchy.bdd.kernel.a6i':      'apodeixi.controllers.kernel.bdd.capability_hierarchy.CapabilityHierarchy_Controller',
 
-            'workstream.initiatives.a6i':               Workstream_Controller,
+            'workstream.initiatives.a6i':               'apodeixi.controllers.initiatives.workstream.Workstream_Controller',
             #'charter.initiatives.a6i':                  None, # TODO
         }
 
@@ -98,23 +100,46 @@ class KnowledgeBase():
 
         Returns a PostResponse object, as well as a string corresponding the log made for this posting
         '''
+        return self._postByLabel(parent_trace, label_handle, posting_build=None)
+
+    def _postByLabel(self, parent_trace, label_handle, posting_build):
+        '''
+        Helper method that implements postByLabel.
+
+        @param posting_build A PostingBuild object, or None. If it is not None, then the posting was already
+                    built by a worker process, so this method only needs to persist it.
+        '''
         self.store.beginTransaction(parent_trace)
         try:
             self.introspection.introspectStore(parent_trace)
 
-            my_trace                = parent_trace.doing("Posting by label",
+            if posting_build == None:
+                my_trace            = parent_trace.doing("Posting by label",
                                                 data = {'relativePath': label_handle.getRelativePath(parent_trace)})
-    
-            posting_api             = label_handle.getPostingAPI(my_trace)
+        
+                posting_api         = label_handle.getPostingAPI(my_trace)
 
-            ctrl                    = self.findController(  parent_trace        = my_trace,
+                ctrl                = self.findController(  parent_trace        = my_trace,
                                                                 posting_api     = posting_api)
-            # Reset the LinkTable, in case the same controller was previouly used to process another Excel file 
-            # since that implies that any previously stored links are for a different scope of UIDs
-            ctrl.init_link_table(parent_trace)
-            my_trace                = parent_trace.doing("Applying controller to process the posting")
-            response                = ctrl.apply(   parent_trace                = my_trace, 
+                # Reset the LinkTable, in case the same controller was previouly used to process another Excel file 
+                # since that implies that any previously stored links are for a different scope of UIDs
+                ctrl.init_link_table(parent_trace)
+                my_trace            = parent_trace.doing("Applying controller to process the posting")
+                response            = ctrl.apply(   parent_trace                = my_trace, 
                                                         posting_label_handle    = label_handle)
+            else:
+                if posting_build.error != None:
+                    raise posting_build.error
+                # The worker may have inferred filing coordinates, which we need when archiving the posting
+                label_handle.filing_coords  = posting_build.label_handle.filing_coords
+
+                ctrl                = posting_build.controller
+                ctrl.store.rebind(parent_trace, self.store)
+                my_trace            = parent_trace.doing("Applying controller to process the posting")
+                response            = ctrl.persistPosting(  parent_trace            = my_trace, 
+                                                            posting_label_handle    = label_handle,
+                                                            all_manifests_dicts     = posting_build.all_manifests_dicts,
+                                                            label                   = posting_build.label)
 
             log_txt                 = ctrl.log_txt
 
@@ -132,7 +157,7 @@ class KnowledgeBase():
                 raise ApodeixiError(parent_trace, "Transaction aborted due to error found in processing",
                                                     data = {"error": str(ex)})
 
-    def postInBatch(self, parent_trace, label_handle_list):
+    def postInBatch(self, parent_trace, label_handle_list, workers=None):
         '''
         Part of the KnowledgeBase's API, i.e., this method is transactional (to the extent that the
         store used by the KnowledgeBase supports it).
@@ -147,14 +172,31 @@ class KnowledgeBase():
         
         For the success dictionary, the values are the ApodeixiError raised whhile processing the
         correspoding PostingLabelHandle.
+
+        @param workers An int for the number of worker processes to use, or None, in which case it is taken from
+                the Apodeixi configuration (and defaults to 1). If it is bigger than 1 then the Excel postings are parsed
+                and their manifests built in parallel by a pool of worker processes, while the writes to the store
+                are still done by this process, one posting at a time and in the order of `label_handle_list`. 
+                If a worker's output might depend on manifests written by an earlier posting in the batch, that 
+                posting is re-processed serially, so the dictionaries returned are the same as in serial mode.
         '''
         self.store.beginTransaction(parent_trace)
 
         try:
             self.introspection.introspectStore(parent_trace)
 
+            if workers == None:
+                workers             = self.a6i_config.get_PostingWorkers(parent_trace)
+            workers                 = min(workers, len(label_handle_list))
+
             successes               = {}
             errors                  = {}
+            if workers > 1:
+                posting_build_list  = self._buildInParallel(parent_trace, label_handle_list, workers)
+            else:
+                posting_build_list  = [None for handle in label_handle_list]
+
+            written_manifests       = set() # (namespace, name) pairs for manifests written by the batch so far
             for idx in range(len(label_handle_list)):
                 handle              = label_handle_list[idx]
                 loop_trace          = parent_trace.doing("Doing a cycle of loop to process one of " 
@@ -163,10 +205,14 @@ class KnowledgeBase():
                                                         data = {'idx'               : idx,
                                                                 'excel_filename'    : handle.getRelativePath(parent_trace)})
                                                                 
-                
+                posting_build       = posting_build_list[idx]
+                if posting_build != None and posting_build.dependsOn(written_manifests):
+                    posting_build   = None # Worker might have read stale manifests, so re-process serially
                 try:
-                    response, log   = self.postByLabel(loop_trace, handle)
+                    response, log   = self._postByLabel(loop_trace, handle, posting_build)
                     successes[idx]  = response
+                    written_manifests.update([(m.namespace, m.name) for m 
+                                                in response.createdManifests() + response.updatedManifests()])
                 except ApodeixiError as ex:
                     errors[idx]     = ex
 
@@ -182,6 +228,43 @@ class KnowledgeBase():
                 raise ApodeixiError(parent_trace, "Transaction aborted due to error found in processing",
                                                     data = {"error": str(ex)})
 
+    def _buildInParallel(self, parent_trace, label_handle_list, workers):
+        '''
+        Helper method used by postInBatch when posting in parallel. It uses a pool of `workers` processes
+        to build the postings in `label_handle_list` (i.e., parse the Excel and create the manifests), and returns
+        a list of PostingBuild objects, in the same order as `label_handle_list`.
+
+        Postings that the workers could not build (e.g., because of an unexpected non-Apodeixi error) are 
+        represented by None in the list returned, so that the caller processes them serially.
+        '''
+        # Snapshot ourselves before anything is persisted, so that all workers start from the same state
+        try:
+            pickled_kb              = _pickle.dumps(self)
+        except (_pickle.PicklingError, TypeError, AttributeError) as ex: # Some store implementations might not be picklable
+            _logging.getLogger(__name__).warning("Posting serially, since the KnowledgeBase can't be sent to worker "
+                                                    + "processes: " + str(ex))
+            return [None for handle in label_handle_list]
+
+        with _futures.ProcessPoolExecutor(max_workers = workers) as pool:
+            future_list             = []
+            for idx in range(len(label_handle_list)):
+                handle              = label_handle_list[idx]
+                loop_trace          = parent_trace.doing("Doing a cycle of loop to process one of " 
+                                                            + str(len(label_handle_list)) 
+                                                            + " label handles",
+                                                        data = {'idx'               : idx,
+                                                                'excel_filename'    : handle.getRelativePath(parent_trace)})
+                future_list.append(pool.submit(build_posting_in_worker, pickled_kb, loop_trace, handle))
+
+            posting_build_list      = []
+            for future in future_list:
+                try:
+                    posting_build_list.append(future.result())
+                except Exception as ex:
+                    posting_build_list.append(None)
+
+        return posting_build_list
+
     def requestForm(self, parent_trace, form_request):
         '''
         Part of the KnowledgeBase's API, i.e., this method is transactional (to the extent that the
@@ -248,7 +331,7 @@ class KnowledgeBase():
                                                                 root_dict       = self.controllers, 
                                                                 root_dict_name  = 'Knowledge Base supported controllers',
                                                                 path_list       = [posting_api],
-                                                                valid_types     = [type])
+                                                                valid_types     = [type, str])
                                                        
         if not check:
             raise ApodeixiError(my_trace, "Knowledge Base does not support the given posting api and kind",
@@ -262,7 +345,7 @@ class KnowledgeBase():
                                                 data = {    'posting_api':                      str(posting_api),
                                                             'store_supported_apis found':       str(store_supported_apis)})
 
-        klass           = self.controllers[posting_api]
+        klass           = self._resolveControllerClass(parent_trace, posting_api)
         my_trace            = parent_trace.doing("Instantiating a PostingController class",
                                                     data = {    'class':        str(klass),
                                                                 'posting_api':  str(posting_api)})
@@ -276,6 +359,27 @@ class KnowledgeBase():
 
         return ctrl
 
+    def _resolveControllerClass(self, parent_trace, posting_api):
+        '''
+        Returns the PostingController class registered in self.controllers for the `posting_api`. If it was
+        registered by name, its module is imported and the class replaces the name in self.controllers, so that
+        this is only done once.
+        '''
+        klass               = self.controllers[posting_api]
+        if type(klass) == str:
+            my_trace        = parent_trace.doing("Importing PostingController class",
+                                                    data = {    'class':        klass,
+                                                                'posting_api':  str(posting_api)})
+            try:
+                module_path, class_name         = klass.rsplit('.', 1)
+                klass                           = getattr(import_module(module_path), class_name)
+            except (ImportError, AttributeError, ValueError) as ex:
+                raise ApodeixiError(my_trace, "Unable to import controller class",
+                                                data = {    'controller_class':     str(klass),
+                                                            'exception found':      str(ex)})
+            self.controllers[posting_api]   = klass
+        return klass
+
 class KB_Introspection():
     '''
     Class used to record technical, internal-processing-focused logs emitted by the KnowledgeBase and its
@@ -310,6 +414,10 @@ class KB_Introspection():
             data_dict["Transaction_environment"]    = store_impl.transaction_env(parent_trace).name(parent_trace)
             data_dict["Transaction_stack"]          = [env.name(parent_trace) for env in store_impl._transactions_stack]
 
+            posting_cache                           = store_impl.postingCache(parent_trace)
+            if posting_cache != None:
+                data_dict["Posting_cache"]          = posting_cache.stats()
+
             transaction_nb                          = store_impl._transaction_nb 
             # transaction_nb would be the *next* transaction for the store, so subtract 1 to show the current one
             self.introspection_dict["Store@transaction#" + str(transaction_nb-1)]  = data_dict
@@ -27,6 +27,23 @@ class KnowledgeBaseStore():
         self._impl          = impl
         return
 
+    def rebind(self, parent_trace, store):
+        '''
+        Makes this store delegate to the same implementation as `store`, another KnowledgeBaseStore.
+
+        Used when the KnowledgeBase posts in parallel: a controller built in a worker process comes back with a copy
+        of the worker's store, which is rebound to the KnowledgeBase's store so that the controller persists the
+        posting through the latter. Refer to self.unbind
+        '''
+        self._impl          = store._impl
+
+    def unbind(self, parent_trace):
+        '''
+        Detaches this store from its implementation, so that the implementation is not pickled along with the store.
+        The store can't be used until it is rebound. Refer to self.rebind
+        '''
+        self._impl          = None
+
     def beginTransaction(self, parent_trace):
         '''
         Starts an isolation state in which all subsequent I/O is done in an isolation area
@@ -120,6 +137,16 @@ class KnowledgeBaseStore():
         Switches the store's current environment to be the base environment.
         '''
         return self._impl.deactivate(parent_trace)
+
+    def clearSessionState(self, parent_trace):
+        '''
+        Forgets in-memory state that accumulates as the store is used, such as the current environment, environments
+        loaded into memory, or the foreign key constraints, so that subsequent requests see the store as if it had
+        just been created. Caches that validate themselves against storage are kept.
+
+        Used by long-lived processes, such as the Apodeixi daemon, that serve multiple requests with the same store.
+        '''
+        return self._impl.clearSessionState(parent_trace)
  
     def removeEnvironment(self, parent_trace, name):
         '''
@@ -321,6 +348,54 @@ class KnowledgeBaseStore():
         '''
         return self._impl.searchManifests(parent_trace, kinds_of_interest, manifest_filter)
 
+    def getCachedStaticData(self, parent_trace, namespace, kind):
+        '''
+        Returns the object that was cached with self.cacheStaticData for the latest version of the static data
+        manifest for the `namespace` and `kind`, or None if there is none (for example, because a newer version
+        of the manifest was persisted since it was cached).
+        '''
+        return self._impl.getCachedStaticData(parent_trace, namespace, kind)
+
+    def cacheStaticData(self, parent_trace, namespace, kind, version, static_data):
+        '''
+        Caches `static_data`, an object derived from version `version` of the static data manifest for the
+        `namespace` and `kind`, which must be the latest version of that manifest. It remains cached until a new
+        version of the manifest is persisted, or until the store switches to an unrelated environment.
+        '''
+        return self._impl.cacheStaticData(parent_trace, namespace, kind, version, static_data)
+
+    def staticDataCacheStats(self, parent_trace):
+        '''
+        Returns a dictionary with cumulative statistics on how often cached static data was found
+        '''
+        return self._impl.staticDataCacheStats(parent_trace)
+
+    def rebuildManifestCatalog(self, parent_trace):
+        '''
+        Re-creates the index used to look up manifests in the current environment, by scanning all the manifests
+        in the environment. Needed for KnowledgeBases that were created before such indices were introduced.
+
+        Returns an int, corresponding to the number of manifests indexed.
+        '''
+        return self._impl.rebuildManifestCatalog(parent_trace)
+
+    def backfillManifestSidecars(self, parent_trace):
+        '''
+        Writes a binary sidecar for every manifest in the current environment that lacks a valid one. Sidecars
+        are binary copies of manifests that are faster to load than YAML.
+
+        Returns an int, corresponding to the number of sidecars written.
+        '''
+        return self._impl.backfillManifestSidecars(parent_trace)
+
+    def fileTransferStats(self, parent_trace):
+        '''
+        Returns a dictionary with cumulative statistics on how the store transferred files across environments
+        (e.g., when committing transactions), including how many bytes were not copied thanks to moving or
+        hard-linking files.
+        '''
+        return self._impl.fileTransferStats(parent_trace)
+
     def archivePosting(self, parent_trace, posting_label_handle, subnamespace):
         '''
         Used after a posting Excel file has been processed. It moves the Excel file to a newly created folder dedicated 
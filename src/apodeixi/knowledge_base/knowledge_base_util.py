@@ -7,6 +7,7 @@ from apodeixi.knowledge_base.filing_coordinates                 import TBD_Filin
 #from apodeixi.knowledge_base.manifest_utils                     import ManifestUtils
 
 from apodeixi.util.a6i_error                                    import ApodeixiError
+from apodeixi.util.yaml_utils                                   import YAML_Utils
 
 class PostingLabelHandle():
     '''
@@ -22,6 +23,10 @@ class PostingLabelHandle():
         self.posting_api            = posting_api 
         self.filing_coords          = filing_coords 
 
+        # Set by controllers while the posting is being processed, to an ExcelWorkbookSession that lets the Posting
+        # Label and all the manifests be read from the Excel file while opening it only once
+        self.workbook_session       = None
+
     def copy(self, parent_trace):
         new_handle      = PostingLabelHandle(   parent_trace        = parent_trace, 
                                                 posting_api         = self.posting_api, 
@@ -92,6 +97,7 @@ class PostingLabelHandle():
                                                         excel_filename      = self.excel_filename,
                                                         excel_sheet         = excel_sheet,
                                                         excel_range         = excel_range)
+        data_handle.workbook_session    = self.workbook_session
         return data_handle
 
     def createUpdateForm(self, parent_trace, manifest_handles):
@@ -131,6 +137,9 @@ class PostingDataHandle():
         self.manifest_nb            = manifest_nb
         self.kind                   = kind
 
+        # Shared with the PostingLabelHandle that built this handle. Refer to PostingLabelHandle.workbook_session
+        self.workbook_session       = None
+
     def getRelativePath(self, parent_trace):
         if type(self.filing_coords) == TBD_FilingCoordinates: # Filing Coords' tokens don't correspond to the path
             return self.filing_coords.getFullPath()
@@ -242,7 +251,7 @@ def manifest_handle_constructor(loader: YAML_LOADER, node: _yaml.nodes.MappingNo
 
 #TAG                             = "? !!python/object:apodeixi.knowledge_base.knowledge_base_util.ManifestHandle"
 TAG                             = 'tag:yaml.org,2002:python/object:apodeixi.knowledge_base.knowledge_base_util.ManifestHandle'
-YAML_LOADER.add_constructor(TAG, manifest_handle_constructor)
+YAML_Utils().add_constructor(TAG, manifest_handle_constructor)
 
 class Response():
     '''
@@ -0,0 +1,449 @@
+import os                                               as _os
+import json                                             as _json
+import sqlite3                                          as _sqlite3
+import threading                                        as _threading
+from contextlib                                         import contextmanager as _contextmanager
+
+from apodeixi.controllers.util.manifest_api             import ManifestAPIVersion
+
+from apodeixi.util.a6i_error                            import ApodeixiError
+from apodeixi.util.yaml_utils                           import YAML_Utils
+
+class ManifestCatalog():
+    '''
+    On-disk index of the manifests that are held in the manifests area of one environment of a file-based
+    KnowledgeBaseStore.
+
+    It was introduced because lookups like `findLatestVersionManifest`, `retrieveManifest` and `searchManifests`
+    used to list or walk the manifests area and parse YAML files just to confirm their identity, so that the cost
+    of a single lookup grew with the size of the whole KnowledgeBase.
+
+    The catalog is a SQLite database that lives beside the manifests folder it indexes. For example, for the
+    manifests area
+
+            $KB_STORE/envs/store-transaction.3/kb/manifests
+
+    the catalog would be
+
+            $KB_STORE/envs/store-transaction.3/kb/MANIFEST_CATALOG.sqlite
+
+    Each row is keyed by the relative path of a manifest file (e.g.,
+    'my-corp.production/modernization.default.dec-2020.fusionopus/big-rock.2.yaml') and records the
+    manifest api, namespace, name, kind and version, as well as the file's size, modification time and labels.
+    Lookups are B-tree index reads instead of directory scans.
+
+    The catalog is only "trusted" if it is flagged as complete, i.e., if it is known to cover every manifest in
+    its manifests area. That is the case for environments created after this feature was introduced (they start empty),
+    and for any environment whose catalog has been rebuilt by calling self.rebuild.
+    KnowledgeBases created before the catalog existed (such as the base environment of an older KnowledgeBase) have
+    no catalog, so it is built by the first lookup, by scanning the manifests area once. It may also be rebuilt
+    explicitly, e.g., via the CLI command `apo rebuild-index`.
+
+    Lookup methods return None (as opposed to an empty list) to signal that the catalog can't be trusted to answer,
+    in which case the caller is expected to fall back to scanning the file system.
+    If a lookup discovers that a file referenced in the catalog is no longer there, the catalog flags itself as
+    incomplete and returns None, so that the next lookup rebuilds it.
+
+    SQLite connections are cached per catalog file and per process, and the catalog's tables are only created when
+    a connection is opened. Cached connections are shared by threads, so each use of one holds a lock. Call
+    ManifestCatalog.release_connections before removing the folder of an environment, since in Windows open
+    connections prevent the catalog file from being removed.
+
+    @param manifests_rootdir A string, corresponding to the root folder of the manifests area indexed by this catalog.
+    '''
+    def __init__(self, manifests_rootdir):
+        ME                                  = ManifestCatalog
+        self._manifests_rootdir             = manifests_rootdir
+        self._catalog_path                  = _os.path.dirname(manifests_rootdir) + "/" + ME.CATALOG_FILENAME
+
+    CATALOG_FILENAME                        = "MANIFEST_CATALOG.sqlite"
+
+    _COMPLETE                               = "complete"
+
+    _SCHEMA                                 = [
+        "CREATE TABLE IF NOT EXISTS catalog_info (key TEXT PRIMARY KEY, value TEXT)",
+        "CREATE TABLE IF NOT EXISTS manifests (relative_path TEXT PRIMARY KEY, manifest_api TEXT, namespace TEXT, "
+            + "name TEXT, kind TEXT, version INTEGER, size INTEGER, mtime_ns INTEGER, labels TEXT)",
+        "CREATE INDEX IF NOT EXISTS manifests_by_identity ON manifests (namespace, name, kind, version)",
+        "CREATE INDEX IF NOT EXISTS manifests_by_kind ON manifests (kind)",
+    ]
+
+    def is_catalog_file(filename):
+        '''
+        Returns True if `filename` is the name of a catalog file (or of a transient file SQLite creates next to it,
+        such as a journal).
+        Used to exclude catalogs from environment descriptions, since catalogs are derived data and not part
+        of the official content of an environment.
+        '''
+        return _os.path.basename(filename).startswith(ManifestCatalog.CATALOG_FILENAME)
+
+    # Keys are catalog paths, and values are _CachedConnection objects. Guarded by _CONNECTIONS_LOCK
+    _CONNECTIONS                            = {}
+    _CONNECTIONS_LOCK                       = _threading.Lock()
+
+    # Cumulative number of SQLite connections opened by this process, to support testing and monitoring
+    connections_opened                      = 0
+
+    def release_connections(folder):
+        '''
+        Closes the cached connections to catalogs located under `folder`. Must be called before `folder` is removed.
+        '''
+        ME                                  = ManifestCatalog
+        prefix                              = _os.path.normpath(folder) + _os.sep
+        with ME._CONNECTIONS_LOCK:
+            for catalog_path in list(ME._CONNECTIONS.keys()):
+                if _os.path.normpath(catalog_path).startswith(prefix):
+                    ME._CONNECTIONS.pop(catalog_path).close()
+
+    def catalog_path(self):
+        return self._catalog_path
+
+    def exists(self):
+        return _os.path.isfile(self._catalog_path)
+
+    @_contextmanager
+    def _connect(self, parent_trace):
+        '''
+        Context manager that yields the cached SQLite connection to the catalog, opening it (and creating the 
+        catalog's tables) if there is none, and holding the connection's lock while the `with` block runs. 
+        Changes are committed only if the caller does so, e.g., by using the connection as a context manager.
+
+        The cached connection is discarded if it was opened by another process (e.g., before a fork) or if the 
+        catalog file was removed or replaced since it was opened.
+        '''
+        ME                                  = ManifestCatalog
+        try:
+            with ME._CONNECTIONS_LOCK:
+                cached                      = ME._CONNECTIONS.get(self._catalog_path)
+                if cached != None and not cached.is_valid():
+                    ME._CONNECTIONS.pop(self._catalog_path)
+                    cached.close()
+                    cached                  = None
+                if cached == None:
+                    cached                  = _CachedConnection(self._catalog_path, ME._SCHEMA)
+                    ME._CONNECTIONS[self._catalog_path] = cached
+                    ME.connections_opened   += 1
+        except Exception as ex:
+            raise ApodeixiError(parent_trace, "Unable to open manifest catalog",
+                                    data = {"catalog path":     str(self._catalog_path),
+                                            "error":            str(ex)})
+        with cached.lock:
+            yield cached.connection
+
+    def is_complete(self, parent_trace):
+        '''
+        Returns a boolean, stating whether this catalog is known to index every manifest in its manifests area.
+        '''
+        if not self.exists():
+            return False
+        with self._connect(parent_trace) as connection:
+            row                             = connection.execute("SELECT value FROM catalog_info WHERE key = ?",
+                                                                    (ManifestCatalog._COMPLETE,)).fetchone()
+        return row != None and row[0] == "1"
+
+    def _set_complete(self, connection, complete):
+        connection.execute("INSERT OR REPLACE INTO catalog_info (key, value) VALUES (?, ?)",
+                                    (ManifestCatalog._COMPLETE, "1" if complete else "0"))
+
+    def initialize(self, parent_trace):
+        '''
+        Creates an empty catalog flagged as complete. Intended for brand new environments, whose manifests area
+        is empty at creation time.
+        '''
+        with self._connect(parent_trace) as connection:
+            with connection:
+                connection.execute("DELETE FROM manifests")
+                self._set_complete(connection, True)
+
+    def mark_incomplete(self, parent_trace):
+        '''
+        Flags the catalog as no longer trusted, so that lookups fall back to scanning the manifests area until
+        the catalog is rebuilt
+        '''
+        if not self.exists():
+            return
+        with self._connect(parent_trace) as connection:
+            with connection:
+                self._set_complete(connection, False)
+
+    def _parse_relative_path(self, relative_path):
+        '''
+        Helper method that parses a relative path like 'my-corp.production/modernization.default.dec-2020.fusionopus/big-rock.2.yaml'
+        and returns a tuple (namespace, name, kind, version).
+
+        Returns None if the relative path is not for a manifest file (i.e., a file like "<kind>.<version nb>.yaml").
+        If the manifest is not located at the expected depth of <namespace>/<name>, then namespace and name are None.
+        '''
+        path_tokens                         = relative_path.split("/")
+        file_tokens                         = path_tokens[-1].split(".")
+        if len(file_tokens) != 3 or file_tokens[2] != "yaml" or not file_tokens[1].isdigit():
+            return None
+        if len(path_tokens) == 3:
+            namespace, name                 = path_tokens[0], path_tokens[1]
+        else:
+            namespace, name                 = None, None
+        return namespace, name, file_tokens[0], int(file_tokens[1])
+
+    def _manifest_api(self, parent_trace, manifest_dict):
+        '''
+        Returns the manifest api inside `manifest_dict`, or None if it is not a well formed manifest
+        '''
+        api_version                         = manifest_dict.get(ManifestAPIVersion.API_VERSION) \
+                                                    if type(manifest_dict) == dict else None
+        if type(api_version) != str:
+            return None
+        try:
+            return ManifestAPIVersion.parse(parent_trace, api_version).api.apiName()
+        except ApodeixiError:
+            return None
+
+    def _labels(self, manifest_dict):
+        metadata                            = manifest_dict.get('metadata') if type(manifest_dict) == dict else None
+        labels                              = metadata.get('labels') if type(metadata) == dict else None
+        if labels == None:
+            return None
+        return _json.dumps(labels, sort_keys=True, default=str)
+
+    def _row(self, parent_trace, relative_path, manifest_dict):
+        '''
+        Returns a tuple with the values of the catalog's row for the manifest at `relative_path`, or None if
+        `relative_path` is not for a manifest
+        '''
+        parsed                              = self._parse_relative_path(relative_path)
+        if parsed == None:
+            return None
+        namespace, name, kind, version      = parsed
+        stat                                = _os.stat(self._manifests_rootdir + "/" + relative_path)
+        return (relative_path, self._manifest_api(parent_trace, manifest_dict), namespace, name, kind, version,
+                    stat.st_size, stat.st_mtime_ns, self._labels(manifest_dict))
+
+    _INSERT                                 = "INSERT OR REPLACE INTO manifests (relative_path, manifest_api, namespace, " \
+                                                    + "name, kind, version, size, mtime_ns, labels) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+    def record(self, parent_trace, relative_path, manifest_dict):
+        '''
+        Adds or updates the catalog entry for the manifest that was just written to `relative_path` (relative to the
+        manifests area), with content `manifest_dict`.
+        '''
+        if not self.exists():
+            # Catalog not initialized for this environment (e.g., a KnowledgeBase created before catalogs existed).
+            # Don't create one now, since it would be incomplete anyway.
+            return
+        my_trace                            = parent_trace.doing("Recording manifest in catalog",
+                                                                    data = {"relative_path": str(relative_path)})
+        row                                 = self._row(my_trace, relative_path, manifest_dict)
+        if row == None:
+            return
+        with self._connect(my_trace) as connection:
+            with connection:
+                connection.execute(ManifestCatalog._INSERT, row)
+
+    def import_entries(self, parent_trace, source_catalog, relative_path_list):
+        '''
+        Used when manifest files are copied from the manifests area of `source_catalog` to the manifests area
+        of self (for example, when a transaction is committed).
+
+        Copies the catalog entries for the manifests in `relative_path_list` from `source_catalog`, refreshing file
+        sizes and modification times to those of the copies. This avoids re-parsing the YAML of the copied manifests.
+
+        @param source_catalog A ManifestCatalog object
+        @param relative_path_list A list of strings, corresponding to relative paths (under the manifests area)
+                    of the manifests that were copied
+        '''
+        if not self.exists() or len(relative_path_list) == 0:
+            return
+
+        source_rows                         = {}
+        if source_catalog.exists():
+            with source_catalog._connect(parent_trace) as connection:
+                for relative_path in relative_path_list:
+                    row                     = connection.execute("SELECT * FROM manifests WHERE relative_path = ?",
+                                                                    (relative_path,)).fetchone()
+                    if row != None:
+                        source_rows[relative_path] = row
+
+        rows                                = []
+        for relative_path in relative_path_list:
+            if relative_path in source_rows.keys():
+                stat                        = _os.stat(self._manifests_rootdir + "/" + relative_path)
+                row                         = source_rows[relative_path]
+                rows.append(row[:6] + (stat.st_size, stat.st_mtime_ns, row[8]))
+            else:
+                # Source catalog did not know about this manifest, so we must parse it
+                loop_trace                  = parent_trace.doing("Loading manifest not found in source catalog",
+                                                                    data = {"relative_path": str(relative_path)})
+                manifest_dict               = YAML_Utils().load(loop_trace,
+                                                                path = self._manifests_rootdir + "/" + relative_path)
+                row                         = self._row(loop_trace, relative_path, manifest_dict)
+                if row != None:
+                    rows.append(row)
+
+        with self._connect(parent_trace) as connection:
+            with connection:
+                connection.executemany(ManifestCatalog._INSERT, rows)
+
+    def forget(self, parent_trace, relative_path):
+        '''
+        Removes the catalog entry for `relative_path`, if any. Used when a manifest is deleted.
+        '''
+        if not self.exists():
+            return
+        with self._connect(parent_trace) as connection:
+            with connection:
+                connection.execute("DELETE FROM manifests WHERE relative_path = ?", (relative_path,))
+
+    def _validated(self, parent_trace, rows):
+        '''
+        Helper method that checks that catalog entries in `rows` are consistent with the file system.
+
+        Returns the list of relative paths in `rows`, or None if any of the files is missing, in which case
+        the catalog is flagged as incomplete.
+
+        If a file has been modified since it was catalogued (e.g., another process overwrote it), then its
+        catalog entry is refreshed.
+        '''
+        relative_paths                      = []
+        for row in rows:
+            relative_path, size, mtime_ns   = row
+            full_path                       = self._manifests_rootdir + "/" + relative_path
+            try:
+                stat                        = _os.stat(full_path)
+            except FileNotFoundError:
+                self.mark_incomplete(parent_trace)
+                return None
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                loop_trace                  = parent_trace.doing("Refreshing stale catalog entry",
+                                                                    data = {"relative_path": str(relative_path)})
+                manifest_dict               = YAML_Utils().load(loop_trace, path = full_path, use_cache = False)
+                self.record(loop_trace, relative_path, manifest_dict)
+            relative_paths.append(relative_path)
+        return relative_paths
+
+    def _ensure_built(self, parent_trace):
+        '''
+        Helper method called by lookups. If the catalog does not exist yet or has been flagged as incomplete, it is
+        (re)built by scanning the manifests area, so that this and later lookups can be answered by the catalog
+        '''
+        if not self.is_complete(parent_trace):
+            my_trace                        = parent_trace.doing("Building manifest catalog on first use",
+                                                                    data = {"catalog path": str(self._catalog_path)})
+            self.rebuild(my_trace)
+
+    def findLatest(self, parent_trace, namespace, name, kind):
+        '''
+        Returns a list of relative paths for the manifests of highest version in the folder for `namespace` and
+        `name`, and of the given `kind`. Normally the list has at most 1 element.
+
+        Returns None if the catalog can't be trusted to answer.
+        '''
+        self._ensure_built(parent_trace)
+        with self._connect(parent_trace) as connection:
+            rows                            = connection.execute(
+                                                    "SELECT relative_path, size, mtime_ns FROM manifests "
+                                                    + "WHERE namespace = ? AND name = ? AND kind = ? AND version = "
+                                                    + "(SELECT MAX(version) FROM manifests WHERE namespace = ? AND name = ? AND kind = ?)",
+                                                    (namespace, name, kind, namespace, name, kind)).fetchall()
+        return self._validated(parent_trace, rows)
+
+    def find(self, parent_trace, manifest_api, namespace, name, kind, version):
+        '''
+        Returns a list of relative paths for the manifests that match all the parameters.
+        Normally the list has at most 1 element.
+
+        Returns None if the catalog can't be trusted to answer.
+        '''
+        self._ensure_built(parent_trace)
+        with self._connect(parent_trace) as connection:
+            rows                            = connection.execute(
+                                                    "SELECT relative_path, size, mtime_ns FROM manifests "
+                                                    + "WHERE namespace = ? AND name = ? AND kind = ? AND version = ? "
+                                                    + "AND manifest_api = ?",
+                                                    (namespace, name, kind, version, manifest_api)).fetchall()
+        return self._validated(parent_trace, rows)
+
+    def findByKinds(self, parent_trace, kinds_of_interest):
+        '''
+        Returns a list of relative paths for all manifests whose kind is in the list `kinds_of_interest`,
+        sorted by relative path.
+
+        Returns None if the catalog can't be trusted to answer.
+        '''
+        self._ensure_built(parent_trace)
+        kinds                               = list(kinds_of_interest)
+        if len(kinds) == 0:
+            return []
+        with self._connect(parent_trace) as connection:
+            rows                            = connection.execute(
+                                                    "SELECT relative_path, size, mtime_ns FROM manifests "
+                                                    + "WHERE kind IN (" + ", ".join(["?"] * len(kinds)) + ") "
+                                                    + "ORDER BY relative_path",
+                                                    kinds).fetchall()
+        return self._validated(parent_trace, rows)
+
+    def rebuild(self, parent_trace):
+        '''
+        Discards any existing content in the catalog and re-creates it by scanning the manifests area.
+        Upon completion the catalog is flagged as complete.
+
+        Returns an int, corresponding to the number of manifests catalogued.
+        '''
+        rows                                = []
+        for currentdir, dirs, files in _os.walk(self._manifests_rootdir):
+            for a_file in sorted(files):
+                full_path                   = _os.path.join(currentdir, a_file)
+                relative_path               = _os.path.relpath(full_path, self._manifests_rootdir).replace("\\", "/")
+                if self._parse_relative_path(relative_path) == None:
+                    continue
+                loop_trace                  = parent_trace.doing("Cataloguing manifest",
+                                                                    data = {"relative_path": str(relative_path)})
+                manifest_dict               = YAML_Utils().load(loop_trace, path = full_path, use_cache = False)
+                rows.append(self._row(loop_trace, relative_path, manifest_dict))
+
+        with self._connect(parent_trace) as connection:
+            with connection:
+                connection.execute("DELETE FROM manifests")
+                connection.executemany(ManifestCatalog._INSERT, rows)
+                self._set_complete(connection, True)
+
+        return len(rows)
+
+class _CachedConnection():
+    '''
+    Helper class for ManifestCatalog: a SQLite connection to a catalog file, kept open for reuse, together with the
+    lock that threads must hold while using it and what is needed to tell if it is stale.
+
+    @param catalog_path A string, for the path of the catalog file. It is created if it does not exist.
+    @param schema A list of SQL statements to create the catalog's tables and indexes if they don't exist
+    '''
+    def __init__(self, catalog_path, schema):
+        self.catalog_path                   = catalog_path
+        self.connection                     = _sqlite3.connect(catalog_path, check_same_thread = False)
+        for statement in schema:
+            self.connection.execute(statement)
+        self.connection.commit()
+        self.lock                           = _threading.RLock()
+        self.pid                            = _os.getpid()
+        # Keep a descriptor of our own on the catalog file. While it is open the file's inode can't be reused, so 
+        # comparing it to the inode at catalog_path reliably tells whether the file was removed or replaced
+        self._fd                            = _os.open(catalog_path, _os.O_RDONLY)
+
+    def is_valid(self):
+        '''
+        Returns False if this connection was opened by another process, or if the catalog file has since been removed
+        or replaced, in which case the connection must not be used
+        '''
+        if self.pid != _os.getpid():
+            return False
+        try:
+            return _os.path.samestat(_os.fstat(self._fd), _os.stat(self.catalog_path))
+        except FileNotFoundError:
+            return False
+
+    def close(self):
+        '''
+        Closes the connection, unless it belongs to another process (in which case only that process may close it)
+        '''
+        if self.pid == _os.getpid():
+            with self.lock:
+                self.connection.close()
+                _os.close(self._fd)
@@ -0,0 +1,127 @@
+import pickle                                           as _pickle
+
+from apodeixi.util.a6i_error                            import ApodeixiError
+
+from apodeixi.knowledge_base.knowledge_base_store       import KnowledgeBaseStore
+from apodeixi.knowledge_base.isolation_kb_store         import Isolation_KBStore_Impl
+
+class ReadTracking_KBStore(KnowledgeBaseStore):
+    '''
+    KnowledgeBaseStore used when a posting is built in a worker process, as part of posting in parallel.
+
+    It delegates to the same implementation as a normal KnowledgeBaseStore, but it records which manifests were
+    read. That way the KnowledgeBase can later tell whether the manifests built by the worker might depend on
+    manifests written by an earlier posting in the same batch, in which case the worker's output can't be trusted
+    and the posting has to be re-processed serially.
+
+    Manifests are recorded as (namespace, name) pairs in `self.reads`. Reads that can't be narrowed down to a
+    particular manifest (e.g., searches or foreign key constraints) are recorded as ReadTracking_KBStore.ANY
+    '''
+    def __init__(self, parent_trace, impl):
+        super().__init__(parent_trace, impl)
+        self.reads          = set()
+
+    ANY                     = "*"
+
+    def getForeignKeyConstraints(self, parent_trace):
+        self.reads.add(ReadTracking_KBStore.ANY)
+        return super().getForeignKeyConstraints(parent_trace)
+
+    def retrievePreviousManifest(self, parent_trace, manifest_dict):
+        metadata            = manifest_dict['metadata']
+        self.reads.add((metadata['namespace'], metadata['name']))
+        return super().retrievePreviousManifest(parent_trace, manifest_dict)
+
+    def retrieveManifest(self, parent_trace, manifest_handle):
+        self.reads.add((manifest_handle.namespace, manifest_handle.name))
+        return super().retrieveManifest(parent_trace, manifest_handle)
+
+    def findLatestVersionManifest(self, parent_trace, manifest_api_name, namespace, name, kind):
+        self.reads.add((namespace, name))
+        return super().findLatestVersionManifest(parent_trace, manifest_api_name, namespace, name, kind)
+
+    def searchManifests(self, parent_trace, kinds_of_interest, manifest_filter):
+        self.reads.add(ReadTracking_KBStore.ANY)
+        return super().searchManifests(parent_trace, kinds_of_interest, manifest_filter)
+
+class PostingBuild():
+    '''
+    Outcome of building a posting (i.e., parsing its Excel and creating the manifests, but without persisting
+    anything) in a worker process.
+
+    @param label_handle The PostingLabelHandle that was built. It may differ from the one submitted to the worker
+                    if its filing coordinates had to be inferred.
+    @param controller The PostingController that built the posting, or None if there was an error.
+    @param all_manifests_dicts The dictionary of manifest dictionaries built by the controller, or None if there
+                    was an error.
+    @param label The PostingLabel parsed by the controller, or None if there was an error.
+    @param error The ApodeixiError raised while building the posting, or None if there was no error.
+    @param dependencies A set of (namespace, name) pairs for all manifests read or built by the worker. May
+                    include ReadTracking_KBStore.ANY if the worker did reads that can't be narrowed down to particular
+                    manifests.
+    '''
+    def __init__(self, label_handle, controller, all_manifests_dicts, label, error, dependencies):
+        self.label_handle           = label_handle
+        self.controller             = controller
+        self.all_manifests_dicts    = all_manifests_dicts
+        self.label                  = label
+        self.error                  = error
+        self.dependencies           = dependencies
+
+    def dependsOn(self, written_manifests):
+        '''
+        Returns a boolean, stating whether this build might have been affected by writes to any of the manifests
+        in `written_manifests`, a set of (namespace, name) pairs.
+        '''
+        if len(written_manifests) == 0:
+            return False
+        if ReadTracking_KBStore.ANY in self.dependencies:
+            return True
+        return len(self.dependencies.intersection(written_manifests)) > 0
+
+def build_posting_in_worker(pickled_kb, parent_trace, label_handle):
+    '''
+    Entry point for worker processes when the KnowledgeBase posts in parallel. It mirrors what
+    KnowledgeBase.postByLabel does before anything is persisted, using the same FunctionalTraces so that any
+    errors are reported exactly as they would be when posting serially.
+
+    Returns a PostingBuild.
+
+    @param pickled_kb The bytes for the pickled KnowledgeBase, snapshotted by the parent process before it
+                started persisting anything. If its store supports transactions, the snapshot is in the midst of the
+                transaction that the parent process opened for the whole batch. The worker reads from that 
+                transaction's environment through a read-only store, so that it never creates, changes or removes 
+                anything that the parent process or other workers use. Reads that miss in that environment fail over
+                to its parent environment, as they would in the transaction the parent process opens for the posting.
+    '''
+    kb                          = _pickle.loads(pickled_kb)
+    store                       = ReadTracking_KBStore(parent_trace, kb.store._impl)
+    kb.store                    = store
+    if issubclass(type(store._impl), Isolation_KBStore_Impl):
+        store._impl.makeReadOnly(parent_trace)
+
+    try:
+        my_trace                = parent_trace.doing("Posting by label",
+                                            data = {'relativePath': label_handle.getRelativePath(parent_trace)})
+
+        posting_api             = label_handle.getPostingAPI(my_trace)
+
+        ctrl                    = kb.findController(    parent_trace        = my_trace,
+                                                        posting_api         = posting_api)
+        ctrl.init_link_table(parent_trace)
+        my_trace                = parent_trace.doing("Applying controller to process the posting")
+        all_manifests_dicts, label  = ctrl.buildPosting(    parent_trace            = my_trace,
+                                                            posting_label_handle    = label_handle)
+        error                   = None
+        dependencies            = set([(m['metadata']['namespace'], m['metadata']['name'])
+                                                for m in all_manifests_dicts.values()])
+    except ApodeixiError as ex:
+        ctrl, all_manifests_dicts, label, error = None, None, None, ex
+        dependencies            = set()
+
+    dependencies                = dependencies.union(store.reads)
+
+    # The parent process will re-attach its own store implementation, so don't send ours back
+    store.unbind(parent_trace)
+
+    return PostingBuild(label_handle, ctrl, all_manifests_dicts, label, error, dependencies)
@@ -1,11 +1,13 @@
 import os                                                   as _os
 
 from apodeixi.knowledge_base.isolation_kb_store             import Isolation_KBStore_Impl
+from apodeixi.knowledge_base.filing_coordinates             import TBD_FilingCoordinates
 from apodeixi.knowledge_base.manifest_utils                 import ManifestUtils
 
 from apodeixi.util.a6i_error                                import ApodeixiError
-from apodeixi.util.path_utils                               import PathUtils
+from apodeixi.util.path_utils                               import PathUtils, FileTransferBatch
 from apodeixi.util.rollover_utils                           import RolloverUtils
+from apodeixi.util.yaml_utils                               import YAML_Utils
 
 class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
     '''
@@ -28,10 +30,54 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
                             generated forms or reports requested by end-users. This is a "root folder" in that
                             the structure below will be assumed to follow the filing structure of the
                             KnowledgeBase for postings.
+    @param manifest_sidecars A boolean. If True, each persisted manifest also gets a binary sidecar file
+                            next to its YAML file, which speeds up subsequent retrievals.
+    @param posting_cache Optional ExcelRangeCache, in which to cache data read from postings' Excel files.
+
+    Files are transferred across environments without copying their bytes whenever possible: when committing
+    a transaction they are moved, and when failing over reads to a parent environment manifests are hard-linked
+    (postings are copied, since their Excel files may be modified in place). Refer to FileTransferBatch. In overlay environments reads that fail over are not brought into the current
+    environment at all, and a posting is only brought in right before it is archived (i.e., copy-on-write).
     '''
-    def __init__(self, parent_trace, kb_rootdir, clientURL):
+    def __init__(self, parent_trace, kb_rootdir, clientURL, manifest_sidecars=False, posting_cache=None):
 
-        super().__init__(parent_trace, kb_rootdir, clientURL)
+        super().__init__(parent_trace, kb_rootdir, clientURL, manifest_sidecars, posting_cache)
+
+        self._file_transfer_stats       = FileTransferBatch.empty_stats()
+
+    def fileTransferStats(self, parent_trace):
+        '''
+        Returns a dictionary with cumulative statistics on how files were transferred across environments by this
+        store: how many were moved, hard-linked or copied, and how many bytes were not copied thanks to moving or
+        linking.
+        '''
+        return dict(self._file_transfer_stats)
+
+    def _transfer_files(self, parent_trace, batch):
+        '''
+        Helper method to run a FileTransferBatch and accumulate its statistics
+        '''
+        stats                           = batch.run(parent_trace)
+        for key in stats.keys():
+            self._file_transfer_stats[key] += stats[key]
+
+    def _link_file(self, parent_trace, from_path, to_dir):
+        '''
+        Helper method to bring a file from a parent environment into the current one, when reads fail over
+        '''
+        batch                           = FileTransferBatch(move = False)
+        batch.add(from_path, to_dir)
+        self._transfer_files(parent_trace, batch)
+
+    def _copy_on_read_miss(self, parent_trace):
+        '''
+        Returns a boolean, stating whether data found in the parent environment after a read miss should be brought
+        into the current environment. That is not the case for overlay environments, which only hold what was
+        written to them, nor for read-only stores. Refer to KB_Environment_Config and to self.makeReadOnly.
+        '''
+        if self._read_only:
+            return False
+        return not self.current_environment(parent_trace).config(parent_trace).overlay
 
     def beginTransaction(self, parent_trace):
         '''
@@ -78,12 +124,13 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
         ending_env                  = self._transactions_stack[-1]
         events                      = self._transaction_events_dict[ending_env.name(parent_trace)]
 
+        # The transaction's environment is removed at the end of the commit, so we can move its files instead
+        # of copying them
+        batch                       = FileTransferBatch(move = True)
         for relative_path in events.posting_writes():
             from_path               = src_postings_root + "/" + relative_path
             to_path                 = dst_postings_root + "/" + relative_path
-            to_dir                  = _os.path.dirname(to_path)
-            PathUtils().create_path_if_needed(parent_trace, to_dir)
-            PathUtils().copy_file(parent_trace, from_path, to_dir)
+            batch.add(from_path, _os.path.dirname(to_path))
 
             if parent_events != None:
                 parent_events.remember_posting_write(relative_path)
@@ -91,9 +138,10 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
         for relative_path in events.manifest_writes():
             from_path               = src_manifests_root + "/" + relative_path
             to_path                 = dst_manifests_root + "/" + relative_path
-            to_dir                  = _os.path.dirname(to_path)
-            PathUtils().create_path_if_needed(parent_trace, to_dir)
-            PathUtils().copy_file(parent_trace, from_path, to_dir)
+            batch.add(from_path, _os.path.dirname(to_path))
+            sidecar_path            = YAML_Utils().sidecar_path(from_path)
+            if _os.path.isfile(sidecar_path):
+                batch.add(sidecar_path, _os.path.dirname(to_path))
 
             if parent_events != None:
                 parent_events.remember_manifest_write(relative_path)
@@ -106,13 +154,20 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
             # the file when the two paths are different
             if not _os.path.samefile(from_path, to_path):
             #if from_path != to_path: 
-                to_dir                  = _os.path.dirname(to_path)
-                PathUtils().create_path_if_needed(parent_trace, to_dir)
-                PathUtils().copy_file(parent_trace, from_path, to_dir)
+                batch.add(from_path, _os.path.dirname(to_path))
 
                 if parent_events != None:
                     parent_events.remember_clientURL_write(relative_path)
 
+        self._transfer_files(parent_trace, batch)
+
+        # Keep the parent's manifest catalog in sync with the manifests we just transferred, re-using the 
+        # transaction's catalog entries so that we don't have to parse the transferred manifests again
+        parent_catalog              = self.manifestCatalog(parent_trace, environment = parent_env)
+        parent_catalog.import_entries(  parent_trace, 
+                                        source_catalog      = self.manifestCatalog(parent_trace, environment = env), 
+                                        relative_path_list  = events.manifest_writes())
+
         for relative_path in events.posting_deletes():
             to_path                 = dst_postings_root + "/" + relative_path
             if 0 == PathUtils().remove_file_if_exists(parent_trace, to_path):
@@ -121,6 +176,8 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
 
         for relative_path in events.manifest_deletes():
             to_path                 = dst_manifests_root + "/" + relative_path
+            parent_catalog.forget(parent_trace, relative_path)
+            PathUtils().remove_file_if_exists(parent_trace, YAML_Utils().sidecar_path(to_path))
             if 0 == PathUtils().remove_file_if_exists(parent_trace, to_path):
                 if parent_events != None:
                     parent_events.remember_manifest_deletes(relative_path)
@@ -131,17 +188,11 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
                 if parent_events != None:
                     parent_events.remember_clientURL_deletes(relative_path)
 
-        # Last but not least: persist foreign key constraints and copy them to the
+        # Last but not least: persist foreign key constraints and carry them over to the
         # parent environment
         # 
         self.persistForeignKeyConstraints(parent_trace)
-
-        version                             = 1
-        FOREIGN_KEY_FILE                    = "foreign_key_contraints." + str(version) + ".yaml"
-        from_path               = src_manifests_root + "/system/" + FOREIGN_KEY_FILE
-        to_dir                 = dst_manifests_root + "/system/"
-        PathUtils().create_path_if_needed(parent_trace, to_dir)
-        PathUtils().copy_file(parent_trace, from_path, to_dir)
+        self._commitForeignKeyConstraints(parent_trace, env, parent_env)
       
 
         # Now remove the environment of the transaction we just committed
@@ -156,6 +207,32 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
         ending_env                  = self._transactions_stack.pop()
         events                      = self._transaction_events_dict.pop(ending_env.name(parent_trace))
 
+    def _commitForeignKeyConstraints(self, parent_trace, env, parent_env):
+        '''
+        Helper method used when committing the transaction whose environment is `env`, to carry over its persisted
+        foreign key constraints to the `parent_env`.
+
+        Normally the transaction's environment only has a log of the constraints registered during the transaction, which
+        is then appended to the parent's log. If it has a snapshot, then the transaction's files replace the parent's.
+        '''
+        src_snapshot, src_log               = self._foreignKeyConstraintsPaths(parent_trace, env)
+        dst_snapshot, dst_log               = self._foreignKeyConstraintsPaths(parent_trace, parent_env)
+        if _os.path.isfile(src_snapshot):
+            if not _os.path.isfile(src_log):
+                PathUtils().remove_file_if_exists(parent_trace, dst_log)
+            batch                           = FileTransferBatch(move = True)
+            for from_path in [src_snapshot, src_log]:
+                if _os.path.isfile(from_path):
+                    batch.add(from_path, _os.path.dirname(dst_snapshot))
+            self._transfer_files(parent_trace, batch)
+        elif _os.path.isfile(src_log):
+            my_trace                        = parent_trace.doing("Appending foreign key constraints to parent environment's log")
+            PathUtils().create_path_if_needed(parent_trace=my_trace, path=_os.path.dirname(dst_log))
+            for delta_dict in YAML_Utils().load_all(my_trace, path = src_log):
+                YAML_Utils().append(my_trace, data_dict = delta_dict, path = dst_log)
+            PathUtils().remove_file_if_exists(my_trace, src_log)
+            self._compactForeignKeyConstraints(my_trace, parent_env)
+
     def abortTransaction(self, parent_trace):
         '''
         Aborts a transaction previously started by beginTransaction, by deleting transaction's isolation area,
@@ -191,9 +268,7 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
         my_trace                    = parent_trace.doing("Copying a posting file",
                                         data = {"src_path":     from_path,
                                                 "to_dir":       to_dir})
-        if not _os.path.exists(to_dir):
-            PathUtils().create_path_if_needed(parent_trace=my_trace, path=to_dir)
-        PathUtils().copy_file(parent_trace, from_path, to_dir)
+        self._link_file(my_trace, from_path, to_dir)
 
     def _file_not_found_error(self, ex):
         '''
@@ -216,17 +291,16 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
             # Try again in parent environment if failover is configured and error is a missing file
             if self._file_not_found_error(ex) and self._failover_posting_reads_to_parent(parent_trace):
                 my_trace                = parent_trace.doing("Searching in parent environment")
-                # Temporarily switch to the environment in which to search
+                # Search in the parent environment, seen as current only by this thread
                 original_env            = self.current_environment(my_trace)
-                self.activate(my_trace, self.parent_environment(my_trace).name(my_trace))
-                label_df                = self.loadPostingLabel(
-                                                    parent_trace                = my_trace,
-                                                    posting_label_handle        = posting_label_handle)
-                # Now that search in parent environment is done, reset back to original environment
-                self.activate(my_trace, original_env.name(my_trace))
+                with self._reading_from_environment(my_trace, self.parent_environment(my_trace)):
+                    label_df                = self.loadPostingLabel(
+                                                        parent_trace                = my_trace,
+                                                        posting_label_handle        = posting_label_handle)
                 # Before leaving, copy the parent's data into our environment, so next time 
                 # we don't have to failover again
-                self.copy_posting_across_environments(  
+                if self._copy_on_read_miss(my_trace):
+                    self.copy_posting_across_environments(  
                                                 parent_trace        = my_trace, 
                                                 handle              = posting_label_handle, 
                                                 from_environment    = self.parent_environment(my_trace), 
@@ -248,18 +322,17 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
             # Try again in parent environment if failover is configured and error is a missing file
             if self._file_not_found_error(ex) and self._failover_posting_reads_to_parent(parent_trace):
                 my_trace                = parent_trace.doing("Searching in parent environment")
-                # Temporarily switch to the environment in which to search
+                # Search in the parent environment, seen as current only by this thread
                 original_env            = self.current_environment(my_trace)
-                self.activate(my_trace, self.parent_environment(my_trace).name(my_trace))
-                df                      = self.loadPostingData(
-                                                    parent_trace        = my_trace,
-                                                    data_handle         = data_handle,
-                                                    config              = config)
-                # Now that search in parent environment is done, reset back to original environment
-                self.activate(my_trace, original_env.name(my_trace))
+                with self._reading_from_environment(my_trace, self.parent_environment(my_trace)):
+                    df                      = self.loadPostingData(
+                                                        parent_trace        = my_trace,
+                                                        data_handle         = data_handle,
+                                                        config              = config)
                 # Before leaving, copy the parent's data into our environment, so next time 
                 # we don't have to failover again
-                self.copy_posting_across_environments(  
+                if self._copy_on_read_miss(my_trace):
+                    self.copy_posting_across_environments(  
                                                 parent_trace        = my_trace, 
                                                 handle              = data_handle, 
                                                 from_environment    = self.parent_environment(my_trace), 
@@ -290,29 +363,30 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
             # Search in parent first, and copy anything found to the current environment
 
             my_trace                = parent_trace.doing("Searching in parent environment")
-            # Temporarily switch to the environment in which to search
+            # Search in the parent environment, seen as current only by this thread
             original_env            = self.current_environment(my_trace)
-            self.activate(my_trace, self.parent_environment(my_trace).name(my_trace))
-            parent_handles          = self.searchPostings(
-                                                parent_trace                = my_trace,
-                                                posting_api                 = posting_api,
-                                                filing_coordinates_filter   = filing_coordinates_filter)
-            # Now that search in parent environment is done, reset back to original environment
-            self.activate(my_trace, original_env.name(my_trace))
+            with self._reading_from_environment(my_trace, self.parent_environment(my_trace)):
+                parent_handles          = self.searchPostings(
+                                                    parent_trace                = my_trace,
+                                                    posting_api                 = posting_api,
+                                                    filing_coordinates_filter   = filing_coordinates_filter)
 
             # Populate current environment with anything found in the parent environment, but only if it is not
             # already in current environment
-            my_trace                = parent_trace.doing("Copying postings from parent environment",
+            if self._copy_on_read_miss(my_trace):
+                my_trace            = parent_trace.doing("Copying postings from parent environment",
                                                 data = {"parent environment name":  
                                                                     self.parent_environment(my_trace).name(my_trace),
                                                         "current environment name":     
                                                                     self.current_environment(my_trace).name(my_trace)})
-            for handle in parent_handles:
-                self.copy_posting_across_environments(  
+                for handle in parent_handles:
+                    self.copy_posting_across_environments(  
                                                 parent_trace        = my_trace, 
                                                 handle              = handle, 
                                                 from_environment    = self.parent_environment(my_trace), 
                                                 to_environment      = self.current_environment(my_trace))
+        else:
+            parent_handles          = []
 
         my_trace                = parent_trace.doing("Searching in environment '" 
                                                         + str(self.current_environment(parent_trace).name(parent_trace)) 
@@ -321,6 +395,13 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
                                                 parent_trace                = my_trace, 
                                                 posting_api                 = posting_api, 
                                                 filing_coordinates_filter   = filing_coordinates_filter)
+
+        if not self._copy_on_read_miss(my_trace):
+            # Overlay environment, so the parent's postings were not copied. Merge them in, unless the current
+            # environment has its own version of the posting
+            scanned_paths           = set([handle.getRelativePath(my_trace) for handle in scanned_handles])
+            scanned_handles         = scanned_handles + [handle for handle in parent_handles
+                                                            if not handle.getRelativePath(my_trace) in scanned_paths]
         return scanned_handles
 
     def persistManifest(self, parent_trace, manifest_dict):
@@ -400,18 +481,16 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
                 # Search in parent first, and copy anything found to the current environment
 
                 my_trace                = parent_trace.doing("Searching in parent environment")
-                # Temporarily switch to the parent environment, and try again
+                # Try again in the parent environment, seen as current only by this thread
                 original_env            = self.current_environment(my_trace)
-                self.activate(my_trace, self.parent_environment(my_trace).name(my_trace))
+                with self._reading_from_environment(my_trace, self.parent_environment(my_trace)):
 
-                manifest, manifest_path = self.findLatestVersionManifest(my_trace, manifest_api_name, 
-                                                                                namespace, name, kind)
-                # Now that search in parent environment is done, reset back to original environment
-                self.activate(my_trace, original_env.name(my_trace))
+                    manifest, manifest_path = self.findLatestVersionManifest(my_trace, manifest_api_name, 
+                                                                                    namespace, name, kind)
 
                 # Populate current environment with anything found in the parent environment, but only if it is not
                 # already in current environment
-                if manifest != None:
+                if manifest != None and self._copy_on_read_miss(my_trace):
                     my_trace            = parent_trace.doing("Copying manifest from parent environment",
                                                     data = {"parent environment name":  
                                                                         self.parent_environment(my_trace).name(my_trace),
@@ -422,12 +501,10 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
                     from_path           = manifest_path
                     to_dir              = self.current_environment(my_trace).postingsURL(parent_trace) 
 
-                    if not _os.path.exists(to_dir):
-                        my_trace                    = parent_trace.doing("Copying a manifest file",
-                                                        data = {"src_path":     from_path,
-                                                                "to_dir":       to_dir})
-                        PathUtils().create_path_if_needed(parent_trace=my_trace, path=to_dir)
-                    PathUtils().copy_file(parent_trace, from_path, to_dir)
+                    my_trace            = parent_trace.doing("Copying a manifest file",
+                                                    data = {"src_path":     from_path,
+                                                            "to_dir":       to_dir})
+                    self._link_file(my_trace, from_path, to_dir)
 
         return manifest, manifest_path
 
@@ -512,17 +589,15 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
                 # Search in parent first, and copy anything found to the current environment
 
                 my_trace                = parent_trace.doing("Searching in parent environment")
-                # Temporarily switch to the parent environment, and try again
+                # Try again in the parent environment, seen as current only by this thread
                 original_env            = self.current_environment(my_trace)
-                self.activate(my_trace, self.parent_environment(my_trace).name(my_trace))
+                with self._reading_from_environment(my_trace, self.parent_environment(my_trace)):
 
-                manifest, manifest_path = self.retrieveManifest(my_trace, manifest_handle)
-                # Now that search in parent environment is done, reset back to original environment
-                self.activate(my_trace, original_env.name(my_trace))
+                    manifest, manifest_path = self.retrieveManifest(my_trace, manifest_handle)
 
                 # Populate current environment with anything found in the parent environment, but only if it is not
                 # already in current environment
-                if manifest != None:
+                if manifest != None and self._copy_on_read_miss(my_trace):
                     my_trace            = parent_trace.doing("Copying manifest from parent environment",
                                                     data = {"parent environment name":  
                                                                         self.parent_environment(my_trace).name(my_trace),
@@ -533,12 +608,10 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
                     from_path           = manifest_path
                     to_dir              = self.current_environment(my_trace).postingsURL(parent_trace) 
 
-                    if not _os.path.exists(to_dir):
-                        my_trace                    = parent_trace.doing("Copying a manifest file",
-                                                        data = {"src_path":     from_path,
-                                                                "to_dir":       to_dir})
-                        PathUtils().create_path_if_needed(parent_trace=my_trace, path=to_dir)
-                    PathUtils().copy_file(parent_trace, from_path, to_dir)
+                    my_trace            = parent_trace.doing("Copying a manifest file",
+                                                    data = {"src_path":     from_path,
+                                                            "to_dir":       to_dir})
+                    self._link_file(my_trace, from_path, to_dir)
 
 
         return manifest, manifest_path
@@ -561,17 +634,21 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
                 # Search in parent first, and copy anything found to the current environment
 
                 my_trace                = parent_trace.doing("Searching in parent environment")
-                # Temporarily switch to the parent environment, and try again
+                # Try again in the parent environment, seen as current only by this thread
                 original_env            = self.current_environment(my_trace)
-                self.activate(my_trace, self.parent_environment(my_trace).name(my_trace))
+                with self._reading_from_environment(my_trace, self.parent_environment(my_trace)):
 
-                foreign_key_constraints, path = self.loadForeignKeyConstraints(my_trace)
-                # Now that search in parent environment is done, reset back to original environment
-                self.activate(my_trace, original_env.name(my_trace))
+                    foreign_key_constraints, path = self.loadForeignKeyConstraints(my_trace)
+
+                # The current environment may have a log of constraints registered on top of the parent's
+                snapshot_path, log_path = self._foreignKeyConstraintsPaths(my_trace)
+                if _os.path.isfile(log_path):
+                    foreign_key_constraints = self._readForeignKeyConstraints(my_trace, original_env,
+                                                                                registry = foreign_key_constraints)
 
                 # Populate current environment with anything found in the parent environment, but only if it is not
                 # already in current environment
-                if foreign_key_constraints != None:
+                if foreign_key_constraints != None and self._copy_on_read_miss(my_trace) and _os.path.isfile(path):
                     my_trace            = parent_trace.doing("Copying foreign key constraints from parent environment",
                                                     data = {"parent environment name":  
                                                                         self.parent_environment(my_trace).name(my_trace),
@@ -582,22 +659,57 @@ class Shutil_KBStore_Impl(Isolation_KBStore_Impl):
                     from_path           = path
                     to_dir              = self.current_environment(my_trace).postingsURL(parent_trace) 
 
-                    if not _os.path.exists(to_dir):
-                        my_trace                    = parent_trace.doing("Copying a manifest file",
-                                                        data = {"src_path":     from_path,
-                                                                "to_dir":       to_dir})
-                        PathUtils().create_path_if_needed(parent_trace=my_trace, path=to_dir)
-                    PathUtils().copy_file(parent_trace, from_path, to_dir)
+                    my_trace            = parent_trace.doing("Copying a manifest file",
+                                                    data = {"src_path":     from_path,
+                                                            "to_dir":       to_dir})
+                    self._link_file(my_trace, from_path, to_dir)
 
 
         return foreign_key_constraints, path
 
+    def _materialize_posting(self, parent_trace, handle):
+        '''
+        Helper method used by overlay environments right before a posting is modified. If the posting denoted by
+        the `handle` is not in the current environment, it is brought in (copied, refer to FileTransferBatch) from the
+        closest ancestor environment that has it and that reads would fail over to.
+        '''
+        if type(handle.filing_coords) == TBD_FilingCoordinates: # Posting is not in the postings area
+            return
+        relative_path               = handle.getRelativePath(parent_trace)
+        original_env                = self.current_environment(parent_trace)
+        if _os.path.exists(original_env.postingsURL(parent_trace) + "/" + relative_path):
+            return
+
+        my_trace                    = parent_trace.doing("Searching posting in ancestor environments",
+                                                            data = {"relative_path": relative_path})
+        def _search_ancestors():
+            if not self._failover_posting_reads_to_parent(my_trace):
+                return None
+            with self._reading_from_environment(my_trace, self.parent_environment(my_trace)):
+                env                     = self.current_environment(my_trace)
+                if _os.path.exists(env.postingsURL(my_trace) + "/" + relative_path):
+                    return env
+                return _search_ancestors()
+
+        source_env                  = _search_ancestors()
+
+        if source_env != None:
+            self.copy_posting_across_environments(  parent_trace        = my_trace, 
+                                                    handle              = handle, 
+                                                    from_environment    = source_env, 
+                                                    to_environment      = original_env)
+
     def archivePosting(self, parent_trace, posting_label_handle, subnamespace):
         '''
         Used after a posting Excel file has been processed. It moves the Excel file to a newly created folder dedicated 
         to this posting event and returns a PostingLabelHandle to identify the Excel file in this newly
         created archival folder.       
         '''
+        if not self._copy_on_read_miss(parent_trace):
+            # Archiving moves the posting within the postings area, so in an overlay environment we need to first
+            # bring the posting into the current environment if it was only read from a parent environment
+            self._materialize_posting(parent_trace, posting_label_handle)
+
         archival_handle                     = super().archivePosting(parent_trace, posting_label_handle, subnamespace)
         
         return archival_handle
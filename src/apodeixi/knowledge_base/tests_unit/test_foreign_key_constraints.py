@@ -0,0 +1,122 @@
+import sys                                              as _sys
+import os                                               as _os
+
+from apodeixi.testing_framework.a6i_unit_test           import ApodeixiUnitTest
+from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
+from apodeixi.util.path_utils                           import PathUtils
+from apodeixi.util.yaml_utils                           import YAML_Utils
+
+from apodeixi.knowledge_base.isolation_kb_store         import Isolation_KBStore_Impl
+from apodeixi.knowledge_base.knowledge_base_store       import KnowledgeBaseStore
+from apodeixi.knowledge_base.knowledge_base_util        import ManifestHandle
+from apodeixi.knowledge_base.shutil_kb_store            import Shutil_KBStore_Impl
+from apodeixi.tree_relationships.foreign_key_constraints    import ForeignKeyConstraintEntries, ForeignKeyLink
+
+class Test_ForeignKeyConstraints(ApodeixiUnitTest):
+
+    def setUp(self):
+        super().setUp()
+
+    def test_foreign_key_persistence(self):
+
+        TEST_NAME                       = 'foreign_key_persistence'
+        MANIFEST_API                    = 'delivery-planning.journeys.a6i.io'
+        NAMESPACE                       = 'my-corp.production'
+        NAME                            = 'modernization.dec-2020.fusionopus.default'
+
+        try:
+            root_trace                  = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing foreign key constraints",
+                                                                        origination = {
+                                                                                'signaled_from' : __file__,
+                                                                                'concrete class': str(self.__class__.__name__)})
+
+            test_dir                    = self.output_data + "/" + TEST_NAME
+            PathUtils().remove_folder_if_exists(root_trace, test_dir)
+            PathUtils().create_path_if_needed(root_trace, test_dir + "/kb")
+            PathUtils().create_path_if_needed(root_trace, test_dir + "/collab")
+
+            store                       = KnowledgeBaseStore(root_trace, Shutil_KBStore_Impl(   parent_trace    = root_trace,
+                                                                                                kb_rootdir      = test_dir + "/kb",
+                                                                                                clientURL       = test_dir + "/collab"))
+            big_rock_dict               = YAML_Utils().load(root_trace,
+                                                            path = self.expected_data + "/posting_with_mock_store.big-rock.1.yaml")
+            system_dir                  = test_dir + "/kb/manifests/system"
+
+            def _handle(kind, version):
+                return ManifestHandle(manifest_api = MANIFEST_API, kind = kind, namespace = NAMESPACE, name = NAME,
+                                        version = version)
+
+            def _post_milestones(loop_trace, big_rock_version, milestones_version, uids_per_milestone):
+                store.beginTransaction(loop_trace)
+                entries                 = ForeignKeyConstraintEntries(loop_trace, _handle("big-rock", big_rock_version), store)
+                for milestone_uid in uids_per_milestone.keys():
+                    link                = ForeignKeyLink(   loop_trace, _handle("modernization-milestone", milestones_version),
+                                                            ["assertion", "milestone", milestone_uid, "big-rock"], store,
+                                                            referenced_uids = uids_per_milestone[milestone_uid])
+                    entries.addLink(loop_trace, link)
+                store.getForeignKeyConstraints(loop_trace).registerEntries(loop_trace, entries)
+                store.commitTransaction(loop_trace)
+
+            def _describe(loop_trace, description):
+                registry                = store.getForeignKeyConstraints(loop_trace)
+                result_txt              = "\n\n======== " + description + " ========"
+                result_txt              += "\nFiles:\t\t\t" + str(sorted(_os.listdir(system_dir)))
+                log_path                = system_dir + "/" + Isolation_KBStore_Impl.FOREIGN_KEY_LOG
+                if _os.path.isfile(log_path):
+                    result_txt          += "\nLog documents:\t\t" + str(len(YAML_Utils().load_all(loop_trace, log_path)))
+                for referenced_type, links_by_type in registry.latest_links.items():
+                    for referencing_type, (version, links) in links_by_type.items():
+                        result_txt      += "\nEnforced links:\t\t" + referencing_type.kind + " v" + str(version) + " -> " \
+                                            + referenced_type.kind + ": " + str([link.referenced_uids for link in links])
+                for removed_uids in [[], ["BR2"], ["BR4"]]:
+                    next_dict           = YAML_Utils().load(loop_trace,
+                                                    path = self.expected_data + "/posting_with_mock_store.big-rock.1.yaml")
+                    for uid in removed_uids:
+                        next_dict['assertion']['big-rock'].pop(uid)
+                        next_dict['assertion']['big-rock'].pop(uid + "-name")
+                    try:
+                        registry.check_foreign_key_constraints(loop_trace, next_dict)
+                        outcome         = "OK"
+                    except ApodeixiError as ex:
+                        outcome         = ex.msg + " " + str(ex.data["Problem UIDs"])
+                    result_txt          += "\nRemoving " + str(removed_uids) + ":\t" + outcome
+                return result_txt
+
+            output_txt                  = ""
+            my_trace                    = root_trace.doing("Registering constraints in two transactions")
+            _post_milestones(my_trace, 1, 1, {"M1": ["BR1", "BR2"], "M2": ["BR3"]})
+            _post_milestones(my_trace, 1, 2, {"M1": ["BR1"], "M2": ["BR3", "BR4"]})
+            output_txt                  += _describe(my_trace, "After two commits")
+
+            my_trace                    = root_trace.doing("Re-loading constraints from storage")
+            store.clearSessionState(my_trace)
+            output_txt                  += _describe(my_trace, "After re-loading")
+
+            my_trace                    = root_trace.doing("Compacting constraints")
+            original_threshold          = Isolation_KBStore_Impl.FOREIGN_KEY_LOG_COMPACTION_BYTES
+            Isolation_KBStore_Impl.FOREIGN_KEY_LOG_COMPACTION_BYTES = 0
+            try:
+                _post_milestones(my_trace, 1, 3, {"M1": ["BR2"]})
+            finally:
+                Isolation_KBStore_Impl.FOREIGN_KEY_LOG_COMPACTION_BYTES = original_threshold
+            output_txt                  += _describe(my_trace, "After compaction")
+
+            store.clearSessionState(my_trace)
+            output_txt                  += _describe(my_trace, "After re-loading the compacted snapshot")
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        T = Test_ForeignKeyConstraints()
+        T.setUp()
+        what_to_do = args[1]
+        if what_to_do=='foreign_key_persistence':
+            T.test_foreign_key_persistence()
+
+    main(_sys.argv)
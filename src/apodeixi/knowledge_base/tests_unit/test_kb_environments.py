@@ -0,0 +1,272 @@
+import sys                                              as _sys
+import os                                               as _os
+import pickle                                           as _pickle
+from concurrent.futures                                 import ThreadPoolExecutor as _ThreadPoolExecutor
+
+from apodeixi.testing_framework.a6i_unit_test           import ApodeixiUnitTest
+from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
+from apodeixi.util.path_utils                           import PathUtils
+from apodeixi.util.yaml_utils                           import YAML_Utils
+
+from apodeixi.knowledge_base.kb_environment             import KB_Environment_Config
+from apodeixi.knowledge_base.knowledge_base_store       import KnowledgeBaseStore
+from apodeixi.knowledge_base.knowledge_base_util        import ManifestHandle
+from apodeixi.knowledge_base.shutil_kb_store            import Shutil_KBStore_Impl
+
+class Test_KB_Environments(ApodeixiUnitTest):
+
+    def setUp(self):
+        super().setUp()
+
+    def test_overlay_environment(self):
+
+        TEST_NAME                       = 'overlay_environment'
+        MANIFEST_API                    = 'delivery-planning.journeys.a6i.io'
+        NAMESPACE                       = 'my-corp.production'
+        NAME                            = 'modernization.dec-2020.fusionopus.default'
+        KIND                            = 'big-rock'
+
+        try:
+            root_trace                  = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing overlay environments",
+                                                                        origination = {
+                                                                                'signaled_from' : __file__,
+                                                                                'concrete class': str(self.__class__.__name__)})
+
+            test_dir                    = self.output_data + "/" + TEST_NAME
+            PathUtils().remove_folder_if_exists(root_trace, test_dir)
+            PathUtils().create_path_if_needed(root_trace, test_dir + "/kb")
+            PathUtils().create_path_if_needed(root_trace, test_dir + "/collab")
+
+            store                       = KnowledgeBaseStore(root_trace, Shutil_KBStore_Impl(   parent_trace    = root_trace,
+                                                                                                kb_rootdir      = test_dir + "/kb",
+                                                                                                clientURL       = test_dir + "/collab"))
+            manifest_dict               = YAML_Utils().load(root_trace,
+                                                            path = self.expected_data + "/posting_with_mock_store." + KIND + ".1.yaml")
+            store.beginTransaction(root_trace)
+            store.persistManifest(root_trace, manifest_dict)
+            store.commitTransaction(root_trace)
+
+            def _files(env_name):
+                env_dir                 = test_dir + "/kb/envs/" + env_name
+                result                  = []
+                for currentdir, dirs, files in _os.walk(env_dir):
+                    for a_file in files:
+                        if a_file != "METADATA.yaml" and not a_file.startswith("MANIFEST_CATALOG"):
+                            result.append(_os.path.relpath(_os.path.join(currentdir, a_file), env_dir).replace("\\", "/"))
+                return sorted(result)
+
+            output_txt                  = ""
+            for overlay in [False, True]:
+                env_name                = "OVERLAY_ENV" if overlay else "COPY_ENV"
+                loop_trace              = root_trace.doing("Testing environment", data = {"env_name": env_name})
+                env_config              = KB_Environment_Config(
+                                                parent_trace        = loop_trace,
+                                                read_misses_policy  = KB_Environment_Config.FAILOVER_ALL_READS_TO_PARENT,
+                                                use_timestamps      = False,
+                                                path_mask           = self._path_mask,
+                                                overlay             = overlay)
+                store.current_environment(loop_trace).addSubEnvironment(loop_trace, env_name, env_config)
+                store.activate(loop_trace, env_name)
+
+                handle                  = ManifestHandle(   manifest_api    = MANIFEST_API,
+                                                            kind            = KIND,
+                                                            namespace       = NAMESPACE,
+                                                            name            = NAME,
+                                                            version         = 1)
+                retrieved_dict, path    = store.retrieveManifest(loop_trace, handle)
+                latest_dict, path       = store.findLatestVersionManifest(loop_trace, MANIFEST_API, NAMESPACE, NAME, KIND)
+                store.getForeignKeyConstraints(loop_trace)
+
+                output_txt              += "\n\n======== " + env_name + " ========"
+                output_txt              += "\nRetrieved version 1:\t\t" + str(retrieved_dict == manifest_dict)
+                output_txt              += "\nLatest version:\t\t\t" + str(latest_dict['metadata']['version'])
+                output_txt              += "\nFiles after reads:\t\t" + str(_files(env_name))
+
+                next_dict               = YAML_Utils().load(loop_trace,
+                                                            path = self.expected_data + "/posting_with_mock_store." + KIND + ".1.yaml")
+                next_dict['metadata']['version'] = 2
+                store.beginTransaction(loop_trace)
+                store.persistManifest(loop_trace, next_dict)
+                store.commitTransaction(loop_trace)
+
+                latest_dict, path       = store.findLatestVersionManifest(loop_trace, MANIFEST_API, NAMESPACE, NAME, KIND)
+                output_txt              += "\nLatest version after write:\t" + str(latest_dict['metadata']['version'])
+                output_txt              += "\nFiles after write:\t\t" + str(_files(env_name))
+
+                store.deactivate(loop_trace)
+                latest_dict, path       = store.findLatestVersionManifest(loop_trace, MANIFEST_API, NAMESPACE, NAME, KIND)
+                output_txt              += "\nLatest version in parent:\t" + str(latest_dict['metadata']['version'])
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
+    def test_concurrent_failover_reads(self):
+        '''
+        Several threads retrieve manifests inside a transaction, so each read misses in the transaction's environment
+        and fails over to the parent. The reads must not switch the environment that other threads (or the caller,
+        once the threads are done) see as current.
+        '''
+        TEST_NAME                       = 'concurrent_failover_reads'
+        MANIFEST_API                    = 'delivery-planning.journeys.a6i.io'
+        NAMESPACE                       = 'my-corp.production'
+        KIND                            = 'big-rock'
+        NB_NAMES                        = 8
+        NB_THREADS                      = 4
+        NB_ROUNDS                       = 5
+
+        try:
+            root_trace                  = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing concurrent failover reads",
+                                                                        origination = {
+                                                                                'signaled_from' : __file__,
+                                                                                'concrete class': str(self.__class__.__name__)})
+
+            test_dir                    = self.output_data + "/" + TEST_NAME
+            PathUtils().remove_folder_if_exists(root_trace, test_dir)
+            PathUtils().create_path_if_needed(root_trace, test_dir + "/kb")
+            PathUtils().create_path_if_needed(root_trace, test_dir + "/collab")
+
+            store                       = KnowledgeBaseStore(root_trace, Shutil_KBStore_Impl(   parent_trace    = root_trace,
+                                                                                                kb_rootdir      = test_dir + "/kb",
+                                                                                                clientURL       = test_dir + "/collab"))
+            names                       = ["modernization.dec-2020.product-" + str(idx) + ".default" for idx in range(NB_NAMES)]
+            store.beginTransaction(root_trace)
+            for name in names:
+                manifest_dict           = YAML_Utils().load(root_trace,
+                                                            path = self.expected_data + "/posting_with_mock_store." + KIND + ".1.yaml")
+                manifest_dict['metadata']['name'] = name
+                store.persistManifest(root_trace, manifest_dict)
+            store.commitTransaction(root_trace)
+
+            store.beginTransaction(root_trace)
+            transaction_env             = store.current_environment(root_trace)
+
+            def _read_all(thread_nb):
+                thread_trace            = root_trace.doing("Reading manifests in a thread", data = {"thread_nb": thread_nb})
+                found                   = []
+                for round_nb in range(NB_ROUNDS):
+                    # Each thread reads in a different order, so that threads miss on different manifests at the same time
+                    for name in names[thread_nb:] + names[:thread_nb]:
+                        handle          = ManifestHandle(   manifest_api    = MANIFEST_API,
+                                                            kind            = KIND,
+                                                            namespace       = NAMESPACE,
+                                                            name            = name,
+                                                            version         = 1)
+                        retrieved_dict, path    = store.retrieveManifest(thread_trace, handle)
+                        latest_dict, path       = store.findLatestVersionManifest(thread_trace, MANIFEST_API, NAMESPACE,
+                                                                                    name, KIND)
+                        found.append(retrieved_dict != None and retrieved_dict['metadata']['name'] == name
+                                        and latest_dict != None and latest_dict['metadata']['name'] == name)
+                return all(found)
+
+            with _ThreadPoolExecutor(max_workers = NB_THREADS) as executor:
+                results                 = list(executor.map(_read_all, range(NB_THREADS)))
+
+            output_txt                  = ""
+            output_txt                  += "\nAll threads found all manifests:\t" + str(all(results))
+            output_txt                  += "\nCurrent environment unchanged:\t\t" \
+                                                + str(store.current_environment(root_trace) == transaction_env)
+            store.abortTransaction(root_trace)
+            output_txt                  += "\nBack in base environment:\t\t" \
+                                                + str(store.current_environment(root_trace) == store.base_environment(root_trace))
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
+    def test_read_only_store(self):
+        '''
+        Worker processes that build postings in parallel get a pickled copy of a store in the midst of a transaction,
+        turned into a read-only store. They must be able to read through the transaction's environment, but must
+        neither write to it (not even to copy in what they read from the parent environment) nor open transactions.
+        '''
+        TEST_NAME                       = 'read_only_store'
+        MANIFEST_API                    = 'delivery-planning.journeys.a6i.io'
+        NAMESPACE                       = 'my-corp.production'
+        NAME                            = 'modernization.dec-2020.fusionopus.default'
+        KIND                            = 'big-rock'
+
+        try:
+            root_trace                  = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing read-only stores",
+                                                                        origination = {
+                                                                                'signaled_from' : __file__,
+                                                                                'concrete class': str(self.__class__.__name__)})
+
+            test_dir                    = self.output_data + "/" + TEST_NAME
+            PathUtils().remove_folder_if_exists(root_trace, test_dir)
+            PathUtils().create_path_if_needed(root_trace, test_dir + "/kb")
+            PathUtils().create_path_if_needed(root_trace, test_dir + "/collab")
+
+            store                       = KnowledgeBaseStore(root_trace, Shutil_KBStore_Impl(   parent_trace    = root_trace,
+                                                                                                kb_rootdir      = test_dir + "/kb",
+                                                                                                clientURL       = test_dir + "/collab"))
+            manifest_dict               = YAML_Utils().load(root_trace,
+                                                            path = self.expected_data + "/posting_with_mock_store." + KIND + ".1.yaml")
+            store.beginTransaction(root_trace)
+            store.persistManifest(root_trace, manifest_dict)
+            store.commitTransaction(root_trace)
+
+            store.beginTransaction(root_trace)
+            transaction_dir             = store.current_environment(root_trace).postingsURL(root_trace)
+
+            def _files():
+                result                  = []
+                for currentdir, dirs, files in _os.walk(transaction_dir):
+                    for a_file in files:
+                        if a_file != "METADATA.yaml" and not a_file.startswith("MANIFEST_CATALOG"):
+                            result.append(_os.path.relpath(_os.path.join(currentdir, a_file), transaction_dir).replace("\\", "/"))
+                return sorted(result)
+
+            worker_impl                 = _pickle.loads(_pickle.dumps(store._impl))
+            worker_impl.makeReadOnly(root_trace)
+            worker_store                = KnowledgeBaseStore(root_trace, worker_impl)
+
+            handle                      = ManifestHandle(   manifest_api    = MANIFEST_API,
+                                                            kind            = KIND,
+                                                            namespace       = NAMESPACE,
+                                                            name            = NAME,
+                                                            version         = 1)
+            output_txt                  = ""
+            retrieved_dict, path        = worker_store.retrieveManifest(root_trace, handle)
+            output_txt                  += "\nRead-only store retrieved version 1:\t" + str(retrieved_dict == manifest_dict)
+            output_txt                  += "\nFiles after read-only read:\t\t" + str(_files())
+
+            next_dict                   = YAML_Utils().load(root_trace,
+                                                            path = self.expected_data + "/posting_with_mock_store." + KIND + ".1.yaml")
+            next_dict['metadata']['version'] = 2
+            for description, attempt in [("beginTransaction", lambda: worker_store.beginTransaction(root_trace)),
+                                            ("persistManifest", lambda: worker_store.persistManifest(root_trace, next_dict))]:
+                try:
+                    attempt()
+                    output_txt          += "\n" + description + " in read-only store:\t\tallowed"
+                except ApodeixiError as ex:
+                    output_txt          += "\n" + description + " in read-only store:\t\t" + ex.msg
+
+            retrieved_dict, path        = store.retrieveManifest(root_trace, handle)
+            output_txt                  += "\nFiles after normal read:\t\t" + str(_files())
+            store.abortTransaction(root_trace)
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        T = Test_KB_Environments()
+        T.setUp()
+        what_to_do = args[1]
+        if what_to_do=='overlay_environment':
+            T.test_overlay_environment()
+        elif what_to_do=='concurrent_failover_reads':
+            T.test_concurrent_failover_reads()
+        elif what_to_do=='read_only_store':
+            T.test_read_only_store()
+
+    main(_sys.argv)
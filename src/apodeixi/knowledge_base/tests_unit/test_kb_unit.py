@@ -5,8 +5,10 @@ from apodeixi.testing_framework.mock_kb_store           import UnitTest_Knowledg
 from apodeixi.knowledge_base.knowledge_base_store       import KnowledgeBaseStore
 from apodeixi.util.formatting_utils                     import DictionaryFormatter
 from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
+from apodeixi.util.path_utils                           import PathUtils
 
 from apodeixi.knowledge_base.knowledge_base             import KnowledgeBase
+from apodeixi.knowledge_base.posting_workers            import PostingBuild, ReadTracking_KBStore
 
 from apodeixi.util.apodeixi_config              import ApodeixiConfig
 
@@ -77,6 +79,147 @@ class Test_KnowledgeBase_Unit(ApodeixiUnitTest):
         # If we get this far, the tests failed since we should have returned within the try statement. 
         # So hardcode an informative failure.
         self.assertTrue("Shouldn't have gotten to this line" == 0)                                                                      
+    def test_post_in_batch_in_parallel(self):
+
+        TEST_NAME               = 'post_in_batch_in_parallel'
+        MANIFEST_FILE_PREFIX    = 'posting_with_mock_store'
+        EXCEL_FILE              = MANIFEST_FILE_PREFIX + '_big-rocks.journeys.a6i.xlsx'
+
+        try:
+            root_trace          = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Posting in batch in parallel",
+                                                                                origination = {
+                                                                                        'signaled_from' : __file__,
+                                                                                        'concrete class': str(self.__class__.__name__)})
+            output_txt          = ""
+            explanations        = {}
+            for workers in [1, 2]:
+                loop_trace      = root_trace.doing("Posting in batch", data = {'workers': workers})
+                OUTPUT_FOLDER   = self.output_data + "/" + TEST_NAME + "_with_" + str(workers) + "_workers"
+                PathUtils().remove_folder_if_exists(loop_trace, OUTPUT_FOLDER)
+                PathUtils().create_path_if_needed(loop_trace, OUTPUT_FOLDER)
+                STORE_IMPL      = UnitTest_KnowledgeBaseStore(  test_case_name          = MANIFEST_FILE_PREFIX,
+                                                                input_manifests_dir     = self.input_data, 
+                                                                input_postings_dir      = self.input_data, 
+                                                                output_manifests_dir    = OUTPUT_FOLDER, 
+                                                                output_postings_dir     = OUTPUT_FOLDER)
+                store           = KnowledgeBaseStore(loop_trace, STORE_IMPL)
+                kbase           = KnowledgeBase(loop_trace, store, a6i_config=self.a6i_config)
+
+                # The second handle posts the same manifests as the first, so it can't be processed in parallel 
+                # with it. The third handle points to a non-existent worksheet, so it should error out
+                handle_list     = [store.buildPostingHandle(loop_trace, EXCEL_FILE, sheet, "B2:C1000") 
+                                        for sheet in ["Sheet1", "Sheet1", "Sheet2"]]
+
+                successes, errors   = kbase.postInBatch(loop_trace, handle_list, workers = workers)
+
+                explanation_txt = ""
+                for idx in sorted(successes.keys()):
+                    explanation_txt += "\n\tSuccess for handle #" + str(idx) + ": created " \
+                                        + ", ".join([h.kind + " v" + str(h.version) 
+                                                        for h in successes[idx].createdManifests()])
+                for idx in sorted(errors.keys()):
+                    explanation_txt += "\n\tError for handle #" + str(idx) + ": " + errors[idx].msg
+                explanations[workers]   = explanation_txt
+                output_txt      += "\n\nPosting in batch with " + str(workers) + " workers:" + explanation_txt
+
+            output_txt          += "\n\nSame outcome in serial and parallel mode: " + str(explanations[1] == explanations[2])
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message()) 
+            self.assertTrue(1==2)
+
+    def test_posting_build_dependencies(self):
+
+        TEST_NAME               = 'posting_build_dependencies'
+        NAMESPACE               = 'my-corp.production'
+        BIG_ROCKS               = (NAMESPACE, 'modernization.dec-2020.fusionopus.default')
+        MILESTONES              = (NAMESPACE, 'modernization.dec-2020.opus.default')
+
+        try:
+            root_trace          = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Checking posting build dependencies",
+                                                                                origination = {
+                                                                                        'signaled_from' : __file__,
+                                                                                        'concrete class': str(self.__class__.__name__)})
+            builds              = { "reads nothing":            set(),
+                                    "reads big rocks":          set([BIG_ROCKS]),
+                                    "reads big rocks, searches":set([BIG_ROCKS, ReadTracking_KBStore.ANY])}
+            writes              = { "no writes":                set(),
+                                    "writes big rocks":         set([BIG_ROCKS]),
+                                    "writes milestones":        set([MILESTONES])}
+            output_txt          = ""
+            for build_description in builds.keys():
+                posting_build   = PostingBuild( label_handle            = None, 
+                                                controller              = None, 
+                                                all_manifests_dicts     = None, 
+                                                label                   = None, 
+                                                error                   = None, 
+                                                dependencies            = builds[build_description])
+                for write_description in writes.keys():
+                    output_txt  += "\nBuild that " + build_description + " depends on batch with " + write_description + ":\t" \
+                                        + str(posting_build.dependsOn(writes[write_description]))
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message()) 
+            self.assertTrue(1==2)
+
+    def test_post_in_batch_reprocessing(self):
+
+        TEST_NAME               = 'post_in_batch_reprocessing'
+        MANIFEST_FILE_PREFIX    = 'posting_with_mock_store'
+        EXCEL_FILE              = MANIFEST_FILE_PREFIX + '_big-rocks.journeys.a6i.xlsx'
+
+        try:
+            root_trace          = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Posting in batch in parallel",
+                                                                                origination = {
+                                                                                        'signaled_from' : __file__,
+                                                                                        'concrete class': str(self.__class__.__name__)})
+            OUTPUT_FOLDER       = self.output_data + "/" + TEST_NAME
+            PathUtils().remove_folder_if_exists(root_trace, OUTPUT_FOLDER)
+            PathUtils().create_path_if_needed(root_trace, OUTPUT_FOLDER)
+            STORE_IMPL          = UnitTest_KnowledgeBaseStore(  test_case_name          = MANIFEST_FILE_PREFIX,
+                                                                input_manifests_dir     = self.input_data, 
+                                                                input_postings_dir      = self.input_data, 
+                                                                output_manifests_dir    = OUTPUT_FOLDER, 
+                                                                output_postings_dir     = OUTPUT_FOLDER)
+            store               = KnowledgeBaseStore(root_trace, STORE_IMPL)
+            kbase               = BuildRecording_KnowledgeBase(root_trace, store, a6i_config=self.a6i_config)
+
+            # Handles #1 and #3 post the same manifests as handle #0, so they are built by workers from a snapshot 
+            # in which handle #0's manifests don't exist yet, and must be re-processed after handle #0 is persisted.
+            # Handle #2 errors out in its worker, and that error is used as is since it wrote nothing
+            handle_list         = [store.buildPostingHandle(root_trace, EXCEL_FILE, sheet, "B2:C1000") 
+                                        for sheet in ["Sheet1", "Sheet1", "Sheet2", "Sheet1"]]
+
+            successes, errors   = kbase.postInBatch(root_trace, handle_list, workers = 3)
+
+            output_txt          = ""
+            for idx in range(len(handle_list)):
+                outcome         = "success" if idx in successes.keys() else "error"
+                how             = "from worker's build" if kbase.worker_builds_used[idx] else "re-processed serially"
+                output_txt      += "\nHandle #" + str(idx) + ":\t" + outcome + ", " + how
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message()) 
+            self.assertTrue(1==2)
+
+class BuildRecording_KnowledgeBase(KnowledgeBase):
+    '''
+    KnowledgeBase used in tests of posting in parallel. For each posting that it persists, it records whether a 
+    worker's build was used or the posting had to be re-processed serially.
+    '''
+    def __init__(self, parent_trace, store, a6i_config):
+        super().__init__(parent_trace, store, a6i_config)
+        self.worker_builds_used     = []
+
+    def _postByLabel(self, parent_trace, label_handle, posting_build):
+        self.worker_builds_used.append(posting_build != None)
+        return super()._postByLabel(parent_trace, label_handle, posting_build)
 
 if __name__ == "__main__":
     # execute only if run as a script
@@ -86,5 +229,11 @@ if __name__ == "__main__":
         what_to_do = args[1]
         if what_to_do=='posting_with_mock_store':
             T.test_posting_with_mock_store()
+        elif what_to_do=='post_in_batch_in_parallel':
+            T.test_post_in_batch_in_parallel()
+        elif what_to_do=='posting_build_dependencies':
+            T.test_posting_build_dependencies()
+        elif what_to_do=='post_in_batch_reprocessing':
+            T.test_post_in_batch_reprocessing()
 
     main(_sys.argv)
\ No newline at end of file
@@ -0,0 +1,109 @@
+import sys                                              as _sys
+import os                                               as _os
+
+from apodeixi.testing_framework.a6i_unit_test           import ApodeixiUnitTest
+from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
+from apodeixi.util.path_utils                           import PathUtils
+from apodeixi.util.yaml_utils                           import YAML_Utils
+
+from apodeixi.knowledge_base.manifest_catalog           import ManifestCatalog
+
+class Test_ManifestCatalog(ApodeixiUnitTest):
+
+    def setUp(self):
+        super().setUp()
+
+    def test_manifest_catalog(self):
+
+        TEST_NAME                       = 'manifest_catalog'
+        MANIFEST_API                    = 'delivery-planning.journeys.a6i.io'
+        NAMESPACE                       = 'my-corp.production'
+        NAME                            = 'modernization.dec-2020.fusionopus.default'
+        KINDS                           = ['big-rock', 'big-rock-estimate', 'investment']
+
+        try:
+            root_trace                  = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing manifest catalog",
+                                                                        origination = {
+                                                                                'signaled_from' : __file__,
+                                                                                'concrete class': str(self.__class__.__name__)})
+
+            manifests_rootdir           = self.output_data + "/" + TEST_NAME + "/kb/manifests"
+            manifest_dir                = manifests_rootdir + "/" + NAMESPACE + "/" + NAME
+            PathUtils().remove_folder_if_exists(root_trace, _os.path.dirname(manifests_rootdir))
+            PathUtils().create_path_if_needed(root_trace, manifest_dir)
+
+            # Seed the manifests area "behind the catalog's back", as would be the case for a KnowledgeBase
+            # created before catalogs were introduced
+            for kind in KINDS:
+                loop_trace              = root_trace.doing("Seeding manifest", data = {"kind": kind})
+                manifest_dict           = YAML_Utils().load(loop_trace,
+                                                            path = self.expected_data + "/posting_with_mock_store." + kind + ".1.yaml")
+                YAML_Utils().save(loop_trace, data_dict = manifest_dict, path = manifest_dir + "/" + kind + ".1.yaml")
+
+            catalog                     = ManifestCatalog(manifests_rootdir)
+            output_txt                  = ""
+            connections_before          = ManifestCatalog.connections_opened
+
+            def _describe(title, result):
+                return "\n" + title + ":\n\t" + str(result)
+
+            # The first lookup builds the catalog, since there is none yet
+            output_txt                  += _describe("Complete before first lookup", catalog.is_complete(root_trace))
+            output_txt                  += _describe("Latest big-rock on first lookup",
+                                                            catalog.findLatest(root_trace, NAMESPACE, NAME, "big-rock"))
+            output_txt                  += _describe("Complete after first lookup", catalog.is_complete(root_trace))
+
+            output_txt                  += _describe("Number of manifests catalogued by rebuild", catalog.rebuild(root_trace))
+            output_txt                  += _describe("Complete after rebuild", catalog.is_complete(root_trace))
+            output_txt                  += _describe("Latest big-rock after rebuild",
+                                                            catalog.findLatest(root_trace, NAMESPACE, NAME, "big-rock"))
+
+            # Now write a new version of the big-rock and record it in the catalog, as persistManifest would
+            manifest_dict               = YAML_Utils().load(root_trace, path = manifest_dir + "/big-rock.1.yaml")
+            manifest_dict['metadata']['version'] = 2
+            YAML_Utils().save(root_trace, data_dict = manifest_dict, path = manifest_dir + "/big-rock.2.yaml")
+            catalog.record(root_trace, NAMESPACE + "/" + NAME + "/big-rock.2.yaml", manifest_dict)
+
+            output_txt                  += _describe("Latest big-rock after recording version 2",
+                                                            catalog.findLatest(root_trace, NAMESPACE, NAME, "big-rock"))
+            output_txt                  += _describe("Version 1 of big-rock-estimate",
+                                                            catalog.find(root_trace, MANIFEST_API, NAMESPACE, NAME,
+                                                                            "big-rock-estimate", 1))
+            output_txt                  += _describe("Version 1 of big-rock-estimate for another manifest API",
+                                                            catalog.find(root_trace, "capability-hierarchy.kernel.a6i.io",
+                                                                            NAMESPACE, NAME, "big-rock-estimate", 1))
+            output_txt                  += _describe("All big-rocks and investments",
+                                                            catalog.findByKinds(root_trace, ["big-rock", "investment"]))
+
+            # If a catalogued file disappears the catalog should stop trusting itself
+            PathUtils().remove_file_if_exists(root_trace, manifest_dir + "/big-rock.2.yaml")
+            output_txt                  += _describe("Latest big-rock after deleting version 2 file",
+                                                            catalog.findLatest(root_trace, NAMESPACE, NAME, "big-rock"))
+            output_txt                  += _describe("Complete after deleting version 2 file", catalog.is_complete(root_trace))
+            output_txt                  += _describe("Latest big-rock on next lookup, which rebuilds the catalog",
+                                                            catalog.findLatest(root_trace, NAMESPACE, NAME, "big-rock"))
+
+            # All of the above reused one cached connection. Once released, a new one is opened when needed
+            output_txt                  += _describe("Connections opened", ManifestCatalog.connections_opened 
+                                                                                - connections_before)
+            ManifestCatalog.release_connections(_os.path.dirname(manifests_rootdir))
+            output_txt                  += _describe("Complete after releasing connections", catalog.is_complete(root_trace))
+            output_txt                  += _describe("Connections opened after releasing them", 
+                                                            ManifestCatalog.connections_opened - connections_before)
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        T = Test_ManifestCatalog()
+        T.setUp()
+        what_to_do = args[1]
+        if what_to_do=='manifest_catalog':
+            T.test_manifest_catalog()
+
+    main(_sys.argv)
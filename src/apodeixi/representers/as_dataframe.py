@@ -26,6 +26,161 @@ class UID_Info:
         '''
         return str(self.uid) + ": " + str(self.entity_value)
 
+class DataFrameColumns:
+    '''
+    Data structure class used by the AsDataframe_Representer to accumulate the content of a DataFrame-to-be
+    column by column, as rows are discovered while traversing a manifest. It holds:
+
+    * The intervals of the DataFrame, i.e., for each entity the list of columns (UID column, entity column and the
+      entity's scalar properties). Each entity has exactly one interval, even if its properties are discovered
+      gradually as more rows are seen.
+    * For each column, the list of its values across all rows added so far. Rows that don't have a value
+      for a column get a NaN in that column's list, like Pandas would do if building a DataFrame from a list of dicts.
+    * The list of UID_Info objects for the entities in the manifest.
+
+    Filling per-column lists is cheaper than building a dict per row, and lets callers get the DataFrame
+    in batches of rows with `batches` instead of all at once with `as_df`.
+    '''
+    def __init__(self):
+        self.intervals_dict     = {} # Keys are entity names, values are Intervals
+        self.values_dict        = {} # Keys are columns, values are lists of column values, one per row
+        self.nb_rows            = 0
+        self.uid_info_list      = []
+        self.intervals          = None # Set by `sort_intervals` once all rows are added
+
+    def interval_for(self, parent_trace, UID_COL, entity_name):
+        '''
+        Returns the Interval for the given `entity_name`, creating it if this is the first time the entity is seen
+        '''
+        interval                = self.intervals_dict.get(entity_name)
+        if interval == None:
+            interval            = Interval( parent_trace    = parent_trace, 
+                                            columns         = [UID_COL, entity_name],
+                                            entity_name     = entity_name)
+            self.intervals_dict[entity_name]    = interval
+        return interval
+
+    def add_row(self, row):
+        '''
+        Adds a row to the columns.
+
+        @param row A dict whose keys are (some of) the columns and whose values are the row's values for them
+        '''
+        NAN                     = float('nan')
+        nb_rows                 = self.nb_rows
+        for col, val in row.items():
+            column              = self.values_dict.get(col)
+            if column == None:
+                column          = []
+                self.values_dict[col]   = column
+            if len(column) < nb_rows:
+                column.extend([NAN] * (nb_rows - len(column)))
+            column.append(val)
+        self.nb_rows            = nb_rows + 1
+
+    def sort_intervals(self, parent_trace, acronym_schema):
+        '''
+        Sorts the intervals to be order-consistent with the acronym_schema and sets self.intervals to the sorted list.
+        This is needed because due to the possibility of some rows having skipped an entity, it is possible
+        that we saw the interval for UID-3 before the interval for UID-2.
+        '''
+        all_intervals           = list(self.intervals_dict.values())
+        my_trace                = parent_trace.doing("Sorting intervals as per Acronym Schema",
+                                                            data = {"acronym schema":   str(acronym_schema)})
+        sorted_intervals        = []
+        for acronyminfo in acronym_schema.acronym_infos():
+            # Find the interval for this acronym, if there is one
+            entity_name         = acronyminfo.entity_name
+            matches             = [interval for interval in all_intervals if entity_name in interval.columns]
+            if len(matches) > 1:
+                raise ApodeixiError(my_trace, "Found multiple intervals for the same entity, and there shoud be at most 1")
+            elif len(matches) == 1:
+                sorted_intervals.append(matches[0])
+
+        # Check we sorted everything
+        if len(sorted_intervals) != len(all_intervals):
+            raise ApodeixiError(my_trace, "Was not able to sort all intervals based on the Acronym Schema. Some intervals "
+                                            + " did not seem to correspond to anything recognized in the Acronym Schema, "
+                                            + "The sorted intervals should have been equally long as all_intervals",
+                                            data = {"len(all_intervals)":       str(len(all_intervals)),
+                                                    "len(sorted_intervals)":    str(len(sorted_intervals))})
+        self.intervals          = sorted_intervals
+
+    def all_columns(self):
+        '''
+        Returns the list of the DataFrame's columns, i.e., the concatenation of the sorted intervals
+        '''
+        all_columns             = []
+        for interval in self.intervals:
+            all_columns.extend(interval.columns)
+        return all_columns
+
+    def _column_values(self, col, start, end):
+        '''
+        Returns the values of column `col` for rows `start` (inclusive) to `end` (exclusive), padded with NaNs
+        '''
+        NAN                     = float('nan')
+        column                  = self.values_dict.get(col, [])[start:end]
+        if len(column) < end - start:
+            column.extend([NAN] * (end - start - len(column)))
+        return column
+
+    def as_df(self, parent_trace):
+        '''
+        Returns a DataFrame with all the rows, and blanks instead of NaNs. Column types are inferred by Pandas
+        the same way as if the DataFrame were built from a list of dicts, one per row.
+        '''
+        all_columns             = self.all_columns()
+        if self.nb_rows == 0:
+            return _pd.DataFrame(columns=all_columns, data=[])
+        # Key the data by position, not by column name, since the same column name might appear in two intervals
+        df                      = _pd.DataFrame({idx: self._column_values(all_columns[idx], 0, self.nb_rows)
+                                                    for idx in range(len(all_columns))})
+        df.columns              = all_columns
+        df                      = df.fillna('')
+        return df
+
+    def batches(self, parent_trace, batch_size):
+        '''
+        Generator that yields DataFrames with consecutive rows, each with at most `batch_size` rows and blanks 
+        instead of NaNs. The index of each batch continues where the previous batch left off, and 
+        column types are those that `as_df` would have, so that concatenating all batches results in 
+        the same DataFrame as `as_df`.
+        '''
+        all_columns             = self.all_columns()
+        if self.nb_rows == 0:
+            yield _pd.DataFrame(columns=all_columns, data=[])
+            return
+        if batch_size == None or batch_size < 1:
+            raise ApodeixiError(parent_trace, "Can't split a DataFrame in batches unless the batch size is a positive int",
+                                                data = {"batch_size": str(batch_size)})
+        # Infer types across all rows, one column at a time, so that batches agree with each other and with `as_df`.
+        # We can't just use `fillna` on each batch, since after filling NaNs Pandas re-infers the types of 
+        # object columns from just the batch's values. So for each column we record its type and whether
+        # `fillna` on the whole column would blank its NaNs (it doesn't for datetime columns, for example).
+        column_info             = []
+        for col in all_columns:
+            whole_column        = _pd.Series(self._column_values(col, 0, self.nb_rows))
+            blanks_nans         = whole_column.isna().any() and not whole_column.to_frame().fillna('').isna().any().any()
+            column_info.append((whole_column.dtype, blanks_nans))
+
+        def _batch_column(col_nb, start, end):
+            dtype, blanks_nans  = column_info[col_nb]
+            column              = _pd.Series(   self._column_values(all_columns[col_nb], start, end),
+                                                index   = _pd.RangeIndex(start, end),
+                                                dtype   = dtype)
+            if blanks_nans:
+                values          = column.to_numpy(dtype=object)
+                values[column.isna().to_numpy()] = ''
+                column          = _pd.Series(values, index = column.index, dtype = object)
+            return column
+
+        for start in range(0, self.nb_rows, batch_size):
+            end                 = min(start + batch_size, self.nb_rows)
+            df                  = _pd.DataFrame({idx: _batch_column(idx, start, end) for idx in range(len(all_columns))})
+            df.columns          = all_columns
+            yield df
+
 class AsDataframe_Representer:
     '''
     Class that can represent an Apodeixi manifest as a Pandas DataFrame
@@ -110,7 +265,7 @@ class AsDataframe_Representer:
         * As input to subsequent processing to render an Excel visualization (using sparse=True)
         * As input to data analysis in Pandas (using sparse=False). 
         
-        Refer to detailed documentation for method `self._build_df_rows`, that does the heavy lifting.
+        Refer to detailed documentation for method `self._build_df_columns`, that does the heavy lifting.
 
         It returns two objects:
 
@@ -150,31 +305,37 @@ class AsDataframe_Representer:
                     DataFrame returned by this method
         '''
         my_trace            = parent_trace.doing('Converting content to DataFrame')
+        df_columns          = self._build_df_columns(   parent_trace        = my_trace, 
+                                                        content_dict        = content_dict, 
+                                                        contents_path       = contents_path, 
+                                                        sparse              = sparse, 
+                                                        abbreviate_uids     = abbreviate_uids)
+        df                  = df_columns.as_df(my_trace)
 
-        # For reasons explained in the documentation of the method _find_acronyminfo_list, we need to do a first
-        # pass to get the correct, holistic set of acronyms before we call the _build_df_rows method
-        acronym_schema      = UID_Acronym_Schema()
-        acronym_schema.build_schema_from_manifest_content(  parent_trace        = my_trace, 
-                                                            content_dict        = content_dict, 
-                                                            parent_path         = contents_path)
+        return df, df_columns.uid_info_list
 
-        intervals, rows, uid_info_list      = self._build_df_rows(          
-                                                            parent_trace        = my_trace,
-                                                            content_dict        = content_dict,
-                                                            acronym_schema      = acronym_schema,
-                                                            parent_path         = contents_path,
-                                                            parent_uid          = None,
-                                                            sparse              = sparse,
-                                                            abbreviate_uids     = abbreviate_uids)
-        
-        all_columns         = []
-        for interval in intervals:
-            all_columns.extend(interval.columns)
-            
-        df                  =  _pd.DataFrame(columns=all_columns, data=rows)
-        df                  = df.fillna('')
+    def dict_2_df_batches(self, parent_trace, content_dict, contents_path, sparse, abbreviate_uids, batch_size=1000):
+        '''
+        Generator version of `self.dict_2_df`, for callers that don't need the whole DataFrame at once, such as 
+        callers that just concatenate DataFrames for multiple manifests.
+
+        It yields DataFrames with at most `batch_size` rows each, and concatenating all of them results in the
+        same DataFrame that `self.dict_2_df` would return. Unlike `self.dict_2_df`, it does not provide the list
+        of UID_Info objects.
+
+        Refer to the documentation of `self.dict_2_df` for the meaning of the other parameters.
 
-        return df, uid_info_list
+        @param batch_size A positive int, for the maximum number of rows in each yielded DataFrame
+        '''
+        my_trace            = parent_trace.doing('Converting content to DataFrame batches',
+                                                    data = {'batch_size': str(batch_size)})
+        df_columns          = self._build_df_columns(   parent_trace        = my_trace, 
+                                                        content_dict        = content_dict, 
+                                                        contents_path       = contents_path, 
+                                                        sparse              = sparse, 
+                                                        abbreviate_uids     = abbreviate_uids)
+        for df in df_columns.batches(my_trace, batch_size):
+            yield df
     
     def _split_out(self, parent_trace, manifest_dict, splitting_path):
         '''
@@ -232,16 +393,14 @@ class AsDataframe_Representer:
                 
         return on_path_dict, off_path_dict
     
-    def _build_df_rows(self, parent_trace, content_dict, acronym_schema, parent_path, parent_uid, sparse,
-                                abbreviate_uids):
+    def _build_df_columns(self, parent_trace, content_dict, contents_path, sparse, abbreviate_uids):
         '''
-        Recursive method that creates the data from which a Pandas DataFrame can be easily created by the caller,
-        based on the dictionary `content_dict`. It returns:
+        Traverses the dictionary `content_dict` and returns a DataFrameColumns object with the data from which
+        a Pandas DataFrame can be easily created by the caller, i.e.:
         
         * The list of intervals whose concatenation would yield the columns for such a DataFrame-to-be (see 
             example below for an explanation)
-        * The list of rows (each row represented as a dict, whose keys are DataFrame columns, at least those
-            columns for which the row has a non-NaN value)
+        * The values of each column, one per row
         * A list of UID_Info objects, built as a by-product of this method's processing and which some callers
             may find useful. Refer to the documentation of UID_Info for explanation and example use cases.
 
@@ -275,24 +434,25 @@ class AsDataframe_Representer:
 
         This example also helps us comment some other nuances of the algorithm:
 
-        1. The first object returned by this method is a "list of intervals", which in the example would be
+        1. The intervals in the DataFrameColumns returned by this method would be
 
                 [["UID", "Big Rock"], ["UID-1", "Sub rock"]]
 
-        2. The second object returned by this method is "all the rows as dictionaries", which for a sparse
-            situation would be:
+        2. Each entity contributes a "level 1 row" for its interval, with its UID, name and scalar attributes. 
+            For example, for BR1 and BR1.SR1 they would be:
+
+                {  "UID": "BR1",   "Big Rock": "New UX"}
+                {  "UID-1", "BR1.1",   "Sub rock": "FX UI"}
+
+            In the sparse case, each entity's level 1 row is a row of the DataFrame, in the order in which entities 
+            are visited (each entity before its sub-entities).
+            In the non-sparse case, only entities without sub-entities get a row, which is their level 1 row 
+            merged with the level 1 rows of all their ancestors (when they share a column, the ancestor's value wins):
 
-                [{  "UID": "BR1",   "Big Rock": "New UX"                                                                },          
-                                                                  { "UID-1", "BR1.1",   "Sub rock": "FX UI"             },
-                                                                  { "UID-1", "BR1.2",   "Sub rock": "Lending UI"        },
-                 {  "UID": "BR2",   "Big Rock": "Contanerization"                                                       },  
-                                                                  { "UID-1", "BR2.1",   "Sub rock": "Pricing service"   },
-                                                                  { "UID-1", "BR2.2",   "Sub rock": "Market data svc"   },
-                ]
+                {  "UID": "BR1",   "Big Rock": "New UX",           "UID-1", "BR1.1",   "Sub rock": "FX UI"             }
 
-        3. The dictionaries representing rows don't need to have all columns present as keys. Pandas can still
-            create a DataFrame from that, and will just put a null (nan or such) as the value of that column for
-            the row in question. The algorithm makes use of this.
+        3. Rows don't need to have all columns. The DataFrameColumns will just put a NaN as the value of that 
+            column for the row in question, which the caller will later replace by a blank.
         
         4. The UIDs are "abbreviated". For example, UID-1 has a value like "BR1.1" instead of "BR1.SR1". So only
             the first acronym "BR" (for "Big Rock") is displayed, not the second acronym "SR" (for Sub rock).
@@ -309,358 +469,164 @@ class AsDataframe_Representer:
             such `content_dict`, there are columns like "BR1-name" and "SR1-name". These are ignored by this
             method.
 
-        7. This algorithm operates recursively, one interval at a time. In the example, we first process
-            interval ["UID", "Big Rock"], first identify this row fragment:
-
-             {  "UID": "BR1",   "Big Rock": "New UX"}
-
-            The algorithm then makes a recursive call on `content_df["BR1"], which returns two objects:
-
-                * A list of intervals: [["UID-1", "Sub rock"]], which is then merged with the caller's interval
-                    list to date and results in [["UID", "Big Rock"], ["UID-1", "Sub rock"]]
-
-                * A list of rows:
-                                                                [ { "UID-1", "BR1.1",   "Sub rock": "FX UI"             },
-                                                                  { "UID-1", "BR1.2",   "Sub rock": "Lending UI"        }
-                                                                ]
-                    These then need to be "merged" with the caller, and the merging varies depending on whether
-                    sparse=True or not. In the sparse case, the merging would look like 3 rows:
-
-                [{  "UID": "BR1",   "Big Rock": "New UX"                                                                },          
-                                                                  { "UID-1", "BR1.1",   "Sub rock": "FX UI"             },
-                                                                  { "UID-1", "BR1.2",   "Sub rock": "Lending UI"        }
-                ]
-
-                    In the case sparse=False, the merging would look like 2 rows:
-
-                [{  "UID": "BR1",   "Big Rock": "New UX",           "UID-1", "BR1.1",   "Sub rock": "FX UI"             },
-                 {  "UID": "BR1",   "Big Rock": "New UX",           "UID-1", "BR1.2",   "Sub rock": "Lending UI"        }
-                ]
+        7. The algorithm is iterative, not recursive, so that deep manifests don't hit Python's recursion limit:
+            it keeps a stack with the path from the top of `content_dict` to the entity being processed. 
+            Each level in the stack has the level 1 row of an entity and an iterator over the entity's sub-entities 
+            not yet processed.
 
         8. Apart from sub-dictionaries, `content_dict` usually has scalar attributes. These need to be included
             in the rows when they have a value. 
 
-        9. Scalar attributes introduce a nuance with the merging of intervals: as subsequent rows of the result
-            are gradually created, the algorithm only has a partial view of what the intervals are, since it infers
-            intervals' columns based on what it has seen so far. It thus may happen that when dealing with 
-            a later row it will encounter additional columns for an entity's interval that had been previously
-            seen. This must be taken into consideration in the merging of intervals.
-
-            For example, perhaps we are processing a manifest dict arose from parsing a posting like this:
+        9. Scalar attributes introduce a nuance with intervals: since they are optional, different rows may 
+            uncover different columns for the same entity. For example, perhaps we are processing a manifest dict 
+            that arose from parsing a posting like this:
 
                     UID         |   Big rock        |   Asset classes           | Intended user
                     ===========================================================================
                     BR1         | Lending UI        |  Mortgages, commercial    |
                     BR2         | Treasury UI       |                           | FX traders
 
-            Then the manifest will have a branch for the first row that will make us infer an
-            interval like 
-            
-                    [UID, Big rock, Asset classes]
-                    
-            Later when we process the manifest's branch that arose from the second row we will instead get 
-            an interval like 
-            
-                    [UID, Big rock, Intended user]
+            Processing BR1 leads to an interval like [UID, Big rock, Asset classes], and later processing BR2 
+            uncovers an extra column for the same interval, which thus becomes 
             
-            The correct "merge" behavior in such case is not to treat these as separate intervals, but to merge them 
-            as 
                     [UID, Big rock, Asset classes, Intended user]
 
+            That is why the DataFrameColumns keeps one interval per entity, and grows it as new columns are seen.
 
         @param contents_dict A dict object representing the contents of a manifest, as opposed to the
                             entire manifest. 
                             In the first example above, if manifest_dict represents a full manifest, 
                             then content_df = manifest_dict['assertion']['big-rock']
-        @param acronym_schema An AcronymSchema object that captures all the acronyms for `content_dict`
-                            as well as their corresponding entity names. This should be
-                            "global", i.e., is not for a "sub tree" but for the full manifest. 
-                            Logically speaking the schema contains information that specifice the order
-                            of the acronyms and their entities. While an object and not a list, logically
-                            it is as in this example:
-
-                                [("BR", "big-rock"), ("MR", "medium_rock"), ("SR", "small rock")] 
-                            
-        @param parent_path A string using 'dot notation' for the path in the original YAML file that led
-                          to the `content_dict`. 
-                          In the first example above, that would be "assertion.big-rock" when this method is
-                          first called, and "assertion.big-rock.BR1.Sub rock" when it recursively
-                          calls itself.
-        @param parent_uid   A string used to assist in recursive calls.
-                            In the first example above, that would be None when this method is first called,
-                            and "BR1" on a 1st recursion, or "BR1.SR1" on a 2nd nested recursion.
+        @param contents_path A string using 'dot notation' for the path in the original YAML file that led
+                          to the `content_dict`. In the first example above, that would be "assertion.big-rock"
         @param sparse A boolean. If True, it returns a "sparse" representation suitable for Excel rendering,
                     with exactly 1 UID per row (helpful when making joins)
         @param abbreviate_uids A boolean. If True, UIDs will only keep the top acronym. For example, 
                     a UID like "BR2.MR2.SM4" in the manifest would be transformed to "BR2.2.4" in the
                     DataFrame returned by this method
         '''
-        my_trace                            = parent_trace.doing("Validating parent_path '" + parent_path + "''",
+        my_trace                            = parent_trace.doing("Validating contents_path '" + str(contents_path) + "''",
                                                         data = {'signaledFrom': __file__})
         if True:
-            if parent_path == None or len(parent_path.strip()) == 0:
-                raise ApodeixiError(my_trace, "Can't process a parent_path that is null or blank")
-        
-        # parent_path is something like "assertion.big-rock" when this method is first called, and 
-        # like  "assertion.big-rock.BR1.Sub rock" when this method is calls recursively on itself
-        
-        entity_uids                         = [key for key in content_dict.keys() if not key.endswith('-name')]
+            if contents_path == None or len(contents_path.strip()) == 0:
+                raise ApodeixiError(my_trace, "Can't process a contents_path that is null or blank")
+
+        # For reasons explained in the documentation of the method _find_acronyminfo_list, we need to do a first
+        # pass to get the correct, holistic set of acronyms before we build the rows
+        acronym_schema                      = UID_Acronym_Schema()
+        acronym_schema.build_schema_from_manifest_content(  parent_trace        = parent_trace, 
+                                                            content_dict        = content_dict, 
+                                                            parent_path         = contents_path)
 
-        # Will be one per entity_value, a dictionary of level_1_columns -> scalar value. By "level 1 columns"
-        # we mean columns for the interval being processed here (subsequent intervals would be processed
-        # in recursive invocations of this method). See method documentation for explanation of algorithm.
-        all_rows                            = [] 
-        
         # Some manifest field names that have fixed, hard-coded values in Apodeixi
         UID                                 = Interval.UID
         NAME                                = 'name'
         SYNTHETIC_COLUMNS                   = [UID, NAME] # These are added when parsing Excel, so not "real" content
-        
-        all_intervals                       = []
 
-        uid_info_list                       = [] # We'll build this as a by-product and return it
+        df_columns                          = DataFrameColumns()
 
-        # On a first call we loop through something like e_uid = "BR1", "BR2", "BR3", .... For that call
-        #       parent_uid = None and parent_path = "assertion.big-rock"
-        # On a recursive call with parent_uid = "BR1" we loop through e_uid = "SR1", "SR2", "SR3", .... In this case
-        #       parent_path = "assertion.big-rock.BR1.Sub rock"
-        for e_uid in entity_uids:
-            if parent_uid == None:
-                full_e_uid                  = e_uid
-            else:
-                full_e_uid                  = parent_uid + '.' + e_uid
-                
-            e_path                          = parent_path  + '.' + e_uid
-            e_dict                          = content_dict[e_uid]
+        def _entities(a_content_dict, a_path, parent_uid):
+            # Yields the entities under `a_content_dict`, as tuples (e_uid, full_e_uid, e_path, e_dict). For example,
+            # if a_path = "assertion.big-rock.BR1.Sub rock" and parent_uid = "BR1" we loop through 
+            # e_uid = "SR1", "SR2", "SR3", ..., and their full_e_uid are "BR1.SR1", "BR1.SR2", "BR1.SR3", ...
+            for e_uid in [key for key in a_content_dict.keys() if not key.endswith('-name')]:
+                full_e_uid                  = e_uid if parent_uid == None else parent_uid + '.' + e_uid
+                yield e_uid, full_e_uid, a_path + '.' + e_uid, a_content_dict[e_uid]
+
+        def _sub_entities(e_dict, e_path, full_e_uid, sub_entities):
+            # Yields the entities under all the sub-entities of e_dict. For example, if e_dict = content_dict["BR1"], 
+            # it yields the entities under e_dict["Sub rock"] (and also under e_dict["Tiny rock"], if the user 
+            # skipped sub rocks for some tiny rocks of BR1)
+            for sub_entity in sub_entities:
+                for entity in _entities(e_dict[sub_entity], e_path + '.' + sub_entity, full_e_uid):
+                    yield entity
+
+        # Each member of the stack is a list [level_1_row, entities_iterator, nb_rows_before]. The level_1_row is None
+        # for the bottom of the stack, since it is for `content_dict` itself and not for an entity.
+        # `nb_rows_before` is the number of rows in df_columns before processing the stack member's sub-entities,
+        # so that in the non-sparse case we can tell if any of them added rows.
+        stack                               = [[None, _entities(content_dict, contents_path, None), 0]]
+        while len(stack) > 0:
+            level_1_row, entities, nb_rows_before   = stack[-1]
+            entity                          = next(entities, None)
+            if entity == None: # We are done with the sub-entities of the entity at the top of the stack
+                stack.pop()
+                if sparse == False and level_1_row != None and df_columns.nb_rows == nb_rows_before:
+                    # No sub-entity added rows, so add a row for this entity, with data from all its ancestors.
+                    # Ancestors' data goes last, so it wins if ancestors and descendants share columns
+                    row                     = dict(level_1_row)
+                    for ancestor in reversed(stack[1:]):
+                        row.update(ancestor[0])
+                    df_columns.add_row(row)
+                continue
+
+            e_uid, full_e_uid, e_path, e_dict       = entity
             loop_trace                      = parent_trace.doing("Looping on entity with path '" + e_path + "'",
                                                     data = {'signaledFrom': __file__})
 
-            inner_trace                     = loop_trace.doing("Determining name to give to UID column in DataFrame for a UID",
-                                                    data = {"entity UID": str(full_e_uid)})            
-
-            e_acronyminfo, UID_COL          = acronym_schema.schema_info_for_UID(parent_trace, e_uid)
+            e_acronyminfo, UID_COL          = acronym_schema.schema_info_for_UID(loop_trace, e_uid)
+            my_interval                     = df_columns.interval_for(loop_trace, UID_COL, e_acronyminfo.entity_name)
 
-            # Check if we already have an interval for this acronym info, and if not, create one
-            my_prior_interval               = [interval for interval in all_intervals 
-                                                        if e_acronyminfo.entity_name in interval.columns]
-            if len(my_prior_interval) == 0:          
-                my_interval                 = Interval( parent_trace    = my_trace, 
-                                                        columns         = [UID_COL, e_acronyminfo.entity_name],
-                                                        entity_name     = e_acronyminfo.entity_name)
-                all_intervals.append(my_interval)
-
-
-            inner_trace                     = loop_trace.doing("Checking tree under '" + e_path + "' is well formed",
-                                                    data = {'signaledFrom': __file__})
             if True:
                 # Check e.g. if content_dict = manifest_dict["assertion"]["big-rock"]["BR1"]["SubRock"]
                 # that content_dict["SR2"] exists
                 if e_dict == None:
-                    raise ApodeixiError(inner_trace, "Badly formatted tree: found nothing under '" + e_path + "'")
+                    raise ApodeixiError(loop_trace, "Badly formatted tree: found nothing under '" + e_path + "'")
                 # Check e.g. content_dict["SR2"] is a dictionary
                 if type(e_dict) != dict:
-                    raise ApodeixiError(inner_trace, "Badly formatted tree: expected dictionary at '" + e_path
+                    raise ApodeixiError(loop_trace, "Badly formatted tree: expected dictionary at '" + e_path
                                                        + "' but instead found a " + str(type(e_dict)))
                 # Check e.g. content_dict["SR2"]["UID"] exists
                 if not UID in e_dict.keys():
-                    raise ApodeixiError(inner_trace, "Badly formatted tree: expected a child called '" + UID
+                    raise ApodeixiError(loop_trace, "Badly formatted tree: expected a child called '" + UID
                                                     + "' under '" + e_path + "'") 
                 # Check e.g. content_dict["SR2"]["UID"] == "SR2", except possibly for padding (this occurs
                 # when the end user skips an entity). Thus, content_dict["SR2"]["UID"] = "MR0.SR2" would be OK
-                if e_dict[UID] != acronym_schema.pad_uid(parent_trace, full_e_uid):
-                    raise ApodeixiError(inner_trace, "Badly formatted tree: expected '" + e_path
+                padded_full_e_uid           = acronym_schema.pad_uid(loop_trace, full_e_uid)
+                if e_dict[UID] != padded_full_e_uid:
+                    raise ApodeixiError(loop_trace, "Badly formatted tree: expected '" + e_path
                                                    + "[" + UID + "] = " + full_e_uid + "'", 
                                                    data = {"expected": full_e_uid, "actual": str(e_dict[UID])})
                 # Check e.g. content_dict["SR2"]["UID"]['name'] exists
                 if not NAME in e_dict.keys():
-                    raise ApodeixiError(inner_trace, "Badly formatted tree: expected a child called '" + NAME
+                    raise ApodeixiError(loop_trace, "Badly formatted tree: expected a child called '" + NAME
                                                     + "' under '" + e_path + "'") 
-                    
-            inner_trace                     = loop_trace.doing("Building DataFrame row",
-                                                    data = {"entity path": str(e_path)})
-            # We call it "level 1" because it is for my_interval. Recursive calls would be the subsequent
-            # intervals, which are "level 2, 3, ..." in the content_df "tree"
+
+            # We call it "level 1" because it is for my_interval. Sub-entities' rows would be for
+            # subsequent intervals, which are "level 2, 3, ..." in the content_df "tree"
             new_level_1_row                 = {} 
             # Add the entity column to the level_1 row
             # But first replace by "friendly" UID like 'BR1.2' instead of "BR1.SR2", if we are thus configured
             if abbreviate_uids == True:
-                abbreviated_full_e_uid      = UID_Utils().abbreviate_uid(   parent_trace    = inner_trace, 
+                new_level_1_row[UID_COL]    = UID_Utils().abbreviate_uid(   parent_trace    = loop_trace, 
                                                                             uid             = full_e_uid,
                                                                             acronym_schema  = acronym_schema)
-                new_level_1_row[UID_COL]    = abbreviated_full_e_uid 
             else:
                 # Remember to pad if needed, i.e., maybe full_e_uid is BR1.TR1, but if the acronym schema 
                 # is [BR, MR, TR], we should put a BR1.MR0.TR1 in the new_level_1_row, not a BR1.TR1
-                new_level_1_row[UID_COL]    = acronym_schema.pad_uid(parent_trace, full_e_uid) 
+                new_level_1_row[UID_COL]    = padded_full_e_uid
             new_level_1_row[e_acronyminfo.entity_name]    = e_dict[NAME]
 
-            uid_info_list.append(UID_Info(  uid             = new_level_1_row[UID_COL], 
-                                            entity_value    = new_level_1_row[e_acronyminfo.entity_name]))
+            df_columns.uid_info_list.append(UID_Info(   uid             = new_level_1_row[UID_COL], 
+                                                        entity_value    = new_level_1_row[e_acronyminfo.entity_name]))
             
-            sub_entities                      = acronym_schema.find_entities(inner_trace, e_dict) # Something like "Sub rock"
+            sub_entities                    = acronym_schema.find_entities(loop_trace, e_dict) # Something like "Sub rock"
             # Now add the "scalar" attributes to the row and if needed also to the interval. A reason they may
             # not be in the interval already arises if we are creating the "first row" (i.e., entity e_uid) 
             # or if that attribute was not present in "previous rows"
-            #for attrib in [a for a in e_dict.keys() if not a in sub_entities and a not in SYNTHETIC_COLUMNS]:
             for attrib in [a for a in e_dict.keys() if not a in sub_entities and a not in SYNTHETIC_COLUMNS]:
                 if not attrib in my_interval.columns:
                     my_interval.columns.append(attrib)
                 new_level_1_row[attrib]     = e_dict[attrib]
 
-            # Now we gear up to make a recursive call. For example, if we have been processing the interval
-            # ["UID", "big-rock"] and e_dict = content_df["BR1"], we are now going to take the plunge into
-            # the unique sub-entity "Sub rock" and make a recursive call to process interval
-            # ["UID-1", "Sub rock"] passing content_df["BR1"]["Sub rock"] as the content to process.
-            #
-            # For our e_path = "assertion"."big-rock"."BR1" we pass a path of "assertion"."big-rock"."BR1"."Sub rock"
-            # we set "ourselves" ("BR1") as the parent_uid in the recursive call
-            sub_rows_across_subentities     = []
-            for sub_entity in sub_entities:
-                sub_rows                    = []
-                sub_intervals               = []
-                inner_trace                 = loop_trace.doing("Making a recursive call for '" + sub_entity + "'",
-                                                                data = {'signaledFrom': __file__})
-                
-                sub_intervals, sub_rows, sub_uid_info_list  = self._build_df_rows(  
-                                                                    parent_trace        = inner_trace, 
-                                                                    content_dict        = e_dict[sub_entity], 
-                                                                    acronym_schema      = acronym_schema,
-                                                                    parent_path         = e_path + '.' + sub_entity,
-                                                                    parent_uid          = full_e_uid,
-                                                                    sparse              = sparse,
-                                                                    abbreviate_uids     = abbreviate_uids)
-
-                uid_info_list.extend(sub_uid_info_list)
-
-                # Post-processing recursive call: handle the columns
-                # 
-                # The recursive call discovered what other columns pertain to the sub-entity. We need to merge this
-                # from two perspectives:
-                # -If this was the first time we created an interval for the sub-entity (e.g., for "Sub rock"),
-                #  then add it to the list of intervals.
-                # -However, if we already had an interval for "Sub rock" from having processed "previous rows",
-                #  then it may be that the recursive call we just made uncovered additional columns to be added to
-                #  that pre-existing row. See documentation for self._merge_interval
-                self._merge_interval_lists(loop_trace, all_intervals, sub_intervals)
-
-                sub_rows_across_subentities.extend(sub_rows)
-
-            # Post-processing recursive call: handle the rows
-            #
-            # This is where the logic of sparse or non-sparse applies. See documentation to this method to explain
-            # that algorithm
-            if sparse == True:                              # Add (1 + N) rows, here N = len(sub_rows)
-                all_rows.append(new_level_1_row)
-                for idx in range(len(sub_rows_across_subentities)):
-                    all_rows.append(sub_rows_across_subentities[idx])
-
-            else:                                           # Add N rows, where N = max(len(sub_rows), 1)
-                if len(sub_rows_across_subentities) > 0:
-                    for r in sub_rows_across_subentities: # Copy the "level 1" data to all sub-rows and add them
-                        for k in new_level_1_row.keys():
-                            r[k]                    = new_level_1_row[k]
-                        all_rows.append(r)
-                else:
-                    all_rows.append(new_level_1_row)
-
-        # Before returning, we need to sort the intervals to be order-consistent with the acronym_schema.
-        # This is needed because due to the possibility of some rows having skipped an entity, it is possible
-        # that in `all_intervals` we have the interval for UID-3 before the interval for UID-2.
-        my_trace                            = parent_trace.doing("Sorting intervals as per Acronym Schema",
-                                                            data = {"parent_uid":       str(parent_uid),
-                                                                    "acronym schema":   str(acronym_schema)})
-        sorted_intervals                    = []
-        for acronyminfo in acronym_schema.acronym_infos():
-            # Find the interval for this acronym, if there is one in our list so far
-            entity_name                     = acronyminfo.entity_name
-            matches                         = [interval for interval in all_intervals if entity_name in interval.columns]
-            if len(matches) > 1:
-                raise ApodeixiError(my_trace, "Found multiple intervals for the same entity, and there shoud be at most 1")
-            elif len(matches) == 1:
-                sorted_intervals.append(matches[0])
-
-        # Check we sorted everything
-        if len(sorted_intervals) != len(all_intervals):
-
-            raise ApodeixiError(my_trace, "Was not able to sort all intervals based on the Acronym Schema. Some intervals "
-                                            + " did not seem to correspond to anything recognized in the Acronym Schema, "
-                                            + "The sorted intervals should have been equally long as all_intervals",
-                                            data = {"len(all_intervals)":       str(len(all_intervals)),
-                                                    "len(sorted_intervals)":    str(len(sorted_intervals))})
-        
-        # Return value to caller (which for recursive call was this method itself, processing left interval to ours)
-        return sorted_intervals, all_rows, uid_info_list
-        
+            if sparse == True: # The entity's row goes before the rows of its sub-entities
+                df_columns.add_row(new_level_1_row)
 
-    
-    def _merge_2_intervals(self, parent_trace, growing, contributing):
-        '''
-        Helper methods that merges intervals for the same entity. expand growingInterval if needed
-        so that all the columns on contributing
-        
-        @param growing an Interval to expand by adding columns from `contributing`
-        @param contributing an Interval whose columns should be added to growing, if they are not already present
-        '''
-        if growing.entity_name != contributing.entity_name:
-            raise ApodeixiError(parent_trace, "Can't merge intervals for different entities: ''" 
-                                + growing.entity_name + "' and '" + contributing.entity_name + "'")
-        for c in contributing.columns:
-            if not c in growing.columns:
-                growing.columns.append(c)
-    
-    def _merge_interval(self, parent_trace, interval_list, contributing):
-        '''
-        Merges the Interval `contributing` into the list of intervals `interval_list`, following these
-        procedures:
-        
-        * If none of the intervals in `interval_list` is for the same entity as `contributing`, then we
-          add `contributing` as another member at the end of `interval_list`. 
-        * If on the other hand there is an index idx such that interval_list[idx] is for the same entity
-          as `contributing`, then we enlarge interval_list[idx] so that its columns include those of 
-          `contributing`. 
-          This can happen if there are some properties for an entity are "optional". 
-          For example, perhaps we are processing a manifest dict arose from parsing a posting like this:
-
-                UID         |   Big rock        |   Asset classes           | Intended user
-                ===========================================================================
-                BR1         | Lending UI        |  Mortgages, commercial    |
-                BR2         | Treasury UI       |                           | FX traders
-
-          Then the manifest will have a branch for the first row that will make us infer an
-          interval like 
-          
-                [UID, Big rock, Asset classes]
-                
-          Later when we process the manifest's branch that arose from the second row we will instead get 
-          an interval like 
-          
-                [UID, Big rock, Intended user]
-           
-          The correct "merge" behavior in such case is not to treat these as separate intervals, but to merge them 
-          as 
-                [UID, Big rock, Asset classes, Intended user]
-
-          
-        @param interval_list A list of Interval objects. It is modified by this method
-        @param contributing An Interval object
-        '''
-        for interval in interval_list:
-            if interval.entity_name == contributing.entity_name:
-                self._merge_2_intervals(parent_trace, interval, contributing)
-                return
-        # If we get this far, then we have a brand new entity
-        interval_list.append(contributing)
-                  
-    def _merge_interval_lists(self, parent_trace, growing_list, contributing_list):
-        '''
-        Helper method to merge intervals from `contributing_list` into the `growing_list`, ensuring
-        that there is at most one interval per entity. So if two intervals from each list are
-        from the same entity, their columns get merged into 1 interval, as opposed to ending up with 2
-        intervals
-        
-        @param growing_list A list of Interval objects. It is modified by this method
-        @param contributing_list A list of interval_objects
-        '''
-        for interval in contributing_list:
-            self._merge_interval(parent_trace, growing_list, interval)
+            # Now we gear up to process the sub-entities. For example, if we have been processing the interval
+            # ["UID", "big-rock"] and e_dict = content_df["BR1"], we are now going to take the plunge into
+            # the unique sub-entity "Sub rock" and process interval ["UID-1", "Sub rock"] for 
+            # content_df["BR1"]["Sub rock"]
+            stack.append([new_level_1_row, _sub_entities(e_dict, e_path, full_e_uid, sub_entities), df_columns.nb_rows])
 
+        df_columns.sort_intervals(parent_trace, acronym_schema)
+        return df_columns
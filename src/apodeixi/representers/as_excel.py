@@ -1,6 +1,9 @@
 
 import xlsxwriter
 import pandas                               as _pd
+import numpy                                as _numpy
+import heapq                                as _heapq
+import itertools                            as _itertools
 from xlsxwriter.utility                     import xl_col_to_name, xl_rowcol_to_cell, xl_range, xl_range_abs
 
 from apodeixi.util.a6i_error                import ApodeixiError
@@ -53,6 +56,27 @@ class ManifestRepresenter:
         #
         self.formula_shift_dict     = {}
 
+        # XL_FormatRegistry for the workbook being written, so that cells with the same formatting share the same 
+        # xlsxwriter Format. Set when the workbook is created.
+        self.format_registry        = None
+
+        # If True, the workbook is written in xlsxwriter's constant memory mode: each worksheet's rows are streamed
+        # to disk as soon as a later row is written, so cells must be written in row order. To that end, all cells
+        # of a worksheet are then collected in an XL_RowOrderedCellBatch and written when the worksheet is complete.
+        # Callers may change this attribute before calling dataframe_to_xl.
+        if a6i_config != None:
+            self.streaming          = a6i_config.get_StreamExcelForms(parent_trace)
+        else:
+            self.streaming          = False
+
+        # Used when self.streaming is True. Keys are worksheet names, and values are the XL_RowOrderedCellBatch
+        # objects with the cells to write to that worksheet
+        self._row_ordered_batches   = {}
+
+        # Set by self.prepareContents. Keys are manifest names, and values are XL_PreparedContent objects for manifests
+        # whose content was prepared ahead of writing the workbook
+        self._prepared_contents     = {}
+
         return
 
     POSTING_LABEL_SHEET     = "Posting Label"
@@ -61,6 +85,9 @@ class ManifestRepresenter:
     FORMULA_SHIFT_X         = "FORMULA_SHIFT_X"
     FORMULA_SHIFT_Y         = "FORMULA_SHIFT_Y"
 
+    # Header of the extra column where cumulative sums are displayed, for columns configured to have them
+    CUMULATIVE_HEADER       = "Cumulative"
+
     def dataframe_to_xl(self, parent_trace, excel_folder, excel_filename):
         '''
         '''
@@ -69,7 +96,10 @@ class ManifestRepresenter:
         
         PathUtils().create_path_if_needed(my_trace, excel_folder)
 
-        workbook                = xlsxwriter.Workbook(excel_folder + '/' + excel_filename)
+        workbook                = xlsxwriter.Workbook(excel_folder + '/' + excel_filename, 
+                                                        {'constant_memory': self.streaming})
+        self.format_registry    = XL_FormatRegistry(workbook)
+        self._row_ordered_batches = {}
 
         my_trace                = parent_trace.doing("Enriching Posting Label with location of manifest data")
         self._add_data_locations_to_posting_label(my_trace, workbook)
@@ -89,6 +119,32 @@ class ManifestRepresenter:
 
         return ManifestRepresenter.SUCCESS
 
+    def prepareContents(self, parent_trace, executor):
+        '''
+        Optional step before calling self.dataframe_to_xl, which prepares the content of manifests so that less
+        work is left for dataframe_to_xl: building the DataFrames to display and computing their column widths.
+
+        Each manifest is prepared in a separate task submitted to `executor`, which may run them in parallel. Only
+        manifests whose AsExcel_Config is standalone (refer to AsExcel_Config.is_standalone) are prepared, since
+        the others depend on the state built while writing the workbook. If several manifests fail, the error
+        raised is that of the first of them in self.manifestInfo_dict.
+
+        The Excel spreadsheet later written by dataframe_to_xl is the same as if this method had not been called.
+
+        @param executor A concurrent.futures.Executor, such as a ThreadPoolExecutor
+        '''
+        futures                 = {}
+        for name in self.manifestInfo_dict.keys():
+            loop_trace          = parent_trace.doing("Preparing Excel content for '" + str(name) + "'")
+            config              = self.xlw_config_table.getManifestXLWriteConfig(loop_trace, name)
+            if not config.is_standalone(loop_trace):
+                continue
+            df                  = self.manifestInfo_dict[name].getManifestContents(loop_trace)
+            futures[name]       = executor.submit(self._prepare_content, loop_trace, df, config)
+
+        for name in futures.keys():
+            self._prepared_contents[name] = futures[name].result()
+
     def _add_data_locations_to_posting_label(self, parent_trace, workbook):
         '''
         Adds entries like
@@ -236,6 +292,8 @@ class ManifestRepresenter:
             #
             #self._unprotect_free_space(parent_trace, worksheet = worksheet)
 
+            # Only now, after all manifests for this worksheet were laid out, can its cells be written in row order
+            self._write_row_ordered_cells(parent_trace, worksheet)
             self._remember_formatting(worksheet, worksheet.get_name())
 
     def _write_posting_label(self, parent_trace, workbook):
@@ -263,6 +321,7 @@ class ManifestRepresenter:
                                 xl_config       = label_xlw_config, 
                                 text            = ME.POSTING_LABEL_SHEET)
 
+        self._write_row_ordered_cells(parent_trace, posting_label_worksheet)
         self._remember_formatting(posting_label_worksheet, ME.POSTING_LABEL_SHEET)
 
     def _write_text_label(self, parent_trace, workbook, worksheet, xl_config, text):
@@ -288,8 +347,57 @@ class ManifestRepresenter:
                       
         title               = text
         fmt_dict            ={'bold': True, 'font_color': Palette.DARK_BLUE}
-        fmt                 = workbook.add_format(fmt_dict)
-        worksheet.write(title_y, title_x, title, fmt)
+        fmt                 = self.format_registry.format(fmt_dict)
+        self._write_rows(parent_trace, worksheet, [(title_y, [(title_y, title_x, title, fmt, xl_config.layout)])])
+
+    def _new_format_grid(self, parent_trace, layout):
+        '''
+        Returns the XL_FormatGrid to use for writing the cells of the `layout`. Derived classes may override it, e.g.,
+        for benchmarking
+        '''
+        return XL_FormatGrid(parent_trace, layout, self.format_registry)
+
+    def _new_cell_batch(self, worksheet):
+        '''
+        Returns the XL_CellBatch to use for writing cells to the `worksheet`. Derived classes may override it, e.g.,
+        for benchmarking
+        '''
+        return XL_CellBatch(worksheet)
+
+    def _write_rows(self, parent_trace, worksheet, rows):
+        '''
+        Writes to the `worksheet` the cells in `rows`, an iterable over tuples (excel_row, cells) in increasing order
+        of `excel_row`, such as the generator returned by self._populated_rows.
+
+        If we are streaming, nothing is written yet: `rows` is added to the worksheet's XL_RowOrderedCellBatch, which
+        writes the rows of all the data laid out in the worksheet, in row order, when self._write_row_ordered_cells
+        is called for the worksheet. Otherwise each row is written right away.
+        '''
+        if self.streaming:
+            sheet               = worksheet.get_name()
+            cell_batch          = self._row_ordered_batches.get(sheet)
+            if cell_batch == None:
+                cell_batch      = XL_RowOrderedCellBatch(worksheet)
+                self._row_ordered_batches[sheet] = cell_batch
+            cell_batch.add_rows(rows)
+            return
+
+        cell_batch              = self._new_cell_batch(worksheet)
+        for excel_row, cells in rows:
+            for row, col, val, fmt, layout in cells:
+                cell_batch.add(row, col, val, fmt, layout)
+            cell_batch.flush(parent_trace)
+
+    def _write_row_ordered_cells(self, parent_trace, worksheet):
+        '''
+        If we are streaming, writes the rows of all the data laid out in the `worksheet`, in row order. Must be 
+        called once nothing else remains to be laid out in the worksheet. No-op if we are not streaming.
+        '''
+        cell_batch              = self._row_ordered_batches.pop(worksheet.get_name(), None)
+        if cell_batch != None:
+            my_trace            = parent_trace.doing("Writing cells in row order",
+                                                        data = {"sheet": worksheet.get_name()})
+            cell_batch.write_all(my_trace)
 
     def _remember_formatting(self, worksheet, sheet):
         '''
@@ -309,11 +417,11 @@ class ManifestRepresenter:
         scaled_width    = column_width * self._scale_to_font_size(parent_trace, font_size = 11)
         worksheet.set_column(xl_x,      xl_x,       scaled_width)
 
-    def _write_val(self,    parent_trace,   workbook,   worksheet,  layout_x,   layout_y, 
+    def _write_val(self,    parent_trace,   cells,      format_grid,    layout_x,   layout_y, 
                             excel_row,      excel_col,  val,        layout,     num_format):
         '''
-        Writes the value `val` to the given worksheet. The Excel location for writing the value is given 
-        by the `excel_row` and `excel_col` parameters, which are in the Excel coordinate space.
+        Adds the value `val` to `cells`, the list of cells for the caller to write to a worksheet. The Excel location for writing
+        the value is given by the `excel_row` and `excel_col` parameters, which are in the Excel coordinate space.
 
         The `layout_x` and `layout_y` are in the layout space, which may be different than Excel's for
         different reasons, including:
@@ -325,6 +433,9 @@ class ManifestRepresenter:
           manifests, Excel rows correspond to the layout x axis instead of the layout y axis. 
           The dual is true for Excel columns.
 
+        @param cells A list of tuples (row, col, val, fmt, layout), to which the cell for the value is appended. The
+                            value is only written when the caller writes these cells.
+        @param format_grid An XL_FormatGrid for the `layout`
         @param layout_x An int. Represents the x-coordinate in layout space.
         @param layout_y An int. Represents the y-coordinates in layout space.
         @param excel_row An int. Normally this should be the same as layout_y, except in cases special
@@ -347,12 +458,7 @@ class ManifestRepresenter:
                                                     "layout.name":      str(layout.name),
                                                     "excel row":        str(excel_row),
                                                     "excel column":     str(excel_col)})
-        fmt_dict        = layout.getFormat(parent_trace, layout_x, layout_y)
-        if num_format != None:
-            fmt_dict    = fmt_dict.copy() # GOTCHA - copy or else subsequent use of xlsxwriter will use a polluted format
-            fmt_dict['num_format'] = num_format
-
-        fmt             = workbook.add_format(fmt_dict)
+        fmt             = format_grid.format(parent_trace, layout_x, layout_y, num_format)
 
         # clean_val might be an empty string if it was NaN or something like that. However, even an empty string
         # can cause problems later in the processing if the column in question is supposed to be a number,
@@ -362,35 +468,15 @@ class ManifestRepresenter:
         if type(clean_val) == str and len(clean_val.strip()) == 0 and (num_format == NumFormats.INT or num_format == NumFormats.DOUBLE):
             clean_val   = 0
         
-        try:
-            worksheet.write(excel_row, excel_col, clean_val, fmt)
+        cells.append((excel_row, excel_col, clean_val, fmt, layout))
 
-        except Exception as ex:
-            raise ApodeixiError(parent_trace, "Encountered a problem when writing a cell in Excel",
-                                            data = {"problematic val":  str(clean_val),
-                                                    "error":            str(ex),
-                                                    "layout.name":      str(layout.name),
-                                                    "excel row":        str(excel_row),
-                                                    "excel column":     str(excel_col)})
-
-
-    def _populate_worksheet(self, parent_trace, content_df, xlw_config, workbook, worksheet):
+    def _prepare_content(self, parent_trace, content_df, xlw_config):
         '''
-        Helper method to write the block in Excel that comes from the manifest's content (as opposed to the Posting Label 
-        data).
-        Returns the layout against which the `content_df` was pasted.
+        Helper method to _populate_worksheet, which computes all that is needed to write `content_df` to a worksheet
+        without yet touching the workbook: the DataFrame to display (in layout space and in Excel space) and the
+        optimal column widths.
 
-        Transpose functionality is supported. So we have 2 spaces:
-
-        1. "Layout space" - those are the coordinates for content_df and config, config.layout. We use layout_x, layout_y
-            for these coordinates.
-        2. "Excel space" - the coordinates in Excel. We use xl_x, xl_y for these coordinates.
-
-        The relationship between both spaces depends on the config.layout.is_transposed flag. If True, then
-
-            xl_x = layout_y and xl_y = layout_x.
-
-        Otherwise, xl_x = layout_x and xl_y = layout_y
+        Returns an XL_PreparedContent object.
 
         @param xlw_config An AsExcel_Config object specifying how the data in `content_df` should be laid out on 
                         the worksheet
@@ -417,18 +503,17 @@ class ManifestRepresenter:
             #   In such situations, Pandas "misbehaves" and adds a new column "Q1 FY22" instead of modifying
             #   the column ("Q1 FY22", "Actuals").
             #   So instead we use iloc, not loc, which is why we need to get the column indices
-            for row in displayable_df.iterrows():
-                for jdx in range(len(displayable_df.columns)):
-                #for col in displayable_df.columns:
-                    col                 = displayable_df.columns[jdx]
-                    if col in xlw_config.num_formats.keys():
-                        num_format      = xlw_config.num_formats[col]
-                        if num_format == NumFormats.INT or num_format == NumFormats.DOUBLE:
-
-                            val             = row[1][col]
-                            if type(val) == str and len(val.strip()) == 0:
-                                #displayable_df.loc[row[0],col] = 0
-                                displayable_df.iloc[row[0],jdx] = 0
+            #
+            # This is done a column at a time, instead of iterating through the rows, since it is much faster for
+            # big manifests
+            for jdx in range(len(displayable_df.columns)):
+                col                     = displayable_df.columns[jdx]
+                if col in xlw_config.num_formats.keys():
+                    num_format          = xlw_config.num_formats[col]
+                    if num_format == NumFormats.INT or num_format == NumFormats.DOUBLE:
+                        blank_rows      = self._blank_positions(displayable_df.iloc[:, jdx])
+                        if len(blank_rows) > 0:
+                            displayable_df.iloc[blank_rows, jdx] = 0
 
 
             layout.validate(my_trace)
@@ -453,12 +538,48 @@ class ManifestRepresenter:
             # Dictionary - keys are columns of displayable_df, vals are sub-dicts {'width': <number>, 'nb_lines': <number>}
             widths_dict         = calc.calc(inner_trace) 
 
-            # Remember these to support debugging
-            # The layout.name *must* be the manifest_identifier if we are populating a manifest (as opposed to a posting label)
-            name                            = layout.name 
-            self.widths_dict_dict[name]     = widths_dict
-            self.span_dict[name]            = span
-            self.hidden_cols_dict[name]     = xlw_config.hidden_cols
+        return XL_PreparedContent(displayable_df, xl_df, widths_dict, span)
+
+    def _populate_worksheet(self, parent_trace, content_df, xlw_config, workbook, worksheet):
+        '''
+        Helper method to write the block in Excel that comes from the manifest's content (as opposed to the Posting Label 
+        data).
+        Returns the layout against which the `content_df` was pasted.
+
+        Transpose functionality is supported. So we have 2 spaces:
+
+        1. "Layout space" - those are the coordinates for content_df and config, config.layout. We use layout_x, layout_y
+            for these coordinates.
+        2. "Excel space" - the coordinates in Excel. We use xl_x, xl_y for these coordinates.
+
+        The relationship between both spaces depends on the config.layout.is_transposed flag. If True, then
+
+            xl_x = layout_y and xl_y = layout_x.
+
+        Otherwise, xl_x = layout_x and xl_y = layout_y
+
+        @param xlw_config An AsExcel_Config object specifying how the data in `content_df` should be laid out on 
+                        the worksheet
+        '''
+        layout                  = xlw_config.layout
+        is_transposed           = layout.is_transposed
+        format_grid             = self._new_format_grid(parent_trace, layout)
+
+        # The content may have been prepared ahead of time by self.prepareContents, possibly in another thread.
+        # The layout.name *must* be the manifest_identifier if we are populating a manifest (as opposed to a posting label)
+        name                    = layout.name 
+        prepared_content        = self._prepared_contents.pop(name, None)
+        if prepared_content == None:
+            prepared_content    = self._prepare_content(parent_trace, content_df, xlw_config)
+        displayable_df          = prepared_content.displayable_df
+        xl_df                   = prepared_content.xl_df
+        widths_dict             = prepared_content.widths_dict
+        span                    = prepared_content.span
+
+        # Remember these to support debugging
+        self.widths_dict_dict[name]     = widths_dict
+        self.span_dict[name]            = span
+        self.hidden_cols_dict[name]     = xlw_config.hidden_cols
 
         # Now we start laying out content on the worksheet. 
         # Start by re-sizing the columns.
@@ -475,170 +596,303 @@ class ManifestRepresenter:
                     xl_x        = xlw_config.x_offset + xl_idx
                 self._set_column_width(loop_trace, worksheet, xl_x, width, layout)
    
-        # Now populate headers
-        my_trace                        = parent_trace.doing("Populating headers", data = {'layout span': str(span)})
-        if True:            
+        # Now work out the range of cells to which each column's formulas apply, if any. Formulas may need wider 
+        # columns, and column widths are not cells, so they are set right away
+        my_trace                        = parent_trace.doing("Planning formulas", data = {'layout span': str(span)})
+        if True:
             columns                     = displayable_df.columns
+            # Keys are layout column numbers of the columns with formulas, and values are the tuples returned
+            # by self._formula_range
+            formula_ranges              = {}
             for layout_idx in range(len(columns)): # GOTCHA: Loop is in "Layout space"
                 col                     = columns[layout_idx]
                 loop_trace              = my_trace.doing("Processing layout column '" + str(col) + "'")
-                layout_x                = xlw_config.x_offset + layout_idx
-                layout_y                = xlw_config.y_offset 
+                formula_range           = self._formula_range(loop_trace, displayable_df, xlw_config, layout_idx)
+                if formula_range != None:
+                    formula_ranges[layout_idx]  = formula_range
+                    first_x, first_y, last_x, last_y = formula_range
+                    self._set_formula_widths(   parent_trace        = loop_trace,
+                                                column              = col,
+                                                column_width        = width,
+                                                last_x              = last_x,
+                                                data_df             = displayable_df,
+                                                config              = xlw_config,
+                                                worksheet           = worksheet)
+
+        # Remember UID -> row mappings before any cell is written, since writing cells may be deferred if we are
+        # streaming, and other manifests joined to this one need the mappings to be laid out
+        my_trace                        = parent_trace.doing("Linking UIDs to Excel rows", data = {'layout span': str(span)})
+        self._link_UIDs(my_trace, displayable_df, xlw_config)
+
+        # Now lay out the headers and content. Rows are computed one at a time, in Excel row order, so that if we
+        # are streaming each of them is written as soon as it is complete, instead of keeping the worksheet's
+        # cells in memory
+        my_trace                        = parent_trace.doing("Populating headers and content", 
+                                                                data = {'layout span': str(span)})
+        rows                            = self._populated_rows(my_trace, displayable_df, xlw_config, format_grid, 
+                                                                formula_ranges)
+        self._write_rows(my_trace, worksheet, rows)
+
+        # Add any drop downs that where configured
+        # If we have drop downs for this column, add them to the worksheet
+        my_trace                        = parent_trace.doing("Populating dropdowns", data = {'layout span': str(span)})
+        self._add_dropdowns(my_trace, workbook, worksheet, xlw_config, displayable_df)
 
+    def _link_UIDs(self, parent_trace, displayable_df, xlw_config):
+        '''
+        Remembers in self.link_table the Excel row where each UID in `displayable_df` is displayed, for aligning other
+        manifests joined to this one when they are laid out later on.
+        '''
+        name                            = xlw_config.layout.name
+        columns                         = displayable_df.columns
+        index                           = displayable_df.index
+        # Like DataFrame.iterrows, this gives the values of displayable_df's rows
+        values                          = displayable_df.values
+        for layout_idx in range(len(columns)): # GOTCHA: Loop is in "Layout space"
+            col                         = columns[layout_idx]
+            if not IntervalUtils().is_a_UID_column(parent_trace, col):
+                continue
+            for row_pos in range(len(index)):
+                row_nb                  = index[row_pos]
+                raw_uid                 = values[row_pos][layout_idx]
+                # Only if there is a value in the UID column, since we allow the case that it be blank in some rows if
+                # we default it from earlier rows (as when constructing an n-table instead of a b-table: refer
+                # to the AssertionTree documentation)
+                if StringUtils().is_blank(raw_uid):
+                    continue
+                loop_trace              = parent_trace.doing("Processing column = '" + str(col) 
+                                                                + "' row = '" + str(row_nb) + "'")
                 excel_row, excel_col, last_excel_row, last_excel_col    = xlw_config.df_xy_2_excel_xy(
-                                                                            parent_trace            = parent_trace, 
-                                                                            displayable_df          = displayable_df,
-                                                                            df_row_number           = -1, # -1 for headers
+                                                                            parent_trace            = loop_trace,
+                                                                            displayable_df          = displayable_df, 
+                                                                            df_row_number           = row_nb,
                                                                             df_col_number           = layout_idx,
                                                                             representer             = self)
-                if type(col) == tuple: 
-                    # This happens when displayble_df uses a MultiIndex. For example, when estimates data is specific to a subproduct
-                    # so get columns like (<subproduct>, "Q1"), (<subproduct>, "Q2"), etc.
-                    # In that case we need more than one row for the headers
-                    headers             = list(col)
-                else:
-                    headers             = [col]
-                
-                for header_jdx in range(len(headers)):
-                    col_val             = headers[header_jdx]
-                    # If col is not a tuple, then xl_col = excel_col and xl_row = excel_row
-                    # Otherwise, xl_row <= excel_row for non-transposed data sets, i.e., we place the multi-level headers
-                    # so that the last row they use is excel_row.
-                    # For transposed data sets is it similar, but xl_col <= excel_col in that case
-                    if is_transposed:
-                        xl_row          = excel_row
-                        xl_col          = excel_col + header_jdx - len(headers) + 1
-
-                    else:
-                        xl_row          = excel_row + header_jdx - len(headers) + 1
-                        xl_col          = excel_col
-                    self._write_val(        parent_trace        = loop_trace, 
-                                            workbook            = workbook, 
-                                            worksheet           = worksheet, 
-                                            layout_x            = layout_x, 
-                                            layout_y            = layout_y, #No change even if col is a tuple, since in layout space columns are a single row, and layout_y is only relevenat for purposes of getting the formatters
-                                            excel_row           = xl_row, 
-                                            excel_col           = xl_col,
-                                            val                 = col_val, 
-                                            layout              = layout, 
-                                            num_format          = None)
-        # Now lay out the content
-        my_trace                        = parent_trace.doing("Populating content", data = {'layout span': str(span)})
-        if True:
-            for layout_idx in range(len(columns)):
-                col                     = columns[layout_idx]
-                outer_loop_trace        = my_trace.doing("Processing column = '" + str(col) + "'")
-
-                # These are the coordinates of the first cell populated with content for this column
-                # They are needed later to define the start of the range to which a column-level formula applies,
-                # if such a formula has been configured to be required. They are set in the first cycle of the loop,
-                # so we initialize them to None so that the loop uses that as the hint that it is on the first cycle
-                first_x                 = None
-                first_y                 = None
-                # This will be set in each cycle of the loop, so after the loop they will correspond to the last
-                # cell populated for this column
-                last_x                  = None
-                last_y                  = None
-                for row in displayable_df.iterrows(): # GOTCHA: Loop is in "Layout space"
-                    row_nb      = row[0]
-                    row_content = row[1]
-                
-                    loop_trace          = outer_loop_trace.doing("Processing column = '" + str(col) 
-                                                                    + "' row = '" + str(row_nb) + "'")
-                    layout_x            = xlw_config.x_offset + layout_idx 
-                    layout_y            = xlw_config.y_offset + 1 + row_nb # An extra '1' because of the headers
-                    excel_row, excel_col, last_excel_row, last_excel_col    = xlw_config.df_xy_2_excel_xy(
-                                                                                parent_trace            = loop_trace,
-                                                                                displayable_df          = displayable_df, 
-                                                                                df_row_number           = row_nb,
-                                                                                df_col_number           = layout_idx,
-                                                                                representer             = self)
-
-                    # If we have inserted formulas that took space, shift accordingly 
-                    if xlw_config.sheet in self.formula_shift_dict.keys():
-                        formula_shift   = self.formula_shift_dict[xlw_config.sheet]
-                        layout_x        += formula_shift.shift_x
-                        layout_y        += formula_shift.shift_y  
-
-                    if first_x == None:
-                        first_x         = layout_x
-                    if first_y == None:
-                        first_y         = layout_y
-                 
-                    num_format          = None
-                    if col in xlw_config.num_formats.keys():
-                        num_format      = xlw_config.num_formats[col]
-
-                    val             = row_content[col]
-
-
-                    self._write_val(    parent_trace        = loop_trace, 
-                                        workbook            = workbook, 
-                                        worksheet           = worksheet, 
-                                        layout_x            = layout_x, 
-                                        layout_y            = layout_y, 
-                                        excel_row           = excel_row, 
-                                        excel_col           = excel_col,
-                                        val                 = val, 
-                                        layout              = layout, 
-                                        num_format          = num_format)
-
-                    # Remember UID -> row mapping, for aligninig other joined manifests later on. But only if there
-                    # is a value in the UID column, since we allow the case that it be blank in some rows if
-                    # we default it from earlier rows (as when constructing an n-table instead of a b-table: refer
-                    # to the AssertionTree documentation)
-                    if IntervalUtils().is_a_UID_column(parent_trace, col) and not StringUtils().is_blank(val):
-
-                        # Bug fix: raw_uid might be abbreviated, like "BR10.1". We need to unabbreviate it to
-                        # something like "BR10.B1"
-                        uid_store       = UID_Store(parent_trace)
-                        manifest_info   = self.manifestInfo_dict[xlw_config.manifest_name]
-
-                        manifest_dict   = manifest_info.getManifestDict(parent_trace)
-      
-                        acronym_schema  = UID_Acronym_Schema()
-                        acronym_schema.build_schema_from_manifest(parent_trace, manifest_dict) 
-                        uid_store.set_acronym_schema(parent_trace, acronym_schema) 
-
-                        uid_store.initializeFromManifest(my_trace, manifest_dict)
-                        raw_uid         = row_content[col]
-
-                        good_uid        = UID_Utils().unabbreviate_uid( parent_trace        = loop_trace, 
+
+                # Bug fix: raw_uid might be abbreviated, like "BR10.1". We need to unabbreviate it to
+                # something like "BR10.B1"
+                uid_store               = UID_Store(parent_trace)
+                manifest_info           = self.manifestInfo_dict[xlw_config.manifest_name]
+
+                manifest_dict           = manifest_info.getManifestDict(parent_trace)
+
+                acronym_schema          = UID_Acronym_Schema()
+                acronym_schema.build_schema_from_manifest(parent_trace, manifest_dict) 
+                uid_store.set_acronym_schema(parent_trace, acronym_schema) 
+
+                uid_store.initializeFromManifest(loop_trace, manifest_dict)
+
+                good_uid                = UID_Utils().unabbreviate_uid( parent_trace        = loop_trace, 
                                                                         uid                 = str(raw_uid), 
                                                                         acronym_schema      = acronym_schema)
 
-                        self.link_table.keep_row_last_UID(parent_trace, 
-                                                            manifest_identifier     = name, 
-                                                            row_nb                  = excel_row, 
-                                                            uid                     = good_uid) 
-
-                    last_x              = layout_x
-                    last_y              = excel_row
-                # Before exiting this row, write any formulas associated to this column
-                # Sometimes where there are joins, the last_y is not the same as where the manifest's
-                # area should end. In such cases we rely on the last_excel_row to tell us where the manifest's
-                # area ended so we correctly position the formaulae
-                if last_excel_row != None:
-                    last_y              = last_excel_row
-                self._add_formulas( parent_trace        = outer_loop_trace,
-                                    column              = col,
-                                    column_width        = width,
-                                    first_x             = first_x,
-                                    first_y             = first_y,
-                                    last_x              = last_x,
-                                    last_y              = last_y,
-                                    data_df             = displayable_df,
-                                    config              = xlw_config,
-                                    workbook            = workbook,
-                                    worksheet           = worksheet)
+                self.link_table.keep_row_last_UID(parent_trace, 
+                                                    manifest_identifier     = name, 
+                                                    row_nb                  = excel_row, 
+                                                    uid                     = good_uid) 
 
-        # Add any drop downs that where configured
-        # If we have drop downs for this column, add them to the worksheet
-        my_trace                        = parent_trace.doing("Populating dropdowns", data = {'layout span': str(span)})
-        self._add_dropdowns(my_trace, workbook, worksheet, xlw_config, displayable_df)
+    def _header_cells(self, parent_trace, displayable_df, xlw_config, format_grid):
+        '''
+        Returns a list of tuples (row, col, val, fmt, layout) for the cells of the headers of `displayable_df`
+        '''
+        is_transposed                   = xlw_config.layout.is_transposed
+        cells                           = []
+        columns                         = displayable_df.columns
+        for layout_idx in range(len(columns)): # GOTCHA: Loop is in "Layout space"
+            col                         = columns[layout_idx]
+            loop_trace                  = parent_trace.doing("Processing layout column '" + str(col) + "'")
+            layout_x                    = xlw_config.x_offset + layout_idx
+            layout_y                    = xlw_config.y_offset 
+
+            excel_row, excel_col, last_excel_row, last_excel_col    = xlw_config.df_xy_2_excel_xy(
+                                                                        parent_trace            = parent_trace, 
+                                                                        displayable_df          = displayable_df,
+                                                                        df_row_number           = -1, # -1 for headers
+                                                                        df_col_number           = layout_idx,
+                                                                        representer             = self)
+            if type(col) == tuple: 
+                # This happens when displayble_df uses a MultiIndex. For example, when estimates data is specific to a subproduct
+                # so get columns like (<subproduct>, "Q1"), (<subproduct>, "Q2"), etc.
+                # In that case we need more than one row for the headers
+                headers                 = list(col)
+            else:
+                headers                 = [col]
+            
+            for header_jdx in range(len(headers)):
+                col_val                 = headers[header_jdx]
+                # If col is not a tuple, then xl_col = excel_col and xl_row = excel_row
+                # Otherwise, xl_row <= excel_row for non-transposed data sets, i.e., we place the multi-level headers
+                # so that the last row they use is excel_row.
+                # For transposed data sets is it similar, but xl_col <= excel_col in that case
+                if is_transposed:
+                    xl_row              = excel_row
+                    xl_col              = excel_col + header_jdx - len(headers) + 1
+
+                else:
+                    xl_row              = excel_row + header_jdx - len(headers) + 1
+                    xl_col              = excel_col
+                self._write_val(        parent_trace        = loop_trace, 
+                                        cells               = cells, 
+                                        format_grid         = format_grid, 
+                                        layout_x            = layout_x, 
+                                        layout_y            = layout_y, #No change even if col is a tuple, since in layout space columns are a single row, and layout_y is only relevenat for purposes of getting the formatters
+                                        excel_row           = xl_row, 
+                                        excel_col           = xl_col,
+                                        val                 = col_val, 
+                                        layout              = xlw_config.layout, 
+                                        num_format          = None)
+        return cells
+
+    def _content_cell(self, parent_trace, cells, displayable_df, values, xlw_config, format_grid, row_pos, layout_idx):
+        '''
+        Adds to `cells` the cell for the content of `displayable_df` at row position `row_pos` and column 
+        number `layout_idx`
+
+        @param cells A list of tuples (row, col, val, fmt, layout), to which the cell is appended
+        @param values The values of `displayable_df`'s rows, as given by `displayable_df.values`
+        '''
+        row_nb                          = displayable_df.index[row_pos]
+        col                             = displayable_df.columns[layout_idx]
+        layout_x                        = xlw_config.x_offset + layout_idx 
+        layout_y                        = xlw_config.y_offset + 1 + row_nb # An extra '1' because of the headers
+        excel_row, excel_col, last_excel_row, last_excel_col    = xlw_config.df_xy_2_excel_xy(
+                                                                    parent_trace            = parent_trace,
+                                                                    displayable_df          = displayable_df, 
+                                                                    df_row_number           = row_nb,
+                                                                    df_col_number           = layout_idx,
+                                                                    representer             = self)
+
+        # If we have inserted formulas that took space, shift accordingly 
+        if xlw_config.sheet in self.formula_shift_dict.keys():
+            formula_shift               = self.formula_shift_dict[xlw_config.sheet]
+            layout_x                    += formula_shift.shift_x
+            layout_y                    += formula_shift.shift_y  
+
+        num_format                      = None
+        if col in xlw_config.num_formats.keys():
+            num_format                  = xlw_config.num_formats[col]
+
+        self._write_val(    parent_trace        = parent_trace, 
+                            cells               = cells, 
+                            format_grid         = format_grid, 
+                            layout_x            = layout_x, 
+                            layout_y            = layout_y, 
+                            excel_row           = excel_row, 
+                            excel_col           = excel_col,
+                            val                 = values[row_pos][layout_idx], 
+                            layout              = xlw_config.layout, 
+                            num_format          = num_format)
+
+    def _populated_rows(self, parent_trace, displayable_df, xlw_config, format_grid, formula_ranges):
+        '''
+        Generator of the cells for the headers and content of `displayable_df`, and for the formulas configured
+        for its columns, if any.
+
+        It yields tuples (excel_row, cells) in increasing order of `excel_row`, where `cells` is a list of tuples
+        (row, col, val, fmt, layout) for the cells in that Excel row. Within a row, cells are listed in the order in
+        which they would be written if content was written a column at a time, so that if some cell is written 
+        more than once the same value wins. Rows are only computed as they are yielded, so the caller may write 
+        each row before the next one is computed.
+
+        @param formula_ranges A dictionary whose keys are the layout column numbers of the columns with formulas,
+                        and whose values are the tuples returned by self._formula_range for those columns
+        '''
+        is_transposed                   = xlw_config.layout.is_transposed
+        columns                         = displayable_df.columns
+        index                           = displayable_df.index
+        # Like DataFrame.iterrows, this gives the values of displayable_df's rows
+        values                          = displayable_df.values
+
+        # Cells computed but not yielded yet. Keys are Excel rows, and values are lists of cells. It starts with
+        # the headers, which are just a few cells per column
+        pending                         = {}
+        for cell in self._header_cells(parent_trace, displayable_df, xlw_config, format_grid):
+            pending.setdefault(cell[0], []).append(cell)
+
+        # Each line of content is displayed in a single Excel row: a row of displayable_df if the layout is not
+        # transposed, and a column otherwise. Lines are visited in the order of their Excel rows, which may differ
+        # from their order in layout space, e.g., if this manifest is joined to another one
+        if is_transposed:
+            nb_lines                    = len(columns)
+        elif len(columns) > 0:
+            nb_lines                    = len(index)
+        else:
+            nb_lines                    = 0
+        line_keys                       = _numpy.zeros(nb_lines, dtype = int)
+        for line_nb in range(nb_lines):
+            if is_transposed:
+                df_row_number           = -1 # -1 for headers
+                df_col_number           = line_nb
+            else:
+                df_row_number           = index[line_nb]
+                df_col_number           = 0
+            excel_row, excel_col, last_excel_row, last_excel_col    = xlw_config.df_xy_2_excel_xy(
+                                                                        parent_trace            = parent_trace,
+                                                                        displayable_df          = displayable_df, 
+                                                                        df_row_number           = df_row_number,
+                                                                        df_col_number           = df_col_number,
+                                                                        representer             = self)
+            line_keys[line_nb]          = excel_row
+        line_order                      = _numpy.argsort(line_keys, kind = 'stable')
+
+        # Excel rows with content, formulas or headers, in increasing order. There may be repetitions
+        row_iterables                   = [sorted(pending.keys()), (int(line_keys[line_nb]) for line_nb in line_order)]
+        for layout_idx in formula_ranges.keys():
+            row_iterables.append(self._formula_rows(parent_trace, columns[layout_idx], formula_ranges[layout_idx], 
+                                                    xlw_config))
+        order_idx                       = 0 # Position in line_order of the next line to visit
+        last_row                        = None
+        for excel_row in _heapq.merge(*row_iterables):
+            if excel_row == last_row:
+                continue
+            last_row                    = excel_row
+            loop_trace                  = parent_trace.doing("Processing Excel row", data = {"excel row": str(excel_row)})
+
+            lines                       = []
+            while order_idx < nb_lines and line_keys[line_order[order_idx]] == excel_row:
+                lines.append(int(line_order[order_idx]))
+                order_idx               += 1
+
+            cells                       = []
+            if is_transposed:
+                for layout_idx in lines:
+                    for row_pos in range(len(index)):
+                        self._content_cell( loop_trace, cells, displayable_df, values, xlw_config, format_grid, 
+                                            row_pos, layout_idx)
+            else:
+                for layout_idx in range(len(columns)):
+                    for row_pos in lines:
+                        self._content_cell( loop_trace, cells, displayable_df, values, xlw_config, format_grid, 
+                                            row_pos, layout_idx)
+                    if layout_idx in formula_ranges.keys():
+                        cells.extend(self._formula_cells(   loop_trace, columns[layout_idx], 
+                                                            formula_ranges[layout_idx], xlw_config, excel_row))
+            for cell in cells:
+                pending.setdefault(cell[0], []).append(cell)
+            for row in sorted(row for row in pending.keys() if row <= excel_row):
+                yield row, pending.pop(row)
+
+        for row in sorted(pending.keys()):
+            yield row, pending.pop(row)
+
+    def _blank_positions(self, series):
+        '''
+        Returns a list of ints, for the positions in the Pandas Series `series` of the values that are blank strings
+        '''
+        is_str                  = series.map(type) == str
+        if not is_str.any():
+            return []
+        is_blank                = series[is_str].str.strip().str.len() == 0
+        # Positions, not labels, since the caller assigns with iloc
+        positions               = _numpy.flatnonzero(is_str.to_numpy())
+        return list(positions[is_blank.to_numpy()])
 
     def _add_dropdowns(self, parent_trace, workbook, worksheet, xlw_config, displayable_df):
         '''
+        Adds the dropdowns configured in `xlw_config`, if any, each with a reference sheet for the dropdown's list.
+
+        Data validations are not cells, so they are added directly to the `worksheet`, even if its cells have not 
+        been written yet because we are streaming.
         '''
         if xlw_config.excel_dropdowns != None:
             for dropdown_params in xlw_config.excel_dropdowns.getAll():
@@ -666,7 +920,9 @@ class ManifestRepresenter:
                     fmt_dict            = {'bold': True, 'font_color': Palette.WHITE, 'align': 'center', 
                                             'bg_color': Palette.VERY_DARK_GREY}
 
-                    fmt                 = workbook.add_format(fmt_dict)
+                    # The reference sheet is written top to bottom, i.e., in row order, so this works the same
+                    # way if we are streaming. The reference sheet is complete before anything else is written to it.
+                    fmt                 = self.format_registry.format(fmt_dict)
                     reference_sheet.write(0, xl_col, HEADER, fmt)
 
                     for idx in range(len(dropdown_params.source)):
@@ -789,18 +1045,60 @@ class ManifestRepresenter:
                         raise ApodeixiError(my_trace, "Unable to add dropdown because the XlxsWriter library returned status="
                                                         + str(status))
 
-    def _add_formulas(self, parent_trace, column, column_width, first_x, first_y, last_x, last_y,
-                        data_df, config, workbook, worksheet):
+    def _formula_range(self, parent_trace, displayable_df, config, layout_idx):
         '''
-        Writes the formulas to the worksheet that pertain to column, if any
+        Returns None if no formulas are configured for the column of `displayable_df` with number `layout_idx`, or
+        if there is no content for them to apply to.
+
+        Otherwise it returns a tuple (first_x, first_y, last_x, last_y) with the coordinates of the first and last 
+        cells populated with content for the column, which define the range to which the column's formulas apply.
         '''
         if config.excel_formulas == None:
-            return
+            return None
         if config.layout.is_transposed:
             # TODO Logic in this method needs to be enhanced & refactored to support cases where layout
             # is transposed. For example, totals wouldn't be for Excel column but for Excel rows.
             raise ApodeixiError(parent_trace, "Sorry, but formulas are not yet supported for transposed layouts")
 
+        column                          = displayable_df.columns[layout_idx]
+        if not config.excel_formulas.hasTotal(parent_trace, column) \
+                                and not config.excel_formulas.hasCumulativeSum(parent_trace, column):
+            return None
+        if len(displayable_df.index) == 0:
+            return None
+
+        first_row_nb                    = displayable_df.index[0]
+        last_row_nb                     = displayable_df.index[-1]
+        first_x                         = config.x_offset + layout_idx
+        first_y                         = config.y_offset + 1 + first_row_nb # An extra '1' because of the headers
+
+        # If we have inserted formulas that took space, shift accordingly 
+        if config.sheet in self.formula_shift_dict.keys():
+            formula_shift               = self.formula_shift_dict[config.sheet]
+            first_x                     += formula_shift.shift_x
+            first_y                     += formula_shift.shift_y  
+
+        last_x                          = first_x
+        excel_row, excel_col, last_excel_row, last_excel_col    = config.df_xy_2_excel_xy(
+                                                                        parent_trace            = parent_trace,
+                                                                        displayable_df          = displayable_df, 
+                                                                        df_row_number           = last_row_nb,
+                                                                        df_col_number           = layout_idx,
+                                                                        representer             = self)
+        # Sometimes where there are joins, the Excel row of the last row of content is not where the manifest's
+        # area should end. In such cases we rely on the last_excel_row to tell us where the manifest's
+        # area ended so we correctly position the formulae
+        if last_excel_row != None:
+            last_y                      = last_excel_row
+        else:
+            last_y                      = excel_row
+        return first_x, first_y, last_x, last_y
+
+    def _set_formula_widths(self, parent_trace, column, column_width, last_x, data_df, config, worksheet):
+        '''
+        Sets the width of the Excel columns used by the formulas that pertain to `column`, so that their values fit
+        '''
+        ME                              = ManifestRepresenter
         if config.excel_formulas.hasTotal(parent_trace, column):
             my_trace                    = parent_trace.doing("Adjusting column width so totals will fit")
             if True:
@@ -828,27 +1126,8 @@ class ManifestRepresenter:
                 new_width               = max(len(total_txt), column_width)
                 self._set_column_width(my_trace, worksheet, last_x, new_width, config.layout)
 
-            my_trace                    = parent_trace.doing("Writing down totals for column")
-            if True:
-                cell_first              = xl_rowcol_to_cell(first_y,        first_x) 
-                cell_last               = xl_rowcol_to_cell(last_y,         last_x)
-                cell_totals             = xl_rowcol_to_cell(last_y + 1,     last_x)
-                formula                 = "=SUM(" + cell_first + ":" + cell_last + ")" # For example, "=SUM(C3:C6)"
-                self._write_formula_val(parent_trace, cell_totals, formula, column, config, worksheet, workbook)
-
-            my_trace                    = parent_trace.doing("Writing down label for totals, if so configured")
-            if True:
-                formula_params      = config.excel_formulas.getFormulaParameters(parent_trace, 
-                                                                        column              = column, 
-                                                                        formula_proxy_type  = ExcelFormulas.COLUMN_TOTAL)
-                FLAG                = ExcelFormulas.COLUMN_TOTAL.INCLUDE_LABEL
-                if formula_params != None and FLAG in formula_params.keys() and formula_params[FLAG] == True:
-                    fmt_dict            ={'bold': True, 'align': 'right', 'font_color': Palette.DARK_BLUE}
-                    fmt                 = workbook.add_format(fmt_dict)
-                    worksheet.write(last_y + 1, last_x - 1, "Total:", fmt)          
-
         if config.excel_formulas.hasCumulativeSum(parent_trace, column):
-            HEADER                      = "Cumulative"
+            HEADER                      = ME.CUMULATIVE_HEADER
             my_trace                    = parent_trace.doing("Setting up column width for extra column for cumulative totals")
             if True:
                 # To correctly set the width of the column where we display cumulative sums, we
@@ -878,47 +1157,87 @@ class ManifestRepresenter:
                 # Set width of Excel column last_x+1, which is where we will later write the cumulative sums
                 self._set_column_width(my_trace, worksheet, last_x + 1, scaled_width, config.layout)   
 
-            my_trace                    = parent_trace.doing("Writing out header for extra column for cumulative totals")
+    def _formula_rows(self, parent_trace, column, formula_range, config):
+        '''
+        Generator of the Excel rows, in increasing order, in which self._formula_cells adds cells for the formulas
+        that pertain to `column`
+
+        @param formula_range A tuple (first_x, first_y, last_x, last_y), as returned by self._formula_range
+        '''
+        first_x, first_y, last_x, last_y    = formula_range
+        if config.excel_formulas.hasCumulativeSum(parent_trace, column):
+            yield first_y - 1
+            yield from range(first_y, last_y + 1)
+        if config.excel_formulas.hasTotal(parent_trace, column):
+            yield last_y + 1
+
+    def _formula_cells(self, parent_trace, column, formula_range, config, excel_row):
+        '''
+        Returns a list of tuples (row, col, val, fmt, layout) for the cells in `excel_row` of the formulas that 
+        pertain to `column`, and of their labels, if any. The list is empty if there are none.
+
+        @param formula_range A tuple (first_x, first_y, last_x, last_y), as returned by self._formula_range
+        '''
+        ME                              = ManifestRepresenter
+        first_x, first_y, last_x, last_y    = formula_range
+        cells                           = []
+        if config.excel_formulas.hasTotal(parent_trace, column) and excel_row == last_y + 1:
+            my_trace                    = parent_trace.doing("Writing down totals for column")
             if True:
-                header_fmt_dict         = config.layout.FORMULA_HEADER_FMT
-                header_fmt              = workbook.add_format(header_fmt_dict)
-                worksheet.write(first_y - 1, last_x + 1, HEADER, header_fmt)
+                cell_first              = xl_rowcol_to_cell(first_y,        first_x) 
+                cell_last               = xl_rowcol_to_cell(last_y,         last_x)
+                formula                 = "=SUM(" + cell_first + ":" + cell_last + ")" # For example, "=SUM(C3:C6)"
+                self._write_formula_val(my_trace, cells, last_y + 1, last_x, formula, column, config)
 
-            my_trace                    = parent_trace.doing("Writing down extra column for cumulative totals")
+            my_trace                    = parent_trace.doing("Writing down label for totals, if so configured")
             if True:
+                formula_params      = config.excel_formulas.getFormulaParameters(my_trace, 
+                                                                        column              = column, 
+                                                                        formula_proxy_type  = ExcelFormulas.COLUMN_TOTAL)
+                FLAG                = ExcelFormulas.COLUMN_TOTAL.INCLUDE_LABEL
+                if formula_params != None and FLAG in formula_params.keys() and formula_params[FLAG] == True:
+                    fmt_dict            ={'bold': True, 'align': 'right', 'font_color': Palette.DARK_BLUE}
+                    fmt                 = self.format_registry.format(fmt_dict)
+                    cells.append((last_y + 1, last_x - 1, "Total:", fmt, config.layout))
+
+        if config.excel_formulas.hasCumulativeSum(parent_trace, column):
+            if excel_row == first_y - 1:
+                my_trace                = parent_trace.doing("Writing out header for extra column for cumulative totals")
+                header_fmt_dict         = config.layout.FORMULA_HEADER_FMT
+                header_fmt              = self.format_registry.format(header_fmt_dict)
+                cells.append((first_y - 1, last_x + 1, ME.CUMULATIVE_HEADER, header_fmt, config.layout))
+
+            if excel_row >= first_y and excel_row <= last_y:
+                my_trace                = parent_trace.doing("Writing down extra column for cumulative totals")
                 cell_first              = xl_rowcol_to_cell(first_y,        first_x, row_abs=True) # For example: "C$3"
-                for row_nb in range(first_y, last_y + 1):
-                    cell_last           = xl_rowcol_to_cell(row_nb,         last_x)
-                    cell_cumsum         = xl_rowcol_to_cell(row_nb,         last_x + 1)
-                    formula             = "=SUM(" + cell_first + ":" + cell_last + ")" # For example, "=SUM(C$3:C6)"
-                    self._write_formula_val(my_trace, cell_cumsum, formula, column, config, worksheet, workbook)
- 
-
-        # Default case: do nothing
-        return
+                cell_last               = xl_rowcol_to_cell(excel_row,      last_x)
+                formula                 = "=SUM(" + cell_first + ":" + cell_last + ")" # For example, "=SUM(C$3:C6)"
+                self._write_formula_val(my_trace, cells, excel_row, last_x + 1, formula, column, config)
 
-    def _write_formula_val(self, parent_trace, cell, formula, column, config, worksheet, workbook):
+        return cells
+
+    def _write_formula_val(self, parent_trace, cells, excel_row, excel_col, formula, column, config):
         '''
-        Helper method to write the formula into the given cell
+        Helper method to add the formula to `cells`, the list of cells for the caller to write, at the given Excel row
+        and column. xlsxwriter writes strings that start with "=" as formulas, so the formula is added like any other
+        value.
 
+        @param cells A list of tuples (row, col, val, fmt, layout), to which the formula's cell is appended
         @param column A string representing a column name for a manifest dataset, which is the column
                     for which a formula was configured (Note: depending on the formula type, the formula might 
                     not be written to the same Excel spreadsheet column as the dataset column that inspired
                     the need for the formula. For example, cumulative totals formulae are written to the
                     right of the dataset's column against which cumulative totals are computed).
-        @param cell A string representing an Excel cell where a formula should be writte. Example: "D3"
         @param formula A string representing an Excel formula to be added to the cell. Example: "=SUM(C3:C6)"
         '''
         formula_fmt_dict        = config.layout.FORMULA_W_FMT
 
+        num_format              = None
         if column in config.num_formats.keys():
-            num_format  = config.num_formats[column]
-            if num_format != None:
-                formula_fmt_dict    = formula_fmt_dict.copy() # GOTCHA - copy or else subsequent use of xlsxwriter will use a polluted format
-                formula_fmt_dict['num_format'] = num_format
+            num_format          = config.num_formats[column]
 
-        formula_fmt             = workbook.add_format(formula_fmt_dict)
-        worksheet.write_formula(cell, formula, formula_fmt)
+        formula_fmt             = self.format_registry.format(formula_fmt_dict, num_format)
+        cells.append((excel_row, excel_col, formula, formula_fmt, config.layout))
 
     def _scale_to_font_size(self, parent_trace, font_size):
         '''
@@ -936,6 +1255,9 @@ class ManifestRepresenter:
         '''
         Scans a large range of cells (limit is hard coded) and unprotects any cell that is not in any layout
         for any manifest
+
+        Unprotected ranges are not cells, so this may be called before or after the worksheet's cells are written. 
+        Within each row, adjacent free cells are unprotected as a single range.
         '''
         LIMIT                           = 500
 
@@ -960,12 +1282,16 @@ class ManifestRepresenter:
         
         # Within the global area, unprotect any empty space not in any layout (e.g., if pasting multiple
         # manifests, there will be empty space between them)
-        for x in range(global_xmin, global_xmax + 1):
-            for y in range(global_ymin,global_ymax + 1):
-                hits = [layout.name for layout in layouts if layout.contains(my_trace, x, y)]
-                if len(hits) == 0: # We never pasted this point, so unprotect it
-                    cell                = xl_rowcol_to_cell(y, x)
-                    worksheet.unprotect_range(cell)
+        for y in range(global_ymin,global_ymax + 1):
+            run_start                   = None # First x of the current run of points we never pasted in row y
+            for x in range(global_xmin, global_xmax + 2):
+                if x <= global_xmax and not any(layout.contains(my_trace, x, y) for layout in layouts):
+                    if run_start == None:
+                        run_start       = x
+                elif run_start != None:
+                    # For a single cell, xl_range returns just that cell, like "C5"
+                    worksheet.unprotect_range(xl_range(y, run_start, y, x - 1))
+                    run_start           = None
 
 
 class XL_WorksheetInfo():
@@ -1006,6 +1332,221 @@ class XL_WorksheetInfo():
                     fmt        = cell_struct.format.__dict__
                     self.format_dict[row_nb][col_nb] = fmt
 
+class XL_PreparedContent():
+    '''
+    Helper data structure with what ManifestRepresenter._prepare_content computes for a manifest, ahead of writing it
+    to a worksheet.
+
+    @param displayable_df A DataFrame with the content to display, in layout space
+    @param xl_df A DataFrame with the content to display, in Excel space (i.e., transposed if the layout is)
+    @param widths_dict A dictionary whose keys are the columns of xl_df, and values are sub-dicts like 
+                        {'width': <number>, 'nb_lines': <number>}
+    @param span The span of the layout, kept to support debugging
+    '''
+    def __init__(self, displayable_df, xl_df, widths_dict, span):
+        self.displayable_df     = displayable_df
+        self.xl_df              = xl_df
+        self.widths_dict        = widths_dict
+        self.span               = span
+
+class XL_FormatRegistry():
+    '''
+    Helper class that interns the xlsxwriter Formats of a workbook: it creates a Format the first time some formatting
+    is requested, and returns that same Format whenever the same formatting is requested again.
+
+    Without it, each cell would get its own Format object, which makes xlsxwriter slower and use more memory, since 
+    it has to work out each Format's XF record when saving the workbook.
+
+    @param workbook An xlsxwriter.Workbook
+    '''
+    def __init__(self, workbook):
+        self.workbook               = workbook
+        # Keys are frozensets of format properties, and values are xlsxwriter Formats
+        self._formats               = {}
+        self.requests               = 0 # How many Formats were requested, to support benchmarking
+
+    def format(self, fmt_dict, num_format=None):
+        '''
+        Returns the xlsxwriter Format for the properties in the dictionary `fmt_dict`, overwriting its 'num_format' 
+        property with `num_format` if it is not None. The `fmt_dict` is not modified.
+        '''
+        self.requests               += 1
+        if num_format != None:
+            fmt_dict                = fmt_dict | {'num_format': num_format}
+        # Include types in the key, since for instance True == 1 but xlsxwriter would not format them the same way
+        key                         = frozenset((k, type(v), v) for k, v in fmt_dict.items())
+        fmt                         = self._formats.get(key)
+        if fmt == None:
+            fmt                     = self.workbook.add_format(fmt_dict)
+            self._formats[key]      = fmt
+        return fmt
+
+    def nb_formats(self):
+        '''
+        Returns how many distinct Formats were created
+        '''
+        return len(self._formats)
+
+class XL_FormatGrid():
+    '''
+    Helper class with the xlsxwriter Formats for the cells of an Excel_Layout, so that writing a cell does not require
+    hashing format properties: cells whose layout block has the same format share the same xlsxwriter Format.
+
+    @param layout An Excel_Layout, which must not change while this grid is in use
+    @param format_registry An XL_FormatRegistry for the workbook into which the layout is written
+    '''
+    def __init__(self, parent_trace, layout, format_registry):
+        self.layout                 = layout
+        self.format_registry        = format_registry
+
+        # Keys are pairs (id of a block's format dictionary, num_format), and values are xlsxwriter Formats. Using
+        # ids is safe since the blocks' format dictionaries are kept alive by the layout
+        self._formats               = {}
+
+    def format(self, parent_trace, x, y, num_format):
+        '''
+        Returns the xlsxwriter Format for cell [x, y] in layout space, overwriting the 'num_format' property of the 
+        layout's format for that cell with `num_format` if it is not None.
+        '''
+        fmt_dict                    = self.layout.getFormat(parent_trace, x, y)
+        key                         = (id(fmt_dict), num_format)
+        fmt                         = self._formats.get(key)
+        if fmt == None:
+            fmt                     = self.format_registry.format(fmt_dict, num_format)
+            self._formats[key]      = fmt
+        return fmt
+
+class XL_CellBatch():
+    '''
+    Helper class that accumulates cells to write to a worksheet, and writes them when flushed. Cells are written in 
+    the order in which they were added, but runs of adjacent cells with the same Format are written with a single 
+    call to xlsxwriter's `write_column` (for cells below each other) or `write_row` (for cells next to each other).
+
+    @param worksheet An xlsxwriter.Worksheet
+    '''
+    def __init__(self, worksheet):
+        self.worksheet              = worksheet
+        # List of tuples (row, col, val, fmt, layout)
+        self._cells                 = []
+
+    def add(self, row, col, val, fmt, layout):
+        '''
+        Adds a cell to be written when this batch is flushed
+
+        @param layout The Excel_Layout for which the cell is written, to provide context in case of errors
+        '''
+        self._cells.append((row, col, val, fmt, layout))
+
+    def flush(self, parent_trace):
+        '''
+        Writes all the cells added since the last flush
+        '''
+        cells                       = self._cells
+        self._cells                 = []
+        start                       = 0
+        while start < len(cells):
+            row, col, val, fmt, layout  = cells[start]
+            end                     = start + 1
+            # Extend the run downwards while cells are in the same column, in consecutive rows
+            while end < len(cells) and cells[end][1] == col and cells[end][0] == row + end - start \
+                                                            and cells[end][3] is fmt:
+                end                 += 1
+            if end - start > 1:
+                self._write_run(parent_trace, cells[start:end], self.worksheet.write_column)
+                start               = end
+                continue
+            # Extend the run rightwards while cells are in the same row, in consecutive columns
+            while end < len(cells) and cells[end][0] == row and cells[end][1] == col + end - start \
+                                                            and cells[end][3] is fmt:
+                end                 += 1
+            if end - start > 1:
+                self._write_run(parent_trace, cells[start:end], self.worksheet.write_row)
+            else:
+                self._write_run(parent_trace, cells[start:end], None)
+            start                   = end
+
+    def _write_run(self, parent_trace, run, write_method):
+        '''
+        Writes the cells in `run` with `write_method`, which must be None if `run` has a single cell. If that
+        fails, cells are written one by one so that the error can report the problematic cell.
+        '''
+        row, col, val, fmt, layout  = run[0]
+        try:
+            if write_method == None:
+                self.worksheet.write(row, col, val, fmt)
+            else:
+                write_method(row, col, [cell[2] for cell in run], fmt)
+            return
+        except Exception as ex:
+            if write_method != None:
+                for cell in run:
+                    self._write_run(parent_trace, [cell], None)
+            raise ApodeixiError(parent_trace, "Encountered a problem when writing a cell in Excel",
+                                            data = {"problematic val":  str(val),
+                                                    "error":            str(ex),
+                                                    "layout.name":      str(layout.name),
+                                                    "excel row":        str(row),
+                                                    "excel column":     str(col)})
+
+class XL_RowOrderedCellBatch(XL_CellBatch):
+    '''
+    XL_CellBatch for worksheets of workbooks in xlsxwriter's constant memory mode, in which a row is written to disk 
+    as soon as a cell in a later row is written, so that cells written afterwards to earlier rows are lost.
+
+    Several manifests may be laid out side by side in a worksheet, so its rows can't be written a manifest at a time.
+    Instead, the rows of each manifest are added as an iterable over tuples (excel_row, cells) in increasing order 
+    of `excel_row`, such as the generator returned by ManifestRepresenter._populated_rows, which computes each row 
+    only when it is needed. `write_all` goes through all of them at once, and writes each row as soon as all of them
+    have moved past it, so only the cells of the row being written are kept in memory.
+
+    @param worksheet An xlsxwriter.Worksheet
+    '''
+    def __init__(self, worksheet):
+        super().__init__(worksheet)
+        # List of iterables over tuples (excel_row, cells), in increasing order of excel_row
+        self._row_iterables         = []
+
+    def add_rows(self, rows):
+        '''
+        Adds `rows`, an iterable over tuples (excel_row, cells) in increasing order of `excel_row`, where `cells` is
+        a list of tuples (row, col, val, fmt, layout) for the cells in that row. Nothing is written until `write_all`
+        is called.
+        '''
+        self._row_iterables.append(rows)
+
+    def write_all(self, parent_trace):
+        '''
+        Writes the rows of all the iterables added so far, in row order, and each row in column order. If the same 
+        cell was added more than once, the value added last wins, as it would if cells were written in the order in 
+        which they were added, taking the iterables in the order in which they were added.
+        Runs of adjacent cells with the same Format in a row are written with a single call to xlsxwriter's `write_row`.
+        '''
+        numbered_rows               = [self._numbered_rows(rows, nb) for nb, rows in enumerate(self._row_iterables)]
+        self._row_iterables         = []
+        last_row                    = None
+        for excel_row, group in _itertools.groupby(_heapq.merge(*numbered_rows), key = lambda item: item[0]):
+            if last_row != None and excel_row <= last_row:
+                raise ApodeixiError(parent_trace, "Can't write a row to Excel after a later row has been written",
+                                                data = {"sheet":            str(self.worksheet.get_name()),
+                                                        "excel row":        str(excel_row),
+                                                        "last excel row":   str(last_row)})
+            # Keys are Excel columns, and values are the last cell added for them
+            row_cells               = {}
+            for excel_row, nb, cells in group:
+                for cell in cells:
+                    row_cells[cell[1]] = cell
+            self._cells             = [row_cells[col] for col in sorted(row_cells.keys())]
+            self.flush(parent_trace)
+            last_row                = excel_row
+
+    def _numbered_rows(self, rows, nb):
+        '''
+        Generator of tuples (excel_row, nb, cells) for the tuples (excel_row, cells) in `rows`, so that rows from
+        different iterables are merged in row order and, within a row, in the order of the iterables
+        '''
+        for excel_row, cells in rows:
+            yield excel_row, nb, cells
+
 class FormulaShift():
     '''
     Helper class used when there are formulas to add to an Excel spreadsheet, in addition to the content of manifests.
@@ -5,6 +5,7 @@ from apodeixi.testing_framework.a6i_unit_test           import ApodeixiUnitTest
 from apodeixi.controllers.util.manifest_api             import ManifestAPIVersion
 from apodeixi.util.a6i_error            import ApodeixiError, FunctionalTrace
 from apodeixi.util.dataframe_utils      import DataFrameComparator
+from apodeixi.util.yaml_utils           import YAML_Utils
 
 from apodeixi.representers              import AsDataframe_Representer
 
@@ -67,6 +68,40 @@ class Test_AsDataframe_Representer(ApodeixiUnitTest):
                                         columns_to_ignore   = [], 
                                         id_column           = None)
 
+    def test_dict_2_df_batches(self):
+        '''
+        Checks that the DataFrames yielded by AsDataframe_Representer.dict_2_df_batches have at most the requested
+        number of rows, and that concatenating them yields the same DataFrame as dict_2_df, both for the sparse and
+        the full representations
+        '''
+        TEST_NAME           = 'dict_2_df_batches'
+        MANIFEST_FILE       = 'yaml_2_dataframe_INPUT.yaml' # Input file common across multiple tests
+        CONTENTS_PATH       = 'scaffolding.jobs-to-be-done'
+        BATCH_SIZE          = 3
+        root_trace   = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing dict_2_df_batches")
+        try:
+            rep                 = AsDataframe_Representer()
+            manifest_dict       = YAML_Utils().load(root_trace, path = self.input_data + '/' + MANIFEST_FILE)
+            content_dict, non_content_dict = rep._split_out(root_trace, manifest_dict, CONTENTS_PATH.split('.'))
+
+            output_txt          = ""
+            for sparse in [True, False]:
+                loop_trace      = root_trace.doing("Splitting DataFrame in batches", data = {"sparse": str(sparse)})
+                df, uid_info_list = rep.dict_2_df(loop_trace, content_dict, CONTENTS_PATH, sparse=sparse, 
+                                                    abbreviate_uids=True)
+                batches         = list(rep.dict_2_df_batches(loop_trace, content_dict, CONTENTS_PATH, sparse=sparse, 
+                                                    abbreviate_uids=True, batch_size=BATCH_SIZE))
+                concatenated_df = _pd.concat(batches)
+                output_txt      += "\nsparse=" + str(sparse) + ":\tshape=" + str(df.shape) \
+                                    + "\tbatch sizes=" + str([len(batch) for batch in batches]) \
+                                    + "\tsame as dict_2_df=" + str(concatenated_df.equals(df) 
+                                                                    and concatenated_df.dtypes.equals(df.dtypes))
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
 
     def _expected_subtree(self):
         return {ManifestAPIVersion.API_VERSION:   'kernel.a6i.io/v1dev',
@@ -85,6 +120,8 @@ if __name__ == "__main__":
         what_to_do = args[1]
         if what_to_do=='yaml_2_sparse_dataframe':
             T.test_yaml_2_sparse_dataframe()
+        elif what_to_do=='dict_2_df_batches':
+            T.test_dict_2_df_batches()
 
 
     main(_sys.argv)
\ No newline at end of file
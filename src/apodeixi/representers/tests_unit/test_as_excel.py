@@ -1,5 +1,7 @@
 import sys                                                      as _sys
 import pandas                                                   as _pd
+import xlsxwriter
+from concurrent.futures                                         import ThreadPoolExecutor as _ThreadPoolExecutor
 
 from apodeixi.testing_framework.a6i_unit_test                   import ApodeixiUnitTest
 from apodeixi.testing_framework.controllers.mock_controller     import Mock_Controller
@@ -7,8 +9,10 @@ from apodeixi.util.formatting_utils                             import Dictionar
 from apodeixi.util.a6i_error                                    import ApodeixiError, FunctionalTrace
 
 from apodeixi.controllers.util.skeleton_controller              import SkeletonController
-from apodeixi.representers.as_excel                             import ManifestRepresenter
+from apodeixi.representers.as_excel                             import ManifestRepresenter, XL_FormatRegistry, \
+                                                                        XL_CellBatch, XL_RowOrderedCellBatch
 from apodeixi.text_layout.excel_layout                          import ManifestXLWriteConfig, \
+                                                                        MappedManifestXLWriteConfig, \
                                                                         AsExcel_Config_Table, \
                                                                         PostingLabelXLWriteConfig
 
@@ -143,6 +147,177 @@ class Test_ManifestRepresenter(ApodeixiUnitTest):
             print(ex.trace_message())
             self.assertTrue(1==2)                                                                                        
 
+    def test_format_interning(self):
+        '''
+        Checks that the same formatting gets the same xlsxwriter Format, and that cells are written in runs
+        '''
+        TEST_NAME               = 'format_interning'
+        try:
+            root_trace          = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing Excel format interning")
+            workbook            = xlsxwriter.Workbook(self.output_data + "/" + TEST_NAME + ".xlsx")
+            worksheet           = workbook.add_worksheet("Sheet")
+            registry            = XL_FormatRegistry(workbook)
+
+            fmt_dict            = {'bold': True, 'font_color': '#0000FF'}
+            fmt1                = registry.format(fmt_dict)
+            fmt2                = registry.format(dict(fmt_dict))
+            fmt3                = registry.format(fmt_dict, num_format = '#,##0')
+            fmt4                = registry.format({'bold': 1, 'font_color': '#0000FF'})
+
+            output_txt          = "Same formatting gives same Format:\t\t" + str(fmt1 is fmt2)
+            output_txt          += "\nDifferent num_format gives same Format:\t" + str(fmt1 is fmt3)
+            output_txt          += "\nInt instead of bool gives same Format:\t" + str(fmt1 is fmt4)
+            output_txt          += "\nFormat dict left unchanged:\t\t" + str(fmt_dict)
+            output_txt          += "\nFormats requested: " + str(registry.requests) + ", created: " + str(registry.nb_formats())
+
+            # Record the calls made to the worksheet when the batch is flushed
+            calls               = []
+            for method_name in ['write', 'write_row', 'write_column']:
+                def _recording_method(row, col, val, fmt, method_name=method_name):
+                    calls.append(method_name + "(" + str(row) + ", " + str(col) + ", " + str(val) + ")")
+                setattr(worksheet, method_name, _recording_method)
+
+            batch               = XL_CellBatch(worksheet)
+            for row, col, val, fmt in [(0, 0, "a", fmt1), (1, 0, "b", fmt1), (2, 0, "c", fmt1), (3, 0, "d", fmt3),
+                                        (3, 1, "e", fmt3), (3, 2, "f", fmt3), (5, 2, "g", fmt3), (6, 2, "h", fmt1)]:
+                batch.add(row, col, val, fmt, layout = None)
+            batch.flush(root_trace)
+            workbook.close()
+            output_txt          += "\n\nWorksheet calls:\n\t" + "\n\t".join(calls)
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
+    def test_row_ordered_writing(self):
+        '''
+        Checks that when streaming, the rows of manifests laid out side by side are written in row order, each as soon
+        as it is computed, and that blanks in numerical columns are found without iterating through rows
+        '''
+        TEST_NAME               = 'row_ordered_writing'
+        try:
+            root_trace          = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing row ordered writing")
+            workbook            = xlsxwriter.Workbook(self.output_data + "/" + TEST_NAME + ".xlsx", {'constant_memory': True})
+            worksheet           = workbook.add_worksheet("Sheet")
+            registry            = XL_FormatRegistry(workbook)
+            fmt1                = registry.format({'bold': True})
+            fmt2                = registry.format({'bold': True}, num_format = '#,##0')
+
+            # Record the calls made to the worksheet when the batch is written
+            calls               = []
+            for method_name in ['write', 'write_row', 'write_column']:
+                def _recording_method(row, col, val, fmt, method_name=method_name):
+                    calls.append(method_name + "(" + str(row) + ", " + str(col) + ", " + str(val) + ")")
+                setattr(worksheet, method_name, _recording_method)
+
+            # Two manifests laid out side by side, whose rows are computed as they are needed. The second one also
+            # writes cell [1, 1], and the last value added must win
+            def _rows(name, rows_dict):
+                for row in sorted(rows_dict.keys()):
+                    calls.append("computed " + name + " row " + str(row))
+                    yield row, [(row, col, val, fmt, None) for col, val, fmt in rows_dict[row]]
+
+            batch               = XL_RowOrderedCellBatch(worksheet)
+            batch.add_rows(_rows("left", { 1: [(1, "Header", fmt1), (2, "Cost", fmt1)],
+                                            2: [(1, "a", fmt1), (2, 10, fmt2)],
+                                            3: [(1, "b", fmt1), (2, 20, fmt2)],
+                                            4: [(1, "Total:", fmt1), (2, "=SUM(C3:C4)", fmt2)]}))
+            batch.add_rows(_rows("right", {1: [(1, "Area", fmt1), (3, "Owner", fmt1)],
+                                            3: [(3, "Joe", fmt1)]}))
+            output_txt          = "Calls after adding rows:\t" + str(len(calls))
+
+            batch.write_all(root_trace)
+            output_txt          += "\n\nWorksheet calls:\n\t" + "\n\t".join(calls)
+
+            # Rows that are not in order can't be written, since earlier rows have already been written to disk
+            batch.add_rows([(5, [(5, 1, "c", fmt1, None)]), (2, [(2, 1, "d", fmt1, None)])])
+            try:
+                batch.write_all(root_trace)
+                output_txt      += "\n\nWrote rows out of order"
+            except ApodeixiError as ex:
+                output_txt      += "\n\nRefused to write rows out of order"
+            workbook.close()
+
+            rep                 = ManifestRepresenter(  parent_trace        = root_trace,
+                                                        a6i_config          = None,
+                                                        xlw_config_table    = None,
+                                                        label_ctx           = {},
+                                                        manifestInfo_dict   = {})
+            series              = _pd.Series(["1", "", 3, "  ", None, 4.5, "\t"], index = [10, 11, 12, 13, 14, 15, 16])
+            output_txt          += "\n\nStreaming by default:\t" + str(rep.streaming)
+            output_txt          += "\nBlank positions:\t" + str([int(pos) for pos in rep._blank_positions(series)])
+            output_txt          += "\nNo blanks:\t\t" + str(rep._blank_positions(_pd.Series([1, 2.5, None])))
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
+    def test_prepared_contents(self):
+        '''
+        Checks that preparing the content of manifests in parallel, ahead of writing them, gives the same DataFrames
+        and column widths as preparing them one at a time, and that manifests whose content depends on the writing
+        of other manifests are left to be prepared when written
+        '''
+        TEST_NAME               = 'prepared_contents'
+        try:
+            root_trace          = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing prepared contents")
+            data_df             = self.load_csv(root_trace, self.input_data + '/test_dataframe_2_xl_INPUT.csv')
+
+            def _build_representer(parent_trace):
+                xlw_config_table                = AsExcel_Config_Table()
+                xlw_config_table.addManifestXLWriteConfig(parent_trace, ManifestXLWriteConfig(
+                                                        sheet = "Sheet", manifest_name = "jtbd.0", read_only = False,
+                                                        is_transposed = False, x_offset = 0, y_offset = 0))
+                xlw_config_table.addManifestXLWriteConfig(parent_trace, ManifestXLWriteConfig(
+                                                        sheet = "Sheet", manifest_name = "jtbd.1", read_only = True,
+                                                        is_transposed = True, x_offset = 0, y_offset = 20))
+                xlw_config_table.addManifestXLWriteConfig(parent_trace, MappedManifestXLWriteConfig(
+                                                        sheet = "Sheet", manifest_name = "mapping.2", read_only = False,
+                                                        referenced_manifest_name_list = ["jtbd.0"], my_entity = "Story",
+                                                        mapped_entities_list = ["Feature"], is_transposed = False))
+                manifestInfo_dict               = {}
+                for name in ["jtbd.0", "jtbd.1", "mapping.2"]:
+                    manifestInfo_dict[name]     = SkeletonController._ManifestInfo( 
+                                                        parent_trace    = parent_trace,
+                                                        key             = name,
+                                                        manifest_dict   = {"assertion": {
+                                                                                SkeletonController._ManifestInfo.TEMPLATE_DF: 
+                                                                                data_df.copy()}},
+                                                        controller      = None)
+                return ManifestRepresenter( parent_trace        = parent_trace,
+                                            a6i_config          = None,
+                                            xlw_config_table    = xlw_config_table,
+                                            label_ctx           = {},
+                                            manifestInfo_dict   = manifestInfo_dict)
+
+            rep                 = _build_representer(root_trace)
+            with _ThreadPoolExecutor(max_workers = 3) as executor:
+                rep.prepareContents(root_trace, executor)
+
+            serial_rep          = _build_representer(root_trace)
+            output_txt          = "Prepared ahead:\t" + str(list(rep._prepared_contents.keys()))
+            for name in rep._prepared_contents.keys():
+                prepared        = rep._prepared_contents[name]
+                config          = serial_rep.xlw_config_table.getManifestXLWriteConfig(root_trace, name)
+                df              = serial_rep.manifestInfo_dict[name].getManifestContents(root_trace)
+                expected        = serial_rep._prepare_content(root_trace, df, config)
+                output_txt      += "\n\n" + name + ":"
+                output_txt      += "\n\tspan\t\t\t" + str(prepared.span)
+                output_txt      += "\n\tExcel shape\t\t" + str(prepared.xl_df.shape)
+                output_txt      += "\n\tsame DataFrames\t" + str(prepared.displayable_df.equals(expected.displayable_df)
+                                                                and prepared.xl_df.equals(expected.xl_df))
+                output_txt      += "\n\tsame widths\t\t" + str(prepared.widths_dict == expected.widths_dict)
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
     def _nice_ws_info(self, parent_trace, worksheet_info):
         nice_format                     = ''
         nice_format += "\n======================== Column information ==========================\n"
@@ -168,6 +343,12 @@ if __name__ == "__main__":
         what_to_do = args[1]
         if what_to_do=='dataframe_2_xl':
             T.test_dataframe_2_xl()
+        elif what_to_do=='format_interning':
+            T.test_format_interning()
+        elif what_to_do=='row_ordered_writing':
+            T.test_row_ordered_writing()
+        elif what_to_do=='prepared_contents':
+            T.test_prepared_contents()
 
 
     main(_sys.argv)
\ No newline at end of file
@@ -381,6 +381,8 @@ class ApodeixiIntegrationTest(ApodeixiSkeletonTest):
                                                 data = {"URL to download from":     src_folder, 
                                                         "URL to copy to":           manifestsURL,
                                                         "error":                    str(ex)})
+            # Manifests were copied behind the store's back, so re-index them
+            self.stack().store().rebuildManifestCatalog(my_trace)
 
         my_trace                        = self.trace_environment(parent_trace, "Seeding Excel postings under " 
                                                                                     + str(postings_relative_folder))
@@ -0,0 +1,96 @@
+import sys                                              as _sys
+import time                                             as _time
+
+import pandas                                           as _pd
+
+from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
+
+import apodeixi.text_layout.text_processor              as _text_processor
+from apodeixi.text_layout.column_layout                 import ColumnWidthCalculator
+
+class ColumnWidth_Benchmark():
+    '''
+    Benchmark for the ColumnWidthCalculator's search for column widths, for a DataFrame like those displayed in
+    Excel forms. It times the search in two ways:
+
+    * Row by row, computing the number of lines in each row with TextProcessors (the reference implementation)
+    * Vectorized, computing the number of lines in all rows of a column at once with an _NbLinesEngine
+
+    The TextProcessor caches are cleared before each way, so that both start cold. It also checks that both ways
+    give the same widths and explanations.
+
+    Run it as a script:
+
+        python -m apodeixi.testing_framework.benchmarks.column_width_benchmark [<nb rows>]
+
+    @param nb_rows An int, for how many rows the DataFrame should have
+    '''
+    def __init__(self, nb_rows=2000):
+        self.nb_rows                = nb_rows
+
+    WORDS                           = ["the", "platform", "migration", "of", "customer", "data", "to", "cloud", "and",
+                                        "reconciliation", "for", "regulatory", "reporting", "with", "analytics"]
+
+    def build_df(self, parent_trace, nb_rows):
+        '''
+        Returns a DataFrame with `nb_rows` rows, with short and long texts of the kind entered in Excel forms
+        '''
+        ME                          = ColumnWidth_Benchmark
+        def _text(row_nb, nb_words):
+            return " ".join([ME.WORDS[(row_nb * 7 + word_nb * 3) % len(ME.WORDS)] for word_nb in range(nb_words)])
+
+        data                        = [["Area " + str(row_nb // 50), "Owner " + str(row_nb % 7),
+                                        _text(row_nb, 3 + row_nb % 9), _text(row_nb, 10 + row_nb % 25),
+                                        _text(row_nb, row_nb % 4), 1000 * (row_nb % 13)]
+                                                                                for row_nb in range(nb_rows)]
+        return _pd.DataFrame(columns = ["Area", "Owner", "Objective", "Description", "Comments", "Budget"], data = data)
+
+    def time_calc(self, parent_trace, df, vectorized):
+        '''
+        Returns a tuple: the seconds taken to compute the column widths for `df`, the result, and the calculator used
+        '''
+        _text_processor._TOKENS_CACHE.clear()
+        _text_processor._PROCESSOR_LINES_CACHE.clear()
+        calc                        = ColumnWidthCalculator(    data_df             = df.copy(),
+                                                                viewport_width      = 100,
+                                                                viewport_height     = 40,
+                                                                max_word_length     = 20,
+                                                                vectorized          = vectorized)
+        T0                          = _time.perf_counter()
+        result                      = calc.calc(parent_trace)
+        return _time.perf_counter() - T0, result, calc
+
+    def run(self, parent_trace):
+        '''
+        Runs the benchmark and returns a string describing the results
+        '''
+        df                          = self.build_df(parent_trace, self.nb_rows)
+
+        reference_time, reference_result, reference_calc    = self.time_calc(parent_trace, df, vectorized = False)
+        vectorized_time, vectorized_result, vectorized_calc = self.time_calc(parent_trace, df, vectorized = True)
+
+        same_result                 = vectorized_result == reference_result \
+                                        and vectorized_calc.explanations == reference_calc.explanations
+        engine                      = vectorized_calc.nb_lines_engine
+
+        output_txt                  = "Benchmarked computing column widths for " + str(self.nb_rows) + " rows and " \
+                                        + str(len(df.columns)) + " columns\n"
+        output_txt                  += "\n{:>15}{:>15}{:>10}{:>15}{:>15}  {}".format("Row by row (s)", "Vectorized (s)",
+                                                                        "Speedup", "Cache hits", "Cache misses",
+                                                                        "Same result")
+        output_txt                  += "\n{:>15.3f}{:>15.3f}{:>9.1f}x{:>15}{:>15}  {}".format(reference_time,
+                                                                        vectorized_time, reference_time / vectorized_time,
+                                                                        engine.hits, engine.misses, same_result)
+        return output_txt
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        root_trace                  = FunctionalTrace(parent_trace=None, path_mask=None).doing("Running column width benchmark")
+        nb_rows                     = int(args[1]) if len(args) > 1 else 2000
+        try:
+            print(ColumnWidth_Benchmark(nb_rows).run(root_trace))
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+
+    main(_sys.argv)
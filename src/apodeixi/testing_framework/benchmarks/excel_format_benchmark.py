@@ -0,0 +1,181 @@
+import sys                                              as _sys
+import os                                               as _os
+import time                                             as _time
+import zipfile                                          as _zipfile
+import tempfile                                         as _tempfile
+
+import pandas                                           as _pd
+
+from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
+
+from apodeixi.text_layout.excel_layout                  import AsExcel_Config_Table, ManifestXLWriteConfig, \
+                                                                PostingLabelXLWriteConfig, NumFormats
+from apodeixi.representers.as_excel                     import ManifestRepresenter, XL_CellBatch
+
+class ExcelFormat_Benchmark():
+    '''
+    Benchmark for how xlsxwriter Formats are created and cells are written when generating an Excel form for a
+    manifest, in two ways:
+
+    * Per cell, as it used to be done: a new Format is created for each cell, and each cell is written with its
+      own call to xlsxwriter
+    * Batched, as done by the ManifestRepresenter: Formats are interned by an XL_FormatRegistry and looked up in an
+      XL_FormatGrid, and runs of cells are written with a single call to xlsxwriter
+
+    For each way, it reports how many Formats were created, how many XF records are in the saved workbook, the
+    seconds taken to write and save the workbook, and the workbook's size. It also checks that both ways produce
+    the same worksheets and styles.
+
+    Run it as a script:
+
+        python -m apodeixi.testing_framework.benchmarks.excel_format_benchmark [<nb rows>]
+
+    @param nb_rows An int, for how many rows the manifest should have
+    '''
+    def __init__(self, nb_rows=5000):
+        self.nb_rows                = nb_rows
+
+    MANIFEST_NAME                   = "big-rock.0"
+
+    def build_manifest_df(self, parent_trace, nb_rows):
+        '''
+        Returns a DataFrame like those of manifests displayed in Excel forms, with `nb_rows` rows
+        '''
+        columns                     = ["Area", "Owner", "Description", "Effort", "Budget"]
+        data                        = [["Area " + str(row_nb // 20) if row_nb % 20 == 0 else "", "Owner " + str(row_nb % 7),
+                                        "Task " + str(row_nb) + " of the plan", row_nb % 13 if row_nb % 5 else "",
+                                        1000.5 * (row_nb % 11)]                 for row_nb in range(nb_rows)]
+        return _pd.DataFrame(columns = columns, data = data)
+
+    def build_representer(self, parent_trace, df, per_cell):
+        '''
+        Returns a ManifestRepresenter for a manifest with content `df`. If `per_cell` is True, it creates a Format
+        per cell and writes cells one by one
+        '''
+        ME                          = ExcelFormat_Benchmark
+        xlw_config                  = ManifestXLWriteConfig(sheet               = "Manifest",
+                                                            manifest_name       = ME.MANIFEST_NAME,
+                                                            read_only           = False,
+                                                            is_transposed       = False,
+                                                            viewport_width      = 100,
+                                                            viewport_height     = 40,
+                                                            max_word_length     = 20,
+                                                            editable_cols       = ["Owner", "Description", "Effort", "Budget"],
+                                                            hidden_cols         = [],
+                                                            num_formats         = {"Effort": NumFormats.INT,
+                                                                                    "Budget": NumFormats.DOUBLE},
+                                                            excel_formulas      = None,
+                                                            editable_headers    = [],
+                                                            x_offset            = 1,
+                                                            y_offset            = 1)
+        label_config                = PostingLabelXLWriteConfig(sheet           = ManifestRepresenter.POSTING_LABEL_SHEET,
+                                                            viewport_width      = 100,
+                                                            viewport_height     = 40,
+                                                            max_word_length     = 20,
+                                                            editable_fields     = [],
+                                                            x_offset            = 1,
+                                                            y_offset            = 1)
+        config_table                = AsExcel_Config_Table()
+        config_table.addManifestXLWriteConfig(parent_trace, xlw_config)
+        config_table.setPostingLabelXLWriteConfig(parent_trace, label_config)
+
+        representer_class           = _PerCell_ManifestRepresenter if per_cell else _Benchmark_ManifestRepresenter
+        return representer_class(   parent_trace        = parent_trace,
+                                    a6i_config          = None,
+                                    xlw_config_table    = config_table,
+                                    label_ctx           = {"manifestAPI": "delivery-planning.journeys.a6i.io"},
+                                    manifestInfo_dict   = {ME.MANIFEST_NAME: _ManifestInfo(df)})
+
+    def time_write(self, parent_trace, df, folder, filename, per_cell):
+        '''
+        Writes `df` to an Excel form and returns a tuple: the representer used, the seconds taken, and the contents
+        of the saved workbook's worksheets and styles as a dictionary
+        '''
+        rep                         = self.build_representer(parent_trace, df, per_cell)
+        T0                          = _time.perf_counter()
+        rep.dataframe_to_xl(parent_trace, folder, filename)
+        duration                    = _time.perf_counter() - T0
+        with _zipfile.ZipFile(folder + "/" + filename) as z:
+            contents                = {name: z.read(name) for name in z.namelist() if name.startswith("xl/")}
+        return rep, duration, contents
+
+    def run(self, parent_trace):
+        '''
+        Runs the benchmark and returns a string describing the results
+        '''
+        df                          = self.build_manifest_df(parent_trace, self.nb_rows)
+        with _tempfile.TemporaryDirectory() as folder:
+            rows                    = []
+            for per_cell, filename in [(True, "per_cell.xlsx"), (False, "batched.xlsx")]:
+                rep, duration, contents = self.time_write(parent_trace, df, folder, filename, per_cell)
+                nb_xfs              = contents["xl/styles.xml"].split(b"<cellXfs")[1].count(b"<xf ")
+                rows.append((   "Per cell" if per_cell else "Batched", len(rep.format_registry.workbook.formats), nb_xfs,
+                                duration, _os.path.getsize(folder + "/" + filename), contents))
+
+        same_output                 = rows[0][5] == rows[1][5]
+
+        output_txt                  = "Benchmarked writing a manifest of " + str(self.nb_rows) + " rows and " \
+                                        + str(len(df.columns)) + " columns to an Excel form\n"
+        output_txt                  += "\n{:<10}{:>10}{:>10}{:>12}{:>12}".format("", "Formats", "XFs", "Seconds", "Bytes")
+        for label, nb_formats, nb_xfs, duration, size, contents in rows:
+            output_txt              += "\n{:<10}{:>10}{:>10}{:>12.3f}{:>12}".format(label, nb_formats, nb_xfs, duration, size)
+        output_txt                  += "\n\nSpeedup: {:.1f}x\tSame worksheets and styles: {}".format(rows[0][3] / rows[1][3],
+                                                                                                    same_output)
+        return output_txt
+
+class _ManifestInfo():
+    '''
+    Stand-in for the ManifestInfo objects that controllers pass to ManifestRepresenters
+    '''
+    def __init__(self, df):
+        self.df                     = df
+
+    def getManifestContents(self, parent_trace):
+        return self.df
+
+class _Benchmark_ManifestRepresenter(ManifestRepresenter):
+    '''
+    ManifestRepresenter that skips remembering worksheet formatting, which is only needed by regression tests
+    '''
+    def _remember_formatting(self, worksheet, sheet):
+        return
+
+class _PerCell_ManifestRepresenter(_Benchmark_ManifestRepresenter):
+    '''
+    ManifestRepresenter that creates a new Format for each cell and writes cells one by one
+    '''
+    def _new_format_grid(self, parent_trace, layout):
+        return _PerCell_FormatGrid(self.format_registry.workbook, layout)
+
+    def _new_cell_batch(self, worksheet):
+        return _PerCell_CellBatch(worksheet)
+
+class _PerCell_FormatGrid():
+    def __init__(self, workbook, layout):
+        self.workbook               = workbook
+        self.layout                 = layout
+
+    def format(self, parent_trace, x, y, num_format):
+        fmt_dict                    = self.layout.getFormat(parent_trace, x, y).copy()
+        if num_format != None:
+            fmt_dict['num_format']  = num_format
+        return self.workbook.add_format(fmt_dict)
+
+class _PerCell_CellBatch(XL_CellBatch):
+    def flush(self, parent_trace):
+        cells                       = self._cells
+        self._cells                 = []
+        for cell in cells:
+            self._write_run(parent_trace, [cell], None)
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        root_trace                  = FunctionalTrace(parent_trace=None, path_mask=None).doing("Running Excel format benchmark")
+        nb_rows                     = int(args[1]) if len(args) > 1 else 5000
+        try:
+            print(ExcelFormat_Benchmark(nb_rows).run(root_trace))
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+
+    main(_sys.argv)
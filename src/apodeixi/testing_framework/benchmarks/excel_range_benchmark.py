@@ -0,0 +1,148 @@
+import sys                                              as _sys
+import os                                               as _os
+import time                                             as _time
+import tempfile                                         as _tempfile
+
+import pandas                                           as _pd
+import openpyxl                                         as _openpyxl
+from openpyxl.utils                                     import get_column_letter as _get_column_letter
+
+from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
+from apodeixi.xli.xlimporter                            import ExcelWorkbookSession
+
+class ExcelRange_Benchmark():
+    '''
+    Benchmark comparing two ways of loading a narrow range from a wide Excel worksheet:
+
+    * Pandas' read_excel, which converts every cell in every row it reads, no matter how many columns are needed.
+      This is how ExcelTableReader used to read ranges
+    * ExcelWorkbookSession.read_range, which for both single-level and two-level headers only converts the cells in
+      the range's columns, plus the header cells to their left
+
+    Each way is timed for a range with a single-level header and for one with a two-level header, and the
+    DataFrames they return are checked to be the same.
+
+    Run it as a script:
+
+        python -m apodeixi.testing_framework.benchmarks.excel_range_benchmark [<nb columns>] [<nb rows>] [<repetitions>]
+
+    @param nb_columns An int, for how many columns the generated worksheet has
+    @param nb_rows An int, for how many rows of data the generated worksheet has, excluding the headers
+    @param repetitions An int, stating how many times each range is read per way
+    '''
+    def __init__(self, nb_columns=1000, nb_rows=200, repetitions=3):
+        self.nb_columns             = nb_columns
+        self.nb_rows                = nb_rows
+        self.repetitions            = repetitions
+
+    SHEET                           = "Wide"
+
+    # Number of columns in the ranges read by the benchmark, which start in the middle of the worksheet
+    RANGE_WIDTH                     = 8
+
+    def write_workbook(self, parent_trace, path, nb_columns, nb_rows):
+        '''
+        Creates an Excel workbook at `path` with a worksheet that has two rows of headers and `nb_rows` rows of data,
+        spanning `nb_columns` columns. The first row is left blank, as is usual in postings. The top level header only
+        names every fourth column, like a grouping, and some data cells are blank or numbers.
+        '''
+        ME                          = ExcelRange_Benchmark
+        # Not in write-only mode, so that the workbook is saved like Excel does: with shared strings, and with
+        # the worksheet's dimensions ahead of its data
+        workbook                    = _openpyxl.Workbook()
+        worksheet                   = workbook.active
+        worksheet.title             = ME.SHEET
+        worksheet.append([])
+        worksheet.append(["Group " + str(col_nb) if col_nb % 4 == 0 else None for col_nb in range(nb_columns)])
+        worksheet.append(["Column " + str(col_nb) for col_nb in range(nb_columns)])
+        for row_nb in range(nb_rows):
+            row                     = []
+            for col_nb in range(nb_columns):
+                if (row_nb + col_nb) % 7 == 0:
+                    row.append(None)
+                elif col_nb % 3 == 0:
+                    row.append(row_nb * col_nb / 4)
+                else:
+                    row.append("r" + str(row_nb) + "c" + str(col_nb))
+            worksheet.append(row)
+        workbook.save(path)
+
+    def read_with_pandas(self, parent_trace, path, header_list, nrows, first_col_nb, last_col_nb):
+        '''
+        Returns the DataFrame for the range, loaded like ExcelTableReader used to do: with Pandas' read_excel
+        and `usecols` for single-level headers, and by dropping columns after loading for multi-level headers
+        '''
+        ME                          = ExcelRange_Benchmark
+        if len(header_list) == 1:
+            usecols                 = _get_column_letter(first_col_nb + 1) + ":" + _get_column_letter(last_col_nb + 1)
+            return _pd.read_excel(path, sheet_name = ME.SHEET, header = header_list, usecols = usecols, nrows = nrows)
+        df                          = _pd.read_excel(path, sheet_name = ME.SHEET, header = header_list, nrows = nrows)
+        return df.iloc[:, first_col_nb:last_col_nb + 1]
+
+    def same_df(self, df1, df2):
+        '''
+        Returns a boolean stating whether the two DataFrames have the same columns and values. Unused levels of
+        MultiLevel columns are ignored, since they depend on which columns were dropped
+        '''
+        if not df1.columns.equals(df2.columns):
+            return False
+        df1, df2                    = df1.copy(), df2.copy()
+        for df in [df1, df2]:
+            if isinstance(df.columns, _pd.MultiIndex):
+                df.columns          = df.columns.remove_unused_levels()
+        try:
+            _pd.testing.assert_frame_equal(df1, df2, check_exact = True)
+            return True
+        except AssertionError:
+            return False
+
+    def run(self, parent_trace):
+        '''
+        Runs the benchmark and returns a string describing the results
+        '''
+        ME                          = ExcelRange_Benchmark
+        first_col_nb                = self.nb_columns // 2
+        last_col_nb                 = first_col_nb + ME.RANGE_WIDTH - 1
+        cases                       = [("Single-level", [2], self.nb_rows), ("Two-level", [1, 2], self.nb_rows)]
+
+        output_txt                  = "Benchmarked a range of " + str(ME.RANGE_WIDTH) + " columns in a worksheet of " \
+                                        + str(self.nb_columns) + " columns and " + str(self.nb_rows) + " rows, " \
+                                        + str(self.repetitions) + " repetitions\n"
+        output_txt                  += "\n{:<14}{:>12}{:>12}{:>10}  {}".format("Header", "Pandas (s)", "Range (s)",
+                                                                                "Speedup", "Same DataFrame")
+        with _tempfile.TemporaryDirectory() as tmp_dir:
+            path                    = _os.path.join(tmp_dir, "wide.xlsx")
+            self.write_workbook(parent_trace, path, self.nb_columns, self.nb_rows)
+
+            for label, header_list, nrows in cases:
+                T0                  = _time.perf_counter()
+                for idx in range(self.repetitions):
+                    pandas_df       = self.read_with_pandas(parent_trace, path, header_list, nrows, first_col_nb, last_col_nb)
+                pandas_time         = _time.perf_counter() - T0
+
+                T0                  = _time.perf_counter()
+                for idx in range(self.repetitions):
+                    session         = ExcelWorkbookSession()
+                    range_df        = session.read_range(parent_trace, path, ME.SHEET, header_list, nrows,
+                                                            first_col_nb, last_col_nb)
+                    session.close(parent_trace)
+                range_time          = _time.perf_counter() - T0
+
+                output_txt          += "\n{:<14}{:>12.3f}{:>12.3f}{:>9.1f}x  {}".format(label, pandas_time, range_time,
+                                                                                pandas_time / range_time,
+                                                                                self.same_df(pandas_df, range_df))
+        return output_txt
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        root_trace                  = FunctionalTrace(parent_trace=None, path_mask=None).doing("Running Excel range benchmark")
+        nb_columns                  = int(args[1]) if len(args) > 1 else 1000
+        nb_rows                     = int(args[2]) if len(args) > 2 else 200
+        repetitions                 = int(args[3]) if len(args) > 3 else 3
+        try:
+            print(ExcelRange_Benchmark(nb_columns, nb_rows, repetitions).run(root_trace))
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+
+    main(_sys.argv)
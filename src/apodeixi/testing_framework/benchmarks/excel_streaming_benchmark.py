@@ -0,0 +1,116 @@
+import sys                                              as _sys
+import time                                             as _time
+import tracemalloc                                      as _tracemalloc
+import tempfile                                         as _tempfile
+
+import openpyxl                                         as _openpyxl
+
+from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
+
+from apodeixi.testing_framework.benchmarks.excel_format_benchmark   import ExcelFormat_Benchmark
+
+class ExcelStreaming_Benchmark():
+    '''
+    Benchmark for the memory and time it takes a ManifestRepresenter to write a big manifest to an Excel form, in
+    two ways:
+
+    * In memory, as done by default: xlsxwriter keeps all the cells of the workbook until it is saved
+    * Streaming, as done if the ManifestRepresenter's `streaming` attribute is True: the workbook is written in
+      xlsxwriter's constant memory mode, and each worksheet row is written to disk as soon as it is computed
+
+    For each way, it reports the peak memory allocated by Python (as measured by tracemalloc), the peak of the 
+    memory allocated while the manifest's cells are laid out and written, on top of what was allocated before, and 
+    the seconds taken. The overall peak is often reached earlier, when computing column widths, in which case it is
+    about the same for both ways.
+
+    It also checks that both ways produce workbooks with the same cell values and formats, as read by openpyxl.
+    They can't be compared byte by byte since in constant memory mode strings are written inline in each worksheet
+    instead of in a shared strings table.
+
+    Run it as a script:
+
+        python -m apodeixi.testing_framework.benchmarks.excel_streaming_benchmark [<nb rows>]
+
+    @param nb_rows An int, for how many rows the manifest should have
+    '''
+    def __init__(self, nb_rows=5000):
+        self.nb_rows                = nb_rows
+
+    def time_write(self, parent_trace, df, folder, filename, streaming):
+        '''
+        Writes `df` to an Excel form and returns a tuple: the seconds taken, the peak memory allocated, and the 
+        peak memory allocated while the manifest's cells were laid out and written, in bytes
+        '''
+        rep                         = ExcelFormat_Benchmark().build_representer(parent_trace, df, per_cell = False)
+        rep.streaming               = streaming
+        # The representer links UIDs to Excel rows right before laying out a worksheet's cells, and remembers the
+        # worksheet's formatting right after writing them, so measure memory in between. The manifest's worksheet
+        # is the last one. Peaks are reset in between, so remember the earlier ones for the overall peak
+        before_cells                = []
+        writing_cells               = []
+        peaks                       = []
+        link_UIDs                   = rep._link_UIDs
+        def _link_UIDs(parent_trace, displayable_df, xlw_config):
+            current, peak           = _tracemalloc.get_traced_memory()
+            before_cells.append(current)
+            peaks.append(peak)
+            _tracemalloc.reset_peak()
+            link_UIDs(parent_trace, displayable_df, xlw_config)
+        rep._link_UIDs              = _link_UIDs
+        rep._remember_formatting    = lambda worksheet, sheet: writing_cells.append(_tracemalloc.get_traced_memory()[1])
+        _tracemalloc.start()
+        T0                          = _time.perf_counter()
+        rep.dataframe_to_xl(parent_trace, folder, filename)
+        duration                    = _time.perf_counter() - T0
+        current, peak               = _tracemalloc.get_traced_memory()
+        _tracemalloc.stop()
+        return duration, max(peaks + [peak]), writing_cells[-1] - before_cells[-1]
+
+    def read_cells(self, parent_trace, path):
+        '''
+        Returns a dictionary with the value and format of each cell of the workbook in `path`
+        '''
+        workbook                    = _openpyxl.load_workbook(path)
+        cells                       = {}
+        for worksheet in workbook.worksheets:
+            for row in worksheet.iter_rows():
+                for cell in row:
+                    cells[(worksheet.title, cell.coordinate)] = (cell.value, cell.number_format, cell.font.b,
+                                                                    cell.fill.fgColor.rgb, cell.protection.locked)
+        return cells
+
+    def run(self, parent_trace):
+        '''
+        Runs the benchmark and returns a string describing the results
+        '''
+        df                          = ExcelFormat_Benchmark().build_manifest_df(parent_trace, self.nb_rows)
+        with _tempfile.TemporaryDirectory() as folder:
+            rows                    = []
+            for streaming, filename in [(False, "in_memory.xlsx"), (True, "streaming.xlsx")]:
+                duration, peak, writing = self.time_write(parent_trace, df, folder, filename, streaming)
+                rows.append(("Streaming" if streaming else "In memory", peak, writing, duration))
+            same_cells              = self.read_cells(parent_trace, folder + "/in_memory.xlsx") \
+                                        == self.read_cells(parent_trace, folder + "/streaming.xlsx")
+
+        MB                          = 1024 * 1024
+        output_txt                  = "Benchmarked writing a manifest of " + str(self.nb_rows) + " rows and " \
+                                        + str(len(df.columns)) + " columns to an Excel form\n"
+        output_txt                  += "\n{:<12}{:>18}{:>22}{:>12}".format("", "Peak memory (MB)", 
+                                                                            "Writing cells (MB)", "Seconds")
+        for label, peak, writing, duration in rows:
+            output_txt              += "\n{:<12}{:>18.1f}{:>22.1f}{:>12.3f}".format(label, peak / MB, writing / MB, duration)
+        output_txt                  += "\n\nMemory saved writing cells: {:.0f}%\tSame cells: {}".format(
+                                                                    100 * (1 - rows[1][2] / rows[0][2]), same_cells)
+        return output_txt
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        root_trace                  = FunctionalTrace(parent_trace=None, path_mask=None).doing("Running Excel streaming benchmark")
+        nb_rows                     = int(args[1]) if len(args) > 1 else 5000
+        try:
+            print(ExcelStreaming_Benchmark(nb_rows).run(root_trace))
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+
+    main(_sys.argv)
@@ -0,0 +1,131 @@
+import sys                                              as _sys
+import time                                             as _time
+
+import pandas                                           as _pd
+
+from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
+from apodeixi.xli.breakdown_builder                     import BreakdownTree, DataFrameFragmentIndex
+from apodeixi.xli.interval                              import Interval
+from apodeixi.xli.posting_controller_utils              import PostingConfig
+from apodeixi.xli.uid_acronym_schema                    import UID_Acronym_Schema, AcronymInfo
+from apodeixi.xli.uid_store                             import UID_Store
+from apodeixi.xli.update_policy                         import UpdatePolicy
+
+class FragmentIndex_Benchmark():
+    '''
+    Benchmark comparing two ways in which a BreakdownTree parses a posting's DataFrame, row by row and interval by interval:
+
+    * Without a DataFrameFragmentIndex, so that readDataframeFragment inspects each row's cells for each interval,
+      and walks back through prior rows' cells to find where to dock new entities. This is how postings used to be parsed
+    * With a DataFrameFragmentIndex, as PostingController._xl_2_tree does, so that blank cells and the columns of
+      each interval are worked out once for the whole DataFrame
+
+    The posting has three entities, each with an interval of columns: an "Area" with a UID column, a "Program" that is
+    only set in some rows and a "Task" set in every row. The manifests built both ways are checked to be the same.
+
+    Run it as a script:
+
+        python -m apodeixi.testing_framework.benchmarks.fragment_index_benchmark [<nb rows>]
+
+    @param nb_rows An int, for how many rows the posting has
+    '''
+    def __init__(self, nb_rows=5000):
+        self.nb_rows                = nb_rows
+
+    COLUMNS                         = ["UID", "Area", "Owner", "Budget", "Program", "Status", "Sponsor", "Task",
+                                        "Effort", "Start"]
+    INTERVALS                       = [["UID", "Area", "Owner", "Budget"], ["Program", "Status", "Sponsor"],
+                                        ["Task", "Effort", "Start"]]
+    ENTITIES                        = ["Area", "Program", "Task"]
+
+    def build_posting_df(self, parent_trace, nb_rows):
+        '''
+        Returns a DataFrame like those loaded from postings, with `nb_rows` rows. A new area starts every 100 rows
+        and a new program every 10 rows, and rows in between leave those entities' columns blank.
+        '''
+        ME                          = FragmentIndex_Benchmark
+        data                        = []
+        for row_nb in range(nb_rows):
+            new_area                = row_nb % 100 == 0
+            new_program             = row_nb % 10 == 0
+            data.append([   "A" + str(row_nb // 100 + 1) if new_area else float("nan"),
+                            "Area " + str(row_nb // 100) if new_area else "",
+                            "Owner " + str(row_nb % 7) if new_area else "",
+                            1000.0 * (row_nb % 13) if new_area else float("nan"),
+                            "Program " + str(row_nb // 10) if new_program else "",
+                            ["Active", "Paused", " "][row_nb % 3] if new_program else "",
+                            "Sponsor " + str(row_nb % 5) if new_program else "",
+                            "Task " + str(row_nb),
+                            float(row_nb % 17) if row_nb % 4 != 0 else float("nan"),
+                            _pd.Timestamp("2021-01-01") + _pd.Timedelta(days = row_nb % 365)
+                                                                if row_nb % 6 != 0 else _pd.NaT])
+        return _pd.DataFrame(columns = ME.COLUMNS, data = data)
+
+    def parse(self, parent_trace, df, use_index):
+        '''
+        Parses `df` into a new BreakdownTree like PostingController._xl_2_tree does, and returns the tree.
+
+        @param use_index A boolean. If True, a DataFrameFragmentIndex is passed to readDataframeFragment.
+        '''
+        ME                          = FragmentIndex_Benchmark
+        xlr_config                  = PostingConfig(    kind            = "benchmark",
+                                                        manifest_nb     = 0,
+                                                        update_policy   = UpdatePolicy(reuse_uids=True, merge=False),
+                                                        controller      = None)
+        store                       = UID_Store(parent_trace)
+        tree                        = BreakdownTree(uid_store = store, entity_type = "Area", parent_UID = None)
+        interval_list               = [Interval(parent_trace, columns, entity_name) for columns, entity_name \
+                                                                            in zip(ME.INTERVALS, ME.ENTITIES)]
+        acronym_schema              = UID_Acronym_Schema()
+        acronym_schema.acronyminfo_list = [AcronymInfo("A", "Area"), AcronymInfo("P", "Program"), AcronymInfo("T", "Task")]
+        store.set_acronym_schema(parent_trace, acronym_schema)
+        for interval in interval_list:
+            tree.reserve_user_provided_uids(parent_trace, xlr_config, df[interval.columns], interval.entity_name)
+
+        rows                        = list(df.iterrows())
+        fragment_index              = DataFrameFragmentIndex(parent_trace, tree, df, rows, interval_list) if use_index else None
+        for idx in range(len(rows)):
+            for interval in interval_list:
+                loop_trace          = parent_trace.doing("Processing fragment", data = {'row': idx, 'interval': interval.columns})
+                tree.readDataframeFragment( interval        = interval,
+                                            row             = rows[idx],
+                                            parent_trace    = loop_trace,
+                                            xlr_config      = xlr_config,
+                                            all_rows        = rows,
+                                            acronym_schema  = acronym_schema,
+                                            fragment_index  = fragment_index)
+        return tree
+
+    def run(self, parent_trace):
+        '''
+        Runs the benchmark and returns a string describing the results
+        '''
+        df                          = self.build_posting_df(parent_trace, self.nb_rows)
+
+        T0                          = _time.perf_counter()
+        legacy_tree                 = self.parse(parent_trace, df, use_index = False)
+        legacy_time                 = _time.perf_counter() - T0
+
+        T0                          = _time.perf_counter()
+        indexed_tree                = self.parse(parent_trace, df, use_index = True)
+        indexed_time                = _time.perf_counter() - T0
+
+        output_txt                  = "Benchmarked parsing a posting of " + str(self.nb_rows) + " rows and " \
+                                        + str(len(df.columns)) + " columns\n"
+        output_txt                  += "\n{:>16}{:>16}{:>10}  {}".format("No index (s)", "Index (s)", "Speedup", "Same manifest")
+        output_txt                  += "\n{:>16.3f}{:>16.3f}{:>9.1f}x  {}".format(legacy_time, indexed_time,
+                                                                                legacy_time / indexed_time,
+                                                                                legacy_tree.as_dicts() == indexed_tree.as_dicts())
+        return output_txt
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        root_trace                  = FunctionalTrace(parent_trace=None, path_mask=None).doing("Running fragment index benchmark")
+        nb_rows                     = int(args[1]) if len(args) > 1 else 5000
+        try:
+            print(FragmentIndex_Benchmark(nb_rows).run(root_trace))
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+
+    main(_sys.argv)
@@ -0,0 +1,140 @@
+import sys                                              as _sys
+import pickle                                           as _pickle
+import time                                             as _time
+
+import pandas                                           as _pd
+
+from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
+
+class FunctionalTrace_Benchmark():
+    '''
+    Micro-benchmark for the overhead of FunctionalTraces when processing postings, measured per posting row.
+
+    For each row, it creates the same traces that are created when parsing a posting and computing column widths
+    for its Excel form: one per interval and property of the row and one per column, with context of the kind
+    passed by the real code. This is done in two ways:
+
+    * Eagerly, as traces used to be created: context values are computed by the caller and rendered in 
+      FunctionalTrace.doing (by setting FunctionalTrace.TRACING_ENABLED)
+    * Lazily, with callables for expensive context values, which are not called unless a trace is examined
+
+    The traces created both ways for the last row are checked to display the same, both when examined and 
+    when pickled.
+
+    Run it as a script:
+
+        python -m apodeixi.testing_framework.benchmarks.functional_trace_benchmark [<nb rows>]
+
+    @param nb_rows An int, for how many posting rows to create traces for
+    '''
+    def __init__(self, nb_rows=20000):
+        self.nb_rows                = nb_rows
+
+    INTERVALS                       = [["UID", "Area", "Owner", "Budget"], ["Program", "Status", "Sponsor"],
+                                        ["Task", "Effort", "Start"]]
+
+    def build_posting_df(self, parent_trace, nb_rows):
+        '''
+        Returns a DataFrame like those loaded from postings, with `nb_rows` rows
+        '''
+        ME                          = FunctionalTrace_Benchmark
+        columns                     = [col for interval in ME.INTERVALS for col in interval]
+        data                        = [["A" + str(row_nb // 100 + 1), "Area " + str(row_nb // 100), "Owner " + str(row_nb % 7),
+                                        1000.0 * (row_nb % 13), "Program " + str(row_nb // 10), "Active", 
+                                        "Sponsor " + str(row_nb % 5), "Task " + str(row_nb), float(row_nb % 17),
+                                        _pd.Timestamp("2021-01-01") + _pd.Timedelta(days = row_nb % 365)]
+                                                                                for row_nb in range(nb_rows)]
+        return _pd.DataFrame(columns = columns, data = data)
+
+    def trace_row(self, parent_trace, row, lazy):
+        '''
+        Creates the traces for a posting row and returns the last one
+
+        @param row A tuple (idx, Series), as returned by DataFrame.iterrows
+        @param lazy A boolean. If True, expensive context values are passed as callables
+        '''
+        ME                          = FunctionalTrace_Benchmark
+        ORIGINATION                 = {'signaled_from': __file__}
+        row_nb, row_data            = row
+        for interval in ME.INTERVALS:
+            loop_trace              = parent_trace.doing("Processing fragment", 
+                                                            data = {'excel row': row_nb, 'interval': interval},
+                                                            origination = ORIGINATION)
+            if lazy:
+                my_trace            = loop_trace.doing("Searching for docking UID for an entity in row " + str(row_nb),
+                                                            data = {    'entity':       lambda: str(interval[1]),
+                                                                        'row_nb':       lambda: str(row_nb)})
+            else:
+                my_trace            = loop_trace.doing("Searching for docking UID for an entity in row " + str(row_nb),
+                                                            data = {    'entity':       str(interval[1]),
+                                                                        'row_nb':       str(row_nb)})
+            for col in interval:
+                val                 = row_data[col]
+                if lazy:
+                    last_trace      = my_trace.doing("Considering to set property to new node",
+                                                            data = {"property name": lambda col=col: str(col),
+                                                                    "raw value":     lambda val=val: str(val) })
+                else:
+                    last_trace      = my_trace.doing("Considering to set property to new node",
+                                                            data = {"property name": str(col),
+                                                                    "raw value":     str(val) })
+        for col in row_data.index:
+            if lazy:
+                last_trace          = parent_trace.doing("Computing the width for a row",
+                                                            data = {"column":   lambda col=col: str(col),
+                                                                    "row number in dataset": lambda: str(row_nb),
+                                                                    "row data": lambda: str(row_data.values)})
+            else:
+                last_trace          = parent_trace.doing("Computing the width for a row",
+                                                            data = {"column":   str(col),
+                                                                    "row number in dataset": str(row_nb),
+                                                                    "row data": str(row_data.values)})
+        return last_trace
+
+    def time_rows(self, parent_trace, rows, lazy):
+        '''
+        Returns a pair: the seconds taken to create the traces for all the `rows`, and the last trace created
+        '''
+        FunctionalTrace.TRACING_ENABLED = not lazy
+        try:
+            T0                      = _time.perf_counter()
+            for row in rows:
+                last_trace          = self.trace_row(parent_trace, row, lazy)
+            return _time.perf_counter() - T0, last_trace
+        finally:
+            FunctionalTrace.TRACING_ENABLED = False
+
+    def run(self, parent_trace):
+        '''
+        Runs the benchmark and returns a string describing the results
+        '''
+        df                          = self.build_posting_df(parent_trace, self.nb_rows)
+        rows                        = list(df.iterrows())
+
+        eager_time, eager_trace     = self.time_rows(parent_trace, rows, lazy = False)
+        lazy_time, lazy_trace       = self.time_rows(parent_trace, rows, lazy = True)
+
+        same_trace                  = lazy_trace.examine(as_string=True) == eager_trace.examine(as_string=True)
+        unpickled_trace             = _pickle.loads(_pickle.dumps(lazy_trace))
+        same_trace                  = same_trace and unpickled_trace.examine(as_string=True) == lazy_trace.examine(as_string=True)
+
+        output_txt                  = "Benchmarked creating the functional traces for " + str(self.nb_rows) + " posting rows of " \
+                                        + str(len(df.columns)) + " columns\n"
+        output_txt                  += "\n{:>20}{:>20}{:>10}  {}".format("Eager (us per row)", "Lazy (us per row)", "Speedup", 
+                                                                        "Same trace")
+        output_txt                  += "\n{:>20.1f}{:>20.1f}{:>9.1f}x  {}".format(1e6 * eager_time / self.nb_rows, 
+                                                                                1e6 * lazy_time / self.nb_rows,
+                                                                                eager_time / lazy_time, same_trace)
+        return output_txt
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        root_trace                  = FunctionalTrace(parent_trace=None, path_mask=None).doing("Running functional trace benchmark")
+        nb_rows                     = int(args[1]) if len(args) > 1 else 20000
+        try:
+            print(FunctionalTrace_Benchmark(nb_rows).run(root_trace))
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+
+    main(_sys.argv)
@@ -0,0 +1,144 @@
+import sys                                              as _sys
+import os                                               as _os
+import subprocess                                       as _subprocess
+
+from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
+
+class ImportTime_Benchmark():
+    '''
+    Benchmark for the startup cost of Apodeixi's entry points. It imports a module in a fresh Python interpreter
+    with `python -X importtime` and parses the timings that Python reports.
+
+    Two things are checked for each module:
+
+    * That it takes no longer to import than its budget (in milliseconds). Since timings are noisy, the fastest
+      of several repetitions is used
+    * That it does not import any of the "heavy" modules listed in ImportTime_Benchmark.HEAVY_MODULES, which
+      should only be imported lazily by the code that needs them
+
+    Run it as a script:
+
+        python -m apodeixi.testing_framework.benchmarks.import_time_benchmark [<module>] [<budget in ms>]
+
+    If no module is given, all modules in ImportTime_Benchmark.BUDGETS are benchmarked. The script exits with a non-zero
+    status if any module is over budget or imports a heavy module.
+
+    @param budgets A dict whose keys are module names (strings) and whose values are budgets in milliseconds (floats).
+    @param repetitions An int, stating how many times each module is imported
+    '''
+    def __init__(self, budgets=None, repetitions=3):
+        if budgets == None:
+            budgets                 = ImportTime_Benchmark.BUDGETS
+        self.budgets                = budgets
+        self.repetitions            = repetitions
+
+    # Budgets are generous relative to what is measured on a developer laptop, so that they only fail on real
+    # regressions, such as a module-level import of pandas
+    BUDGETS                         = { "apodeixi.cli.apo_daemon":  150,
+                                        "apodeixi.cli.apo_cli":     400}
+
+    HEAVY_MODULES                   = [ "pandas", "numpy", "openpyxl", "xlsxwriter", "nltk", "nbformat", "nbconvert",
+                                        "apodeixi.knowledge_base.knowledge_base", "apodeixi.controllers.util.skeleton_controller"]
+
+    def measure(self, parent_trace, module):
+        '''
+        Imports `module` in a fresh Python interpreter and returns two things:
+
+        * A float, for the number of milliseconds it took to import `module`
+        * A list of strings, for the names of all modules that were imported as a result
+        '''
+        my_trace                    = parent_trace.doing("Measuring import time", data = {"module": module})
+        result                      = _subprocess.run([_sys.executable, "-X", "importtime", "-c", "import " + module],
+                                                        capture_output = True, text = True, env = self._child_env())
+        if result.returncode != 0:
+            raise ApodeixiError(my_trace, "Unable to import module",
+                                            data = {"module": module, "error": result.stderr[-2000:]})
+        elapsed_ms                  = None
+        imported                    = []
+        for line in result.stderr.split("\n"):
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            self_us, cumulative_us, name = line[len("import time:"):].split("|")
+            imported.append(name.strip())
+            if name.strip() == module and not name.startswith("  "): # Not nested, i.e., imported by the "-c" command
+                elapsed_ms          = int(cumulative_us) / 1000
+        if elapsed_ms == None:
+            raise ApodeixiError(my_trace, "Python did not report the import time for the module",
+                                            data = {"module": module})
+        return elapsed_ms, imported
+
+    def loaded_modules(self, parent_trace, module):
+        '''
+        Imports `module` in a fresh Python interpreter and returns a sorted list of strings, for the names of all
+        modules in `sys.modules` after the import. Unlike self.measure, the result does not depend on timings.
+        '''
+        my_trace                    = parent_trace.doing("Listing modules loaded by an import", data = {"module": module})
+        result                      = _subprocess.run([_sys.executable, "-c", 
+                                                            "import sys, " + module + "\nfor name in sys.modules: print(name)"],
+                                                        capture_output = True, text = True, env = self._child_env())
+        if result.returncode != 0:
+            raise ApodeixiError(my_trace, "Unable to import module",
+                                            data = {"module": module, "error": result.stderr[-2000:]})
+        return sorted([name for name in result.stdout.split("\n") if len(name) > 0])
+
+    def _child_env(self):
+        '''
+        Returns the environment for the fresh Python interpreters, so that they import modules from the same locations
+        as this process does, even if Apodeixi is not installed (e.g., if it runs from a source checkout)
+        '''
+        return dict(_os.environ, PYTHONPATH=_os.pathsep.join(_sys.path))
+
+    def heavy_modules(self, imported):
+        '''
+        Returns a sorted list of the modules in ImportTime_Benchmark.HEAVY_MODULES that appear in `imported` (either
+        themselves or one of their submodules)
+        '''
+        ME                          = ImportTime_Benchmark
+        return sorted([heavy for heavy in ME.HEAVY_MODULES
+                            if len([name for name in imported if name == heavy or name.startswith(heavy + ".")]) > 0])
+
+    def run(self, parent_trace):
+        '''
+        Runs the benchmark and returns two things:
+
+        * A string describing the results
+        * A list of strings, describing the violations found. It is empty if all modules are within budget and don't
+          import heavy modules
+        '''
+        violations                  = []
+        output_txt                  = "{:<32}{:>12}{:>12}  {}".format("Module", "Time (ms)", "Budget (ms)", "Heavy modules")
+        for module in self.budgets.keys():
+            timings                 = []
+            for idx in range(self.repetitions):
+                elapsed_ms, imported = self.measure(parent_trace, module)
+                timings.append(elapsed_ms)
+            best_ms                 = min(timings)
+            heavy                   = self.heavy_modules(imported)
+            budget_ms               = self.budgets[module]
+            output_txt              += "\n{:<32}{:>12.1f}{:>12.1f}  {}".format(module, best_ms, budget_ms, ", ".join(heavy))
+            if best_ms > budget_ms:
+                violations.append(module + " took " + str(best_ms) + " ms to import, over its budget of "
+                                    + str(budget_ms) + " ms")
+            if len(heavy) > 0:
+                violations.append(module + " imports heavy modules " + str(heavy))
+        return output_txt, violations
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        root_trace                  = FunctionalTrace(parent_trace=None, path_mask=None).doing("Running import time benchmark")
+        budgets                     = None
+        if len(args) > 1:
+            budget_ms               = float(args[2]) if len(args) > 2 else ImportTime_Benchmark.BUDGETS.get(args[1], 1000)
+            budgets                 = {args[1]: budget_ms}
+        try:
+            output_txt, violations  = ImportTime_Benchmark(budgets).run(root_trace)
+            print(output_txt)
+            if len(violations) > 0:
+                print("\nBudget violations:\n\t" + "\n\t".join(violations))
+                _sys.exit(1)
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            _sys.exit(1)
+
+    main(_sys.argv)
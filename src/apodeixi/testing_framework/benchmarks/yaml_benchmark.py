@@ -0,0 +1,109 @@
+import sys                                              as _sys
+import os                                               as _os
+import time                                             as _time
+import tempfile                                         as _tempfile
+
+import apodeixi
+import apodeixi.knowledge_base.knowledge_base_util      # Registers custom YAML constructors, like the one for ManifestHandle
+from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
+from apodeixi.util.yaml_utils                           import YAML_Utils
+
+class YAML_Benchmark():
+    '''
+    Benchmark comparing the LibYAML (C) and pure Python paths of YAML_Utils on real manifests.
+
+    For each path it times loading and saving every manifest under a folder, and checks that the YAML written by
+    both paths is byte-identical.
+
+    Run it as a script:
+
+        python -m apodeixi.testing_framework.benchmarks.yaml_benchmark [<folder>] [<repetitions>]
+
+    If no folder is given, the manifests in the expected output of Apodeixi's own tests are used. To benchmark
+    against a real KnowledgeBase, pass its manifests folder.
+
+    @param folder A string, for the root of a folder hierarchy containing the YAML files to use
+    @param repetitions An int, stating how many times each file is loaded and saved per path
+    '''
+    def __init__(self, folder=None, repetitions=5):
+        if folder == None:
+            folder                  = _os.path.dirname(apodeixi.__file__)
+        self.folder                 = folder
+        self.repetitions            = repetitions
+
+    def _manifests(self, parent_trace):
+        '''
+        Returns two lists of the same length: the paths of the manifests under self.folder, and their content as dicts.
+        YAML files that are not manifests (i.e., have no "apiVersion") are ignored.
+        '''
+        paths                       = []
+        data_list                   = []
+        for currentdir, dirs, files in _os.walk(self.folder):
+            if "output_data" in currentdir.split(_os.sep):
+                continue
+            for a_file in sorted(files):
+                if not a_file.endswith(".yaml"):
+                    continue
+                path                = _os.path.join(currentdir, a_file)
+                try:
+                    data_dict       = YAML_Utils(use_libyaml=False).load(parent_trace, path, use_cache=False)
+                except ApodeixiError:
+                    continue # Not valid YAML, e.g., some regression test outputs
+                if type(data_dict) == dict and "apiVersion" in data_dict.keys():
+                    paths.append(path)
+                    data_list.append(data_dict)
+        return paths, data_list
+
+    def run(self, parent_trace):
+        '''
+        Runs the benchmark and returns a string describing the results
+        '''
+        paths, data_list            = self._manifests(parent_trace)
+        nb_bytes                    = sum([_os.path.getsize(path) for path in paths])
+
+        results                     = {}
+        outputs                     = {}
+        with _tempfile.TemporaryDirectory() as tmp_dir:
+            for use_libyaml in [False, True]:
+                utils               = YAML_Utils(use_libyaml = use_libyaml)
+
+                T0                  = _time.perf_counter()
+                for idx in range(self.repetitions):
+                    for path in paths:
+                        utils.load(parent_trace, path, use_cache=False)
+                load_time           = _time.perf_counter() - T0
+
+                T0                  = _time.perf_counter()
+                for idx in range(self.repetitions):
+                    for nb, data_dict in enumerate(data_list):
+                        utils.save(parent_trace, data_dict, tmp_dir + "/" + str(nb) + ".yaml", use_cache=False)
+                save_time           = _time.perf_counter() - T0
+
+                outputs[use_libyaml] = [open(tmp_dir + "/" + str(nb) + ".yaml", 'rb').read() for nb in range(len(data_list))]
+                results[use_libyaml] = (load_time, save_time)
+
+        mismatches                  = [paths[nb] for nb in range(len(data_list)) if outputs[False][nb] != outputs[True][nb]]
+
+        output_txt                  = "Benchmarked " + str(len(paths)) + " manifests (" + str(nb_bytes) + " bytes), " \
+                                        + str(self.repetitions) + " repetitions, under " + str(self.folder) + "\n"
+        output_txt                  += "\n{:<14}{:>12}{:>12}".format("Path", "Load (s)", "Save (s)")
+        for use_libyaml, label in [(False, "Pure Python"), (True, "LibYAML")]:
+            load_time, save_time    = results[use_libyaml]
+            output_txt              += "\n{:<14}{:>12.3f}{:>12.3f}".format(label, load_time, save_time)
+        output_txt                  += "\n\nFiles whose YAML output differs between paths: " + str(len(mismatches))
+        for path in mismatches:
+            output_txt              += "\n\t" + str(path)
+        return output_txt
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        root_trace                  = FunctionalTrace(parent_trace=None, path_mask=None).doing("Running YAML benchmark")
+        folder                      = args[1] if len(args) > 1 else None
+        repetitions                 = int(args[2]) if len(args) > 2 else 5
+        try:
+            print(YAML_Benchmark(folder, repetitions).run(root_trace))
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+
+    main(_sys.argv)
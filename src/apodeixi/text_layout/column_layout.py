@@ -1,4 +1,5 @@
 import pandas                               as _pd
+import numpy                                as _numpy
 import re                                   as _re
 
 from apodeixi.util.a6i_error                import ApodeixiError
@@ -53,9 +54,13 @@ class ColumnWidthCalculator:
                             Since we want to compute the appropriate widths of columns
                             for rendering purposes, when such formatters are used to populate Excel columns we
                             need to take them into account so that we correctly size the columns.
+    @param vectorized A boolean, which defaults to True. If True, the number of lines that rows need for a 
+                            candidate width are computed in bulk with NumPy by an _NbLinesEngine. If False, they are 
+                            computed row by row with a TextProcessor, which is much slower but serves as a reference
+                            implementation. Results are the same either way.
     '''
     def __init__(self, data_df, viewport_width=200, viewport_height=40, max_word_length=20,
-                        column_formatters = {}):
+                        column_formatters = {}, vectorized = True):
         self.data_df                = data_df
 
         # Ensure that columns are strings (or, in the case of a MultiIndex a tuple of strings), in case they are integers 
@@ -86,11 +91,17 @@ class ColumnWidthCalculator:
         # Dictionary of formatters per column. Not all columns need to have one, only when a column's values are
         # to be rendered in a non-literal way (e.g., dates, or doubles with decimals or commas for thousands, etc.)
         self.column_formatters      = column_formatters
+
+        self.vectorized             = vectorized
+        self.nb_lines_engine        = None # Computed by self.calc(), if self.vectorized
+        self._data_rows             = None # List of the rows of data_df, as returned by iterrows. Computed when needed
         return
     
     def calc(self, parent_trace):
         # Initialize our helper DataFrame to guide our decisions
         df                      = self._analyze_widths(parent_trace)
+        if self.vectorized:
+            self.nb_lines_engine    = _NbLinesEngine(df)
         
         gen                    = _ScenarioGenerator(parent_trace        = parent_trace,
                                                     working_df          = df, 
@@ -98,6 +109,7 @@ class ColumnWidthCalculator:
                                                     col_width_limit     = self.MAX_COL_WIDTH,
                                                     row_height_limit    = self.MAX_ROW_HEIGHT,
                                                     word_size_limit     = self.MAX_WORD_LENGTH,
+                                                    nb_lines_engine     = self.nb_lines_engine,
                                             )
         # Now run the iterative algorithm that "guesses" column widths and systematically searches for an optimium
         for candidate, width, PRIOR, NEXT, explanations in gen:
@@ -111,6 +123,8 @@ class ColumnWidthCalculator:
         # Persist intermediate values from calculation in case we need to inspect how we got to the answer 
         self.explanations       = gen.explanations
         self.analysis_df        = df
+        # But not the rows of self.data_df, which take a lot of memory for big DataFrames and are no longer needed
+        self._data_rows         = None
 
         # Now assemble the results, which are held in the columns of self.analysis_df corresponding to last scenario
         W_COL                   = ColumnWidthCalculator._scenarioWidthColumn
@@ -148,6 +162,11 @@ class ColumnWidthCalculator:
                
         analysis_df[NEXT_WIDTH]    = analysis_df.apply(_new_val(column_to_resize, PRIOR_WIDTH, width_val), 
                                                               axis=1)
+        if self.nb_lines_engine != None:
+            engine                      = self.nb_lines_engine
+            analysis_df[NEXT_NB_LINES]  = [engine.max_nb_lines(column_idx, width) 
+                                                for column_idx, width in enumerate(analysis_df[NEXT_WIDTH])]
+            return
         HEIGHT_ESTIMATOR = ColumnWidthCalculator._estimate_nb_lines
         analysis_df[NEXT_NB_LINES] = analysis_df.apply(HEIGHT_ESTIMATOR(parent_trace=parent_trace,
                                                                         column_with_widths= NEXT_WIDTH), 
@@ -287,14 +306,17 @@ class ColumnWidthCalculator:
         # but we do it this way so that we can add tracing information row-by-row, so that when errors
         # occur we can tell the caller what row was the problem
         result              = []
-        for row in self.data_df.iterrows():
+        if self._data_rows == None:
+            # Iterating rows is slow, so do it once for all columns
+            self._data_rows = list(self.data_df.iterrows())
+        for row in self._data_rows:
+            # GOTCHA: Stringifying the row is slow, so it is only done if the trace is examined. Even then, there is 
+            #           a big performance penalty of doing str(row[1]) because __repr__ for Pandas Series is slow.
+            #           So instead we extract the values first, then stringify
             loop_trace = parent_trace.doing("Computing the width for a row",
-                                            data = {"column":   str(column),
-                                                    "row number in dataset": str(row[0]),
-                                                    # GOTCHA: There is a bit performance penalty of doing
-                                                    #           str(row[1]) because __repr__ for Pandas Series is slow.
-                                                    #           So instead we extract the values first, then stringify
-                                                    "row data": str(row[1].values)})
+                                            data = {"column":   lambda: str(column),
+                                                    "row number in dataset": lambda row=row: str(row[0]),
+                                                    "row data": lambda row=row: str(row[1].values)})
             # We format the row data so that we measure its length the way it would be displayed in Excel
             # to the user. That way our width computations match the width the user would experience
             width       = len(formatter(loop_trace, row[1][column]))
@@ -341,7 +363,8 @@ class _ScenarioGenerator():
     column width reduction stops (i.e., what invariant or rule would be broken if a column shrinks further)
     These explanations are useful for debugging and regression tests.
     '''
-    def __init__(self, parent_trace, working_df, viewport_width, col_width_limit, row_height_limit, word_size_limit):
+    def __init__(self, parent_trace, working_df, viewport_width, col_width_limit, row_height_limit, word_size_limit,
+                        nb_lines_engine = None):
         
         self.parent_trace           = parent_trace
         self.working_df             = working_df
@@ -349,6 +372,8 @@ class _ScenarioGenerator():
         self.col_width_limit        = col_width_limit
         self.row_height_limit       = row_height_limit
         self.word_size_limit        = word_size_limit
+        # An _NbLinesEngine, or None if the number of lines in rows are to be computed with TextProcessors
+        self.nb_lines_engine        = nb_lines_engine
 
         self.scenario_nb            = 0
                     
@@ -439,7 +464,7 @@ class _ScenarioGenerator():
         
         explanations    = [] # Will be set only if we abort, to explain why
         
-        for row in self.working_df.iterrows(): # Each row is for a column in data_df
+        for column_idx, row in enumerate(self.working_df.iterrows()): # Each row is for a column in data_df
             column             = row[1]["Column"]        
             prior_width        = row[1][W_COL(PRIOR)]
             #prior_nb_lines     = row[1][NB_COL(PRIOR)]
@@ -452,54 +477,30 @@ class _ScenarioGenerator():
             longest_word =row[1]['Longest word']
                             
             list_of_word_lists = row[1]["Words per row"]
-            what_ifs           = []
-            data_df_row_nb     = -1
-            for word_list in list_of_word_lists: # Each cycle is for a different row in data_df[column]
-                data_df_row_nb  += 1
-                EXPLANATION_PREFIX = NEXT + ": (column, row)=(" + str(column) + ", " + str(data_df_row_nb) + ") - "
-                text                             = ' '.join(word_list)
-                # Find how many lines this used to take
-                processor                        = TextProcessor(prior_width)
-                processor.processText(parent_trace=self.parent_trace, text=text)
-                prior_nb_lines                   = processor.nb_lines
-                
-                if prior_nb_lines >= self.row_height_limit:
-                    explanations.append(EXPLANATION_PREFIX 
-                                        + "Row height rule: height=" + str(prior_nb_lines)
-                                        + " and should not exceed "
-                                        + str(self.row_height_limit) + " for text='" + text + "'") 
-                    break # Give up on this column of data_df
-                what_if_width, what_if_nb_lines, explanation = self._what_if_width(text, 
-                                                                        prior_width, 
-                                                                        prior_nb_lines, 
-                                                                        longest_word)
-                    
-                if not what_if_width < prior_width:
-                    # We didn't shrink, no there is no optimization here, try  next row in data_df[column]
-                    explanations.append(EXPLANATION_PREFIX + explanation)
-                    break
-                
-                elif what_if_nb_lines <= self.row_height_limit:
-                # We haven't violated a global minimum, so this is a good candidate                    
-                    what_ifs.append(what_if_width)
-                else:
-                    explanations.append(EXPLANATION_PREFIX 
-                                        + "Violated row_height_limit=" 
-                                        + str(self.row_height_limit) + " for text='" + text + "'")
-                    
+            if self.nb_lines_engine != None:
+                what_ifs, row_explanations  = self._what_ifs_per_row_vectorized(column_idx, column, prior_width, 
+                                                                                longest_word, list_of_word_lists)
+            else:
+                what_ifs, row_explanations  = self._what_ifs_per_row(column, prior_width, longest_word, list_of_word_lists)
+            explanations.extend(row_explanations)
+
             OUTER_LOOP_EXPLANATION_PREFIX = NEXT + ": column='" + str(column) + "' - "
             # See if this column in data_df found a way to shrink
             if len(what_ifs) > 0:
                 best_found         = max(what_ifs) # They are all acceptable minima conditions to meet, hence max
 
                 if best_found < prior_max_width: # Sounds like we can shrink this column, but check row heights
-                    HEIGHT_ESTIMATOR   = ColumnWidthCalculator._whatif_nb_lines
                     w_df               = self.working_df
-                    list_of_word_lists = w_df[w_df['Column'] ==column].iloc[0]['Words per row']
+                    if self.nb_lines_engine != None:
+                        first_idx      = list(w_df['Column']).index(column)
+                        max_height     = self.nb_lines_engine.max_nb_lines(first_idx, best_found)
+                    else:
+                        HEIGHT_ESTIMATOR   = ColumnWidthCalculator._whatif_nb_lines
+                        list_of_word_lists = w_df[w_df['Column'] ==column].iloc[0]['Words per row']
                     
-                    max_height = HEIGHT_ESTIMATOR(  parent_trace            = self.parent_trace, 
-                                                    list_of_word_lists      = list_of_word_lists, 
-                                                    proposed_width          = best_found)
+                        max_height = HEIGHT_ESTIMATOR(  parent_trace            = self.parent_trace, 
+                                                        list_of_word_lists      = list_of_word_lists, 
+                                                        proposed_width          = best_found)
 
                     if max_height <= self.row_height_limit:
                         candidates.append(column)
@@ -523,6 +524,115 @@ class _ScenarioGenerator():
         else:
             return None, None, explanations
 
+    def _what_ifs_per_row(self, column, prior_width, longest_word, list_of_word_lists):
+        '''
+        Helper method for a data_df column, to find how much each of its rows could shrink if it were to need one more 
+        line. Rows are processed in order until a row that can't shrink, computing the number of lines with 
+        TextProcessors.
+
+        Returns two lists: the what-if widths for the rows that can shrink within the row height limit, and 
+        explanations for the rows that can't.
+        '''
+        NEXT               = 'S' + str(self.scenario_nb)
+        explanations       = []
+        what_ifs           = []
+        data_df_row_nb     = -1
+        for word_list in list_of_word_lists: # Each cycle is for a different row in data_df[column]
+            data_df_row_nb  += 1
+            EXPLANATION_PREFIX = NEXT + ": (column, row)=(" + str(column) + ", " + str(data_df_row_nb) + ") - "
+            text                             = ' '.join(word_list)
+            # Find how many lines this used to take
+            processor                        = TextProcessor(prior_width)
+            processor.processText(parent_trace=self.parent_trace, text=text)
+            prior_nb_lines                   = processor.nb_lines
+            
+            if prior_nb_lines >= self.row_height_limit:
+                explanations.append(EXPLANATION_PREFIX 
+                                    + "Row height rule: height=" + str(prior_nb_lines)
+                                    + " and should not exceed "
+                                    + str(self.row_height_limit) + " for text='" + text + "'") 
+                break # Give up on this column of data_df
+            what_if_width, what_if_nb_lines, explanation = self._what_if_width(text, 
+                                                                    prior_width, 
+                                                                    prior_nb_lines, 
+                                                                    longest_word)
+                
+            if not what_if_width < prior_width:
+                # We didn't shrink, no there is no optimization here, try  next row in data_df[column]
+                explanations.append(EXPLANATION_PREFIX + explanation)
+                break
+            
+            elif what_if_nb_lines <= self.row_height_limit:
+            # We haven't violated a global minimum, so this is a good candidate                    
+                what_ifs.append(what_if_width)
+            else:
+                explanations.append(EXPLANATION_PREFIX 
+                                    + "Violated row_height_limit=" 
+                                    + str(self.row_height_limit) + " for text='" + text + "'")
+        return what_ifs, explanations
+
+    def _what_ifs_per_row_vectorized(self, column_idx, column, prior_width, longest_word, list_of_word_lists):
+        '''
+        Does the same as self._what_ifs_per_row, with the same results and explanations, but instead of processing
+        one row at a time it processes all rows at once, using self.nb_lines_engine to get the number of lines each
+        row needs for a width.
+
+        @param column_idx An int, for the position of `column` among self.working_df's rows
+        '''
+        NEXT                    = 'S' + str(self.scenario_nb)
+        engine                  = self.nb_lines_engine
+        prior_nb_lines          = engine.nb_lines(column_idx, prior_width)
+
+        # Like in self._what_if_width, shrink one character at a time while above the longest word length
+        longest_word_length     = min(len(longest_word), self.word_size_limit)
+        what_if_widths          = [prior_width]
+        while what_if_widths[-1] > longest_word_length:
+            what_if_widths.append(what_if_widths[-1] - 1)
+
+        # For each row, how many times the width can shrink before the row needs more than 1 additional line
+        nb_shrinks              = _numpy.full(len(prior_nb_lines), len(what_if_widths) - 1)
+        what_if_nb_lines        = prior_nb_lines.copy()
+        shrinking               = _numpy.ones(len(prior_nb_lines), dtype = bool)
+        for shrink_nb in range(1, len(what_if_widths)):
+            nb_lines            = engine.nb_lines(column_idx, what_if_widths[shrink_nb])
+            stopped             = shrinking & (nb_lines > prior_nb_lines + 1)
+            nb_shrinks[stopped] = shrink_nb - 1
+            shrinking           &= ~stopped
+            what_if_nb_lines    = _numpy.where(shrinking, nb_lines, what_if_nb_lines)
+            if not shrinking.any():
+                break
+
+        # Rows are considered until the first row that is too high or can't shrink
+        gives_up                = (prior_nb_lines >= self.row_height_limit) | (nb_shrinks == 0)
+        last_row_nb             = int(_numpy.argmax(gives_up)) if gives_up.any() else len(gives_up)
+        is_good_candidate       = what_if_nb_lines[:last_row_nb] <= self.row_height_limit
+
+        what_ifs                = [what_if_widths[nb] for nb in nb_shrinks[:last_row_nb][is_good_candidate]]
+        explanations            = []
+        word_lists              = list(list_of_word_lists)
+        def _prefix(data_df_row_nb):
+            return NEXT + ": (column, row)=(" + str(column) + ", " + str(data_df_row_nb) + ") - "
+        for data_df_row_nb in _numpy.flatnonzero(~is_good_candidate):
+            text                = ' '.join(word_lists[data_df_row_nb])
+            explanations.append(_prefix(data_df_row_nb) 
+                                    + "Violated row_height_limit=" 
+                                    + str(self.row_height_limit) + " for text='" + text + "'")
+        if last_row_nb < len(gives_up):
+            text                = ' '.join(word_lists[last_row_nb])
+            row_nb_lines        = int(prior_nb_lines[last_row_nb])
+            if row_nb_lines >= self.row_height_limit:
+                explanation     = "Row height rule: height=" + str(row_nb_lines) + " and should not exceed " \
+                                    + str(self.row_height_limit) + " for text='" + text + "'"
+            elif len(what_if_widths) == 1:
+                explanation     = "Longest word rule: can't reduce width(" + str(prior_width) + ")  and still fit '" \
+                                    + longest_word + "'"
+            else:
+                explanation     = "Can't shrink column below width=" + str(prior_width) \
+                                    + " because doing so increases number of lines (" \
+                                    + str(row_nb_lines) + ") by more than 1 for text='" + text + "'"
+            explanations.append(_prefix(last_row_nb) + explanation)
+        return what_ifs, explanations
+
     def _what_if_width(self, text, prior_width, prior_nb_lines, longest_word):
         '''
         Helper method that computes and returns a 'what if' width number, defined as the smallest width
@@ -557,3 +667,102 @@ class _ScenarioGenerator():
                 explanation       = None
                 
         return what_if_width, what_if_nb_lines, explanation
+
+class _NbLinesEngine():
+    '''
+    Helper class to assist ColumnWidthCalculator by computing how many lines each row of a data_df column needs for
+    a given width. It uses the same justification algorithm as a TextProcessor, but processes all rows of a column 
+    at once with NumPy.
+
+    For each data_df column it precomputes the lengths of the words in each row, as a ragged array. Results are
+    cached per (column, width), since the search for column widths evaluates the same widths again and again.
+
+    A TextProcessor's line count only depends on the integer part of the width, since it only compares the width
+    to integer lengths. So widths are truncated to ints for computing and caching results.
+
+    @param working_df The DataFrame a ColumnWidthCalculator uses as a working pad, with a row per data_df column
+    '''
+    def __init__(self, working_df):
+        # Lists with an entry per data_df column, in the order of working_df's rows. Entries are:
+        #   * a 2D int array with the word lengths, with a row per word position and a column per data_df row. Since
+        #     rows have different numbers of words, data_df rows are sorted by decreasing number of words, so 
+        #     the rows with a word at a given position come first. Missing words are padded with 0
+        #   * an int array with the number of data_df rows with a word at each position
+        #   * an int array with the order in which data_df rows are sorted
+        self._word_lengths          = []
+        self._nb_rows_per_position  = []
+        self._row_order             = []
+        for list_of_word_lists in working_df['Words per row']:
+            # Same tokenization as a TextProcessor for the text ' '.join(word_list). Empty words take no space 
+            lengths_per_row         = [[len(word) for word in _re.split(r"\s", ' '.join(word_list).strip()) if len(word) > 0]
+                                                                                for word_list in list_of_word_lists]
+            nb_words                = _numpy.array([len(lengths) for lengths in lengths_per_row], dtype = int)
+            row_order               = _numpy.argsort(-nb_words, kind = 'stable')
+            max_nb_words            = int(nb_words.max()) if len(nb_words) > 0 else 0
+            word_lengths            = _numpy.zeros((max_nb_words, len(lengths_per_row)), dtype = int)
+            for sorted_idx, row_nb in enumerate(row_order):
+                word_lengths[:nb_words[row_nb], sorted_idx] = lengths_per_row[row_nb]
+            self._word_lengths.append(word_lengths)
+            self._nb_rows_per_position.append(_numpy.array([_numpy.count_nonzero(nb_words > position) 
+                                                                for position in range(max_nb_words)], dtype = int))
+            self._row_order.append(row_order)
+
+        # Keys are pairs (column_idx, int width), and values are int arrays with the number of lines per data_df row
+        self._cache                 = {}
+        self.hits                   = 0
+        self.misses                 = 0
+
+    def nb_lines(self, column_idx, width):
+        '''
+        Returns an int array, with the number of lines that each data_df row needs in the data_df column at position
+        `column_idx` if the column has the given `width`
+        '''
+        # A TextProcessor would loop forever for widths below 1, so treat them as 1
+        key                         = (column_idx, max(int(width), 1))
+        result                      = self._cache.get(key)
+        if result is None:
+            self.misses             += 1
+            result                  = self._compute(column_idx, key[1])
+            self._cache[key]        = result
+        else:
+            self.hits               += 1
+        return result
+
+    def max_nb_lines(self, column_idx, width):
+        '''
+        Returns an int, for the maximal number of lines that a data_df row needs in the data_df column at position
+        `column_idx` if the column has the given `width`
+        '''
+        return int(self.nb_lines(column_idx, width).max())
+
+    def _compute(self, column_idx, width):
+        word_lengths                = self._word_lengths[column_idx]
+        nb_rows_per_position        = self._nb_rows_per_position[column_idx]
+        row_order                   = self._row_order[column_idx]
+
+        consumed                    = _numpy.zeros(len(row_order), dtype = int) # Characters used in last line
+        nb_lines                    = _numpy.ones(len(row_order), dtype = int)
+        for position in range(len(word_lengths)):
+            nb_rows                 = nb_rows_per_position[position]
+            lengths                 = word_lengths[position, :nb_rows]
+            used                    = consumed[:nb_rows]
+
+            # Words that fit in the width go in the current line if there is room for them (after a space, unless
+            # the line is empty), or else in a new line
+            fits_in_line            = (used == 0) | (used + 1 + lengths <= width)
+            short_consumed          = _numpy.where(fits_in_line & (used > 0), used + 1 + lengths, lengths)
+
+            # Longer words are split in pieces of `width` characters, each in a new line (except the first piece,
+            # if the current line is empty)
+            nb_pieces               = -(-lengths // width)
+            long_nb_new_lines       = (used > 0) + nb_pieces - 1
+            last_piece              = lengths - (nb_pieces - 1) * width
+
+            is_short                = lengths <= width
+            nb_lines[:nb_rows]      += _numpy.where(is_short, ~fits_in_line, long_nb_new_lines)
+            consumed[:nb_rows]      = _numpy.where(is_short, short_consumed, last_piece)
+
+        # Undo the sorting of data_df rows
+        result                      = _numpy.empty(len(row_order), dtype = int)
+        result[row_order]           = nb_lines
+        return result
@@ -1,4 +1,5 @@
 import datetime                         as _datetime
+import bisect                           as _bisect
 
 from apodeixi.util.a6i_error            import ApodeixiError
 from apodeixi.util.formatting_utils     import StringUtils
@@ -22,6 +23,59 @@ class Excel_Block():
         self.y1      = yInterval[1]
         self.fmt     = fmt
         
+class Excel_BlockIndex():
+    '''
+    Spatial index for the Excel_Blocks of a layout, to find the blocks containing a cell without scanning all blocks.
+
+    It is a grid with a slot per column, listing the blocks that span the column sorted by their first row. The blocks 
+    containing a cell are found with a binary search in the slot for the cell's column. Since layouts usually have
+    only a couple of blocks per column, lookups take constant time in practice.
+
+    @param blocks A list of Excel_Block objects. The index becomes stale if the list or the blocks are modified
+    '''
+    def __init__(self, blocks):
+        self.blocks             = blocks
+        self.nb_blocks          = len(blocks)
+
+        # Keys are columns, and values are lists of the blocks spanning the column, sorted by their first row
+        self._slots             = {}
+        for block in blocks:
+            for x in range(block.x0, block.x1 + 1):
+                self._slots.setdefault(x, []).append(block)
+
+        # Keys are columns, and values are lists of the first row of the blocks in the column's slot
+        self._slot_y0s          = {}
+        # True if some blocks overlap, in which case a cell may be in multiple blocks so searches must be exhaustive
+        self._has_overlaps      = False
+        for x, slot in self._slots.items():
+            slot.sort(key = lambda block: block.y0)
+            self._slot_y0s[x]   = [block.y0 for block in slot]
+            last_y1             = None # Last row covered by the blocks seen so far in the slot
+            for block in slot:
+                if last_y1 != None and block.y0 <= last_y1:
+                    self._has_overlaps = True
+                last_y1         = block.y1 if last_y1 == None else max(last_y1, block.y1)
+
+    def indexes(self, blocks):
+        '''
+        Returns a boolean, stating whether this index was built for the list `blocks` and no blocks were added since
+        '''
+        return blocks is self.blocks and len(blocks) == self.nb_blocks
+
+    def locate(self, x, y):
+        '''
+        Returns a list of the blocks that contain cell [x, y]
+        '''
+        slot                    = self._slots.get(x)
+        if slot == None:
+            return []
+        if self._has_overlaps:
+            return [b for b in slot if b.y0 <= y and y <= b.y1]
+        idx                     = _bisect.bisect_right(self._slot_y0s[x], y) - 1
+        if idx >= 0 and y <= slot[idx].y1:
+            return [slot[idx]]
+        return []
+
 class Excel_Layout():
     '''
     Represents a rectangular layout for a self-contained element, such as an Apodeixi manifest. It consists of
@@ -40,6 +94,9 @@ class Excel_Layout():
         self.blocks             = []
         self.name               = name
         self.is_transposed      = is_transposed
+
+        # Excel_BlockIndex to look up blocks by cell. Built when the layout is built, or else when first needed
+        self._block_index       = None
         return
 
     def validate(self, parent_trace):
@@ -57,17 +114,23 @@ class Excel_Layout():
         xmax            = max([block.x1 for block in self.blocks])
         ymin            = min([block.y0 for block in self.blocks])
         ymax            = max([block.y1 for block in self.blocks])
-        # For each cell in the layout, check it exists in exactly one block
+        # Check each cell in the layout exists in exactly one block. Rather than looking up each cell, sweep a line
+        # across the columns, stopping only at columns where some block starts or ends: the columns between two
+        # stops cross the same blocks, so they have the same rows missed or covered multiple times.
         missed          = []
         multiple        = []
-        for x in range(xmin, xmax + 1):
-            for y in range(ymin, ymax + 1) :
-                #hits = [b for b in self.blocks if b.x0 <= x and x <= b.x1 and b.y0 <= y and y <= b.y1]
-                hits = self._locate_block(parent_trace, x, y)
-                if len(hits) == 0:
-                    missed.append('[' + str(x) + ', '+ str(y) + ']')
-                if len(hits) > 1:
-                    multiple.append('[' + str(x) + ', '+ str(y) + ']')
+        stops           = sorted(set([block.x0 for block in self.blocks] + [block.x1 + 1 for block in self.blocks]))
+        starting_blocks = {}
+        for block in self.blocks:
+            starting_blocks.setdefault(block.x0, []).append(block)
+        crossed_blocks  = []
+        for idx in range(len(stops) - 1):
+            x_start     = stops[idx]
+            crossed_blocks  = [b for b in crossed_blocks if b.x1 >= x_start] + starting_blocks.get(x_start, [])
+            missed_ys, multiple_ys = self._sweep_rows(crossed_blocks, ymin, ymax)
+            for x in range(x_start, stops[idx + 1]):
+                missed.extend(['[' + str(x) + ', '+ str(y) + ']' for y in missed_ys])
+                multiple.extend(['[' + str(x) + ', '+ str(y) + ']' for y in multiple_ys])
         if len(missed) > 0:
             raise ApodeixiError(parent_trace, "Cells not present in any block: " + ", ".join(missed),
                                                 origination ={'signaled_from': __file__,})
@@ -75,12 +138,35 @@ class Excel_Layout():
             raise ApodeixiError(parent_trace, "Cells present multiple blocks: " + ", ".join(multiple),
                                                 origination ={'signaled_from': __file__,})  
 
+    def _sweep_rows(self, blocks, ymin, ymax):
+        '''
+        Helper method used in validation for a column crossing the `blocks`. Returns two lists: the rows between
+        `ymin` and `ymax` in none of the `blocks`, and those in more than one of the `blocks`.
+        '''
+        events          = sorted([(b.y0, 1) for b in blocks] + [(b.y1 + 1, -1) for b in blocks])
+        missed_ys       = []
+        multiple_ys     = []
+        nb_hits         = 0
+        y               = ymin
+        for event_y, delta in events:
+            if event_y > y:
+                if nb_hits == 0:
+                    missed_ys.extend(range(y, event_y))
+                elif nb_hits > 1:
+                    multiple_ys.extend(range(y, event_y))
+                y       = event_y
+            nb_hits     += delta
+        missed_ys.extend(range(y, ymax + 1))
+        return missed_ys, multiple_ys
+
     def _locate_block(self, parent_trace, x, y):
         '''
         Helper method that returns a list of blocks from self.blocks that contain cell [x, y]
         '''
-        hits = [b for b in self.blocks if b.x0 <= x and x <= b.x1 and b.y0 <= y and y <= b.y1]
-        return hits
+        if self._block_index == None or not self._block_index.indexes(self.blocks):
+            # Blocks were added or replaced since the index was built
+            self._block_index   = Excel_BlockIndex(self.blocks)
+        return self._block_index.locate(x, y)
 
     def contains(self, parent_trace, x, y):
         '''
@@ -492,6 +578,8 @@ class PostingLayout(Excel_Layout):
                                             yInterval   = [next_y_offset, nb_rows + y_offset], 
                                             mode        = body_mode)
 
+        self._block_index               = Excel_BlockIndex(self.blocks)
+
 class AsExcel_Config():
     def __init__(self, sheet, hidden_cols = [], num_formats = {}, excel_formulas = None, excel_dropdowns = None,
                     nb_header_levels = 1,
@@ -581,6 +669,18 @@ class AsExcel_Config():
                                                 origination = {'concrete class': str(self.__class__.__name__), 
                                                                                 'signaled_from': __file__})
 
+    def is_standalone(self, parent_trace):
+        '''
+        Returns a boolean, stating whether self.build_displayable_df only depends on the content passed to it (and
+        on the representer's a6i_config), as opposed to depending on state that the representer builds as it writes 
+        other data objects, such as its link_table.
+
+        If so, the displayable DataFrame and column widths for this data object may be computed ahead of writing
+        the Excel spreadsheet, possibly in another thread. Derived classes for which that is not the case must 
+        return False.
+        '''
+        return True
+
 
 class ManifestXLWriteConfig(AsExcel_Config):
     '''
@@ -875,6 +975,13 @@ class MappedManifestXLWriteConfig(ManifestXLWriteConfig):
 
         self.original_content_df        = None # Will be the original manifest content, as it is in the YAML manifest
 
+    def is_standalone(self, parent_trace):
+        '''
+        Returns False, since self.build_displayable_df reads the representer's link_table to find the UIDs of the
+        referenced manifests, which are only known once those manifests have been written
+        '''
+        return False
+
  
     def build_displayable_df(self, parent_trace, content_df, representer):
         '''
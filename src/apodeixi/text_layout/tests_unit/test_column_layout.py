@@ -5,7 +5,8 @@ from apodeixi.testing_framework.a6i_unit_test           import ApodeixiUnitTest
 from apodeixi.util.formatting_utils     import DictionaryFormatter
 from apodeixi.util.a6i_error            import ApodeixiError, FunctionalTrace
 
-from apodeixi.text_layout.column_layout import ColumnWidthCalculator
+from apodeixi.text_layout.column_layout import ColumnWidthCalculator, _NbLinesEngine
+from apodeixi.text_layout.text_processor import TextProcessor
 
 class Test_ColumnWidthCalculator(ApodeixiUnitTest):
 
@@ -20,6 +21,50 @@ class Test_ColumnWidthCalculator(ApodeixiUnitTest):
 
         self._shell_test_case('test_thick_layout', viewport_width=100, viewport_height=40, max_word_length=20)
 
+    def test_nb_lines_engine(self):
+        '''
+        Checks that the number of lines computed in bulk by the _NbLinesEngine are the same as a TextProcessor's,
+        and that the vectorized and row-by-row calculations of column widths agree
+        '''
+        TEST_NAME               = 'nb_lines_engine'
+        TEXTS                   = ["", "Cloud", "Migrate the data center to the cloud", 
+                                    "Operations-Optimizations for  regulatory reporting", "x" * 25 + " y"]
+        WIDTHS                  = [3, 5, 7.5, 10, 24.0, 40]
+        try:
+            root_trace          = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing bulk computation of number of lines")
+            working_df          = _pd.DataFrame({'Column':          ['Description'],
+                                                'Words per row':    [[text.split(" ") for text in TEXTS]]})
+            engine              = _NbLinesEngine(working_df)
+            output_txt          = "Number of lines per text, by width"
+            for width in WIDTHS:
+                nb_lines        = [int(n) for n in engine.nb_lines(0, width)]
+                expected        = []
+                for text in TEXTS:
+                    processor   = TextProcessor(width)
+                    processor.processText(root_trace, text)
+                    expected.append(processor.nb_lines)
+                output_txt      += "\nwidth=" + str(width) + ":\t" + str(nb_lines) \
+                                    + "\tsame as TextProcessor: " + str(nb_lines == expected)
+            engine.nb_lines(0, 10.9)
+            output_txt          += "\ncache hits=" + str(engine.hits) + ", misses=" + str(engine.misses)
+
+            data_df             = self.load_csv(root_trace, self.input_data + '/test_thick_layout_INPUT.csv')
+            calcs               = [ColumnWidthCalculator(   data_df             = data_df.copy(), 
+                                                            viewport_width      = 100, 
+                                                            viewport_height     = 40, 
+                                                            max_word_length     = 20,
+                                                            vectorized          = vectorized) for vectorized in [True, False]]
+            results             = [calc.calc(root_trace) for calc in calcs]
+            output_txt          += "\n\nVectorized and row-by-row widths agree:\t\t" + str(results[0] == results[1])
+            output_txt          += "\nVectorized and row-by-row explanations agree:\t" \
+                                    + str(calcs[0].explanations == calcs[1].explanations)
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
     def _shell_test_case(self, name, viewport_width, viewport_height, max_word_length):
 
         INPUT_FOLDER                = self.input_data
@@ -160,6 +205,8 @@ if __name__ == "__main__":
         what_to_do = args[1]
         if what_to_do=='sparse_layout':
             T.test_small_text()
+        elif what_to_do=='nb_lines_engine':
+            T.test_nb_lines_engine()
 
 
     main(_sys.argv)
\ No newline at end of file
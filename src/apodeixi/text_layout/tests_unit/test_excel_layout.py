@@ -76,6 +76,43 @@ class Test_PostingLayout(ApodeixiUnitTest):
 
         self.assertEqual(output_as_str, expected)
 
+    def test_block_index(self):
+        '''
+        Checks that blocks are located through the layout's Excel_BlockIndex, and that the index is rebuilt when
+        blocks are added after it was built
+        '''
+        TEST_NAME               = 'block_index'
+        try:
+            root_trace          = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing layout block index")
+
+            def _block_map(layout):
+                # Display each cell as the number of the block containing it, "." if none, or "*" if multiple
+                lines           = []
+                for y in range(0, 7):
+                    line        = ""
+                    for x in range(0, 7):
+                        hits    = layout._locate_block(root_trace, x, y)
+                        line    += "." if len(hits) == 0 else "*" if len(hits) > 1 else str(layout.blocks.index(hits[0]))
+                    lines.append("\t" + line)
+                return "\n".join(lines)
+
+            layout              = PostingLayout("built-layout", is_transposed=False)
+            layout.build(root_trace, columns = ["A", "B", "C", "D"], nb_rows = 3, editable_cols = ["B", "D"],
+                                        hidden_cols = ["C"], x_offset = 1, y_offset = 1)
+            output_txt          = "Built layout:\n" + _block_map(layout)
+            output_txt          += "\nFormat of [2, 3] is writable:\t" \
+                                        + str(layout.getFormat(root_trace, 2, 3) is layout.BODY_W_FMT)
+            output_txt          += "\nContains [4, 1]:\t\t" + str(layout.contains(root_trace, 4, 1))
+
+            layout.addHeader(root_trace, xInterval = [2, 5], y = 4, mode = 'r')
+            output_txt          += "\n\nAfter adding a header that overlaps other blocks:\n" + _block_map(layout)
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
 
 if __name__ == "__main__":
     # execute only if run as a script
@@ -85,5 +122,7 @@ if __name__ == "__main__":
         what_to_do = args[1]
         if what_to_do=='validate_layout':
             T.test_validate_layout()
+        elif what_to_do=='block_index':
+            T.test_block_index()
 
     main(_sys.argv)
\ No newline at end of file
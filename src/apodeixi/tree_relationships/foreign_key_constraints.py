@@ -1,5 +1,3 @@
-import itertools                                                    as _itertools
-
 from apodeixi.knowledge_base.knowledge_base_util                    import ManifestHandle
 from apodeixi.knowledge_base.knowledge_base_store                   import KnowledgeBaseStore
 from apodeixi.knowledge_base.manifest_utils                         import ManifestUtils
@@ -77,6 +75,13 @@ class ForeignKeyConstraintsRegistry():
            saving A v2 unless B v2 is saved first, which is cumbersome for the user and unnecessary to protect against
            referential integrity problems as long as the only means to change A and B is via their common posting API.
 
+    Checks are done against an index (self.latest_links) that is maintained as entries are registered, so that checking
+    a manifest only looks at the links that are enforced for it, instead of scanning the whole registry.
+
+    For persistence, the registry remembers which entries were registered since it was last loaded or persisted 
+    (refer to self.pending_to_persistent_dict), so that stores can append them to a log instead of re-writing the
+    whole registry each time.
+
     @param store A KnowledgeBaseStore
     '''
     def __init__(self, store):
@@ -87,11 +92,29 @@ class ForeignKeyConstraintsRegistry():
         #
         self.registry                       = {}
         self.store                          = store
-        
+
+        # This dictionary indexes the links in self.registry that are enforced by self.check_foreign_key_constraints.
+        #   * Each key is the ManifestType of a manifest that is referenced by other manifests
+        #   * Each value is a dictionary, where each key is the ManifestType of a referencing manifest and each value is
+        #     a tuple (version, links): the highest version of the referencing manifest across all links to the
+        #     referenced ManifestType, and the list of ForeignKeyLinks for that version.
+        #
+        self.latest_links                   = {}
+
+        # List of ForeignKeyConstraintEntries registered since self was loaded or last persisted
+        self.pending_entries                = []
+
     def registerEntries(self, parent_trace, entries):
         '''
         @param entries A ForeignKeyConstraintEntries object
         '''
+        self._add_entries(parent_trace, entries)
+        self.pending_entries.append(entries)
+
+    def _add_entries(self, parent_trace, entries):
+        '''
+        Adds the `entries` to self.registry and self.latest_links, without remembering them as pending persistence
+        '''
         if type(entries) != ForeignKeyConstraintEntries:
             raise ApodeixiError(parent_trace, "Invalid foreign key constraint entries: expected a 'ForeignKeyConstraintEntries', "
                                             + "and instead was given a '" + str(type(entries)) + "'")
@@ -101,7 +124,37 @@ class ForeignKeyConstraintsRegistry():
             prior_entries                   = self.registry[key]
             prior_entries.merge(parent_trace, entries)
         else:
-            self.registry[key]              = entries
+            # Register a copy, so that merging other entries later on does not modify `entries`, which is also
+            # remembered in self.pending_entries
+            copied_entries                  = ForeignKeyConstraintEntries(parent_trace, key, self.store)
+            copied_entries.links            = list(entries.links)
+            self.registry[key]              = copied_entries
+
+        # Each referencing ManifestType may appear in multiple entries for the referenced ManifestType.
+        # For example, consider the case of milestones manifests that reference big-rocks manifests.
+        #
+        # In that example, suppose that there is a constraint under big-rock's version 2, which contains
+        # links for milestones' version 2, say. Imagine that big-rocks are posted a few times, elevating
+        # the big-rock version to version 8. Meanwhile, milestones is still at version 2. If milestones is
+        # then posted, the milestone's version changes to 3, and since it points to version 8 of big-rocks, that
+        # leads to a new ForeignKeyConstraintEntries constraint created (for big-rock version 8) under which
+        # there would be a list of links for milestone (version 3)
+        #
+        # Of these multiple links, we only care about the ones for which the milestone version is highest, so those
+        # are the only ones we index.
+        #
+        # GOTCHA: there might be multiple links for the same referencing version, since a single referencing manifest
+        # instance has a link per path. So for equal versions we extend the list of links, rather than replacing it
+        #
+        links_by_type                       = self.latest_links.setdefault(key.getManifestType(), {})
+        for link in entries.links:
+            referencing_type                = link.referencing_handle.getManifestType()
+            referencing_version             = link.referencing_handle.version
+            latest                          = links_by_type.get(referencing_type)
+            if latest == None or referencing_version > latest[0]:
+                links_by_type[referencing_type] = (referencing_version, [link])
+            elif referencing_version == latest[0]:
+                latest[1].append(link)
 
     def check_foreign_key_constraints(self, parent_trace, manifest_dict):
         '''
@@ -117,65 +170,22 @@ class ForeignKeyConstraintsRegistry():
         if handle.version == 0:
             return # This is a create, not an update, so nothing to check
 
-        pertinent_constraints                       = [(h, fkc_entries) for (h, fkc_entries) in self.registry.items() 
-                                                                if h.getManifestType() == handle.getManifestType() ]
-        if len(pertinent_constraints) == 0:
+        links_by_type                               = self.latest_links.get(handle.getManifestType(), {})
+        if len(links_by_type) == 0:
             return # There are no constraints registered against this manifest type
-        
-        manifest_uids                               = ManifestUtils().get_manifest_uids(parent_trace, manifest_dict)
-
-        if True:
-            # Take the union of all links across all of the pertinent constraints
-            all_links                               = list(_itertools.chain(*[fck_entries.links 
-                                                            for (h, fck_entries) in pertinent_constraints]))
-
-            # Take the union of all referencing types across all links across all pertinent_constraints
-            referencing_handle_types                = [link.referencing_handle.getManifestType() for link in all_links]
-
-            #Remove duplicates
-            referencing_handle_types                = list(set(referencing_handle_types))
-
-            filtered_links                              = []
-            for ht in referencing_handle_types:
-                # Each referencing handle type may appear in multiple pertinent constraints.
-                # For example, consider the case of milestones manifests that reference big-rocks manifests.
-                #
-                # In that example, suppose that there is a constraint under big-rock's version 2, which contains
-                # links for milestones' version 2, say. Imagine that big-rocks are posted a few times, elevating
-                # the big-rock version to version 8. Meanwhile, milestones is still at version 2. If milestones is
-                # then posted, the milestone's version changes to 3, and since it points to version 8 of big-rocks, that
-                # leads to a new ForeignKeyConstraintEntries constraint created (for big-rock version 8) under which
-                # there would be a list of links for milestone (version 3)
-                #
-                # Thus, if we have to check constraints for referencing handle type ht=milestones, then we would have
-                # multiple big-rock entries in the constraints data structure, each of them with milestones links.
-                #
-                # Of these multiple links, we only care about the ones for which the milestone version is highest.
-                #
-                # Hence we need to search for the highest version of the referencing manifest in the links,
-                # and then only enforce those links when checking constraints.
-                # 
-                # 
-                matching_links                          = [link for link in all_links if 
-                                                            link.referencing_handle.getManifestType()== ht]
-
-                latest_version                          = max([link.referencing_handle.version for link in matching_links])
-                latest_links                            = [link for link in matching_links if
-                                                            link.referencing_handle.version == latest_version]
-                # GOTCHA: while there is only one ManifestType in this loop, there might be multiple links since a
-                # single referencing manifest instance has a link per path. So we use extend, not a append,
-                # since there are multiple links to add, not 1
-                filtered_links.extend(latest_links)
+
+        # A set, so that checking each referenced UID is done in constant time
+        manifest_uids                               = set(ManifestUtils().get_manifest_uids(parent_trace, manifest_dict))
 
         # We will aggregate all foreign key constraint violations (if any) in a dictionary where the keys
         # are ManifestHandles for the referencing manifests, and the values are lists of UIDs that were removed
         # but are relied upon by those referencing manifests
         violations                                  = {}
-        for link in filtered_links: #constraint_entries.links:
-            referenced_uids                         = link.referenced_uids
-            link_violations                         = [uid for uid in referenced_uids if not uid in manifest_uids]
-            if len(link_violations)  > 0:
-                violations[link.referencing_handle] = link_violations
+        for (latest_version, latest_links) in links_by_type.values():
+            for link in latest_links:
+                link_violations                     = [uid for uid in link.referenced_uids if not uid in manifest_uids]
+                if len(link_violations)  > 0:
+                    violations[link.referencing_handle] = link_violations
 
         if len(violations) > 0:
             violation_uids                          = []
@@ -197,33 +207,55 @@ class ForeignKeyConstraintsRegistry():
         Returns a dictionary with the data that should be persisted. This is a slimmed-down version of self.registry,
         removing transient or referential state that shouldn't be persisted.
         '''
+        return self._entries_to_persistent_dict(parent_trace, self.registry.values())
+
+    def pending_to_persistent_dict(self, parent_trace):
+        '''
+        Returns a dictionary like self.to_persistent_dict, but only for the entries that were registered since self
+        was loaded or last persisted. Returns None if there are no such entries.
+
+        Stores can persist this dictionary by appending it to a log, which can later be replayed with 
+        self.replay_persisted_dict.
+        '''
+        if len(self.pending_entries) == 0:
+            return None
+        return self._entries_to_persistent_dict(parent_trace, self.pending_entries)
+
+    def clear_pending(self, parent_trace):
+        '''
+        To be called by stores after they persisted self.pending_to_persistent_dict()
+        '''
+        self.pending_entries                = []
+
+    def _entries_to_persistent_dict(self, parent_trace, entries_list):
         result_dict                         = {}
 
-        for key in self.registry.keys():
-            entries                         = self.registry[key]
+        for entries in entries_list:
             slimmed_links                   = [link.to_persistent_dict(parent_trace) for link in entries.links]
-            result_dict[key]                = slimmed_links
+            result_dict.setdefault(entries.referenced_handle, []).extend(slimmed_links)
 
         return result_dict
 
+    def replay_persisted_dict(self, parent_trace, persisted_dict):
+        '''
+        Adds to self the entries in `persisted_dict`, which is a dictionary as returned by self.to_persistent_dict or
+        self.pending_to_persistent_dict. The entries added are not considered pending persistence.
+        '''
+        for key in persisted_dict.keys():
+            slimmed_links                   = persisted_dict[key]
+            entries                         = ForeignKeyConstraintEntries(parent_trace, key, self.store)
+            entries.links                   = [ForeignKeyLink.from_persisted_dict(parent_trace, slim_link_dict, self.store) 
+                                                            for slim_link_dict in slimmed_links]
+            self._add_entries(parent_trace, entries)
+
     def from_persisted_dict(parent_trace, persisted_dict, store):
         '''
         Creates and returns a ForeignKeyConstraintsRegistry that is built from the `persisted_dict`
 
         @param store A KnowledgeBaseStore object
         '''
-        
-        registry                            = {}
-        for key in persisted_dict.keys():
-            slimmed_links                   = persisted_dict[key]
-            links                           = [ForeignKeyLink.from_persisted_dict(parent_trace, slim_link_dict, store) 
-                                                            for slim_link_dict in slimmed_links]
-            entries                         = ForeignKeyConstraintEntries(parent_trace, key, store)
-            entries.links                   = links
-            registry[key]                   = entries
-    
         result                              = ForeignKeyConstraintsRegistry(store = store)
-        result.registry                     = registry
+        result.replay_persisted_dict(parent_trace, persisted_dict)
         return result
 
 class ForeignKeyConstraintEntries():
@@ -57,18 +57,55 @@ class FunctionalTrace():
                 is displayed. In the above example, that might become:
 
                 '<MASKED>/envs/big_rocks_posting_ENV/excel-postings'
+
+    Since traces are created in nearly every loop, while their context is only looked at if an error is raised,
+    the context passed to `doing` is only rendered when needed. Callers can take advantage of this by passing
+    callables (with no arguments) instead of values that are expensive to compute, such as big strings: the
+    `data` and `origination` parameters may be a callable returning a dictionary, and the values in those
+    dictionaries may also be callables. They are called the first time the trace is examined or pickled.
+
+    GOTCHA: a callable sees variables as they are when it is called, not when it was passed to `doing`. So it should
+    only refer to variables that don't change while the trace is in use. If that is not the case, or to debug a
+    problem, set `FunctionalTrace.TRACING_ENABLED = True`, so that context is rendered as soon as it is passed to 
+    `doing`.
     '''
+    __slots__                       = ('functional_purpose', 'parent_trace', 'path_mask', '_context')
+
     def __init__(self, parent_trace, path_mask):
         self.functional_purpose     = None
         self.parent_trace           = parent_trace # Caller's FunctionalTrace
 
         self.path_mask              = path_mask
 
+        # Tuple of (activity, flow_stage, data, origination) as passed to `doing`, until self.functional_purpose
+        # is rendered from it
+        self._context               = None
+
     ACTIVITY                        = 'activity'
     DATA                            = 'data'
     FLOW_STAGE                      = 'flow_stage'
     ORIGINATION                     = 'origination'
 
+    # If True, context is rendered in `doing` instead of waiting until it is needed
+    TRACING_ENABLED                 = False
+
+    # Activities that were already validated, mapped to their interned string. Activities are nearly always
+    # string literals, but some are built on the fly, so to keep memory bounded activities stop being
+    # remembered once there are this many.
+    _ACTIVITIES                     = {}
+    _MAX_ACTIVITIES                 = 10000
+
+    def __getstate__(self):
+        '''
+        Callables in the context might not be picklable, so render the context before pickling
+        '''
+        self._render()
+        return (self.functional_purpose, self.parent_trace, self.path_mask)
+
+    def __setstate__(self, state):
+        self.functional_purpose, self.parent_trace, self.path_mask = state
+        self._context               = None
+
     def doing(self, activity, flow_stage=None, data=None, origination=None):
         '''
         Meant for a caller to create a new FunctionalTrace object that it can pass to a subroutine it is calling, 
@@ -83,32 +120,56 @@ class FunctionalTrace():
         @param flow_stage       An optional string for caller to say where in its flow this activity sits (e.g., "after such and such" or
                                 "before such and such")
         @param data             A dictionary or useful information about how the activity is being run (e.g., "4th cycle of loop" or
-                                "in cycle of loop processing item ABC")
-        @param 'origination': a dictionary of stack-related information (may include folder information that varies per installation)
+                                "in cycle of loop processing item ABC"). May also be a callable that returns such a dictionary,
+                                and the dictionary's values may be callables that return the value to display.
+        @param 'origination': a dictionary of stack-related information (may include folder information that varies per installation).
+                                Like `data`, it may be a callable and have callable values.
         '''
-        if activity==None:
-            raise ApodeixiError(self.parent_trace, "Can't create a FunctionalTrace with a null activity")
-        if type(activity) != str:
-            raise ApodeixiError(self.parent_trace, "Can't create a FunctionalTrace with a non-string activity of type " + str.type(activity))
-        if len(activity.strip('\n '))==0:
-            raise ApodeixiError(self.parent_trace, "Can't create a FunctionalTrace with a blank activity '" + activity + "'")        
-
-        # Ensure context is non-null
-        if data == None:
-            data                            = {}
-        if flow_stage == None:
-            flow_stage                      = ''
-        if origination == None:
-            origination                     = {}
+        ME                                  = FunctionalTrace
+        interned_activity                   = ME._ACTIVITIES.get(activity) if type(activity) == str else None
+        if interned_activity == None:
+            if activity==None:
+                raise ApodeixiError(self.parent_trace, "Can't create a FunctionalTrace with a null activity")
+            if type(activity) != str:
+                raise ApodeixiError(self.parent_trace, "Can't create a FunctionalTrace with a non-string activity of type " + str.type(activity))
+            if len(activity.strip('\n '))==0:
+                raise ApodeixiError(self.parent_trace, "Can't create a FunctionalTrace with a blank activity '" + activity + "'")        
+            interned_activity               = _sys.intern(activity)
+            if len(ME._ACTIVITIES) < ME._MAX_ACTIVITIES:
+                ME._ACTIVITIES[interned_activity] = interned_activity
 
         subroutine_ctx                      = FunctionalTrace(parent_trace=self, path_mask=self.path_mask)
-        subroutine_ctx.functional_purpose   = { FunctionalTrace.ACTIVITY        : activity, 
-                                                FunctionalTrace.FLOW_STAGE      : flow_stage,
-                                                FunctionalTrace.DATA            : data,
-                                                FunctionalTrace.ORIGINATION     : origination}
+        subroutine_ctx._context             = (interned_activity, flow_stage, data, origination)
+        if ME.TRACING_ENABLED:
+            subroutine_ctx._render()
 
         return subroutine_ctx
 
+    def _render(self):
+        '''
+        Sets self.functional_purpose from the context passed to `doing`, if not done already. This is where
+        callables in the context get called.
+        '''
+        if self._context == None:
+            return
+        activity, flow_stage, data, origination = self._context
+
+        def _rendered(a_dict):
+            if callable(a_dict):
+                a_dict                      = a_dict()
+            # Ensure context is non-null
+            if a_dict == None:
+                return {}
+            return {k: v() if callable(v) else v for k, v in a_dict.items()}
+
+        if flow_stage == None:
+            flow_stage                      = ''
+        self.functional_purpose             = { FunctionalTrace.ACTIVITY        : activity, 
+                                                FunctionalTrace.FLOW_STAGE      : flow_stage,
+                                                FunctionalTrace.DATA            : _rendered(data),
+                                                FunctionalTrace.ORIGINATION     : _rendered(origination)}
+        self._context                       = None
+
     def examine(self, as_string=False, exclude_origination=False):
         '''
         Can be thought of as analogous to a (technical) stack trace, but expressed in functional terms.
@@ -126,13 +187,15 @@ class FunctionalTrace():
         Dependingon the `as_string` flag, this method either returns such list of dictionaries or a string that formats
         them nicely for display on a termina.
         '''
+        self._render()
         trace                   = []
         if as_string:
             trace.append(self._format_functional_trace(exclude_origination))
         else:
             trace.append(self.functional_purpose)
 
-        if self.parent_trace != None and self.parent_trace.functional_purpose != None:
+        if self.parent_trace != None and (self.parent_trace.functional_purpose != None \
+                                            or self.parent_trace._context != None):
             trace               = self.parent_trace.examine(as_string=as_string, exclude_origination=exclude_origination) + trace
         
         return trace
@@ -200,6 +263,14 @@ class ApodeixiError (Exception):
         self.origination                = origination
         self.external_stacktrace        = external_stacktrace
 
+    def __reduce__(self):
+        '''
+        Needed so that ApodeixiErrors can be pickled (e.g., when raised in a worker process), since the
+        default pickling of exceptions relies on `self.args`, which for us contains `self` and would therefore
+        recurse infinitely.
+        '''
+        return (self.__class__, (self.functional_trace, self.msg, self.data, self.origination, self.external_stacktrace))
+
     def trace_message(self, exclude_stack_trace=False, ignore_mask=False):
         '''
         @param ignore_mask A boolean, used to overwrite the setting `self.functional_trace.path_mask` when we want
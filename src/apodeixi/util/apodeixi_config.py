@@ -130,6 +130,157 @@ class ApodeixiConfig():
         # Expand any environment variables in the path
         return _os.path.expandvars(self.config_dict[KB][EXTERNAL_FOLDER])
 
+    def get_ManifestSidecars(self, parent_trace):
+        '''
+        Returns a boolean, stating whether the KnowledgeBase should write binary sidecars next to the YAML files of
+        manifests, to speed up their retrieval. Defaults to False if not configured.
+        '''
+        my_trace            = parent_trace.doing("Retrieving manifest sidecars setting from the Apodeixi Configuration ")
+        KB                  = 'knowledge-base'
+        SIDECARS            = 'manifest-sidecars'
+        check, explanation = DictionaryUtils().validate_path(   parent_trace    = my_trace, 
+                                                                root_dict       = self.config_dict, 
+                                                                root_dict_name  = 'apodeixi',
+                                                                path_list       = [KB, SIDECARS],
+                                                                valid_types     = [bool])
+        if not check:
+            return False
+        
+        return self.config_dict[KB][SIDECARS]
+
+    def get_OverlaySandboxes(self, parent_trace):
+        '''
+        Returns a boolean, stating whether sandbox environments should be created as overlays of their parent
+        environment, i.e., without copying into the sandbox data that is read from the parent environment.
+        Defaults to False if not configured.
+        '''
+        my_trace            = parent_trace.doing("Retrieving overlay sandboxes setting from the Apodeixi Configuration ")
+        KB                  = 'knowledge-base'
+        OVERLAY             = 'overlay-sandboxes'
+        check, explanation = DictionaryUtils().validate_path(   parent_trace    = my_trace,
+                                                                root_dict       = self.config_dict,
+                                                                root_dict_name  = 'apodeixi',
+                                                                path_list       = [KB, OVERLAY],
+                                                                valid_types     = [bool])
+        if not check:
+            return False
+
+        return self.config_dict[KB][OVERLAY]
+
+    def get_PostingCacheFolder(self, parent_trace):
+        '''
+        Returns a string, for the folder in which to cache data read from postings' Excel files, so that postings that
+        are parsed again without having changed are not read from Excel again. Returns None if not configured, in which
+        case no such cache is used.
+        '''
+        my_trace            = parent_trace.doing("Retrieving posting cache folder from the Apodeixi Configuration ")
+        KB                  = 'knowledge-base'
+        CACHE_FOLDER        = 'posting-cache-folder'
+        check, explanation = DictionaryUtils().validate_path(   parent_trace    = my_trace,
+                                                                root_dict       = self.config_dict,
+                                                                root_dict_name  = 'apodeixi',
+                                                                path_list       = [KB, CACHE_FOLDER],
+                                                                valid_types     = [str])
+        if not check:
+            return None
+
+        # Expand any environment variables in the path
+        return _os.path.expandvars(self.config_dict[KB][CACHE_FOLDER])
+
+    def get_PostingCacheMaxMB(self, parent_trace):
+        '''
+        Returns an int, for how many megabytes the posting cache may take on disk before the least recently used
+        entries are evicted. Refer to get_PostingCacheFolder. Defaults to 256 if not configured.
+        '''
+        my_trace            = parent_trace.doing("Retrieving posting cache size from the Apodeixi Configuration ")
+        KB                  = 'knowledge-base'
+        CACHE_MB            = 'posting-cache-max-mb'
+        check, explanation = DictionaryUtils().validate_path(   parent_trace    = my_trace,
+                                                                root_dict       = self.config_dict,
+                                                                root_dict_name  = 'apodeixi',
+                                                                path_list       = [KB, CACHE_MB],
+                                                                valid_types     = [int])
+        if not check:
+            return 256
+
+        return max(0, self.config_dict[KB][CACHE_MB])
+
+    def get_PostingWorkers(self, parent_trace):
+        '''
+        Returns an int, stating how many worker processes the KnowledgeBase should use to parse postings
+        when posting in batch. Defaults to 1 (i.e., serial processing) if not configured.
+        '''
+        my_trace            = parent_trace.doing("Retrieving posting workers setting from the Apodeixi Configuration ")
+        KB                  = 'knowledge-base'
+        WORKERS             = 'posting-workers'
+        check, explanation = DictionaryUtils().validate_path(   parent_trace    = my_trace,
+                                                                root_dict       = self.config_dict,
+                                                                root_dict_name  = 'apodeixi',
+                                                                path_list       = [KB, WORKERS],
+                                                                valid_types     = [int])
+        if not check:
+            return 1
+
+        return max(1, self.config_dict[KB][WORKERS])
+
+    def get_ManifestBuildThreads(self, parent_trace):
+        '''
+        Returns an int, stating how many threads a controller should use to build the manifests of a single posting.
+        Manifests that don't depend on each other are then built in parallel. Defaults to 1 (i.e., manifests are
+        built one at a time, in the order they appear in the Posting Label) if not configured.
+        '''
+        my_trace            = parent_trace.doing("Retrieving manifest build threads setting from the Apodeixi Configuration ")
+        KB                  = 'knowledge-base'
+        THREADS             = 'manifest-build-threads'
+        check, explanation = DictionaryUtils().validate_path(   parent_trace    = my_trace,
+                                                                root_dict       = self.config_dict,
+                                                                root_dict_name  = 'apodeixi',
+                                                                path_list       = [KB, THREADS],
+                                                                valid_types     = [int])
+        if not check:
+            return 1
+
+        return max(1, self.config_dict[KB][THREADS])
+
+    def get_FormGenerationThreads(self, parent_trace):
+        '''
+        Returns an int, stating how many threads a controller should use to generate a form, i.e., to convert the
+        manifests in scope of the form to DataFrames and lay them out, before the form's Excel spreadsheet is 
+        written by a single thread. Defaults to 1 (i.e., manifests are processed one at a time) if
+        not configured.
+        '''
+        my_trace            = parent_trace.doing("Retrieving form generation threads setting from the Apodeixi Configuration ")
+        KB                  = 'knowledge-base'
+        THREADS             = 'form-generation-threads'
+        check, explanation = DictionaryUtils().validate_path(   parent_trace    = my_trace,
+                                                                root_dict       = self.config_dict,
+                                                                root_dict_name  = 'apodeixi',
+                                                                path_list       = [KB, THREADS],
+                                                                valid_types     = [int])
+        if not check:
+            return 1
+
+        return max(1, self.config_dict[KB][THREADS])
+
+    def get_StreamExcelForms(self, parent_trace):
+        '''
+        Returns a boolean, stating whether Excel forms should be written in xlsxwriter's constant memory mode,
+        i.e., streaming each worksheet's rows to disk in order instead of keeping the whole workbook in memory
+        until it is saved. Defaults to False if not configured.
+        '''
+        my_trace            = parent_trace.doing("Retrieving stream Excel forms setting from the Apodeixi Configuration ")
+        KB                  = 'knowledge-base'
+        STREAM              = 'stream-excel-forms'
+        check, explanation = DictionaryUtils().validate_path(   parent_trace    = my_trace,
+                                                                root_dict       = self.config_dict,
+                                                                root_dict_name  = 'apodeixi',
+                                                                path_list       = [KB, STREAM],
+                                                                valid_types     = [bool])
+        if not check:
+            return False
+
+        return self.config_dict[KB][STREAM]
+
     def getMonthFiscalYearStarts(self, parent_trace):
         my_trace            = parent_trace.doing("Retrieving Knowledge Base's fiscal year start from the Apodeixi Configuration ")
         SETTINGS            = 'organization-settings'
@@ -3,19 +3,13 @@ import sys                                      as _sys
 import math                                     as _math
 import re                                       as _re
 
-import nbformat                                 as _nbformat
 import warnings
-from nbconvert.preprocessors                    import ExecutePreprocessor
 
 from apodeixi.util.a6i_error                    import ApodeixiError
 from apodeixi.util.warning_utils                    import WarningUtils
 
-# As documented in https://www.gitmemory.com/issue/zeromq/pyzmq/1521/824694187, need to change the Windows default event loop
-# policy for asyncio (used indirectly by nbconvert, in turn used by NotebookUtils) to work
-import asyncio                              as _asyncio
-if _sys.platform == 'win32':
-    _asyncio.set_event_loop_policy(_asyncio.WindowsSelectorEventLoopPolicy())
-
+# GOTCHA: nbformat and nbconvert are slow to import and only needed by NotebookUtils, so they are imported lazily
+#       in NotebookUtils rather than here. Otherwise every module that needs a StringUtils would pay for them.
 
 class StringUtils():
 
@@ -171,6 +165,15 @@ class NotebookUtils():
         self.destination_filename       = destination_filename
     
     def run(self, parent_trace):
+        import nbformat                                 as _nbformat
+        from nbconvert.preprocessors                    import ExecutePreprocessor
+
+        # As documented in https://www.gitmemory.com/issue/zeromq/pyzmq/1521/824694187, need to change the Windows default 
+        # event loop policy for asyncio (used indirectly by nbconvert) to work
+        if _sys.platform == 'win32':
+            import asyncio                              as _asyncio
+            _asyncio.set_event_loop_policy(_asyncio.WindowsSelectorEventLoopPolicy())
+
         # Catch warnings and handle them so that we avoid spurious noise in the CLI due to noisy 3rd party libraries
         with warnings.catch_warnings(record=True) as w:
             WarningUtils().turn_traceback_on(parent_trace, warnings_list=w) 
@@ -223,6 +226,7 @@ class NotebookUtils():
             
 
     def _val_to_dict(parent_trace, val):
+        import nbformat                                 as _nbformat
         try:
             result                  = {}
             if type(val) == _nbformat.notebooknode.NotebookNode:
@@ -1,6 +1,7 @@
 import os                                           as _os
 import sys                                          as _sys
 import shutil                                       as _shutil
+import threading                                    as _threading
 from pathlib                                        import Path
 import time                                         as _time
 import re                                           as _re
@@ -198,81 +199,11 @@ class PathUtils():
         TEST_DB_ROOT                                                = a6i_config.test_db_dir                                         
         KB_ROOT                                                     = a6i_config.get_KB_RootFolder(parent_trace)
         COLLAB_ROOT                                                 = a6i_config.get_ExternalCollaborationFolder(parent_trace)
-        A6I_DB                                                      = _os.path.dirname(KB_ROOT)
-
-        # In case we print the paths for Python modules (e.g., as in stack traces), we want to mask the location of
-        # the module so that regression test output does not depend on where Python modules get installed.
-        # For that we use this helper function to locate such substrings
-        #
-        def _match_sys_path(line):
-            matches     = [(len(folder.strip()), folder) for folder in _sys.path if len(folder.strip()) > 0 and folder in line]
-            if len(matches) > 0:
-                max_length      = max([pair[0] for pair in matches])
-                best_match      = [pair[1] for pair in matches if pair[0]==max_length][0]
-                return best_match
-            else:
-                return None
-                
-        def _path_mask(raw_txt):
-            '''
-            '''
-            if type(raw_txt) != str:
-                return raw_txt
-            lines                                                   = raw_txt.split("\n")
-            cleaned_lines                                           = []
-            LINE_NB_REGEX                                           = _re.compile(r'line [0-9]+')
-            for line in lines:
-                linux_line                                          = self.to_linux(line)
-                if TEST_DB_ROOT != None and self.is_parent(parent_trace, parent_dir=TEST_DB_ROOT, path=line):
-                    tokens                                          = linux_line.split(TEST_DB_ROOT)
-                    masked_path                                     = '<TEST DB ROOT>' + tokens[-1]
-                    cleaned_lines.append(masked_path)
-                elif self.is_parent(parent_trace, parent_dir=KB_ROOT, path=line):
-                    tokens                                          = linux_line.split(KB_ROOT)
-                    masked_path                                     = '<KNOWLEDGE BASE ROOT>' + tokens[-1]
-                    cleaned_lines.append(masked_path)
-                elif self.is_parent(parent_trace, parent_dir=COLLAB_ROOT, path=line):
-                    linux_line                                      = self.to_linux(line)
-                    tokens                                          = linux_line.split(COLLAB_ROOT)
-                    masked_path                                     = '<EXTERNAL COLLABORATION FOLDER>' + tokens[-1]
-                    cleaned_lines.append(masked_path)
-                elif self.is_parent(parent_trace, parent_dir=A6I_DB, path=line):
-                    tokens                                          = linux_line.split(A6I_DB)
-                    masked_path                                     = '<APODEIXI DATABASE>' + tokens[-1]
-                    cleaned_lines.append(masked_path)
-                elif 'apodeixi' in line:
-                    tokens                                          = line.split('apodeixi')
-                    masked_path                                     = '<APODEIXI INSTALLATION>/apodeixi' + tokens[-1]
-                    cleaned_lines.append(masked_path)
-                else:
-                    module_path                                     = _match_sys_path(line)
-                    if not module_path is None:
-                        '''
-                        masked_path                                 = _re.sub(module_path.replace("\\", "/"), 
-                                                                                '<PYTHON MODULE>', 
-                                                                                line)
-                        '''
-                        tokens                                      = line.split(module_path)
-                        if len(tokens) > 1:
-                            prefix                                  = tokens[0]
-                        else:
-                            prefix                                  = ""
-                        masked_path                                 = prefix + '<PYTHON MODULE>' + tokens[-1]
-
-                        # In case we are using a different minor version of Python, in a test run vs when regression test
-                        # output was created, don't want line numbers to cause spurious regression test failures
-                        masked_path                                 = _re.sub(LINE_NB_REGEX, 'line <HIDDEN>', masked_path)
-
-                        cleaned_lines.append(masked_path)
-                    else:
-                        cleaned_lines.append(line)
-
 
-
-            cleaned_txt                     = "\n".join(cleaned_lines)
-            return cleaned_txt
-
-        return _path_mask
+        # GOTCHA: we return a callable object instead of a closure so that the mask can be pickled, as is
+        #       needed when FunctionalTraces or environment configurations are sent to other processes
+        #       (e.g., when the KnowledgeBase posts in parallel)
+        return _PathMask(parent_trace, TEST_DB_ROOT, KB_ROOT, COLLAB_ROOT)
 
     def to_linux(self, path, absolute=True):
         '''
@@ -290,14 +221,38 @@ class PathUtils():
         return linux_path
 
     def copy_file(self, parent_trace, from_path, to_dir):
+        '''
+        Copies the file in `from_path` to `to_dir`, which can be either a folder or the full path for the copy.
+
+        The copy is first written to a temporary file and then moved into place. This way readers never see a
+        partially written file and, if the destination was a hard link (see FileTransferBatch), the file it
+        was linked to is not modified.
+        '''
         try:
-            _shutil.copy2(src = from_path, dst = to_dir)
+            if _os.path.isdir(to_dir):
+                to_path             = to_dir + "/" + _os.path.basename(from_path)
+            else:
+                to_path             = to_dir
+            tmp_path                = self.tmp_path(to_path)
+            try:
+                _shutil.copy2(src = from_path, dst = tmp_path)
+                _os.replace(tmp_path, to_path)
+            finally:
+                if _os.path.lexists(tmp_path):
+                    _os.remove(tmp_path)
         except Exception as ex:
             raise ApodeixiError(parent_trace, "Got a problem copying a folder structure",
                                         data = {"source folder":        str(from_path),
                                                 "destination folder":   str(to_dir),
                                                 "error":                str(ex)})
 
+    def tmp_path(self, path):
+        '''
+        Returns the path of a temporary file, next to `path`, in which to write content before moving it to `path`. 
+        It is unique per process and thread, so that concurrent writers don't clobber each other's temporary files.
+        '''
+        return path + "." + str(_os.getpid()) + "." + str(_threading.get_ident()) + ".tmp"
+
     def remove_file_if_exists(self, parent_trace, path):
         '''
         Removes the file at the location `path`, and returns an integer status:
@@ -358,6 +313,190 @@ class PathUtils():
             raise ApodeixiError(parent_trace, "Error attempting to remove folder",
                                             data = {"path": str(path), "error": str(ex)})
 
+class _PathMask():
+    '''
+    Mask function returned by PathUtils.get_mask_lambda. It takes a string argument and returns a string, in which
+    the top levels of paths that refer to files in an Apodeixi deployment are masked.
+
+    It is a class (as opposed to a closure) so that it can be pickled.
+    '''
+    def __init__(self, parent_trace, test_db_root, kb_root, collab_root):
+        self.parent_trace                                           = parent_trace
+        self.test_db_root                                           = test_db_root
+        self.kb_root                                                = kb_root
+        self.collab_root                                            = collab_root
+        self.a6i_db                                                 = _os.path.dirname(kb_root)
+
+    def _match_sys_path(self, line):
+        '''
+        In case we print the paths for Python modules (e.g., as in stack traces), we want to mask the location of
+        the module so that regression test output does not depend on where Python modules get installed.
+        For that we use this helper function to locate such substrings
+        '''
+        matches     = [(len(folder.strip()), folder) for folder in _sys.path if len(folder.strip()) > 0 and folder in line]
+        if len(matches) > 0:
+            max_length      = max([pair[0] for pair in matches])
+            best_match      = [pair[1] for pair in matches if pair[0]==max_length][0]
+            return best_match
+        else:
+            return None
+
+    def __call__(self, raw_txt):
+        if type(raw_txt) != str:
+            return raw_txt
+        parent_trace                                            = self.parent_trace
+        TEST_DB_ROOT                                            = self.test_db_root
+        KB_ROOT                                                 = self.kb_root
+        COLLAB_ROOT                                             = self.collab_root
+        A6I_DB                                                  = self.a6i_db
+        P                                                       = PathUtils() # Abbreviation for readability
+        lines                                                   = raw_txt.split("\n")
+        cleaned_lines                                           = []
+        LINE_NB_REGEX                                           = _re.compile(r'line [0-9]+')
+        for line in lines:
+            linux_line                                          = P.to_linux(line)
+            if TEST_DB_ROOT != None and P.is_parent(parent_trace, parent_dir=TEST_DB_ROOT, path=line):
+                tokens                                          = linux_line.split(TEST_DB_ROOT)
+                masked_path                                     = '<TEST DB ROOT>' + tokens[-1]
+                cleaned_lines.append(masked_path)
+            elif P.is_parent(parent_trace, parent_dir=KB_ROOT, path=line):
+                tokens                                          = linux_line.split(KB_ROOT)
+                masked_path                                     = '<KNOWLEDGE BASE ROOT>' + tokens[-1]
+                cleaned_lines.append(masked_path)
+            elif P.is_parent(parent_trace, parent_dir=COLLAB_ROOT, path=line):
+                linux_line                                      = P.to_linux(line)
+                tokens                                          = linux_line.split(COLLAB_ROOT)
+                masked_path                                     = '<EXTERNAL COLLABORATION FOLDER>' + tokens[-1]
+                cleaned_lines.append(masked_path)
+            elif P.is_parent(parent_trace, parent_dir=A6I_DB, path=line):
+                tokens                                          = linux_line.split(A6I_DB)
+                masked_path                                     = '<APODEIXI DATABASE>' + tokens[-1]
+                cleaned_lines.append(masked_path)
+            elif 'apodeixi' in line:
+                tokens                                          = line.split('apodeixi')
+                masked_path                                     = '<APODEIXI INSTALLATION>/apodeixi' + tokens[-1]
+                cleaned_lines.append(masked_path)
+            else:
+                module_path                                     = self._match_sys_path(line)
+                if not module_path is None:
+                    tokens                                      = line.split(module_path)
+                    if len(tokens) > 1:
+                        prefix                                  = tokens[0]
+                    else:
+                        prefix                                  = ""
+                    masked_path                                 = prefix + '<PYTHON MODULE>' + tokens[-1]
+
+                    # In case we are using a different minor version of Python, in a test run vs when regression test
+                    # output was created, don't want line numbers to cause spurious regression test failures
+                    masked_path                                 = _re.sub(LINE_NB_REGEX, 'line <HIDDEN>', masked_path)
+
+                    cleaned_lines.append(masked_path)
+                else:
+                    cleaned_lines.append(line)
+
+        cleaned_txt                     = "\n".join(cleaned_lines)
+        return cleaned_txt
+
+class FileTransferBatch():
+    '''
+    Helper class to transfer a batch of files to other folders while avoiding to copy their bytes, if possible.
+
+    Destination folders are created once for the whole batch. Then each file is either moved with an atomic 
+    `os.replace`, or hard-linked with `os.link`, depending on the `move` flag. Both only work if the source and the 
+    destination are in the same filesystem, so as a fallback the file is copied.
+
+    GOTCHA: hard links are only safe for files that are never modified in place, since otherwise a write to the
+        destination would also modify the source. That is only the case for files with a suffix in 
+        FileTransferBatch.LINKABLE_SUFFIXES, so other files are copied even if `move` is False.
+
+    @param move A boolean. If True, files are moved, i.e., they are removed from their original location. This is
+            appropriate when the source is discarded after the transfer, as when committing a transaction.
+            If False, files are hard-linked if their suffix allows it, and else copied.
+    '''
+    def __init__(self, move):
+        self.move                   = move
+        # Dictionary of from_path, keyed by to_path. Keyed by the destination so that a file that is
+        # added more than once (e.g., if it was written more than once in a transaction) is transferred only once
+        self._transfers             = {}
+
+    MOVED                           = "files_moved"
+    LINKED                          = "files_linked"
+    COPIED                          = "files_copied"
+    BYTES_AVOIDED                   = "bytes_not_copied"
+
+    # YAML files are only written by YAML_Utils, which writes a temporary file and then moves it into place, breaking
+    # any hard link (and which copies a hard-linked file before appending to it). By contrast, Excel files may be
+    # saved in place by end-users or by libraries like openpyxl, so they are never hard-linked.
+    LINKABLE_SUFFIXES               = [".yaml"]
+
+    def empty_stats():
+        '''
+        Returns a dictionary with the statistics that FileTransferBatch.run returns, all set to 0
+        '''
+        ME                          = FileTransferBatch
+        return {ME.MOVED: 0, ME.LINKED: 0, ME.COPIED: 0, ME.BYTES_AVOIDED: 0}
+
+    def is_linkable(path):
+        '''
+        Returns a boolean, stating whether the file in `path` may be hard-linked instead of copied.
+        '''
+        return _os.path.splitext(path)[1] in FileTransferBatch.LINKABLE_SUFFIXES
+
+    def add(self, from_path, to_dir):
+        '''
+        Adds to the batch the transfer of the file in `from_path` into the folder `to_dir`
+        '''
+        self._transfers[to_dir + "/" + _os.path.basename(from_path)] = from_path
+
+    def run(self, parent_trace):
+        '''
+        Transfers all the files in the batch, and returns a dictionary with statistics on how many files were 
+        moved, linked or copied, and how many bytes were not copied thanks to moving or linking.
+        '''
+        ME                          = FileTransferBatch
+        stats                       = ME.empty_stats()
+
+        for to_dir in sorted(set([_os.path.dirname(to_path) for to_path in self._transfers.keys()])):
+            PathUtils().create_path_if_needed(parent_trace, to_dir)
+
+        for to_path, from_path in self._transfers.items():
+            my_trace                = parent_trace.doing("Transferring a file",
+                                                            data = {"from_path":    str(from_path),
+                                                                    "to_path":      str(to_path)})
+            try:
+                size                = _os.path.getsize(from_path)
+            except Exception as ex:
+                raise ApodeixiError(my_trace, "Can't transfer a file because it is not accessible",
+                                                data = {"error":    str(ex)})
+            if not self.move and not ME.is_linkable(from_path):
+                PathUtils().copy_file(my_trace, from_path, to_path)
+                stats[ME.COPIED]            += 1
+                continue
+            # Link to a temporary file first, since os.link can't replace an existing file. The temporary name is 
+            # unique per process and thread, since concurrent reads may bring in the same file
+            tmp_path                = PathUtils().tmp_path(to_path)
+            try:
+                if self.move:
+                    _os.replace(from_path, to_path)
+                    stats[ME.MOVED]         += 1
+                else:
+                    if _os.path.exists(to_path) and _os.path.samefile(from_path, to_path):
+                        continue
+                    _os.link(from_path, tmp_path)
+                    _os.replace(tmp_path, to_path)
+                    stats[ME.LINKED]        += 1
+                stats[ME.BYTES_AVOIDED]     += size
+            except OSError as ex: # For example, if source and destination are in different filesystems
+                PathUtils().copy_file(my_trace, from_path, to_path)
+                if self.move:
+                    PathUtils().remove_file_if_exists(my_trace, from_path)
+                stats[ME.COPIED]            += 1
+            finally:
+                if _os.path.lexists(tmp_path):
+                    _os.remove(tmp_path)
+
+        return stats
+
 class FileMetadata():
     '''
     Helper class to encapsulates properties about a file (notably, its filename) that should be 
@@ -1,4 +1,5 @@
 import sys                              as _sys
+import pickle                           as _pickle
 
 from apodeixi.testing_framework.a6i_unit_test           import ApodeixiUnitTest
 from apodeixi.util.a6i_error            import ApodeixiError, FunctionalTrace
@@ -46,6 +47,47 @@ class Test_ApodeixiError(ApodeixiUnitTest):
 
             self._compare_to_expected_txt(root_trace, output, test_output_name = 'a6i_error', save_output_txt=True)
 
+    def test_lazy_trace(self):
+        '''
+        Checks that callables passed as context to FunctionalTrace.doing are only called when the trace is examined
+        or pickled, and that the trace then displays the same as if values had been passed
+        '''
+        root_trace                          = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing('Testing lazy functional trace')
+        calls                               = []
+        def _thunk(val):
+            def _call():
+                calls.append(val)
+                return val
+            return _call
+
+        def _lazy_trace():
+            return self.step2.doing(activity        = "In loop cycle Step 2-3",
+                                    flow_stage      = "Loop inside Step 2", 
+                                    data            = {'idx': _thunk(3), 'comment': 'Merrily processing loop'},
+                                    origination     = _thunk({'concrete class': str(self.__class__.__name__)}))
+
+        output                              = ""
+        lazy_trace                          = _lazy_trace()
+        output                              += "Calls after doing:\t\t" + str(len(calls))
+        same                                = lazy_trace.examine(as_string=True) == self.step2i.examine(as_string=True)
+        output                              += "\nCalls after examine:\t\t" + str(len(calls)) + "\tsame trace=" + str(same)
+        lazy_trace.examine(as_string=True)
+        output                              += "\nCalls after examine again:\t" + str(len(calls))
+
+        lazy_trace                          = _lazy_trace()
+        unpickled_trace                     = _pickle.loads(_pickle.dumps(lazy_trace))
+        same                                = unpickled_trace.examine(as_string=True) == self.step2i.examine(as_string=True)
+        output                              += "\nCalls after pickling:\t\t" + str(len(calls)) + "\tsame trace=" + str(same)
+
+        FunctionalTrace.TRACING_ENABLED     = True
+        try:
+            lazy_trace                      = _lazy_trace()
+        finally:
+            FunctionalTrace.TRACING_ENABLED = False
+        output                              += "\nCalls with tracing enabled:\t" + str(len(calls))
+
+        self._compare_to_expected_txt(root_trace, output, test_output_name = 'lazy_trace', save_output_txt=True)
+
 if __name__ == "__main__":
     # execute only if run as a script
     def main(args):
@@ -54,5 +96,7 @@ if __name__ == "__main__":
         what_to_do = args[1]
         if what_to_do=='functional_trace':
             T.test_functional_trace()
+        elif what_to_do=='lazy_trace':
+            T.test_lazy_trace()
 
     main(_sys.argv)
\ No newline at end of file
@@ -7,7 +7,7 @@ from apodeixi.util.a6i_error                        import ApodeixiError, Functi
 from apodeixi.util.formatting_utils                 import DictionaryFormatter, NotebookUtils
 from apodeixi.util.dictionary_utils                 import DictionaryUtils 
 
-from apodeixi.util.path_utils              			import PathUtils
+from apodeixi.util.path_utils              			import PathUtils, FileTransferBatch
 
 class Test_PathUtils(ApodeixiUnitTest):
 
@@ -106,6 +106,79 @@ class Test_PathUtils(ApodeixiUnitTest):
             print(ex.trace_message())
             self.assertTrue(1==2)
 
+    def test_file_transfer_batch(self):
+        root_trace                      = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing FileTransferBatch")
+        try:
+            TEST_SCENARIO                   = 'test_file_transfer_batch'
+            OUTPUT_FOLDER                   = self.output_data + "/" + TEST_SCENARIO
+            PathUtils().remove_folder_if_exists(root_trace, OUTPUT_FOLDER)
+            PathUtils().create_path_if_needed(root_trace, OUTPUT_FOLDER + "/src")
+
+            def _write(path, content):
+                with open(path, 'w') as file:
+                    file.write(content)
+
+            def _read(path):
+                with open(path, 'r') as file:
+                    return file.read()
+
+            for name in ["a.yaml", "b.yaml", "c.xlsx"]:
+                _write(OUTPUT_FOLDER + "/src/" + name, "Content of " + name)
+
+            def _tmp_files(folder):
+                return sorted([name for currentdir, dirs, files in _os.walk(folder) for name in files if name.endswith(".tmp")])
+
+            output_txt                      = '============ Linking files ================\n'
+            batch                           = FileTransferBatch(move = False)
+            batch.add(OUTPUT_FOLDER + "/src/a.yaml", OUTPUT_FOLDER + "/linked/x/y")
+            batch.add(OUTPUT_FOLDER + "/src/b.yaml", OUTPUT_FOLDER + "/linked/x/y")
+            # Excel files may be modified in place, so they are copied instead of linked
+            batch.add(OUTPUT_FOLDER + "/src/c.xlsx", OUTPUT_FOLDER + "/linked/x/y")
+            output_txt                      += "\nStats: " + str(batch.run(root_trace))
+            output_txt                      += "\nSources still exist: " + str(_os.path.exists(OUTPUT_FOLDER + "/src/a.yaml"))
+            output_txt                      += "\nLinked content: " + _read(OUTPUT_FOLDER + "/linked/x/y/a.yaml")
+
+            # Overwriting a linked file should not modify the file it was linked to
+            _write(OUTPUT_FOLDER + "/new_a.yaml", "New content of a.yaml")
+            PathUtils().copy_file(root_trace, OUTPUT_FOLDER + "/new_a.yaml", OUTPUT_FOLDER + "/linked/x/y/a.yaml")
+            output_txt                      += "\nLinked content after overwriting it: " + _read(OUTPUT_FOLDER + "/linked/x/y/a.yaml")
+            output_txt                      += "\nSource content after overwriting linked file: " + _read(OUTPUT_FOLDER + "/src/a.yaml")
+
+            # Modifying a copied file in place should not modify its source either
+            _write(OUTPUT_FOLDER + "/linked/x/y/c.xlsx", "New content of c.xlsx")
+            output_txt                      += "\nSource content after modifying copied file in place: " \
+                                                    + _read(OUTPUT_FOLDER + "/src/c.xlsx")
+
+            output_txt                      += '\n\n============ Failing to link files ================\n'
+            # Folders are in the way of the destination file, so neither linking nor copying (into the folder) can succeed
+            PathUtils().create_path_if_needed(root_trace, OUTPUT_FOLDER + "/blocked/a.yaml/a.yaml")
+            batch                           = FileTransferBatch(move = False)
+            batch.add(OUTPUT_FOLDER + "/src/a.yaml", OUTPUT_FOLDER + "/blocked")
+            try:
+                batch.run(root_trace)
+                output_txt                  += "\nBatch failed: False"
+            except ApodeixiError as ex:
+                output_txt                  += "\nBatch failed: True"
+            output_txt                      += "\nTemporary files left behind: " + str(_tmp_files(OUTPUT_FOLDER + "/blocked"))
+
+            output_txt                      += '\n\n============ Moving files ================\n'
+            batch                           = FileTransferBatch(move = True)
+            batch.add(OUTPUT_FOLDER + "/src/a.yaml", OUTPUT_FOLDER + "/moved")
+            batch.add(OUTPUT_FOLDER + "/src/a.yaml", OUTPUT_FOLDER + "/moved") # Adding twice should be harmless
+            batch.add(OUTPUT_FOLDER + "/src/b.yaml", OUTPUT_FOLDER + "/moved")
+            output_txt                      += "\nStats: " + str(batch.run(root_trace))
+            output_txt                      += "\nSources still exist: " + str(_os.path.exists(OUTPUT_FOLDER + "/src/a.yaml"))
+            output_txt                      += "\nMoved content: " + _read(OUTPUT_FOLDER + "/moved/b.yaml")
+
+            self._compare_to_expected_txt(  parent_trace        = root_trace,
+                                            output_txt          = output_txt,
+                                            test_output_name    = TEST_SCENARIO, 
+                                            save_output_txt     = True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
 if __name__ == "__main__":
     # execute only if run as a script
     def main(args):
@@ -114,6 +187,8 @@ if __name__ == "__main__":
         what_to_do = args[1]
         if what_to_do=='path_utils':
             T.test_path_utils()
+        elif what_to_do=='file_transfer_batch':
+            T.test_file_transfer_batch()
         T.tearDown()
         
     main(_sys.argv)
\ No newline at end of file
@@ -0,0 +1,167 @@
+import sys                                          as _sys
+import os                                           as _os
+
+from apodeixi.testing_framework.a6i_unit_test       import ApodeixiUnitTest
+from apodeixi.util.a6i_error                        import ApodeixiError, FunctionalTrace
+from apodeixi.util.path_utils                       import PathUtils
+
+from apodeixi.knowledge_base.knowledge_base_util    import ManifestHandle
+
+from apodeixi.util.yaml_utils                       import YAML_Utils
+
+class Test_YAML_Utils(ApodeixiUnitTest):
+
+    def setUp(self):
+        super().setUp()
+
+    def test_yaml_cache(self):
+        root_trace                      = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing YAML cache")
+        TEST_SCENARIO                   = 'test_yaml_cache'
+        cache                           = YAML_Utils().cache()
+        original_limits                 = (cache.max_entries, cache.max_bytes)
+        try:
+            OUTPUT_FOLDER               = self.output_data + "/" + TEST_SCENARIO
+            PathUtils().remove_folder_if_exists(root_trace, OUTPUT_FOLDER)
+            PathUtils().create_path_if_needed(root_trace, OUTPUT_FOLDER)
+
+            cache.clear()
+            output_txt                  = ""
+
+            def _describe(title, result):
+                return "\n" + title + ":\n\t" + str(result) + "\n\t" + str(cache.stats())
+
+            path_a                      = OUTPUT_FOLDER + "/a.yaml"
+            YAML_Utils().save(root_trace, data_dict = {"name": "a", "items": [1, 2, 3]}, path = path_a)
+            output_txt                  += _describe("After saving a.yaml", None)
+
+            loaded_dict                 = YAML_Utils().load(root_trace, path_a)
+            output_txt                  += _describe("Loading a.yaml", loaded_dict)
+
+            # Mutating what we loaded should not corrupt the cache
+            loaded_dict["items"].append(4)
+            output_txt                  += _describe("Loading a.yaml after mutating a loaded copy",
+                                                            YAML_Utils().load(root_trace, path_a))
+
+            # Another process re-writes the file, so the cached entry becomes stale
+            with open(path_a, 'w', encoding="utf8") as file:
+                file.write("name: a\nitems:\n- 10\n- 20\n- 30\n- 40\n")
+            output_txt                  += _describe("Loading a.yaml after it was re-written by someone else",
+                                                            YAML_Utils().load(root_trace, path_a))
+
+            # Bound the cache to 2 entries and load 3 files
+            cache.configure(max_entries = 2)
+            for name in ["b", "c", "d"]:
+                path                    = OUTPUT_FOLDER + "/" + name + ".yaml"
+                YAML_Utils().save(root_trace, data_dict = {"name": name}, path = path, use_cache=False)
+                YAML_Utils().load(root_trace, path)
+            output_txt                  += _describe("After loading b.yaml, c.yaml, d.yaml with at most 2 entries", None)
+
+            output_txt                  += _describe("Loading b.yaml again (was evicted)",
+                                                            YAML_Utils().load(root_trace, OUTPUT_FOLDER + "/b.yaml"))
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_SCENARIO, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+        finally:
+            cache.configure(max_entries = original_limits[0], max_bytes = original_limits[1])
+
+    def test_libyaml_fast_path(self):
+        root_trace                      = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing LibYAML fast path")
+        TEST_SCENARIO                   = 'test_libyaml_fast_path'
+        try:
+            OUTPUT_FOLDER               = self.output_data + "/" + TEST_SCENARIO
+            PathUtils().remove_folder_if_exists(root_trace, OUTPUT_FOLDER)
+            PathUtils().create_path_if_needed(root_trace, OUTPUT_FOLDER)
+
+            handle                      = ManifestHandle(   manifest_api    = "delivery-planning.journeys.a6i.io",
+                                                            kind            = "big-rock",
+                                                            namespace       = "my-corp.production",
+                                                            name            = "modernization.dec-2020.fusionopus.default",
+                                                            version         = 2)
+            SCENARIOS                   = {
+                "ascii":        {"name": "a", "handle": handle, "items": [1, 2.5, None, True]},
+                "unicode":      {"name": "Cloudification \u2013 Remove Oracle Dependency, which is a long description "
+                                            + "that the pure Python dumper folds in its own way"},
+                "long key":     {"k" * 130: "value"},
+            }
+
+            output_txt                  = ""
+            for scenario in SCENARIOS.keys():
+                data_dict               = SCENARIOS[scenario]
+                loop_trace              = root_trace.doing("Saving scenario", data = {"scenario": scenario})
+                contents                = {}
+                for use_libyaml in [False, True]:
+                    path                = OUTPUT_FOLDER + "/" + scenario + "." + str(use_libyaml) + ".yaml"
+                    YAML_Utils(use_libyaml = use_libyaml).save(loop_trace, data_dict, path, use_cache=False)
+                    with open(path, 'r', encoding="utf8") as file:
+                        contents[use_libyaml] = file.read()
+                    reloaded_dict       = YAML_Utils(use_libyaml = use_libyaml).load(loop_trace, path, use_cache=False)
+                    output_txt          += "\n" + scenario + " (use_libyaml=" + str(use_libyaml) + ") round trips: " \
+                                                + str(reloaded_dict == data_dict)
+                output_txt              += "\n" + scenario + " identical output: " + str(contents[False] == contents[True]) \
+                                                + "\n" + contents[True]
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_SCENARIO, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
+    def test_yaml_sidecar(self):
+        root_trace                      = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing YAML sidecars")
+        TEST_SCENARIO                   = 'test_yaml_sidecar'
+        try:
+            OUTPUT_FOLDER               = self.output_data + "/" + TEST_SCENARIO
+            PathUtils().remove_folder_if_exists(root_trace, OUTPUT_FOLDER)
+            PathUtils().create_path_if_needed(root_trace, OUTPUT_FOLDER)
+
+            output_txt                  = ""
+            path                        = OUTPUT_FOLDER + "/big-rock.1.yaml"
+            data_dict                   = {"kind": "big-rock", "metadata": {"version": 1}, "items": ["a", "b"]}
+            YAML_Utils().save(root_trace, data_dict, path, use_cache=False, write_sidecar=True)
+
+            output_txt                  += "\nSidecars written: " + str(sorted([f for f in _os.listdir(OUTPUT_FOLDER)
+                                                                                if YAML_Utils.is_sidecar(f)]))
+            output_txt                  += "\nContent in sidecar: " + str(YAML_Utils()._load_sidecar(root_trace, path))
+            output_txt                  += "\nLoaded: " + str(YAML_Utils().load(root_trace, path, use_cache=False))
+
+            # Someone edits the YAML, so the sidecar should no longer be used
+            with open(path, 'w', encoding="utf8") as file:
+                file.write("kind: big-rock\nmetadata:\n  version: 1\nitems:\n- c\n")
+            output_txt                  += "\nContent in sidecar after editing the YAML: " \
+                                                + str(YAML_Utils()._load_sidecar(root_trace, path))
+            output_txt                  += "\nLoaded after editing the YAML: " + str(YAML_Utils().load(root_trace, path, use_cache=False))
+
+            # An annotator that fails should not prevent the YAML and its sidecar from being saved
+            def _failing_annotate(parent_trace, data_dict):
+                raise KeyError("assertion")
+            YAML_Utils().register_sidecar_annotator("failing", _failing_annotate, None)
+            try:
+                YAML_Utils().save(root_trace, data_dict, path, use_cache=False, write_sidecar=True)
+            finally:
+                YAML_Utils._sidecar_annotators.pop("failing")
+            output_txt                  += "\nContent in sidecar after a failing annotator: " \
+                                                + str(YAML_Utils()._load_sidecar(root_trace, path))
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_SCENARIO, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        T = Test_YAML_Utils()
+        T.setUp()
+        what_to_do = args[1]
+        if what_to_do=='yaml_cache':
+            T.test_yaml_cache()
+        elif what_to_do=='libyaml_fast_path':
+            T.test_libyaml_fast_path()
+        elif what_to_do=='yaml_sidecar':
+            T.test_yaml_sidecar()
+
+    main(_sys.argv)
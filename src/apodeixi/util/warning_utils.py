@@ -1,5 +1,4 @@
 import sys                                              as _sys
-import pandas                                           as _pd
 import warnings
 import traceback
 from io                                                 import StringIO
@@ -91,6 +90,8 @@ class WarningUtils():
         
         This method returns True if the warning should be ignored, and False otherwise
         '''
+        import pandas                                       as _pd # Imported lazily since it is slow to import
+
         if a_warning.category == ResourceWarning and str(a_warning.message).startswith("unclosed event loop"):
             #Ignore such warnings - they are noise generated by YAML
             return True
@@ -1,26 +1,151 @@
 
+import os                                   as _os
+import datetime                             as _datetime
+import copy                                 as _copy
+import pickle                               as _pickle
+import hashlib                              as _hashlib
+import threading                            as _threading
 import yaml                                 as _yaml
+from collections                            import OrderedDict
 from io                                     import StringIO
 import warnings
 
 from apodeixi.util.a6i_error                import ApodeixiError
 from apodeixi.util.warning_utils            import WarningUtils
+from apodeixi.util.path_utils               import PathUtils
 
 #YAML_LOADER                         = _yaml.FullLoader
 #YAML_DUMPER                         = _yaml.SafeDumper
 
-'''
-This cache was added as part of Apodeixi performance improvements made in March 2022. It was found that early adopters encountered
-a performance degradation in production, which seemed to become worse as time went by. Initial profiling suggested that the
-Apodeixi function `isolation_kb_store.py:_getMatchingManifests` was making a call to load every YAML file in the system
-as a way to find if manifests already exist matching a particular manifest handle. Thus, to load a single manifest we
-were in effect loading the entire database of manifests. And this was being done multiple times, as many times as there
-were manifests to load.
-As an initial low-hanging fruit, this cache was introduced so that we only load (and therefore de-serialize) a manifest once.
+# If PyYAML was built with LibYAML bindings we use the C-based loader and dumper, which are an order of magnitude faster
+# than the pure Python ones. Otherwise these are None and we use the pure Python implementations.
+try:
+    from yaml                               import CFullLoader as _C_LOADER, CDumper as _C_DUMPER
+except ImportError:
+    _C_LOADER                               = None
+    _C_DUMPER                               = None
 
-The cache has paths as keys and dictionaries as values.
-'''
-_YAML_CACHE = {}
+class YAML_Cache():
+    '''
+    This cache was added as part of Apodeixi performance improvements made in March 2022. It was found that early adopters encountered
+    a performance degradation in production, which seemed to become worse as time went by. Initial profiling suggested that the
+    Apodeixi function `isolation_kb_store.py:_getMatchingManifests` was making a call to load every YAML file in the system
+    as a way to find if manifests already exist matching a particular manifest handle. Thus, to load a single manifest we
+    were in effect loading the entire database of manifests. And this was being done multiple times, as many times as there
+    were manifests to load.
+    As an initial low-hanging fruit, a cache was introduced so that we only load (and therefore de-serialize) a manifest once.
+
+    That initial cache was an unbounded dictionary, which caused problems of its own for long-lived processes: memory grew
+    without limit, and stale content was served if another process re-wrote a YAML file. Hence this class, which:
+
+    * Keeps at most `max_entries` entries and at most `max_bytes` worth of YAML (as measured by file sizes), evicting
+      the least recently used entries when either limit is exceeded.
+    * Remembers the modification time and size of each file when it was cached, and ignores a cached entry if
+      the file on disk no longer has that modification time and size.
+    * Hands out copies, so that callers that modify a dictionary they loaded can't corrupt the cache.
+    * Counts hits, misses, evictions and invalidations (i.e., entries discarded for being stale), as returned by self.stats.
+    * Can be used from several threads, e.g., when a controller builds the manifests of a posting in parallel.
+
+    The cache has paths as keys and tuples (mtime_ns, size, dictionary) as values.
+    '''
+    def __init__(self, max_entries=1000, max_bytes=256 * 1024 * 1024):
+        self.max_entries            = max_entries
+        self.max_bytes              = max_bytes
+        self._lock                  = _threading.RLock()
+        self.clear()
+
+    def clear(self):
+        '''
+        Removes all entries from the cache and resets its statistics
+        '''
+        with self._lock:
+            self._entries           = OrderedDict()
+            self._total_bytes       = 0
+            self.hits               = 0
+            self.misses             = 0
+            self.evictions          = 0
+            self.invalidations      = 0
+
+    def configure(self, max_entries=None, max_bytes=None):
+        '''
+        Changes the limits of the cache, evicting entries if needed so that the new limits are honored.
+        Parameters that are None are left unchanged.
+        '''
+        with self._lock:
+            if max_entries != None:
+                self.max_entries    = max_entries
+            if max_bytes != None:
+                self.max_bytes      = max_bytes
+            self._evict_if_needed()
+
+    def stats(self):
+        '''
+        Returns a dictionary with the cache's statistics
+        '''
+        return {"entries":          len(self._entries),
+                "bytes":            self._total_bytes,
+                "hits":             self.hits,
+                "misses":           self.misses,
+                "evictions":        self.evictions,
+                "invalidations":    self.invalidations}
+
+    def _file_signature(self, path):
+        '''
+        Returns a tuple (mtime_ns, size) for the file in `path`, or None if there is no such file
+        '''
+        try:
+            stat                = _os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, path):
+        '''
+        Returns a copy of the dictionary cached for `path`, or None if there is no such entry or if it is stale
+        '''
+        with self._lock:
+            entry                   = self._entries.get(path)
+            if entry == None:
+                self.misses         += 1
+                return None
+            mtime_ns, size, data_dict   = entry
+            if self._file_signature(path) != (mtime_ns, size):
+                self._remove(path)
+                self.invalidations  += 1
+                self.misses         += 1
+                return None
+            self._entries.move_to_end(path)
+            self.hits               += 1
+            return _copy.deepcopy(data_dict)
+
+    def put(self, path, data_dict):
+        '''
+        Caches a copy of `data_dict` as the content of the file in `path`, which must already exist on disk
+        '''
+        with self._lock:
+            signature               = self._file_signature(path)
+            if signature == None:
+                return
+            mtime_ns, size          = signature
+            self._remove(path)
+            if size > self.max_bytes:
+                return # Too big to be cached
+            self._entries[path]     = (mtime_ns, size, _copy.deepcopy(data_dict))
+            self._total_bytes       += size
+            self._evict_if_needed()
+
+    def _remove(self, path):
+        entry                       = self._entries.pop(path, None)
+        if entry != None:
+            self._total_bytes       -= entry[1]
+
+    def _evict_if_needed(self):
+        while len(self._entries) > 0 and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            path, entry             = self._entries.popitem(last=False)
+            self._total_bytes       -= entry[1]
+            self.evictions          += 1
+
+_YAML_CACHE = YAML_Cache()
 
 class YAML_Utils():
     '''
@@ -28,15 +153,82 @@ class YAML_Utils():
     Used to encapsulate Apodeixi from some noise that can happen if the yaml library is not invoked with the appropriate
     settings.
     '''
-    def __init__(self):
-        pass
+    def __init__(self, use_libyaml=True):
+        self._loader                = _C_LOADER if use_libyaml and _C_LOADER != None else _yaml.FullLoader
+        self._dumper                = _C_DUMPER if use_libyaml and _C_DUMPER != None else None
+
+    def add_constructor(self, tag, constructor):
+        '''
+        Registers a custom `constructor` for YAML nodes with the given `tag`, for all the loaders this class might use
+        '''
+        _yaml.FullLoader.add_constructor(tag, constructor)
+        if _C_LOADER != None:
+            _C_LOADER.add_constructor(tag, constructor)
+
+    # Whitelist of scalar types for which the LibYAML and pure Python emitters are known to produce identical output
+    _LIBYAML_SAFE_SCALARS           = (int, float, bool, type(None), _datetime.date, bytes)
+
+    def _dumper_for(self, data_dict):
+        '''
+        Returns the YAML Dumper class to use for `data_dict`.
+
+        The LibYAML emitter formats some strings differently from the pure Python emitter (for example, it folds long
+        double-quoted strings at different points, and doesn't turn keys of 128 characters or more into "? " complex keys).
+        Since Apodeixi regression tests (and users' diffs) rely on the YAML we write being stable, the LibYAML dumper is only
+        used if all strings in `data_dict` are printable ASCII and all mapping keys are short and non-empty, as for them
+        both emitters produce byte-identical output. Otherwise we fall back to the pure Python dumper.
+        '''
+        ME                          = YAML_Utils
+        if self._dumper == None:
+            return _yaml.Dumper
+
+        def _safe_str(s, is_key):
+            if is_key and (len(s) == 0 or len(s) > 100):
+                return False
+            return s.isascii() and s.isprintable()
+
+        pending                     = [(data_dict, False)]
+        seen                        = set()
+        while len(pending) > 0:
+            obj, is_key             = pending.pop()
+            if isinstance(obj, str):
+                if not _safe_str(obj, is_key):
+                    return _yaml.Dumper
+            elif isinstance(obj, ME._LIBYAML_SAFE_SCALARS):
+                continue
+            elif is_key: # Non-scalar keys are emitted as "? " complex keys
+                return _yaml.Dumper
+            elif id(obj) in seen: # Objects referenced multiple times are emitted as YAML aliases, so check them once
+                continue
+            elif isinstance(obj, dict):
+                seen.add(id(obj))
+                pending.extend([(key, True) for key in obj.keys()])
+                pending.extend([(val, False) for val in obj.values()])
+            elif isinstance(obj, (list, tuple, set)):
+                seen.add(id(obj))
+                pending.extend([(val, False) for val in obj])
+            elif hasattr(obj, "__dict__"): # E.g., a ManifestHandle, which is emitted as a mapping of its attributes
+                seen.add(id(obj))
+                pending.extend([(key, True) for key in vars(obj).keys()])
+                pending.extend([(val, False) for val in vars(obj).values()])
+            else:
+                return _yaml.Dumper
+        return self._dumper
 
     def load(self, parent_trace, path, use_cache=True):
         '''
         Returns a dictionary, corresponding to the loaded representation of the YAML file in the given `path`
         '''
-        if use_cache and path in _YAML_CACHE.keys():
-            return _YAML_CACHE[path]
+        if use_cache:
+            cached_dict             = _YAML_CACHE.get(path)
+            if cached_dict != None:
+                return cached_dict
+
+        sidecar_dict                = self._load_sidecar(parent_trace, path)
+        if sidecar_dict != None:
+            if use_cache:
+                _YAML_CACHE.put(path, sidecar_dict)
+            return sidecar_dict
 
         try:
             with open(path, 'r', encoding="utf8") as file:
@@ -45,9 +237,9 @@ class YAML_Utils():
                 with warnings.catch_warnings(record=True) as w:
                     WarningUtils().turn_traceback_on(parent_trace, warnings_list=w)
 
-                    loaded_dict             = _yaml.load(file, Loader=_yaml.FullLoader)
+                    loaded_dict             = _yaml.load(file, Loader=self._loader)
                     if use_cache:
-                        _YAML_CACHE[path]       = loaded_dict
+                        _YAML_CACHE.put(path, loaded_dict)
 
                     WarningUtils().handle_warnings(parent_trace, warning_list=w)
                     return loaded_dict
@@ -56,8 +248,12 @@ class YAML_Utils():
                                  data = {"path":        str(path),
                                         "error":        str(ex)})
 
-    def save(self, parent_trace, data_dict, path, use_cache=True):
+    def save(self, parent_trace, data_dict, path, use_cache=True, write_sidecar=False):
         '''
+        Saves `data_dict` as a YAML file in the given `path`.
+
+        @param write_sidecar A boolean. If True, a binary sidecar is also written next to the YAML file,
+                    so that subsequent loads can avoid parsing YAML. Refer to self.save_sidecar
         '''
         # As documented in https://nbconvert.readthedocs.io/en/latest/execute_api.html
         #
@@ -69,25 +265,205 @@ class YAML_Utils():
         #
         # Happens in particular when trying to save a string representing a Jupyter notebook's execution, since for the same
         # reason above that string had to be written to a string using UTF8 encoding, so now if we save to a file we must use UTF8
-        with open(path, 'w', encoding="utf8") as file:
+        #
+        # Write to a temporary file first and then move it into place, so that readers never see a partially written
+        # file and so that we don't modify in place a file that may be hard-linked from another environment 
+        # (see FileTransferBatch)
+        tmp_path                    = PathUtils().tmp_path(path)
+        try:
+            with open(tmp_path, 'w', encoding="utf8") as file:
+
+                # YAML invokes asyncio.base_events.py, that is noisy and issues spurious ResourceWarnings. So catch and 
+                # suppress such warnings. For other warnings, raise an ApodeixiError
+                with warnings.catch_warnings(record=True) as w:
+                    WarningUtils().turn_traceback_on(parent_trace, warnings_list=w)
+
+                    _yaml.dump(data_dict, file, Dumper=self._dumper_for(data_dict))
+                
+                    WarningUtils().handle_warnings(parent_trace, warning_list=w)           
+            _os.replace(tmp_path, path)
+        finally:
+            if _os.path.lexists(tmp_path):
+                _os.remove(tmp_path)
+
+        # Only cache after the file is closed, so that the cache records the file's final modification time and size
+        if use_cache:
+            _YAML_CACHE.put(path, data_dict)
+
+        if write_sidecar:
+            self.save_sidecar(parent_trace, data_dict, path)
+
+    def append(self, parent_trace, data_dict, path):
+        '''
+        Appends `data_dict` as a new YAML document (i.e., preceded by "---") at the end of the file in `path`, creating
+        the file if it does not exist. Such files are intended to be used as logs, and are read with self.load_all.
+
+        Unlike self.save, it does not re-write the file, so the cost is proportional to the size of `data_dict`, not
+        to the size of the file. The YAML Cache is not used for such files.
+        '''
+        try:
+            # Files may be hard-linked from another environment (see FileTransferBatch), and appending in place would
+            # also modify the other environment's file. So in that case we first replace the file by a copy of its own
+            if _os.path.isfile(path) and _os.stat(path).st_nlink > 1:
+                tmp_path            = PathUtils().tmp_path(path)
+                try:
+                    with open(path, 'rb') as src_file, open(tmp_path, 'wb') as dst_file:
+                        dst_file.write(src_file.read())
+                    _os.replace(tmp_path, path)
+                finally:
+                    if _os.path.lexists(tmp_path):
+                        _os.remove(tmp_path)
 
-            # YAML invokes asyncio.base_events.py, that is noisy and issues spurious ResourceWarnings. So catch and suppress
-            # such warnings. For other warnings, raise an ApodeixiError
-            with warnings.catch_warnings(record=True) as w:
-                WarningUtils().turn_traceback_on(parent_trace, warnings_list=w)
+            with open(path, 'a', encoding="utf8") as file:
+                with warnings.catch_warnings(record=True) as w:
+                    WarningUtils().turn_traceback_on(parent_trace, warnings_list=w)
+
+                    _yaml.dump(data_dict, file, Dumper=self._dumper_for(data_dict), explicit_start=True)
+
+                    WarningUtils().handle_warnings(parent_trace, warning_list=w)
+        except ApodeixiError:
+            raise
+        except Exception as ex:
+            raise ApodeixiError(parent_trace, "Found a problem appending to YAML file",
+                                 data = {"path":        str(path),
+                                        "error":        str(ex)})
+
+    def load_all(self, parent_trace, path):
+        '''
+        Returns a list of dictionaries, one for each YAML document in the file in `path`, in the order in which
+        they were appended by self.append
+        '''
+        try:
+            with open(path, 'r', encoding="utf8") as file:
+                with warnings.catch_warnings(record=True) as w:
+                    WarningUtils().turn_traceback_on(parent_trace, warnings_list=w)
+
+                    loaded_list     = [doc for doc in _yaml.load_all(file, Loader=self._loader) if doc != None]
+
+                    WarningUtils().handle_warnings(parent_trace, warning_list=w)
+                    return loaded_list
+        except ApodeixiError:
+            raise
+        except Exception as ex:
+            raise ApodeixiError(parent_trace, "Found a problem loading YAML file",
+                                 data = {"path":        str(path),
+                                        "error":        str(ex)})
+
+    SIDECAR_SUFFIX                  = ".pickle"
+    _SIDECAR_FORMAT                 = "a6i-yaml-sidecar/2"
+
+    # Keys are names, and values are pairs of functions (annotate, restore). Refer to self.register_sidecar_annotator
+    _sidecar_annotators             = {}
+
+    def register_sidecar_annotator(self, name, annotate, restore):
+        '''
+        Registers functions to persist, in binary sidecars, data derived from the YAML content, so that other processes 
+        that load the same content need not derive it again:
 
-                _yaml.dump(data_dict, file) #, Dumper=YAML_DUMPER)
-            
-                if use_cache:
-                    _YAML_CACHE[path] = data_dict
-                WarningUtils().handle_warnings(parent_trace, warning_list=w)           
+        * `annotate(parent_trace, data_dict)` is called when a sidecar is saved for `data_dict`, and whatever it 
+          returns (unless it is None) is saved in the sidecar, as the annotation for `name`
+        * `restore(parent_trace, data_dict, annotation)` is called when a valid sidecar is loaded, for each 
+          annotation saved in it
+
+        For example, UID_Acronym_Schema uses this to persist the acronym schemas of manifests.
+        '''
+        YAML_Utils._sidecar_annotators[name] = (annotate, restore)
+
+    def sidecar_path(self, path):
+        '''
+        Returns the path of the binary sidecar for the YAML file in `path`. 
+        For example, for 'big-rock.2.yaml' it would be 'big-rock.2.yaml.pickle'
+        '''
+        return path + YAML_Utils.SIDECAR_SUFFIX
+
+    def is_sidecar(filename):
+        '''
+        Returns True if `filename` is a binary sidecar of a YAML file.
+        Used to exclude sidecars from environment descriptions, since they are derived data.
+        '''
+        return filename.endswith(".yaml" + YAML_Utils.SIDECAR_SUFFIX)
+
+    def _digest(self, yaml_bytes):
+        return _hashlib.sha256(yaml_bytes).hexdigest()
+
+    def save_sidecar(self, parent_trace, data_dict, path):
+        '''
+        Writes a binary sidecar (a pickle, protocol 5) for the YAML file in `path`, whose content is given by `data_dict`.
+
+        The YAML file remains the canonical representation: the sidecar records the hash of the YAML file's bytes, 
+        and self.load only uses the sidecar if that hash still matches the YAML file. Pickles are an order of magnitude 
+        faster to load than YAML.
+
+        The sidecar also holds the annotations of `data_dict` by the functions registered with 
+        self.register_sidecar_annotator. Annotations are optional, so if an annotator fails the sidecar is
+        written without its annotation.
+        '''
+        ME                          = YAML_Utils
+        try:
+            annotations             = {}
+            for name, (annotate, restore) in ME._sidecar_annotators.items():
+                try:
+                    annotation      = annotate(parent_trace, data_dict)
+                except Exception:
+                    continue # Other processes will just have to derive the annotation's data themselves
+                if annotation != None:
+                    annotations[name] = annotation
+            with open(path, 'rb') as file:
+                yaml_bytes          = file.read()
+            payload                 = (ME._SIDECAR_FORMAT, self._digest(yaml_bytes), data_dict, annotations)
+            # Write to a temporary file first and then move it, so readers never see a partially written sidecar
+            tmp_path                = PathUtils().tmp_path(self.sidecar_path(path))
+            try:
+                with open(tmp_path, 'wb') as file:
+                    _pickle.dump(payload, file, protocol=5)
+                _os.replace(tmp_path, self.sidecar_path(path))
+            finally:
+                if _os.path.lexists(tmp_path):
+                    _os.remove(tmp_path)
+        except Exception as ex:
+            raise ApodeixiError(parent_trace, "Found a problem saving binary sidecar for YAML file",
+                                 data = {"path":        str(path),
+                                        "error":        str(ex)})
+
+    def _load_sidecar(self, parent_trace, path):
+        '''
+        Returns the content of the binary sidecar for the YAML file in `path`, or None if there is no sidecar
+        or if it is not valid for the YAML file's current content.
+
+        If it is valid, the annotations in the sidecar are restored by the functions registered with
+        self.register_sidecar_annotator.
+        '''
+        ME                          = YAML_Utils
+        sidecar_path                = self.sidecar_path(path)
+        if not _os.path.isfile(sidecar_path):
+            return None
+        try:
+            with open(path, 'rb') as file:
+                yaml_bytes          = file.read()
+            with open(sidecar_path, 'rb') as file:
+                sidecar_format, digest, data_dict, annotations  = _pickle.load(file)
+        except Exception:
+            return None # Treat unreadable sidecars (e.g., in an older format) as missing, so that we fall back to the YAML
+        if sidecar_format != ME._SIDECAR_FORMAT or digest != self._digest(yaml_bytes):
+            return None
+        for name, annotation in annotations.items():
+            if name in ME._sidecar_annotators.keys():
+                annotate, restore   = ME._sidecar_annotators[name]
+                restore(parent_trace, data_dict, annotation)
+        return data_dict
+
+    def cache(self):
+        '''
+        Returns the YAML_Cache used by this class, e.g., to inspect its statistics or change its limits
+        '''
+        return _YAML_CACHE
 
     def dict_to_yaml_string(self, parent_trace, data_dict):
         '''
         Returns a string representation of a YAML content that is equivalent to  the `data_dict`
         '''
         output_stream               = StringIO()
-        _yaml.dump(data_dict, output_stream)
+        _yaml.dump(data_dict, output_stream, Dumper=self._dumper_for(data_dict))
         result_yaml                 = output_stream.getvalue()
         return result_yaml
 
@@ -1,4 +1,5 @@
 import re                                       as _re
+import numpy                                    as _numpy
 import pandas
 
 from apodeixi.util.a6i_error                    import ApodeixiError
@@ -76,7 +77,7 @@ class BreakdownTree():
 
         return result
         
-    def readDataframeFragment(self, interval, row, parent_trace, xlr_config, all_rows, acronym_schema): 
+    def readDataframeFragment(self, interval, row, parent_trace, xlr_config, all_rows, acronym_schema, fragment_index=None): 
         '''
         Used to attach or enrich an immediate child to the root of this BreakdownTree based on information in a row
         in a Pandas DataFrame.
@@ -132,6 +133,8 @@ class BreakdownTree():
                             user's postings includes UIDs already (e.g., as when the user updates instead of create). Or as
                             another example, how to handle a situation where there is a need to put a referential link
                             the UIDs in branches of another previously generated manifest.
+        @param fragment_index Optional DataFrameFragmentIndex for `all_rows`. If given, it is used instead of inspecting
+                            `row` cell by cell, as long as it covers `row` and `interval`.
 
         @returns The full UID of the new _EntityInstance node that was added as a child to this tree, or None if no node was added.
         ''' 
@@ -140,6 +143,8 @@ class BreakdownTree():
             interval, row                       = xlr_config.preprocessReadFragment(parent_trace        = my_trace, 
                                                                                     interval            = interval, 
                                                                                     dataframe_row       = row)
+            if fragment_index != None and not fragment_index.covers(interval, row):
+                fragment_index                  = None # The hook changed the row or interval, so inspect them instead
 
             encountered_new_entity              = False
             entity_column_idx                   = None
@@ -160,54 +165,31 @@ class BreakdownTree():
                     raise ApodeixiError(my_trace, "Didn't get a real Pandas row")   
 
                 # Check there is something to do at all - if all fields are blank, return since there's nothing to do
-                blank_cols                  = [col for col in interval.columns if IntervalUtils().is_blank(row[1][col])]
+                if fragment_index != None:
+                    blank_cols              = fragment_index.blank_columns(interval, row[0])
+                else:
+                    blank_cols              = [col for col in interval.columns if IntervalUtils().is_blank(row[1][col])]
                 if len(blank_cols) == len(interval.columns):
                     return # Nothing to do
 
                 # Check interval and row are consistent
-                columns                     = list(row[1].index)
+                if fragment_index != None:
+                    columns                 = fragment_index.columns
+                else:
+                    columns                 = list(row[1].index)
 
                 if len(interval.columns)==0:
                     raise ApodeixiError(my_trace, "Empty interval of columns was given.")
 
-                if not interval.is_subset(set(columns)):
+                if fragment_index == None and not interval.is_subset(set(columns)): # Index only covers intervals in columns
                     raise ApodeixiError(my_trace, "Interval's non-UID columns are not a subset of the row's columns.",
                                                 data = {'interval': interval.columns, 'columns': columns})
 
                 # Check entity appears in exactly one column. 
-                def _matches_entity(idx):
-                    '''
-                    Returns a boolean if the column at index `idx` is the "same" as the interval's entity name.
-                    By being the "same" we mean that either:
-                    1. The column at index idx is a string identical to the interval's entity_name
-                    2. The column at index idx is a tuple and its first member is identical to the interval's entity_name
-
-                    If the user entered two columns with the same name, such as "Account", Pandas will re-name the second
-                    one to be "Account.1". But that is still a user error for an entity, so we will strip the ".1" suffix
-                    for purposes of validating that the user did not enter duplicate entity column names.
-                    Also, if the user put comments to itself in the form of parenthesis, we remove that
-                    '''
-                    GIST_OF                     = IntervalUtils().without_comments_in_parenthesis # Abbreviation for readability
-                    FMT                         = StringUtils().format_as_yaml_fieldname
-                    raw_col                     = columns[idx]
-                    no_parenthesis_col          = GIST_OF(my_trace, raw_col)
-                    if type(no_parenthesis_col) == tuple:
-                        # This is a boundary case where a MultiLevel index is used for the columns of the DataFrame.
-                        # In that case the entity, if there is one at all, is expected to be the first member of the tuple
-                        column_main_value       = no_parenthesis_col[0]
-                    else:
-                        column_main_value       = no_parenthesis_col
-                    REGEX                       = "(\.[0-9]+)$"
-                    suffix_search               =  _re.search(REGEX, column_main_value)
-                    if suffix_search == None:
-                        cleaned_col_main_value  = column_main_value
-                    else:
-                        suffix                  = suffix_search.group(0)
-                        cleaned_len             = len(column_main_value) - len(suffix)
-                        cleaned_col_main_value  = column_main_value[:cleaned_len]
-                    return FMT(cleaned_col_main_value) == FMT(interval.entity_name) # Format as yaml fieldname to avoid spurious differences due to e.g. upper/lower case
-
-                idxs                        = [idx for idx in range(len(columns)) if _matches_entity(idx)]
+                if fragment_index != None:
+                    idxs                    = fragment_index.entity_column_idxs(interval)
+                else:
+                    idxs                    = self._entity_column_idxs(my_trace, interval, columns)
                 if len(idxs)>1:
                     raise ApodeixiError(my_trace, "Entity '" + interval.entity_name + "' appears in multiple columns. Should appear only once.")
                 elif len(idxs)==0:
@@ -224,7 +206,12 @@ class BreakdownTree():
                 # So make the first validation: check that if interval's entity is blank, all of interval is bank
                 
                 encountered_new_entity      = not interval.entity_name in blank_cols
-                if self._keep_user_provided_UID(my_trace, xlr_config=xlr_config, user_provided_data=row[1][interval.columns]):
+                if fragment_index != None:
+                    keep_user_provided_UID  = fragment_index.keep_user_provided_UID(my_trace, self, xlr_config, interval, row[0])
+                else:
+                    keep_user_provided_UID  = self._keep_user_provided_UID(my_trace, xlr_config=xlr_config, 
+                                                                            user_provided_data=row[1][interval.columns])
+                if keep_user_provided_UID:
                     # The user-provided UID might skip acronyms. For example, it might be 4.2 instead
                     # BR4.C2 for previty when using joins. In those cases Pandas might have thought that the
                     # UID was a number, so force conversion to string "4.2" to prevent problems.
@@ -254,6 +241,8 @@ class BreakdownTree():
                     # If inference falis, then raise the error
                     
                     if self._can_infer_entity_from_prior_row(my_trace, interval.entity_name, row, all_rows):
+                        if fragment_index != None:
+                            fragment_index.forget_row(row[0]) # The row was just changed, so the index is stale for it
                         encountered_new_entity  = True # Reverse prior impression so we dock values onto the tree
                         instance_to_overwrite   = self.last_path[interval.entity_name]
                         uid_to_overwrite        = instance_to_overwrite.UID
@@ -306,7 +295,8 @@ class BreakdownTree():
                                                                                 original_row_nb     = row[0], 
                                                                                 current_row_nb      = row[0], 
                                                                                 all_rows            = all_rows, 
-                                                                                xlr_config          = xlr_config)
+                                                                                xlr_config          = xlr_config,
+                                                                                fragment_index      = fragment_index)
 
                 my_trace                        = parent_trace.doing("Docking a new '" + interval.entity_name 
                                                                         + "' below docking_uid '" + str(docking_uid) + "'",
@@ -325,10 +315,15 @@ class BreakdownTree():
                 if type(entity_type)==tuple: # Must be something like ("Effort", "", "")
                     entity_type                 = entity_type[0]
 
+                if fragment_index != None:
+                    data_to_attach              = fragment_index.interval_data(interval, row)
+                else:
+                    data_to_attach              = row[1][interval.columns]
+
                 subtree_full_uid                = self.dockEntityData(  parent_trace        = my_trace,
                                                                         full_docking_uid    = docking_uid, 
                                                                         entity_type         = entity_type, 
-                                                                        data_to_attach      = row[1][interval.columns],
+                                                                        data_to_attach      = data_to_attach,
                                                                         uid_to_overwrite    = uid_to_overwrite,
                                                                         xlr_config          = xlr_config,
                                                                         acronym_schema      = acronym_schema)
@@ -345,6 +340,43 @@ class BreakdownTree():
                                                     "DataFrame row": str(row[0]),
                                                     "interval": str(interval.columns)})
 
+    def _entity_column_idxs(self, parent_trace, interval, columns):
+        '''
+        Helper method that returns a list of ints, for the indices of the `columns` that are the "same" as the
+        `interval`'s entity name. For a well-formed row, the list has exactly one element.
+
+        By being the "same" we mean that either:
+        1. The column is a string identical to the interval's entity_name
+        2. The column is a tuple and its first member is identical to the interval's entity_name
+
+        If the user entered two columns with the same name, such as "Account", Pandas will re-name the second
+        one to be "Account.1". But that is still a user error for an entity, so we will strip the ".1" suffix
+        for purposes of validating that the user did not enter duplicate entity column names.
+        Also, if the user put comments to itself in the form of parenthesis, we remove that
+        '''
+        GIST_OF                         = IntervalUtils().without_comments_in_parenthesis # Abbreviation for readability
+        FMT                             = StringUtils().format_as_yaml_fieldname
+        def _matches_entity(idx):
+            raw_col                     = columns[idx]
+            no_parenthesis_col          = GIST_OF(parent_trace, raw_col)
+            if type(no_parenthesis_col) == tuple:
+                # This is a boundary case where a MultiLevel index is used for the columns of the DataFrame.
+                # In that case the entity, if there is one at all, is expected to be the first member of the tuple
+                column_main_value       = no_parenthesis_col[0]
+            else:
+                column_main_value       = no_parenthesis_col
+            REGEX                       = "(\.[0-9]+)$"
+            suffix_search               =  _re.search(REGEX, column_main_value)
+            if suffix_search == None:
+                cleaned_col_main_value  = column_main_value
+            else:
+                suffix                  = suffix_search.group(0)
+                cleaned_len             = len(column_main_value) - len(suffix)
+                cleaned_col_main_value  = column_main_value[:cleaned_len]
+            return FMT(cleaned_col_main_value) == FMT(interval.entity_name) # Format as yaml fieldname to avoid spurious differences due to e.g. upper/lower case
+
+        return [idx for idx in range(len(columns)) if _matches_entity(idx)]
+
     def _keep_user_provided_UID(self, parent_trace, xlr_config, user_provided_data):
         '''
         Helper method, to determine if all conditions are met for purposes of reading the UID from
@@ -453,7 +485,7 @@ class BreakdownTree():
         return True
 
     def _discover_docking_uid(self, parent_trace, interval, entity_column_idx, original_row_nb, current_row_nb, 
-                                    all_rows, xlr_config):
+                                    all_rows, xlr_config, fragment_index=None):
         '''
         Helper method used when a new entity is encountered in dataframe cell, where the cell's coordinates
         are:
@@ -475,19 +507,22 @@ class BreakdownTree():
 
         If in the process the search never finds a UID, then it raises an ApodeixiError unless the `entity_column_idx`
         corresponds to the first (highest level) entity, in which case self.parent_UID is returned
+
+        If a DataFrameFragmentIndex is given as `fragment_index`, it is used to tell which cells are blank in rows
+        that it covers.
         '''
         FMT                             = StringUtils().format_as_yaml_fieldname # Abbreviation for readability
         known_entity_types              = list(self.last_path.keys())
         row_data                        = all_rows[current_row_nb][1]
-        columns                         = list(row_data.index)
+        if fragment_index != None and not fragment_index.covers_row(all_rows[current_row_nb]):
+            fragment_index              = None # The row changed since the index was built, so inspect it instead
+        if fragment_index != None:
+            columns                     = fragment_index.columns
+        else:
+            columns                     = list(row_data.index)
         ancestor_entities_idxs          = [idx for idx in range(len(columns)) if columns[idx] in known_entity_types 
                                                                                 and idx < entity_column_idx]
 
-        # These Excel pointers are useful in error messages
-        excel_original_row_nb   = xlr_config.excel_row_nb(parent_trace, original_row_nb)
-        excel_current_row_nb    = xlr_config.excel_row_nb(parent_trace, current_row_nb)
-        excel_sheet             = xlr_config.excel_sheet(parent_trace)
-
         if len(ancestor_entities_idxs) == 0: # Only legal if we are the top-level entity, in which case return the parent_UID
             my_trace                    = parent_trace.doing("Validating we are the root entity", 
                                             data={'self.entity_type': self.entity_type,
@@ -499,9 +534,9 @@ class BreakdownTree():
                 raise ApodeixiError(my_trace, "Could not find a parent entity for '" + interval.entity_name + "'."
                                     + "  You should have a column called '" + str(self.entity_type)
                                     + "' with a non-blank value",
-                                    data = {"Excel row":            str(excel_original_row_nb),
+                                    data = {"Excel row":            str(xlr_config.excel_row_nb(my_trace, original_row_nb)),
                                             "Interval":             interval.columns,
-                                            "Excel worksheet":      excel_sheet}) 
+                                            "Excel worksheet":      xlr_config.excel_sheet(my_trace)}) 
             else:
                 return self.parent_UID
 
@@ -509,12 +544,15 @@ class BreakdownTree():
         # First search in the current row for the last entity that didn't have a non-blank value. If we find one,
         # we dock to its UID. If not, try again in the preceding row
         my_trace                        = parent_trace.doing("Searching for docking UID for an entity in row " + str(current_row_nb),
-                                                        data = {    'entity':       str(columns[entity_column_idx]),
-                                                                    'row_nb':       str(current_row_nb)})
-        row_data                        = all_rows[current_row_nb][1]
-        non_blank_ancestors_idx         = [idx for idx in ancestor_entities_idxs if not
-                                            IntervalUtils().is_blank( row_data[columns[idx]]  )
-                                        ]
+                                                        data = {    'entity':       lambda: str(columns[entity_column_idx]),
+                                                                    'row_nb':       lambda: str(current_row_nb)})
+        if fragment_index != None:
+            non_blank_ancestors_idx     = [idx for idx in ancestor_entities_idxs 
+                                            if not fragment_index.is_blank(current_row_nb, idx)]
+        else:
+            non_blank_ancestors_idx     = [idx for idx in ancestor_entities_idxs if not
+                                                IntervalUtils().is_blank( row_data[columns[idx]]  )
+                                            ]
 
         if len(non_blank_ancestors_idx) == 0: # No luck in this row. Try the preceding one, unless there isn't any, which means fail
 
@@ -522,6 +560,9 @@ class BreakdownTree():
                 # Search failed bacause we have only seen blanks in all rows, so fail with an error message explaining
                 # to the user which part of the Excel spreadsheet is blank and needs fixing
                 ancestor_entities       = [columns[idx] for idx in ancestor_entities_idxs]
+                # These Excel pointers are useful in error messages
+                excel_original_row_nb   = xlr_config.excel_row_nb(my_trace, original_row_nb)
+                excel_current_row_nb    = xlr_config.excel_row_nb(my_trace, current_row_nb)
                 msg                     = "You left blank columns \n['" + "', '".join(ancestor_entities) + "']" \
                                             + "\nfor excel rows " + str(excel_current_row_nb) + "-" + str(excel_original_row_nb) + "." \
                                             + "\nThat is not allowed since you have non-blank data in column '" \
@@ -534,7 +575,8 @@ class BreakdownTree():
                                                     original_row_nb         = original_row_nb, 
                                                     current_row_nb          = current_row_nb -1, 
                                                     all_rows                = all_rows,
-                                                    xlr_config              = xlr_config)
+                                                    xlr_config              = xlr_config,
+                                                    fragment_index          = fragment_index)
         else: # We found it!
             parent_entity               = columns[max(non_blank_ancestors_idx)]
             parent_entity_instance      = self.last_path[parent_entity]
@@ -627,8 +669,8 @@ class BreakdownTree():
             property_name       = idx
             val                 = data_to_attach[idx]
             loop_trace          = my_trace.doing("Considering to set property to new node",
-                                                    data = {"property name": str(property_name),
-                                                            "raw value":     str(val) })
+                                                    data = {"property name": lambda idx=idx: str(idx),
+                                                            "raw value":     lambda val=val: str(val) })
             if IntervalUtils().is_a_UID_column(loop_trace, property_name):
                 if not self._keep_user_provided_UID(loop_trace, xlr_config=xlr_config, user_provided_data=data_to_attach):
                     continue # Don't change the UID value we just generated - ignore whatever the user entered
@@ -878,3 +920,114 @@ class BreakdownTree():
 
 
 
+
+class DataFrameFragmentIndex():
+    '''
+    Helper class used to speed up the parsing of a posting's DataFrame by a BreakdownTree, by computing once
+    for the whole DataFrame what BreakdownTree.readDataframeFragment would otherwise compute for every row and interval.
+    Namely:
+
+    * Which cells are blank, as a boolean NumPy array with a row per DataFrame row and a column per DataFrame column
+    * For each interval, the positions of its columns in the DataFrame and of the columns for its entity
+
+    The index is only used for rows and intervals it "covers", i.e., rows that are still the ones it was built from and 
+    intervals it was built for. Rows or intervals enriched by a PostingConfig's preprocessReadFragment hook are not covered,
+    and callers should inspect them as they would without an index.
+
+    @param df The Pandas DataFrame being parsed.
+    @param all_rows A list of the `(idx, series)` tuples yielded by `df.iterrows()`, which callers will later pass to
+                    readDataframeFragment.
+    @param interval_list A list of Interval objects for the columns of `df`
+    '''
+    def __init__(self, parent_trace, tree, df, all_rows, interval_list):
+        my_trace                    = parent_trace.doing("Indexing blank cells and interval columns in DataFrame")
+        self.all_rows               = all_rows
+        self.columns                = list(df.columns)
+        self.nb_columns             = len(self.columns)
+        self.positions              = {}
+        self.blank                  = None
+        self.intervals              = {}
+        self.changed_rows           = set()
+
+        # The index refers to rows by their position and to columns by their name, so it can't be used if that is ambiguous
+        if not df.index.equals(pandas.RangeIndex(len(df.index))) or len(set(self.columns)) < self.nb_columns:
+            return
+        blank                       = _numpy.zeros((len(df.index), self.nb_columns), dtype=bool)
+        for col_nb in range(self.nb_columns):
+            values                  = df.iloc[:, col_nb]
+            if pandas.api.types.is_float_dtype(values.dtype):
+                if _numpy.isinf(values.to_numpy()).any():
+                    return # IntervalUtils().is_blank raises an error for infinity, so leave it to readDataframeFragment
+                blank[:, col_nb]    = values.isna().to_numpy()
+            elif pandas.api.types.is_datetime64_any_dtype(values.dtype):
+                blank[:, col_nb]    = values.isna().to_numpy()
+            elif not (pandas.api.types.is_integer_dtype(values.dtype) or pandas.api.types.is_bool_dtype(values.dtype)):
+                blank[:, col_nb]    = [IntervalUtils().is_blank(val) for val in values]
+        self.blank                  = blank
+        self.positions              = {self.columns[col_nb]: col_nb for col_nb in range(self.nb_columns)}
+
+        for interval in interval_list:
+            if not all([col in self.positions for col in interval.columns]):
+                continue
+            interval_positions      = [self.positions[col] for col in interval.columns]
+            entity_idxs             = tree._entity_column_idxs(my_trace, interval, self.columns)
+            self.intervals[id(interval)] = (interval, interval_positions, entity_idxs)
+
+    def covers_row(self, row):
+        '''
+        Returns a boolean, stating whether the index can be used for `row`, a tuple `(idx, series)`
+        '''
+        if self.blank is None:
+            return False
+        row_nb                      = row[0]
+        if type(row_nb) != int or row_nb < 0 or row_nb >= len(self.all_rows) or row_nb in self.changed_rows:
+            return False
+        return row is self.all_rows[row_nb] and len(row[1]) == self.nb_columns
+
+    def covers(self, interval, row):
+        '''
+        Returns a boolean, stating whether the index can be used for `interval` in `row`, a tuple `(idx, series)`
+        '''
+        entry                       = self.intervals.get(id(interval))
+        return entry != None and entry[0] is interval and self.covers_row(row)
+
+    def forget_row(self, row_nb):
+        '''
+        Called when the row at position `row_nb` is changed after the index was built, so that the index no
+        longer covers it
+        '''
+        self.changed_rows.add(row_nb)
+
+    def is_blank(self, row_nb, col_nb):
+        return bool(self.blank[row_nb, col_nb])
+
+    def blank_columns(self, interval, row_nb):
+        '''
+        Returns the list of `interval`'s columns that are blank in the row at position `row_nb`
+        '''
+        interval_positions          = self.intervals[id(interval)][1]
+        return [col for col, col_nb in zip(interval.columns, interval_positions) if self.blank[row_nb, col_nb]]
+
+    def entity_column_idxs(self, interval):
+        '''
+        Returns a list of ints, for the positions of the columns that are for `interval`'s entity
+        '''
+        return self.intervals[id(interval)][2]
+
+    def interval_data(self, interval, row):
+        '''
+        Returns a Pandas Series with the values in `row` for `interval`'s columns, same as `row[1][interval.columns]`
+        '''
+        interval_positions          = self.intervals[id(interval)][1]
+        return row[1].take(interval_positions)
+
+    def keep_user_provided_UID(self, parent_trace, tree, xlr_config, interval, row_nb):
+        '''
+        Same as `tree._keep_user_provided_UID` for `interval`'s columns in the row at position `row_nb`
+        '''
+        if xlr_config.update_policy.reuse_uids == False:
+            return False 
+        uid_column                  = tree._identify_uid_column(parent_trace, interval.columns)
+        if uid_column == None:
+            return False
+        return not self.blank[row_nb, self.positions[uid_column]]
@@ -1,5 +1,4 @@
 
-from nltk.tokenize                              import SExprTokenizer 
 
 from apodeixi.util.a6i_error                    import ApodeixiError
 from apodeixi.util.dataframe_utils              import DataFrameUtils
@@ -57,6 +56,7 @@ class IntervalUtils():
                                                     data = {"invalid input":    str(txt)})
             stripped_txt = StringUtils().strip(txt)
             # Remove text within parenthesis, if any, using the natural language tool nltk.tokenize.SExprTokenizer
+            from nltk.tokenize                  import SExprTokenizer # Imported lazily since nltk is slow to import
             sexpr                       = SExprTokenizer(strict=False)
             sexpr_tokens                = sexpr.tokenize(stripped_txt)
             parenthesis_free_tokens     = [t for t in sexpr_tokens if not ')' in t and not '(' in t]
@@ -194,7 +194,7 @@ class MinimalistIntervalSpec(IntervalSpec):
         current_interval_cols           = []
         for idx in range(len(linear_space)):
             loop_trace                  = parent_trace.doing("Looping through linear space to build intervals",
-                                                                data = {    'linear_space':             str(linear_space),
+                                                                data = {    'linear_space':             lambda: str(linear_space),
                                                                             'idx in loop':              str(idx),
                                                                             'current_interval_cols':    str(current_interval_cols)})
             col                         = linear_space[idx]
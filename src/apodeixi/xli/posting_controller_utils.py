@@ -6,7 +6,7 @@ import datetime                                 as _datetime
 from apodeixi.xli.uid_acronym_schema            import UID_Acronym_Schema
 
 from apodeixi.xli.xlimporter                    import SchemaUtils, ExcelTableReader, ManifestXLReadConfig
-from apodeixi.xli.breakdown_builder             import BreakdownTree
+from apodeixi.xli.breakdown_builder             import BreakdownTree, DataFrameFragmentIndex
 from apodeixi.xli.interval                      import IntervalUtils, Interval
 
 from apodeixi.controllers.util.manifest_api     import ManifestAPIVersion
@@ -140,29 +140,29 @@ class PostingController():
             parser.reserve_user_provided_uids(parent_trace, xlr_config, df[interval.columns], interval.entity_name)  
 
         rows                    = list(df.iterrows())
+        ORIGINATION             = {'signaled_from': __file__} # Shared by all traces in the loop, since it doesn't change
         my_trace                = parent_trace.doing("Processing DataFrame", data={ 'parser.entity_type': parser.entity_type,
-                                                                                    'columns'           : list(df.columns)},
-                                                            origination = {                   
-                                                                                    'signaled_from': __file__,
-                                                                                    })
+                                                                                    'columns'           : lambda: list(df.columns)},
+                                                            origination = ORIGINATION)
+        # Blank cells and interval columns are worked out once for the whole DataFrame, rather than for each row and interval
+        fragment_index          = DataFrameFragmentIndex(my_trace, parser, df, rows, interval_list)
         for idx in range(len(rows)):
             last_uid            = None # Will represent the 
+            excel_row_nb        = ExcelTableReader.df_2_xl_row( parent_trace    = my_trace, 
+                                                                df_row_nb       = idx, 
+                                                                excel_range     = data_handle.excel_range)
             for interval in interval_list:
                 loop_trace      = my_trace.doing(   activity="Processing fragment", 
-                                                    data={  'excel row': ExcelTableReader.df_2_xl_row(  
-                                                                            parent_trace    = my_trace, 
-                                                                            df_row_nb       = idx, 
-                                                                            excel_range     = data_handle.excel_range), 
+                                                    data={  'excel row': excel_row_nb, 
                                                             'interval': interval.columns},
-                                                    origination = {
-                                                            'signaled_from': __file__,
-                                                             })
+                                                    origination = ORIGINATION)
                 a_uid           = parser.readDataframeFragment(interval=interval, 
                                                                 row             = rows[idx], 
                                                                 parent_trace    = loop_trace, 
                                                                 xlr_config      = xlr_config, 
                                                                 all_rows        = rows, 
-                                                                acronym_schema  = acronym_schema)
+                                                                acronym_schema  = acronym_schema,
+                                                                fragment_index  = fragment_index)
                 if a_uid != None: # Improve our working hypothesis of last_uid
                     last_uid = a_uid
             # By now full_uid would be set to the UID of the last node added (i.e., the one added for the last interval)
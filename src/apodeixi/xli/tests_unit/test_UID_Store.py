@@ -67,6 +67,40 @@ class Test_UIDStore(ApodeixiUnitTest):
             print(ex.trace_message())
             self.assertTrue(1==2)
 
+    def test_initializeFromUIDs(self):
+        '''
+        Checks that seeding the store in bulk from a manifest's UIDs is the same as adding each UID one at a time,
+        including for abbreviated UIDs and UIDs where an entity was skipped
+        '''
+        root_trace      = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing initializeFromUIDs")
+        manifest_dict   = {'A1':    {'UID': 'A1',           'I1':  {'UID': 'A1.I1', 'S1': {'UID': 'A1.I1.S1'}}},
+                            'A2':   {'UID': 'A2',           'S4':  {'UID': 'A2.I0.S4'}},
+                            'A3':   {'UID': 'A3.2.3'}}
+        # Each scenario is a pair of [parent uid input, acronym input, expected output]
+        scenarios       = [ [None,          'A',    ('A4', 'A4')],
+                            ['A1',          'I',    ('A1.I2', 'I2')],
+                            ['A1.I1',       'S',    ('A1.I1.S2', 'S2')],
+                            ['A3.I2',       'S',    ('A3.I2.S4', 'S4')]]
+        try:
+            acronym_schema                      = UID_Acronym_Schema()
+            acronym_schema.acronyminfo_list     = [AcronymInfo(acronym=x, entity_name=x) for x in ['A', 'I', 'S']]
+            self.store.set_acronym_schema(root_trace, acronym_schema)
+            uid_list                            = self.store.collect_uids(manifest_dict)
+            self.assertEqual(uid_list, ['A1', 'A1.I1', 'A1.I1.S1', 'A2', 'A2.I0.S4', 'A3.2.3'])
+            self.store.initializeFromUIDs(root_trace, uid_list)
+
+            one_by_one_store                    = UID_Store(root_trace)
+            one_by_one_store.set_acronym_schema(root_trace, acronym_schema)
+            for uid in uid_list:
+                one_by_one_store.add_known_uid(root_trace, uid)
+            self.assertEqual(self.store.tree.display(root_trace), one_by_one_store.tree.display(root_trace))
+
+            for (parent_uid, acronym, expected) in scenarios:
+                result                          = self.attempt_generateUID(root_trace, parent_uid, acronym)
+                self.assertEqual(result, expected)
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
 
 if __name__ == "__main__":
     # execute only if run as a script
@@ -78,5 +112,7 @@ if __name__ == "__main__":
             T.test_tokenize()
         if what_to_do=='generateUID':
             T.test_generateUID()
+        if what_to_do=='initializeFromUIDs':
+            T.test_initializeFromUIDs()
 
     main(_sys.argv)
\ No newline at end of file
@@ -7,7 +7,7 @@ from apodeixi.testing_framework.mock_kb_store               import UnitTest_Know
 
 from apodeixi.util.a6i_error                                import ApodeixiError, FunctionalTrace
 
-from apodeixi.xli.breakdown_builder                         import BreakdownTree
+from apodeixi.xli.breakdown_builder                         import BreakdownTree, DataFrameFragmentIndex
 from apodeixi.xli.interval                                  import Interval
 from apodeixi.xli.uid_store                                 import UID_Store
 from apodeixi.xli.posting_controller_utils                  import PostingConfig
@@ -53,6 +53,18 @@ class Test_BreakoutTree(ApodeixiUnitTest):
         
         self._compare_to_expected_yaml(root_trace, result_dict, test_output_name = 'read_df_fragment', save_output_dict=True)
 
+    def test_read_df_fragment_with_index(self):  
+        result_dict                 = None
+        root_trace                  = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Reading df fragment with index")  
+        try:
+            tree                    = self._create_breakdown_tree(root_trace, 'read_df_fragment_with_index', use_fragment_index=True)
+            result_dict             = tree.as_dicts()
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+        
+        self._compare_to_expected_yaml(root_trace, result_dict, test_output_name = 'read_df_fragment_with_index', save_output_dict=True)
+
     def test_find(self):    
         UID_TO_FIND                 = 'A2.B1.C1'   
         NAME_OF_ENTITY_TO_FIND      = 'c4'
@@ -172,7 +184,7 @@ class Test_BreakoutTree(ApodeixiUnitTest):
 
         self._compare_to_expected_yaml(root_trace, result_dict, test_output_name = 'attach_subtree', save_output_dict=True)
 
-    def _create_breakdown_tree(self, parent_trace, test_case_name):
+    def _create_breakdown_tree(self, parent_trace, test_case_name, use_fragment_index=False):
         my_trace        = parent_trace.doing("Creating UID Store")
         store           = UID_Store(my_trace)
         xlr_config      = self._create_posting_config(my_trace, test_case_name)
@@ -198,6 +210,10 @@ class Test_BreakoutTree(ApodeixiUnitTest):
         acronym_schema.acronyminfo_list     = [AcronymInfo("A", "A"), AcronymInfo("B", "B"), AcronymInfo("C", "C"),
                                                 AcronymInfo("CO", "Costs")] # CO acronym is for test_docking_1
         store.set_acronym_schema(my_trace, acronym_schema)
+        if use_fragment_index:
+            fragment_index  = DataFrameFragmentIndex(my_trace, tree, df, rows, intervals)
+        else:
+            fragment_index  = None
         for idx in range(len(rows)):
             for interval in intervals:
                 loop_trace        = my_trace.doing(activity="Processing fragment", data={'row': idx, 
@@ -209,7 +225,8 @@ class Test_BreakoutTree(ApodeixiUnitTest):
                                             parent_trace        = loop_trace, 
                                             all_rows            = rows, 
                                             xlr_config          = xlr_config,
-                                            acronym_schema      = None)
+                                            acronym_schema      = None,
+                                            fragment_index      = fragment_index)
 
         return tree
 
@@ -276,6 +293,8 @@ if __name__ == "__main__":
         T.setUp()
         if what_to_do=='read_df_fragment':
             T.test_read_df_fragment()
+        elif what_to_do=='read_df_fragment_with_index':
+            T.test_read_df_fragment_with_index()
         elif what_to_do=='find':
             T.test_find()
         elif what_to_do=='attach_subtree':
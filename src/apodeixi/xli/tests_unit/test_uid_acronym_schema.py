@@ -0,0 +1,92 @@
+import sys                                              as _sys
+import copy                                             as _copy
+
+from apodeixi.testing_framework.a6i_unit_test           import ApodeixiUnitTest
+from apodeixi.util.a6i_error                            import ApodeixiError, FunctionalTrace
+from apodeixi.util.path_utils                           import PathUtils
+from apodeixi.util.yaml_utils                           import YAML_Utils
+
+from apodeixi.xli.uid_acronym_schema                    import UID_Acronym_Schema
+
+class Test_UID_Acronym_Schema(ApodeixiUnitTest):
+
+    def setUp(self):
+        super().setUp()
+
+    def test_schema_memo(self):
+        '''
+        Checks that acronym schemas built from manifest content are memoized, so that the content is only traversed
+        once, and that they are persisted in manifests' binary sidecars so that loading a sidecar avoids the traversal
+        '''
+        TEST_NAME                       = 'schema_memo'
+        # The second big rock skips the sub-rock entity, so its tiny rock's UID is padded with "SR0"
+        MANIFEST_DICT                   = {'apiVersion': 'delivery-planning.journeys.a6i.io/v1a', 'kind': 'big-rock',
+                                            'metadata': {'name': 'test', 'namespace': 'my-corp.production'},
+                                            'assertion': {'big-rock': {
+                'BR1':  {'UID': 'BR1',  'entity': 'Lift and shift', 'Sub rock': {
+                    'SR1':  {'UID': 'BR1.SR1',  'entity': 'Move VMs'}}},
+                'BR2':  {'UID': 'BR2',  'entity': 'Refactor',       'Tiny rock': {
+                    'TR1':  {'UID': 'BR2.SR0.TR1', 'entity': 'Split DB'}}}},
+                                                            'entity_type': 'big-rock'}}
+        try:
+            root_trace                  = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing acronym schema memo")
+            test_dir                    = self.output_data + "/" + TEST_NAME
+            PathUtils().remove_folder_if_exists(root_trace, test_dir)
+            PathUtils().create_path_if_needed(root_trace, test_dir)
+
+            traversals                  = []
+            def _build(loop_trace, manifest_dict):
+                schema                  = UID_Acronym_Schema()
+                original_map            = schema._map_acronyminfo_lists
+                def _counting_map(*args, **kwargs):
+                    if kwargs.get('parent_uid') == None: # Don't count recursive calls
+                        traversals.append(1)
+                    return original_map(*args, **kwargs)
+                schema._map_acronyminfo_lists = _counting_map
+                schema.build_schema_from_manifest(loop_trace, manifest_dict)
+                return str(schema) + "\ttraversals so far=" + str(len(traversals))
+
+            UID_Acronym_Schema._memo.clear()
+            output_txt                  = ""
+            output_txt                  += "\nFirst build:\t\t\t" + _build(root_trace, MANIFEST_DICT)
+            output_txt                  += "\nSecond build:\t\t\t" + _build(root_trace, MANIFEST_DICT)
+
+            changed_dict                = _copy.deepcopy(MANIFEST_DICT)
+            changed_dict['assertion']['big-rock']['BR3'] = {'UID': 'BR3', 'entity': 'Retire mainframe'}
+            output_txt                  += "\nAfter changing content:\t\t" + _build(root_trace, changed_dict)
+
+            # Saving the sidecar should reuse the memoized schema rather than traversing the manifest again. Schemas
+            # are only persisted in sidecars once registered, as stores that write manifest sidecars do
+            UID_Acronym_Schema().register_sidecar_annotator(root_trace)
+            path                        = test_dir + "/big-rock.1.yaml"
+            original_class_map          = UID_Acronym_Schema._map_acronyminfo_lists
+            def _counting_class_map(schema, *args, **kwargs):
+                if kwargs.get('parent_uid') == None:
+                    traversals.append(1)
+                return original_class_map(schema, *args, **kwargs)
+            UID_Acronym_Schema._map_acronyminfo_lists = _counting_class_map
+            try:
+                YAML_Utils().save(root_trace, MANIFEST_DICT, path, use_cache = False, write_sidecar = True)
+            finally:
+                UID_Acronym_Schema._map_acronyminfo_lists = original_class_map
+            output_txt                  += "\nAfter saving the sidecar:\ttraversals so far=" + str(len(traversals))
+            UID_Acronym_Schema._memo.clear()
+            loaded_dict                 = YAML_Utils()._load_sidecar(root_trace, path)
+            output_txt                  += "\nAfter loading the sidecar:\t" + _build(root_trace, loaded_dict)
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        T = Test_UID_Acronym_Schema()
+        T.setUp()
+        what_to_do = args[1]
+        if what_to_do=='schema_memo':
+            T.test_schema_memo()
+
+    main(_sys.argv)
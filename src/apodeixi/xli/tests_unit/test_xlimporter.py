@@ -0,0 +1,140 @@
+import sys                                                  as _sys
+import shutil                                               as _shutil
+
+from apodeixi.testing_framework.a6i_unit_test               import ApodeixiUnitTest
+from apodeixi.testing_framework.benchmarks.excel_range_benchmark    import ExcelRange_Benchmark
+from apodeixi.util.a6i_error                                import ApodeixiError, FunctionalTrace
+from apodeixi.util.path_utils                               import PathUtils
+
+from apodeixi.xli.xlimporter                                import ExcelWorkbookSession, ExcelRangeCache, ExcelTableReader, \
+                                                                    ManifestXLReadConfig
+
+class Test_ExcelWorkbookSession(ApodeixiUnitTest):
+
+    def setUp(self):
+        super().setUp()
+
+    def test_read_range(self):
+        '''
+        Checks that ranges read by ExcelWorkbookSession are the same as those read with Pandas' read_excel, for
+        ranges at the edges and in the middle of a worksheet, with single-level and two-level headers
+        '''
+        TEST_NAME                   = 'read_range'
+        NB_COLUMNS                  = 30
+        NB_ROWS                     = 20
+        # Each case is a tuple of: header_list, nrows, first_col_nb, last_col_nb
+        CASES                       = [ ([2],       NB_ROWS,        0,              3),
+                                        ([2],       5,              12,             17),
+                                        ([2],       NB_ROWS,        NB_COLUMNS - 4, NB_COLUMNS - 1),
+                                        ([1, 2],    NB_ROWS,        0,              3),
+                                        ([1, 2],    5,              13,             17),
+                                        ([1, 2],    NB_ROWS,        NB_COLUMNS - 4, NB_COLUMNS - 1)]
+        try:
+            root_trace              = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing reading Excel ranges")
+            test_dir                = self.output_data + "/" + TEST_NAME
+            PathUtils().create_path_if_needed(root_trace, test_dir)
+            path                    = test_dir + "/wide.xlsx"
+
+            benchmark               = ExcelRange_Benchmark()
+            benchmark.write_workbook(root_trace, path, NB_COLUMNS, NB_ROWS)
+
+            session                 = ExcelWorkbookSession()
+            output_txt              = ""
+            for header_list, nrows, first_col_nb, last_col_nb in CASES:
+                loop_trace          = root_trace.doing("Reading range", data = {"header_list": str(header_list),
+                                                                                "columns": str([first_col_nb, last_col_nb])})
+                range_df            = session.read_range(loop_trace, path, ExcelRange_Benchmark.SHEET, header_list, nrows,
+                                                            first_col_nb, last_col_nb)
+                pandas_df           = benchmark.read_with_pandas(loop_trace, path, header_list, nrows, first_col_nb, last_col_nb)
+                output_txt          += "\nHeaders " + str(header_list) + ", " + str(nrows) + " rows, columns " \
+                                        + str(first_col_nb) + " to " + str(last_col_nb) + ":\tshape=" \
+                                        + str(range_df.shape) + "\tsame as Pandas=" + str(benchmark.same_df(range_df, pandas_df))
+            session.close(root_trace)
+            output_txt              += "\n\nWorkbook opens: " + str(session.opens) + "\tRanges read: " + str(session.reads)
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
+class Test_ExcelRangeCache(ApodeixiUnitTest):
+
+    def setUp(self):
+        super().setUp()
+
+    def test_range_cache(self):
+        '''
+        Checks that ExcelTableReader only reads a range from Excel if it is not in its ExcelRangeCache, that cache
+        entries are found by the content of Excel files (not their path) and that the cache stays within its size limit
+        '''
+        TEST_NAME                   = 'range_cache'
+        EXCEL_RANGE                 = "B3:E23"
+        try:
+            root_trace              = FunctionalTrace(parent_trace=None, path_mask=self._path_mask).doing("Testing Excel range cache")
+            test_dir                = self.output_data + "/" + TEST_NAME
+            PathUtils().remove_folder_if_exists(root_trace, test_dir)
+            PathUtils().create_path_if_needed(root_trace, test_dir)
+            path                    = test_dir + "/wide.xlsx"
+            copy_path               = test_dir + "/copy_of_wide.xlsx"
+            benchmark               = ExcelRange_Benchmark()
+            benchmark.write_workbook(root_trace, path, 8, 20)
+            _shutil.copyfile(path, copy_path)
+
+            def _read(loop_trace, excel_path, cache):
+                reader              = ExcelTableReader( parent_trace        = loop_trace,
+                                                        excel_fullpath      = excel_path,
+                                                        excel_sheet         = ExcelRange_Benchmark.SHEET,
+                                                        excel_range         = EXCEL_RANGE,
+                                                        xlr_config          = ManifestXLReadConfig(),
+                                                        range_cache         = cache)
+                return reader.read(loop_trace)
+
+            uncached_df             = _read(root_trace, path, None)
+            cache                   = ExcelRangeCache(root_trace, test_dir + "/cache")
+            output_txt              = ""
+            for description, excel_path in [("First read", path), ("Second read", path), ("Copy of file", copy_path)]:
+                loop_trace          = root_trace.doing(description)
+                df                  = _read(loop_trace, excel_path, cache)
+                stats               = cache.stats()
+                output_txt          += "\n" + description + ":\tsame as uncached=" + str(df.equals(uncached_df)) \
+                                        + "\thits=" + str(stats["hits"]) + "\tmisses=" + str(stats["misses"]) \
+                                        + "\tentries=" + str(stats["entries"])
+
+            my_trace                = root_trace.doing("Changing the Excel file")
+            benchmark.write_workbook(my_trace, path, 9, 20)
+            df                      = _read(my_trace, path, cache)
+            stats                   = cache.stats()
+            output_txt              += "\nChanged file:\tsame as uncached=" + str(df.equals(uncached_df)) \
+                                        + "\thits=" + str(stats["hits"]) + "\tmisses=" + str(stats["misses"]) \
+                                        + "\tentries=" + str(stats["entries"])
+
+            my_trace                = root_trace.doing("Re-opening the cache with a smaller size limit")
+            cache                   = ExcelRangeCache(my_trace, test_dir + "/cache", max_bytes = stats["bytes"] - 1)
+            output_txt              += "\nRe-opened cache:\tentries=" + str(cache.stats()["entries"])
+            _read(my_trace, copy_path, cache)
+            stats                   = cache.stats()
+            output_txt              += "\nSmaller cache:\thits=" + str(stats["hits"]) + "\tentries=" + str(stats["entries"]) \
+                                        + "\tevictions=" + str(stats["evictions"]) + "\twithin limit=" \
+                                        + str(stats["bytes"] <= cache.max_bytes)
+
+            self._compare_to_expected_txt(root_trace, output_txt, test_output_name = TEST_NAME, save_output_txt=True)
+
+        except ApodeixiError as ex:
+            print(ex.trace_message())
+            self.assertTrue(1==2)
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    def main(args):
+        T = Test_ExcelWorkbookSession()
+        T.setUp()
+        what_to_do = args[1]
+        if what_to_do=='read_range':
+            T.test_read_range()
+        elif what_to_do=='range_cache':
+            T = Test_ExcelRangeCache()
+            T.setUp()
+            T.test_range_cache()
+
+    main(_sys.argv)
@@ -3,10 +3,16 @@
 # ManifestUtils
 #from apodeixi.knowledge_base.manifest_utils        import ManifestUtils
 
+import hashlib                                      as _hashlib
+import pickle                                       as _pickle
+import threading                                    as _threading
+from collections                                    import OrderedDict
+
 from apodeixi.xli.uid_store                         import UID_Utils
 from apodeixi.xli.interval                          import Interval
 from apodeixi.util.a6i_error                        import ApodeixiError
 from apodeixi.util.list_utils                       import ListUtils
+from apodeixi.util.yaml_utils                       import YAML_Utils
 
 class AcronymInfo():
     '''
@@ -47,6 +53,11 @@ class UID_Acronym_Schema():
 
     * During generation cycles (i.e., an Excel file is being generated from a manifest_dict), it can be generated by an algorithm
       that traverses the manifest_dict to read the UID and entity fields in the tree represented by the manifest_dict.
+
+    Since the same manifest content may be converted many times in a single command (e.g., to diff, describe or
+    aggregate manifests, or to generate forms), schemas generated from manifest content are memoized, keyed by the
+    content's path and a hash of the content. They are also persisted in the binary sidecars of manifests, if the
+    KnowledgeBaseStore writes them, so that other processes that load the manifest don't have to traverse it.
     '''
     def __init__(self):
         self.acronyminfo_list       = [] # This is populated later by the build_schema* methods
@@ -56,10 +67,54 @@ class UID_Acronym_Schema():
         self.MU                     = ManifestUtils()
         return
 
+    # Keys are tuples (parent_path, content digest), and values are lists of tuples (acronym, entity_name) for
+    # the schemas built by self.build_schema_from_manifest_content, from least to most recently used
+    _memo                           = OrderedDict()
+    _memo_lock                      = _threading.Lock()
+    MAX_MEMOIZED                    = 1000
+
     def __str__(self):
         str_list    = [str(info) for info in self.acronyminfo_list]
         return str(str_list)
 
+    def content_digest(self, content_dict):
+        '''
+        Returns a string hash of `content_dict`, or None if it can't be computed. It is a hash of the pickled
+        `content_dict`, which is much faster to compute than traversing `content_dict`
+        '''
+        try:
+            return _hashlib.sha256(_pickle.dumps(content_dict, protocol=5)).hexdigest()
+        except Exception:
+            return None
+
+    def _memoized(self, memo_key):
+        '''
+        Returns the list of (acronym, entity_name) tuples memoized for `memo_key`, or None if there is none
+        '''
+        ME                          = UID_Acronym_Schema
+        with ME._memo_lock:
+            memoized                = ME._memo.get(memo_key)
+            if memoized != None:
+                ME._memo.move_to_end(memo_key)
+            return memoized
+
+    def _memoize(self, memo_key, schema_tuples):
+        ME                          = UID_Acronym_Schema
+        with ME._memo_lock:
+            ME._memo[memo_key]      = schema_tuples
+            ME._memo.move_to_end(memo_key)
+            while len(ME._memo) > ME.MAX_MEMOIZED:
+                ME._memo.popitem(last=False)
+
+    def register_sidecar_annotator(self, parent_trace):
+        '''
+        Registers with YAML_Utils the functions that persist the acronym schemas of manifests in their binary sidecars,
+        so that other processes that load the same manifests need not build the schemas again. 
+        
+        Stores call it when they are configured to write manifest sidecars.
+        '''
+        YAML_Utils().register_sidecar_annotator("acronym-schema", _annotate_sidecar, _restore_sidecar)
+
     def acronym_infos(self):
         return self.acronyminfo_list
 
@@ -114,13 +169,21 @@ class UID_Acronym_Schema():
 
         See documentation of self.build_schema_from_manifest_content, to which this method delegates
         '''
+        content_dict, contents_path     = self._manifest_content(parent_trace, manifest_dict)
+        self.build_schema_from_manifest_content(parent_trace, content_dict, parent_path = contents_path)
+
+    def _manifest_content(self, parent_trace, manifest_dict):
+        '''
+        Returns a pair: the content of `manifest_dict` (i.e., the dictionary under its 'assertion' for the manifest's
+        entity), and the path to that content, like 'assertion.big-rock'
+        '''
         entity                          = self.MU.infer_entity( parent_trace        = parent_trace, 
                                                                         manifest_dict       = manifest_dict, 
                                                                         manifest_nickname   = "Some manifest")
         contents_path                   = 'assertion.' + entity
         assertion_dict                  = manifest_dict['assertion']
         content_dict                    = assertion_dict[entity]
-        self.build_schema_from_manifest_content(parent_trace, content_dict, parent_path = contents_path)
+        return content_dict, contents_path
 
     def build_schema_from_manifest_content(self, parent_trace, content_dict, parent_path):
         '''
@@ -184,7 +247,22 @@ class UID_Acronym_Schema():
 
         * Second pass then reduces this to a single list that has the property that it includes all acronyms listed
           in any of the lists in the first pass, in the same order. In the example, that is ["A", "I", SI", "AS"]
+
+        Both passes are skipped if the schema for the same `parent_path` and content was memoized.
+        '''
+        memo_key                        = (parent_path, self.content_digest(content_dict))
+        self._build_schema_from_manifest_content(parent_trace, content_dict, parent_path, memo_key)
+
+    def _build_schema_from_manifest_content(self, parent_trace, content_dict, parent_path, memo_key):
+        '''
+        Implements self.build_schema_from_manifest_content, for the `memo_key` already computed by the caller
         '''
+        if memo_key[1] != None:
+            memoized                    = self._memoized(memo_key)
+            if memoized != None:
+                self.acronyminfo_list   = [AcronymInfo(acronym, entity_name) for acronym, entity_name in memoized]
+                return
+
         # all_acronyms_list is a list of lists of _AcronymInfo objects
         all_acronym_info_lists          = self._map_acronyminfo_lists(parent_trace, content_dict, parent_path, parent_uid=None)
 
@@ -213,6 +291,8 @@ class UID_Acronym_Schema():
             working_acronyminfo_lists   = next_working_lists
 
         self.acronyminfo_list           = result
+        if memo_key[1] != None:
+            self._memoize(memo_key, [(info.acronym, info.entity_name) for info in result])
 
     def pad_uid(self, parent_trace, a_full_uid):
         '''
@@ -526,3 +606,30 @@ class UID_Acronym_Schema():
         result.append(AcronymInfo(e_acronym, entity_name))
 
         return result
+
+def _annotate_sidecar(parent_trace, data_dict):
+    '''
+    Returns an annotation to persist in the binary sidecar of a manifest: a tuple (memo_key, schema_tuples) with the
+    acronym schema of the manifest `data_dict`, or None if `data_dict` is not a manifest or its schema can't be built.
+
+    If the schema was memoized, it is reused rather than traversing `data_dict` again.
+    '''
+    if type(data_dict) != dict or not 'assertion' in data_dict.keys():
+        return None
+    try:
+        schema                          = UID_Acronym_Schema()
+        content_dict, contents_path     = schema._manifest_content(parent_trace, data_dict)
+        memo_key                        = (contents_path, schema.content_digest(content_dict))
+        if memo_key[1] == None:
+            return None
+        schema._build_schema_from_manifest_content(parent_trace, content_dict, contents_path, memo_key)
+    except ApodeixiError:
+        return None
+    return memo_key, [(info.acronym, info.entity_name) for info in schema.acronym_infos()]
+
+def _restore_sidecar(parent_trace, data_dict, annotation):
+    '''
+    Memoizes the acronym schema persisted by _annotate_sidecar in the binary sidecar of a manifest
+    '''
+    memo_key, schema_tuples             = annotation
+    UID_Acronym_Schema()._memoize(memo_key, schema_tuples)
@@ -1,8 +1,14 @@
 import re                                       as _re
+import sys                                      as _sys
 
 from apodeixi.util.a6i_error                    import ApodeixiError
 from apodeixi.xli.interval                      import Interval
 
+# Compiled once, rather than each time a UID is generated or tokenized
+_ACRONYM_REGEX                                  = _re.compile('^([a-zA-Z]+)$')
+_TOKEN_REGEX                                    = _re.compile('^([a-zA-Z]+)([0-9]+)$')
+_ABBREVIATED_TOKEN_REGEX                        = _re.compile('^[0-9]+$')
+
 class UID_Store:
     '''
     Stores UIDs like 'P12.AC3.E45', and is able to generate the next UID for a given prefix.
@@ -21,9 +27,15 @@ class UID_Store:
 
         To avoid accidental infinite loops, a _TokenTree has a maximum height of 100 levels.
 
+        Since a UID_Store may hold tens of thousands of UIDs, and most of the _TokenTree objects are leaves,
+        _TokenTree objects have slots instead of a __dict__, and their dictionaries are only created when the
+        first child is added.
+
         @level an int, recording how many levels this _TokenTree is from the root, since a _TokenTree
                         might be a sub-tree of a larget _TokenTree.
         '''
+        __slots__ = ('level', 'vals', 'max_vals', 'children')
+
         def __init__(self, parent_trace, level):
             
             if level > UID_Store._TokenTree.MAX_LEVELS:
@@ -31,44 +43,59 @@ class UID_Store:
                                  + str( UID_Store._TokenTree.MAX_LEVELS))
             self.level     = level
             
-            # Keys are acronyms like 'P', and values are arrays of non-negative integers like [1, 2, 3]
-            # indicating that this _TokenTree contains 'P1', 'P2', and P3
-            self.vals      = {} 
+            # Keys are acronyms like 'P', and values are sets of non-negative integers like {1, 2, 3}
+            # indicating that this _TokenTree contains 'P1', 'P2', and P3. None until the first child is added
+            self.vals      = None
+
+            # Keys are acronyms like 'P', and values are the biggest integer in self.vals['P'], so that the
+            # next UID can be generated without scanning self.vals['P']. None until the first child is added
+            self.max_vals  = None
             
-            # A dictionary where the key is a string like 'P12' where 12 belongs to array self.vals['P']
-            # Value for that key 'P12' is another _TokenTree
-            self.children  = {} 
+            # A dictionary where the key is a string like 'P12' where 12 belongs to set self.vals['P']
+            # Value for that key 'P12' is another _TokenTree. None until the first child is added
+            self.children  = None
             
             
         MAX_LEVELS = 100
         
+        def _addChild(self, parent_trace, token, acronym, nb):
+            '''
+            Adds a child for `token` (like 'P4', with `acronym` 'P' and `nb` 4) if there is not one already,
+            and returns the child
+            '''
+            if self.children == None:
+                self.vals           = {}
+                self.max_vals       = {}
+                self.children       = {}
+            child                   = self.children.get(token)
+            if child == None:
+                nb_set              = self.vals.get(acronym)
+                if nb_set == None:
+                    nb_set          = set()
+                    self.vals[acronym]      = nb_set
+                    self.max_vals[acronym]  = nb
+                elif nb > self.max_vals[acronym]:
+                    self.max_vals[acronym]  = nb
+                nb_set.add(nb)
+                child               = UID_Store._TokenTree(parent_trace, self.level + 1)
+                self.children[token] = child
+            return child
+
         def addToken(self, parent_trace, token):
             '''
             Given a string `token` such as P4, it adds it to this tree
             '''
             acronym, nb     = UID_Utils().parseToken(parent_trace, token) 
-            if not acronym in self.vals.keys():
-                self.vals[acronym] = []
-            nb_list         = self.vals[acronym]
-            if not nb in nb_list:
-                nb_list.append(nb)
-            if not token in self.children.keys():
-                self.children[token] = UID_Store._TokenTree(parent_trace, self.level + 1)           
+            self._addChild(parent_trace, token, acronym, nb)
         
         def _generateHere(self, parent_trace, acronym):
-            if acronym not in self.vals.keys():
-                self.vals[acronym] = []
-            
-            used_numbers           = self.vals[acronym]
-            
-            if len(used_numbers) ==0:
+            if self.max_vals == None or not acronym in self.max_vals.keys():
                 nextVal            = 1 # Start at 1, not 0. Though parent might have 0's
             else:
-                nextVal            = max(used_numbers) + 1
+                nextVal            = self.max_vals[acronym] + 1
                 
-            used_numbers.append(nextVal)
             uid                    = acronym + str(nextVal)
-            self.children[uid]     = UID_Store._TokenTree(parent_trace = parent_trace, level = self.level + 1)
+            self._addChild(parent_trace, uid, acronym, nextVal)
             return uid
     
         def generateNextUID(self, parent_trace, branch, acronym):
@@ -79,8 +106,7 @@ class UID_Store:
                           Returns two uids: a full UID P12.AC3.E45.W5 and the leaf UID W5
             '''                
             # Validate acronym is valid
-            REGEX         = '^([a-zA-Z]+)$'
-            m             = _re.match(REGEX, acronym)
+            m             = _ACRONYM_REGEX.match(acronym)
             if m == None or len(m.groups()) != 1:
                 raise ApodeixiError(parent_trace, "Invalid acronym='" + acronym + "': expected something like 'P' or 'AV'.  "
                                 + "Level=" + str(self.level))                
@@ -115,33 +141,37 @@ class UID_Store:
                         Else raises an error.
             '''
             acronym, val  = UID_Utils().parseToken(parent_trace, head)
+            vals          = self.vals if self.vals != None else {}
+            children      = self.children if self.children != None else {}
 
             # Some of these checks are theoretically duplicate if the inner state of this object
             # is consistent as in theory it should be. But being paranoid, we do duplicate
             # checks since that might also catch bugs with inconsistent state
-            if acronym not in self.vals.keys():
+            if acronym not in vals.keys():
                 raise ApodeixiError(parent_trace, 'Acronym ' + acronym + ' corresponds to no valid child. Level=' 
                                  + str(self.level) + ". Happened while doing _findChild(" + head + ')')
-            if val not in self.vals[acronym]:
+            if val not in vals[acronym]:
                 raise ApodeixiError(parent_trace, 'Value ' + str(val) + ' corresponds to no valid child. Level=' 
                                  + str(self.level) + ". Happened while doing _findChild(" + head + ')',
                                  data = {'acronym': acronym, 'level': str(self.level),
-                                            'self.vals[' + acronym + ']': self.vals[acronym]})
-            if head not in self.children.keys():
+                                            'self.vals[' + acronym + ']': str(sorted(vals[acronym]))})
+            if head not in children.keys():
                 raise ApodeixiError(parent_trace, 'Token ' + head + ' corresponds to no valid child. Level=' 
                                  + str(self.level) + ". Happened while doing _findChild(" + head + ')')
 
             # We got past the checks, so this should not crash
-            return self.children[head]
+            return children[head]
             
         def display(self, parent_trace):
             '''
             Used for debugging, to return a dictionary representation of the tree
             '''
             result_dict = {}
+            if self.children == None:
+                return result_dict
             for uid in self.children.keys():
                 child   = self.children[uid]
-                result_dict[uid] = child.display()
+                result_dict[uid] = child.display(parent_trace)
             return result_dict
            
     def __init__(self, parent_trace):
@@ -213,12 +243,44 @@ class UID_Store:
 
         @param manifest_dict A dict object representing a manifest
         '''      
-        for key in manifest_dict.keys():
-            val             = manifest_dict[key]
+        self.initializeFromUIDs(parent_trace, UID_Store.collect_uids(self, manifest_dict))
+
+    def collect_uids(self, manifest_dict):
+        '''
+        Returns a list of the values of all nodes called "UID" in `manifest_dict`, at any depth, in the order
+        in which they appear in the manifest
+        '''
+        result                      = []
+        # Walk the manifest depth-first with a stack of iterators, rather than recursively
+        stack                       = [iter(manifest_dict.items())]
+        while len(stack) > 0:
+            item                    = next(stack[-1], None)
+            if item == None:
+                stack.pop()
+                continue
+            key, val                = item
             if key == Interval.UID:
-                self.add_known_uid(parent_trace, val)
-            elif type(val) == dict: #Recursive call
-                self.initializeFromManifest(parent_trace, val)
+                result.append(val)
+            elif type(val) == dict:
+                stack.append(iter(val.items()))
+        return result
+
+    def initializeFromUIDs(self, parent_trace, uid_list):
+        '''
+        Records that all the UIDs in `uid_list` are already used, as self.add_known_uid would do for each of them.
+        Meant for seeding the store in bulk, e.g., with UIDs previously collected from a manifest with 
+        self.collect_uids.
+
+        @param uid_list A list of strings such as "JTBD1.C1.F1.S1"
+        '''
+        if self.acronym_schema == None:
+            raise ApodeixiError(parent_trace, "Detected incorrectly built UID_Store while adding known uids: this "
+                                                + "UID_Store's acronym schema is not initialized",
+                                            {"uids": str(uid_list[:10])})
+
+        known_acronym_list          = [info.acronym for info in self.acronym_schema.acronym_infos()]
+        for uid in uid_list:
+            self._mark_uid_as_used(parent_trace, uid, known_acronym_list, self.tree)
 
     def add_known_uid(self, parent_trace, uid, last_acronym=None):
         '''
@@ -255,37 +317,51 @@ class UID_Store:
 
     def _mark_uid_as_used(self, parent_trace, uid, acronym_list, token_tree):
         '''
-        Recursive implementation of `add_known_uid`
+        Implementation of `add_known_uid`, which adds the tokens of `uid` as a branch of `token_tree`.
+
+        Tokens are unabbreviated when `uid` is tokenized, so they are all added in a single walk down the tree.
         '''
         tokens              = UID_Utils().tokenize(parent_trace, uid, acronym_list)
-        if len(tokens) == 0:
-            return # Nothing to do
-
-        head                = tokens[0]
-        tail                = tokens[1:]
-        token_tree.addToken(parent_trace, head)
-        if len(tail) > 0: #recurse
-            subtree         = token_tree.children[head]
-            sub_uid         = '.'.join(tail)
-            self._mark_uid_as_used(parent_trace, sub_uid, acronym_list[1:], subtree)
+        for token in tokens:
+            acronym, nb     = UID_Utils().parseToken(parent_trace, token)
+            token_tree      = token_tree._addChild(parent_trace, token, acronym, nb)
        
-
 class UID_Utils():
     '''
+    Utilities to parse, tokenize and (un)abbreviate UIDs.
+
+    The same UIDs are tokenized over and over (e.g., each time a manifest seeds a UID_Store), so the results of 
+    self.parseToken and self.tokenize are memoized per string, in dictionaries shared by all UID_Utils objects.
+    Acronyms are interned, so that all tokens for an acronym share the same string.
+    Each memo is cleared when it reaches MAX_MEMOIZED entries, to bound memory in long-lived processes.
     '''
     def __init__(self):
         return
 
+    MAX_MEMOIZED                    = 100000
+
+    # Keys are tokens like 'PR34', and values are tuples like ('PR', 34)
+    _parsed_tokens                  = {}
+
+    # Keys are tuples (uid, acronym_list) where acronym_list is a tuple or None, and values are tuples of tokens
+    _tokenized_uids                 = {}
+
     def parseToken(self, parent_trace, token):
         '''
         Given a token like 'PR34', it returns the acronym 'PR' and the value 34
         '''
-        REGEX         = '^([a-zA-Z]+)([0-9]+)$'
-        m             = _re.match(REGEX, token)
+        ME                  = UID_Utils
+        parsed              = ME._parsed_tokens.get(token)
+        if parsed != None:
+            return parsed
+        m                   = _TOKEN_REGEX.match(token)
         if m == None or len(m.groups())!= 2:
             raise ApodeixiError(parent_trace, "Invalid token='" + token + "': expected something like 'P3' or 'AV45'.  ")
-        acronym       = m.group(1)
-        val           = int(m.group(2))
+        acronym             = _sys.intern(m.group(1))
+        val                 = int(m.group(2))
+        if len(ME._parsed_tokens) >= ME.MAX_MEMOIZED:
+            ME._parsed_tokens.clear()
+        ME._parsed_tokens[token]    = (acronym, val)
         return acronym, val
 
     def abbreviate_uid(self, parent_trace, uid, acronym_schema):
@@ -425,20 +501,25 @@ class UID_Utils():
         '''
         if uid==None:
             return []
+        ME                                  = UID_Utils
+        # Callers may modify the list we return, so the memo keeps tuples
+        memo_key                            = (uid, tuple(acronym_list) if acronym_list != None else None)
+        memoized                            = ME._tokenized_uids.get(memo_key)
+        if memoized != None:
+            return list(memoized)
+
         raw_tokens                          = uid.split('.')
         result                              = []
-        # Something like P3 pr AV456. 
-        REGEX                               = '^[a-zA-Z]+[0-9]+$' 
         for idx in range(len(raw_tokens)):
             t                               = raw_tokens[idx]
-            m                               = _re.match(REGEX, t)
+            # Something like P3 pr AV456. 
+            m                               = _TOKEN_REGEX.match(t)
             if m == None:
                 # Before we fail, let's try to recover. It may be that the user entered something like
                 # "AV45.1.12" for usability reasons, expecting us to infer that the user meant "AV45.P1.E12".
                 # This kind of "abbreviated UIDs" are expected when doing joins, for example, since the user
                 # needs to type the UIDs and it is more user-friendly to type abbreviated UIDs than the full thing.
-                ABBREVIATED_REGEX           = '^[0-9]+$'
-                m2                          = _re.match(ABBREVIATED_REGEX, t)
+                m2                          = _ABBREVIATED_TOKEN_REGEX.match(t)
                 if m2 == None: # Recovery attempt did not work, so abort
                     raise ApodeixiError(parent_trace, "Invalid uid='" + uid 
                             + "': expected something like P3 or AV45.P1.E12, or abbreviations like AV45.1.12")
@@ -455,5 +536,8 @@ class UID_Utils():
                 full_t                      = t 
             result.append(full_t)
 
+        if len(ME._tokenized_uids) >= ME.MAX_MEMOIZED:
+            ME._tokenized_uids.clear()
+        ME._tokenized_uids[memo_key]        = tuple(result)
         return result
 
@@ -1,11 +1,22 @@
 import warnings
 
 import pandas                       as _pd
+import os                           as _os
 import re                           as _re
+import time                         as _time
 import math                         as _math
 import datetime                     as _datetime
 import string                       as _string
+import hashlib                      as _hashlib
+import pickle                       as _pickle
+import tempfile                     as _tempfile
+import threading                    as _threading
+from collections                    import OrderedDict
 
+from openpyxl.cell.cell             import TYPE_ERROR as _TYPE_ERROR, TYPE_NUMERIC as _TYPE_NUMERIC
+from pandas.io.parsers              import TextParser
+
+import apodeixi
 from apodeixi.util.a6i_error        import *
 from apodeixi.util.warning_utils    import WarningUtils
 from apodeixi.util.dataframe_utils  import DataFrameUtils
@@ -355,6 +366,341 @@ class ManifestXLReadConfig(XLReadConfig):
         
         return manifest_df 
 
+class ExcelWorkbookSession():
+    '''
+    Keeps Excel workbooks open while a posting is processed, so that the Posting Label and all the manifests' ranges
+    (possibly in several worksheets) are read from a workbook that is unzipped and parsed only once, instead of once
+    per range.
+
+    Workbooks are opened as Pandas ExcelFile objects, with the same settings as Pandas' read_excel uses, so 
+    worksheets are streamed row by row by openpyxl rather than loaded into memory. Ranges are read by 
+    self.read_range.
+
+    It is meant to be short-lived: it does not notice if a workbook changes on disk after it was opened. Callers must
+    call self.close when done. Ranges may be read from several threads, as when a controller builds the manifests
+    of a posting in parallel.
+
+    It keeps these metrics:
+
+    * self.opens        An int, for the number of times a workbook was opened and parsed
+    * self.reads        An int, for the number of ranges read
+    * self.open_secs    A float, for the seconds spent opening and parsing workbooks
+    * self.read_secs    A float, for the seconds spent reading ranges from already opened workbooks
+    '''
+    def __init__(self):
+        # Keys are absolute paths to Excel files, and values are the corresponding Pandas ExcelFile objects
+        self._excel_files       = {}
+        self._lock              = _threading.Lock()
+
+        self.opens              = 0
+        self.reads              = 0
+        self.open_secs          = 0.0
+        self.read_secs          = 0.0
+
+    def read_range(self, parent_trace, excel_fullpath, excel_sheet, header_list, nrows, first_col_nb, last_col_nb):
+        '''
+        Returns a DataFrame for the columns `first_col_nb` through `last_col_nb` (ints, starting at 0) of the
+        `excel_sheet` worksheet, with `header_list` and `nrows` as in Pandas' read_excel.
+
+        Errors are raised like Pandas' read_excel would, so that callers can handle them in the same way.
+        '''
+        key                     = _os.path.abspath(excel_fullpath)
+        with self._lock:
+            excel_file          = self._excel_files.get(key)
+            if excel_file == None:
+                start           = _time.perf_counter()
+                excel_file      = _pd.ExcelFile(excel_fullpath, engine="openpyxl")
+                self.open_secs  += _time.perf_counter() - start
+                self.opens      += 1
+                self._excel_files[key] = excel_file
+
+        start                   = _time.perf_counter()
+        if not excel_sheet in excel_file.sheet_names:
+            raise ValueError("Worksheet named '" + str(excel_sheet) + "' not found") # Same message as Pandas
+        worksheet               = excel_file.book[excel_sheet]
+        # Same as Pandas does before it reads a worksheet, since the dimensions recorded in the file may be wrong
+        worksheet.reset_dimensions()
+
+        # Only the rows and columns of the range are read from the worksheet, as opposed to calling Pandas' read_excel,
+        # which converts every cell of every row up to the end of the range, even for columns far to the right of it.
+        # The DataFrame is the same as read_excel would return for the range, except as noted in #2 below:
+        #
+        #   1. Pandas names columns based on their position and on the headers to their left (blank headers become
+        #      "Unnamed: <position>", duplicates get a ".1" suffix, and MultiLevel headers are forward-filled from
+        #      the left). So the header rows are read from the first column of the worksheet up to last_col_nb. 
+        #      That is only a few rows, so it costs little even for wide worksheets.
+        #   2. Trailing blank rows are dropped if they are blank within the range, whereas read_excel only drops them
+        #      if they are blank across the whole worksheet. Conversely, all the range's columns are kept, whereas
+        #      read_excel drops trailing columns that are blank across the whole worksheet.
+        #
+        if header_list[-1] == None:
+            header_rows         = []
+            first_data_row      = 0
+        else:
+            header_rows         = self._converted_rows(worksheet, min_row=header_list[0], max_row=header_list[-1],
+                                                                    min_col=0, max_col=last_col_nb)
+            first_data_row      = header_list[-1] + 1
+        data_rows               = self._converted_rows(worksheet, min_row=first_data_row, 
+                                                                    max_row=first_data_row + nrows - 1,
+                                                                    min_col=first_col_nb, max_col=last_col_nb)
+        while len(data_rows) > 0 and len([val for val in data_rows[-1] if val != ""]) == 0:
+            data_rows.pop()
+
+        if len(data_rows) == 0 and len([val for row in header_rows for val in row if val != ""]) == 0:
+            df                  = _pd.DataFrame() # Same as Pandas for a blank worksheet
+        else:
+            if len(header_rows) == 0:
+                columns         = list(range(first_col_nb, last_col_nb + 1))
+            else:
+                if len(header_rows) > 1:
+                    self._fill_multi_level_header(header_rows)
+                columns         = TextParser(   header_rows, 
+                                                header              = list(range(len(header_rows))), 
+                                                skip_blank_lines    = False).read().columns[first_col_nb:]
+            if len(data_rows) == 0:
+                df              = _pd.DataFrame(columns=columns)
+            else:
+                df              = TextParser(data_rows, header=None, skip_blank_lines=False).read()
+                df.columns      = columns
+
+        with self._lock:
+            self.read_secs      += _time.perf_counter() - start
+            self.reads          += 1
+        return df
+
+    def _converted_rows(self, worksheet, min_row, max_row, min_col, max_col):
+        '''
+        Returns a list of lists, with the values of the `worksheet`'s cells in rows `min_row` through `max_row` and 
+        columns `min_col` through `max_col` (all ints, starting at 0), converted as Pandas' read_excel does: blank
+        cells become "", error cells become nan, and floats that are whole numbers become ints.
+        '''
+        rows                    = []
+        if max_row < min_row:
+            return rows
+        for row in worksheet.iter_rows(min_row=min_row + 1, max_row=max_row + 1, min_col=min_col + 1, max_col=max_col + 1):
+            converted_row       = []
+            for cell in row:
+                val             = cell.value
+                if val == None:
+                    val         = ""
+                elif cell.data_type == _TYPE_ERROR:
+                    val         = _math.nan
+                elif cell.data_type == _TYPE_NUMERIC and int(val) == val:
+                    val         = int(val)
+                converted_row.append(val)
+            # Cells beyond the last one in the worksheet are not returned by openpyxl in read-only mode
+            converted_row       += [""] * (max_col + 1 - min_col - len(converted_row))
+            rows.append(converted_row)
+        # Rows beyond the last one in the worksheet are not returned either
+        rows                    += [[""] * (max_col + 1 - min_col) for idx in range(max_row + 1 - min_row - len(rows))]
+        return rows
+
+    def _fill_multi_level_header(self, header_rows):
+        '''
+        Forward-fills blank headers in `header_rows` (a list of lists of values, one for each level of a MultiLevel
+        header) from the left, as Pandas' read_excel does. A blank is filled only while the header in the levels
+        above remains the same, so the fill stops at the boundary of a header in a higher level.
+        '''
+        same_parent             = [True] * len(header_rows[0])
+        for row in header_rows:
+            last                = row[0]
+            for idx in range(1, len(row)):
+                if not same_parent[idx]:
+                    last        = row[idx]
+                if row[idx] == "":
+                    row[idx]    = last
+                else:
+                    same_parent[idx] = False
+                    last        = row[idx]
+
+    def stats(self):
+        '''
+        Returns a dictionary with this session's metrics
+        '''
+        return {"opens":        self.opens,
+                "reads":        self.reads,
+                "open_secs":    self.open_secs,
+                "read_secs":    self.read_secs}
+
+    def close(self, parent_trace):
+        '''
+        Closes all the workbooks opened by this session. Metrics are retained.
+        '''
+        for excel_file in self._excel_files.values():
+            excel_file.close()
+        self._excel_files       = {}
+
+class ExcelRangeCache():
+    '''
+    Disk-based cache of the DataFrames read from ranges in Excel files, so that postings that are parsed again
+    without having changed (e.g., when aggregating metrics across archived postings, or when re-posting) are not
+    read from Excel again.
+
+    Entries are keyed by a hash of the Excel file's content, so a cached DataFrame is used for any file with the
+    same bytes, regardless of its path or modification time. The key also includes the worksheet, the cells
+    read (which is how a PostingConfig determines what is read, via its pandasRowParameters), and the versions of
+    Apodeixi and Pandas. The DataFrame cached is the one read from Excel before the PostingConfig's toManifestDF is 
+    applied, since that may depend on other manifests in the KnowledgeBase.
+
+    Since the folder may be shared by several processes, entries are written atomically, and files that disappear
+    (e.g., because another process evicted them) are treated as misses. Within a process, the cache may be used
+    from several threads.
+
+    It keeps these metrics, as returned by self.stats:
+
+    * hits, misses      Ints, for the number of lookups that did or did not find a DataFrame
+    * writes            An int, for the number of DataFrames added to the cache
+    * evictions         An int, for the number of entries removed to keep the cache within `max_bytes`
+
+    @param cache_folder A string, for the folder where the cache entries are saved. Created if it does not exist.
+    @param max_bytes An int, for how big the cache's files may be in total, beyond which the least recently 
+                    used entries are evicted
+    '''
+    def __init__(self, parent_trace, cache_folder, max_bytes=256 * 1024 * 1024):
+        self.cache_folder           = cache_folder
+        self.max_bytes              = max_bytes
+        self._lock                  = _threading.Lock()
+        _os.makedirs(cache_folder, exist_ok=True)
+
+        # Keys are the file names of entries, and values their sizes, from least to most recently used
+        self._entries               = OrderedDict()
+        self._total_bytes           = 0
+        entry_list                  = []
+        for filename in _os.listdir(cache_folder):
+            if filename.endswith(ExcelRangeCache._SUFFIX):
+                try:
+                    stat            = _os.stat(_os.path.join(cache_folder, filename))
+                except OSError:
+                    continue
+                entry_list.append((stat.st_mtime_ns, filename, stat.st_size))
+        for mtime_ns, filename, size in sorted(entry_list):
+            self._entries[filename] = size
+            self._total_bytes       += size
+
+        # Keys are absolute paths to Excel files and values are tuples (mtime_ns, size, hash of file's content),
+        # so that a file is only hashed once per process as long as it doesn't change
+        self._file_hashes           = {}
+
+        self.hits                   = 0
+        self.misses                 = 0
+        self.writes                 = 0
+        self.evictions              = 0
+
+        self._evict_if_needed()
+
+    def __getstate__(self):
+        '''
+        Locks can't be pickled, so leave ours out when the cache is sent to another process (e.g., as part of a
+        KnowledgeBaseStore sent to the worker processes that parse postings)
+        '''
+        state                       = self.__dict__.copy()
+        state.pop('_lock')
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock                  = _threading.Lock()
+
+    _SUFFIX                         = ".range.pkl"
+
+    # Bump this if the DataFrames read from Excel change in a way not reflected by the Apodeixi version
+    _FORMAT                         = 1
+
+    def key(self, parent_trace, excel_fullpath, excel_sheet, header_list, nrows, first_col_nb, last_col_nb):
+        '''
+        Returns a string to identify the range described by the parameters (same as for ExcelWorkbookSession.read_range)
+        in self.get and self.put
+        '''
+        path                        = _os.path.abspath(excel_fullpath)
+        stat                        = _os.stat(path)
+        known                       = self._file_hashes.get(path)
+        if known != None and known[:2] == (stat.st_mtime_ns, stat.st_size):
+            file_hash               = known[2]
+        else:
+            digest                  = _hashlib.sha256()
+            with open(path, 'rb') as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            file_hash               = digest.hexdigest()
+            self._file_hashes[path] = (stat.st_mtime_ns, stat.st_size, file_hash)
+
+        coordinates                 = [ExcelRangeCache._FORMAT, apodeixi.__version__, _pd.__version__, file_hash, 
+                                        excel_sheet, header_list, nrows, first_col_nb, last_col_nb]
+        return _hashlib.sha256(repr(coordinates).encode("utf-8")).hexdigest()
+
+    def get(self, parent_trace, key):
+        '''
+        Returns the DataFrame cached for `key`, or None if there is none
+        '''
+        filename                    = key + ExcelRangeCache._SUFFIX
+        path                        = _os.path.join(self.cache_folder, filename)
+        try:
+            with open(path, 'rb') as file:
+                entry_format, df    = _pickle.load(file)
+        except Exception:
+            entry_format, df        = None, None # Treat unreadable entries as missing
+        if entry_format != ExcelRangeCache._FORMAT:
+            with self._lock:
+                self.misses         += 1
+            return None
+        try:
+            _os.utime(path) # So that other processes also see that the entry was recently used
+        except OSError:
+            pass
+        with self._lock:
+            self.hits               += 1
+            size                    = self._entries.pop(filename, None)
+            if size == None:
+                size                = _os.path.getsize(path) if _os.path.exists(path) else 0
+                self._total_bytes   += size
+            self._entries[filename] = size
+        return df
+
+    def put(self, parent_trace, key, df):
+        '''
+        Adds `df` to the cache as the DataFrame for `key`, evicting the least recently used entries if needed
+        '''
+        filename                    = key + ExcelRangeCache._SUFFIX
+        path                        = _os.path.join(self.cache_folder, filename)
+        file_descriptor, tmp_path   = _tempfile.mkstemp(dir=self.cache_folder, suffix=".tmp")
+        try:
+            with _os.fdopen(file_descriptor, 'wb') as file:
+                _pickle.dump((ExcelRangeCache._FORMAT, df), file, protocol=_pickle.HIGHEST_PROTOCOL)
+            _os.replace(tmp_path, path)
+        except Exception as ex:
+            if _os.path.exists(tmp_path):
+                _os.remove(tmp_path)
+            raise ApodeixiError(parent_trace, "Unable to save DataFrame in cache",
+                                            data = {"cache folder": str(self.cache_folder), "error": str(ex)})
+        size                        = _os.path.getsize(path)
+        with self._lock:
+            self.writes             += 1
+            self._total_bytes       -= self._entries.pop(filename, 0)
+            self._entries[filename] = size
+            self._total_bytes       += size
+            self._evict_if_needed()
+
+    def _evict_if_needed(self):
+        while len(self._entries) > 0 and self._total_bytes > self.max_bytes:
+            evicted, evicted_size   = self._entries.popitem(last=False)
+            self._total_bytes       -= evicted_size
+            self.evictions          += 1
+            try:
+                _os.remove(_os.path.join(self.cache_folder, evicted))
+            except OSError:
+                pass # Perhaps another process already evicted it
+
+    def stats(self):
+        '''
+        Returns a dictionary with the cache's metrics
+        '''
+        return {"entries":          len(self._entries),
+                "bytes":            self._total_bytes,
+                "hits":             self.hits,
+                "misses":           self.misses,
+                "writes":           self.writes,
+                "evictions":        self.evictions}
+
 class ExcelTableReader:
     '''
     Reads a table of data from an Excel spreadsheet and creates a Pandas DataFrame from it.
@@ -364,14 +710,20 @@ class ExcelTableReader:
     @param excel_sheet Name of the worksheet in the Excel spreadsheet where we should retrieve content from.
     @param excel_range A string representing a range in Excel. The first row must be the column headers.
                        Example: "A3:D10"
+    @param workbook_session Optional ExcelWorkbookSession. If given, the Excel spreadsheet is read through it, so that
+                        it is not re-opened if it was already opened in the session.
+    @param range_cache Optional ExcelRangeCache. If given, the range is only read from Excel if it is not in the cache.
     @return A Pandas DataFrame built from the data provided.
     '''
-    def __init__(self, parent_trace, excel_fullpath, excel_sheet, excel_range, xlr_config):
+    def __init__(self, parent_trace, excel_fullpath, excel_sheet, excel_range, xlr_config, workbook_session=None,
+                        range_cache=None):
         self.excel_fullpath     = excel_fullpath
         self.excel_sheet        = excel_sheet
         self.excel_range        = excel_range.upper()
         self.xlr_config         = xlr_config
-        
+        self.workbook_session   = workbook_session
+        self.range_cache        = range_cache
+
     def read(self, parent_trace):
         '''
         Loads the Apodeixi object in Excel that this ExcelTableReader was initialized for, and returns it
@@ -402,63 +754,39 @@ class ExcelTableReader:
             with warnings.catch_warnings(record=True) as w:
                 WarningUtils().turn_traceback_on(parent_trace, warnings_list=w)
 
-                # We have two cases:
-                #   1. header_list is a singleton - this is the "normal" case, and we can use the `usecols` parameter
-                #      in Pandas read_excel
-                #   2. header_list has multiple elements. This means we have a MultiLevel index in the DataFrame-to-be,
-                #      and unfortunately Pandas disallows `usecols` in that case. That makes the logic more complicated,
-                #      because after calling Pandas::read_excel we have to prune spurious columns that might have been
-                #      picked up by Pandas::read_excel, since we couldn't tell it to just use columns in the range
-                #      first_column:last_column
-                #
-                #  Case #2 is more general than #1, so the logic for #2 could address #1 as well. However, since historically
-                #  Apodeixi only supported #1, we retain the simpler code for #1 as a defensive quality tactic: if for 
-                #  some reason our implementation of #2 is buggy, we don't want that bug to affect the previously working
-                #  functionality for usecase #1
-                #  So we explicitly have an "if-else" statement for the two cases, even if in theory that's unnecessary
-                #
-                if len(header_list) == 1:
-                    df                  = _pd.read_excel(   io         = self.excel_fullpath,
-                                                            sheet_name = self.excel_sheet,
-                                                            header     = header_list, 
-                                                            usecols    = first_column + ':' + last_column, 
-                                                            nrows      = nrows)
-                elif len(header_list) > 1:
-                    # This is the MultiLevel index case, and can' t use `usecols` in the call to Pandas::read_excel, so must
-                    # first call read_excel and after that prune the result to confine to the desired columns
-                    #
-                    raw_df              = _pd.read_excel(   io         = self.excel_fullpath,
-                                                            sheet_name = self.excel_sheet,
-                                                            header     = header_list, 
-                                                            nrows      = nrows)
-                    # We need to convert the letter columns to integers, before we can prune them. That requires a little
-                    # helper function inspired by 
-                    # https://stackoverflow.com/questions/7261936/convert-an-excel-or-spreadsheet-column-letter-to-its-number-in-pythonic-fashion
-                    def _col2num(col):
-                        '''
-                        Converts Excel letter columns to ints, starting at 0
-                        '''
-                        num = 0
-                        for c in col:
-                            if c in _string.ascii_letters:
-                                num = num * 26 + (ord(c.upper()) - ord('A')) + 1
-                        return num - 1
-
-                    first_col_nb        = _col2num(first_column)
-                    last_col_nb         = _col2num(last_column)
-
-                    raw_columns         = list(raw_df.columns)
-                    # Prune spurious columns on the left
-                    df                  = raw_df.drop(raw_columns[:first_col_nb], axis=1)
-
-                    # Prune columns on the right
-                    df                  = df.drop(raw_columns[last_col_nb+1:], axis=1)
-
-                else:
+                if len(header_list) == 0:
                     raise ApodeixiError(parent_trace, "Can't load Excel file because no headers were specified",
                                                         data = {"path": str(self.excel_fullpath), 
-                                                                "sheet_name": str(self.sheet_name),
+                                                                "sheet_name": str(self.excel_sheet),
                                                                 "range": str(self.excel_range)})   
+
+                # The range is read by an ExcelWorkbookSession, which handles the two cases of header_list: a singleton,
+                # or multiple elements for a MultiLevel index in the DataFrame-to-be
+                first_col_nb            = ExcelTableReader.col_2_num(first_column)
+                last_col_nb             = ExcelTableReader.col_2_num(last_column)
+                df                      = None
+                if self.range_cache != None:
+                    cache_key           = self.range_cache.key(my_trace, self.excel_fullpath, self.excel_sheet, header_list, 
+                                                                nrows, first_col_nb, last_col_nb)
+                    df                  = self.range_cache.get(my_trace, cache_key)
+                if df is None:
+                    if self.workbook_session != None:
+                        workbook_session    = self.workbook_session
+                    else:
+                        workbook_session    = ExcelWorkbookSession()
+                    try:
+                        df              = workbook_session.read_range(  parent_trace    = my_trace, 
+                                                                        excel_fullpath  = self.excel_fullpath,
+                                                                        excel_sheet     = self.excel_sheet,
+                                                                        header_list     = header_list,
+                                                                        nrows           = nrows,
+                                                                        first_col_nb    = first_col_nb,
+                                                                        last_col_nb     = last_col_nb)
+                    finally:
+                        if workbook_session != self.workbook_session:
+                            workbook_session.close(my_trace)
+                    if self.range_cache != None:
+                        self.range_cache.put(my_trace, cache_key, df)
                 WarningUtils().handle_warnings(parent_trace, warning_list=w)
 
         except PermissionError as ex:
@@ -560,6 +888,19 @@ class ExcelTableReader:
         return first_column, last_column, first_row, last_row
         
     
+    def col_2_num(col):
+        '''
+        Converts Excel letter columns to ints, starting at 0. For example, 'A' becomes 0 and 'AB' becomes 27.
+
+        Inspired by
+        https://stackoverflow.com/questions/7261936/convert-an-excel-or-spreadsheet-column-letter-to-its-number-in-pythonic-fashion
+        '''
+        num = 0
+        for c in col:
+            if c in _string.ascii_letters:
+                num = num * 26 + (ord(c.upper()) - ord('A')) + 1
+        return num - 1
+
     def df_2_xl_row(parent_trace, df_row_nb, excel_range):
         '''
         Helper method available to other Apodeixi classes. Particularly helpful in creating user-friendly error messages by